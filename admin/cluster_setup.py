@@ -207,7 +207,11 @@ def main(reactor, args, base_path, top_level):
                             remote_logs_file).addErrback(write_failure)
 
     flocker_client = _make_client(reactor, cluster)
-    yield _wait_for_nodes(reactor, flocker_client, len(cluster.agent_nodes))
+    try:
+        yield _wait_for_nodes(
+            reactor, flocker_client, len(cluster.agent_nodes))
+    finally:
+        yield flocker_client.close()
 
     if options['no-keep']:
         print("not keeping cluster")
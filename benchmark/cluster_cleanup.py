@@ -54,7 +54,9 @@ def main(reactor, args):
     user_key = certificates_path.child(b"user.key")
     client = FlockerClient(reactor, options['control-node'], REST_API_PORT,
                            cluster_cert, user_cert, user_key)
-    return cleanup_cluster(client, options['wait'])
+    d = cleanup_cluster(client, options['wait'])
+    d.addBoth(lambda result: client.close().addCallback(lambda _: result))
+    return d
 
 
 @inlineCallbacks
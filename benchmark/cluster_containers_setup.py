@@ -111,7 +111,10 @@ def main(reactor, argv, environ):
     container_deployment = ClusterContainerDeployment(reactor,
                                                       environ,
                                                       options)
-    return container_deployment.deploy_and_wait_for_creation()
+    d = container_deployment.deploy_and_wait_for_creation()
+    d.addBoth(lambda result: container_deployment.client.close().addCallback(
+        lambda _: result))
+    return d
 
 
 class ResponseError(Exception):
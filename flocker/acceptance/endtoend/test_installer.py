@@ -329,11 +329,11 @@ class DockerComposeTests(AsyncTestCase):
             hostname_to_public_address={},
             username='user1',
         )
-        d.addCallback(
-            lambda cluster: cluster.clean_nodes(
-                remove_foreign_containers=False
-            )
-        )
+
+        def clean(cluster):
+            self.addCleanup(cluster.client.close)
+            return cluster.clean_nodes(remove_foreign_containers=False)
+        d.addCallback(clean)
         return d
 
     def _cleanup_compose(self):
@@ -962,6 +962,7 @@ def require_cluster(num_nodes, required_backend=None):
             waiting_for_cluster = _get_test_cluster(reactor)
 
             def clean(cluster):
+                test_case.addCleanup(cluster.client.close)
                 existing = len(cluster.nodes)
                 if num_nodes > existing:
                     raise SkipTest(
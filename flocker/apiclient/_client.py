@@ -20,13 +20,16 @@ from pyrsistent import PClass, field, pmap_field, pmap
 from eliot import ActionType, Field
 from eliot.twisted import DeferredContext
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import (
+    Deferred, succeed, fail, gatherResults, maybeDeferred, DeferredSemaphore,
+)
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
     CREATED, OK, CONFLICT, NOT_FOUND, PRECONDITION_FAILED,
 )
 from twisted.internet.utils import getProcessOutput
 from twisted.internet.task import deferLater
+from twisted.web.client import HTTPConnectionPool
 
 from treq import json_content, content
 
@@ -263,6 +266,28 @@ class IFlockerAPIV1Client(Interface):
             ``DatasetAlreadyExists``.
         """
 
+    def create_dataset_if_name_absent(primary, metadata, maximum_size=None,
+                                      dataset_id=None):
+        """
+        Create a new dataset in the configuration, unless a non-deleted
+        dataset with the same ``name`` in its metadata already exists.
+
+        The check and the creation happen atomically in the control
+        service.
+
+        :param UUID primary: The node where the dataset should manifest.
+        :param metadata: A mapping between unicode keys and values, to be
+            stored as dataset metadata.  Must include a ``u"name"`` key.
+        :param maximum_size: Size of new dataset in bytes (as ``int``) or
+            ``None`` if no particular size is required (not recommended).
+        :param dataset_id: If given, the UUID to use for the dataset.
+
+        :return: ``Deferred`` that fires after the configuration has been
+            updated with resulting ``Dataset``, or errbacking with
+            ``DatasetAlreadyExists`` if either the name or the dataset ID is
+            already in use.
+        """
+
     def move_dataset(primary, dataset_id, configuration_tag=None):
         """
         Move the dataset to a new location.
@@ -303,6 +328,19 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with iterable of ``DatasetState``.
         """
 
+    def wait_for_dataset_state(dataset_id, primary):
+        """
+        Wait until a dataset is manifest on a node.
+
+        :param UUID dataset_id: The dataset.
+        :param UUID primary: The node where it should be manifest.
+
+        :return: ``Deferred`` firing with the ``DatasetState`` of the dataset
+            once it is manifest on the node.  It may instead fail with
+            ``NotFound`` if that takes too long, in which case the caller
+            can try again.
+        """
+
     def acquire_lease(dataset_id, node_uuid, expires):
         """
         Acquire a lease on a dataset on a given node.
@@ -410,6 +448,7 @@ class FakeFlockerClient(object):
             nodes = []
         self._nodes = nodes
         self._this_node_uuid = this_node_uuid
+        self._state_waiters = []
         self.synchronize_state()
 
     def _ensure_matching_tag(self, configuration_tag):
@@ -440,6 +479,14 @@ class FakeFlockerClient(object):
             dataset_id, result)
         return succeed(result)
 
+    def create_dataset_if_name_absent(self, primary, metadata,
+                                      maximum_size=None, dataset_id=None):
+        for dataset in self._configured_datasets.values():
+            if dataset.metadata.get(u"name") == metadata[u"name"]:
+                return fail(DatasetAlreadyExists())
+        return self.create_dataset(primary, maximum_size=maximum_size,
+                                   dataset_id=dataset_id, metadata=metadata)
+
     def delete_dataset(self, dataset_id, configuration_tag=None):
         try:
             self._ensure_matching_tag(configuration_tag)
@@ -457,6 +504,8 @@ class FakeFlockerClient(object):
         except:
             return fail()
 
+        if dataset_id not in self._configured_datasets:
+            return fail(ResponseError(NOT_FOUND, b"Dataset not found."))
         self._configured_datasets = self._configured_datasets.transform(
             [dataset_id, "primary"], primary)
         return succeed(self._configured_datasets[dataset_id])
@@ -471,9 +520,30 @@ class FakeFlockerClient(object):
     def list_datasets_state(self):
         return succeed(self._state_datasets)
 
+    def _manifest_state(self, dataset_id, primary):
+        """
+        :return: The ``DatasetState`` of the given dataset if it is manifest
+            on the given node, otherwise ``None``.
+        """
+        for state in self._state_datasets:
+            if state.dataset_id == dataset_id and state.primary == primary:
+                return state
+        return None
+
+    def wait_for_dataset_state(self, dataset_id, primary):
+        state = self._manifest_state(dataset_id, primary)
+        if state is not None:
+            return succeed(state)
+        waiting = Deferred()
+        self._state_waiters.append((dataset_id, primary, waiting))
+        return waiting
+
     def synchronize_state(self):
         """
         Copy configuration into state.
+
+        Any calls to ``wait_for_dataset_state`` waiting for a dataset that is
+        now manifest are completed.
         """
         self._state_datasets = [
             DatasetState(
@@ -492,6 +562,13 @@ class FakeFlockerClient(object):
                 volumes=container.volumes,
             ) for container in self._configured_containers.values()
         ]
+        waiters, self._state_waiters = self._state_waiters, []
+        for dataset_id, primary, waiting in waiters:
+            state = self._manifest_state(dataset_id, primary)
+            if state is None:
+                self._state_waiters.append((dataset_id, primary, waiting))
+            elif not waiting.called:
+                waiting.callback(state)
 
     def acquire_lease(self, dataset_id, node_uuid, expires):
         try:
@@ -578,7 +655,8 @@ class FlockerClient(object):
     A client for the Flocker V1 REST API.
     """
     def __init__(self, reactor, host, port,
-                 ca_cluster_path, cert_path, key_path):
+                 ca_cluster_path, cert_path, key_path,
+                 pool_size=10, idle_timeout=60.0, max_concurrent_requests=10):
         """
         :param reactor: Reactor to use for connections.
         :param bytes host: Host to connect to.
@@ -586,15 +664,35 @@ class FlockerClient(object):
         :param FilePath ca_cluster_path: Path to cluster's CA certificate.
         :param FilePath cert_path: Path to user certificate.
         :param FilePath key_path: Path to user private key.
+        :param int pool_size: The maximum number of idle connections to keep
+            open to the control service for use by later requests.
+        :param float idle_timeout: Seconds after which an idle connection is
+            closed.
+        :param int max_concurrent_requests: The maximum number of requests
+            in progress at once; further requests wait for one of these to
+            finish.
         """
         self._reactor = reactor
+        self._pool = HTTPConnectionPool(reactor, persistent=True)
+        self._pool.maxPersistentPerHost = pool_size
+        self._pool.cachedConnectionTimeout = idle_timeout
         self._treq = treq_with_authentication(reactor, ca_cluster_path,
-                                              cert_path, key_path)
+                                              cert_path, key_path,
+                                              pool=self._pool)
+        self._concurrency = DeferredSemaphore(max_concurrent_requests)
         self._base_url = b"https://%s:%d/v1" % (host, port)
 
+    def close(self):
+        """
+        Close the connections kept open for later requests.
+
+        :return: ``Deferred`` that fires when they have been closed.
+        """
+        return self._pool.closeCachedConnections()
+
     def _request_with_headers(
             self, method, path, body, success_codes, error_codes=None,
-            configuration_tag=None):
+            configuration_tag=None, limit_concurrency=True):
         """
         Send a HTTP request to the Flocker API, return decoded JSON body and
         headers.
@@ -608,6 +706,10 @@ class FlockerClient(object):
             raised if it is present, or ``None`` to set no errors.
         :param configuration_tag: If not ``None``, include value as
             ``X-If-Configuration-Matches`` header.
+        :param bool limit_concurrency: Whether the request counts towards
+            ``max_concurrent_requests``.  Requests which the server holds
+            open until something happens should not, lest they starve
+            everything else.
 
         :return: ``Deferred`` firing a tuple of (decoded JSON,
             response headers).
@@ -646,14 +748,23 @@ class FlockerClient(object):
             headers["X-If-Configuration-Matches"] = [
                 configuration_tag.encode("utf-8")]
 
+        def send():
+            # Requests queued behind the concurrency limit are sent later,
+            # outside of the caller's context, so restore the action's:
+            with action.context():
+                d = DeferredContext(
+                    self._treq.request(method, url, data=data,
+                                       headers=headers))
+                d.addCallback(got_response)
+                return d.result
+
         with action.context():
-            request = DeferredContext(self._treq.request(
-                method, url,
-                data=data, headers=headers,
-                # Keep tests from having dirty reactor problems:
-                persistent=False
-                ))
-        request.addCallback(got_response)
+            if limit_concurrency:
+                # The semaphore is only released once the body has been read,
+                # so it also bounds the number of connections in use:
+                request = DeferredContext(self._concurrency.run(send))
+            else:
+                request = DeferredContext(send())
 
         def got_body(result):
             action.addSuccessFields(response_body=result[0])
@@ -709,6 +820,20 @@ class FlockerClient(object):
         request.addCallback(self._parse_configuration_dataset)
         return request
 
+    def create_dataset_if_name_absent(self, primary, metadata,
+                                      maximum_size=None, dataset_id=None):
+        dataset = {u"primary": unicode(primary),
+                   u"metadata": dict(metadata)}
+        if dataset_id is not None:
+            dataset[u"dataset_id"] = unicode(dataset_id)
+        if maximum_size is not None:
+            dataset[u"maximum_size"] = maximum_size
+        request = self._request(
+            b"POST", b"/configuration/_create_dataset_if_name_absent",
+            dataset, {CREATED}, {CONFLICT: DatasetAlreadyExists})
+        request.addCallback(self._parse_configuration_dataset)
+        return request
+
     def move_dataset(self, primary, dataset_id, configuration_tag=None):
         request = self._request(
             b"POST", b"/configuration/datasets/%s" % (dataset_id,),
@@ -732,24 +857,36 @@ class FlockerClient(object):
         )
         return request
 
-    def list_datasets_state(self):
-        request = self._request(b"GET", b"/state/datasets", None, {OK})
+    def _parse_dataset_state(self, dataset_dict):
+        """
+        Convert a dictionary decoded from JSON with a dataset's state.
 
-        def parse_dataset_state(dataset_dict):
-            primary = dataset_dict.get(u"primary")
-            if primary is not None:
-                primary = UUID(primary)
-            path = dataset_dict.get(u"path")
-            if path is not None:
-                path = FilePath(path)
-            return DatasetState(primary=primary,
-                                maximum_size=dataset_dict.get(
-                                    u"maximum_size", None),
-                                dataset_id=UUID(dataset_dict[u"dataset_id"]),
-                                path=path)
+        :param dataset_dict: Dictionary describing a dataset.
+        :return: ``DatasetState`` instance.
+        """
+        primary = dataset_dict.get(u"primary")
+        if primary is not None:
+            primary = UUID(primary)
+        path = dataset_dict.get(u"path")
+        if path is not None:
+            path = FilePath(path)
+        return DatasetState(primary=primary,
+                            maximum_size=dataset_dict.get(
+                                u"maximum_size", None),
+                            dataset_id=UUID(dataset_dict[u"dataset_id"]),
+                            path=path)
 
+    def list_datasets_state(self):
+        request = self._request(b"GET", b"/state/datasets", None, {OK})
         request.addCallback(
-            lambda results: [parse_dataset_state(d) for d in results])
+            lambda results: [self._parse_dataset_state(d) for d in results])
+        return request
+
+    def wait_for_dataset_state(self, dataset_id, primary):
+        request = self._request(
+            b"GET", b"/state/datasets/_wait/%s/%s" % (dataset_id, primary),
+            None, {OK}, {NOT_FOUND: NotFound}, limit_concurrency=False)
+        request.addCallback(self._parse_dataset_state)
         return request
 
     def _parse_lease(self, dictionary):
@@ -903,6 +1040,25 @@ class FlockerClient(object):
         return request
 
 
+def gather(calls):
+    """
+    Make independent API calls concurrently.
+
+    ``FlockerClient`` limits how many of the resulting requests are in
+    progress at once.
+
+    :param calls: Iterable of zero-argument callables, each making one call
+        to an ``IFlockerAPIV1Client`` and returning a ``Deferred``.
+
+    :return: ``Deferred`` firing with a ``list`` of the results of the calls,
+        in the same order, or failing with the first failure of any of them.
+    """
+    d = gatherResults([maybeDeferred(call) for call in calls],
+                      consumeErrors=True)
+    d.addErrback(lambda failure: failure.value.subFailure)
+    return d
+
+
 def conditional_create(client, reactor, condition, *args, **kwargs):
     """
     Create a dataset only if a certain condition is true for the
@@ -16,24 +16,32 @@ from zope.interface.verify import verifyObject
 
 from pyrsistent import pmap
 
-from eliot import ActionType
-from eliot.testing import capture_logging, assertHasAction, LoggedAction
+from eliot import ActionType, Message
+from eliot.testing import (
+    capture_logging, assertHasAction, LoggedAction, LoggedMessage,
+)
 
 from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.web.http import BAD_REQUEST
-from twisted.internet.defer import gatherResults
+from twisted.web.http import BAD_REQUEST, urlparse
+from twisted.internet.defer import (
+    Deferred, DeferredSemaphore, gatherResults, succeed,
+)
 from twisted.python.runtime import platform
 from twisted.python.procutils import which
+from twisted.web.resource import Resource
 
+from treq.client import HTTPClient
+
+from .. import _client
 from .._client import (
     IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetAlreadyExists,
     DatasetState, FlockerClient, ResponseError, _LOG_HTTP_REQUEST,
     Lease, LeaseAlreadyHeld, Node, Container, ContainerAlreadyExists,
     DatasetsConfiguration, ConfigurationChanged, conditional_create,
-    _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset,
+    _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset, gather,
 )
 from ...ca import rest_api_context_factory
 from ...ca.testtools import get_credential_sets
@@ -42,13 +50,16 @@ from ...testtools import (
 )
 from ...control._persistence import ConfigurationPersistenceService
 from ...control._clusterstate import ClusterStateService
-from ...control.httpapi import create_api_service
+from ...control.httpapi import (
+    REST_API_PORT, ConfigurationAPIUserV1, create_api_service,
+)
 from ...control import (
     NodeState, NonManifestDatasets, Dataset as ModelDataset, ChangeSource,
-    DockerImage, UpdateNodeStateEra,
+    DockerImage, UpdateNodeStateEra, Manifestation,
 )
 from ...restapi._logging import JSON_REQUEST
 from ...restapi import _infrastructure as rest_api
+from ...restapi.testtools import MemoryAgent
 from ... import __version__
 
 DATASET_SIZE = int(GiB(1).to_Byte().value)
@@ -201,6 +212,40 @@ def make_clientv1_tests():
             d.addCallback(got_result)
             return d
 
+        def test_create_if_name_absent(self):
+            """
+            ``create_dataset_if_name_absent`` creates a dataset if no other
+            dataset has the given name.
+            """
+            d = self.client.create_dataset(
+                primary=self.node_1.uuid, maximum_size=DATASET_SIZE,
+                metadata={u"name": u"other"})
+            d.addCallback(lambda _: self.client.create_dataset_if_name_absent(
+                primary=self.node_1.uuid, maximum_size=DATASET_SIZE,
+                metadata={u"name": u"myvol"}))
+
+            def created(dataset):
+                listing = self.client.list_datasets_configuration()
+                listing.addCallback(
+                    lambda config: self.assertEqual(
+                        dataset, config.datasets[dataset.dataset_id]))
+                return listing
+            d.addCallback(created)
+            return d
+
+        def test_create_if_name_absent_conflict(self):
+            """
+            ``create_dataset_if_name_absent`` fails with
+            ``DatasetAlreadyExists`` if another dataset has the given name.
+            """
+            d = self.client.create_dataset(
+                primary=self.node_1.uuid, maximum_size=DATASET_SIZE,
+                metadata={u"name": u"myvol"})
+            d.addCallback(lambda _: self.client.create_dataset_if_name_absent(
+                primary=self.node_2.uuid, maximum_size=DATASET_SIZE,
+                metadata={u"name": u"myvol"}))
+            return self.assertFailure(d, DatasetAlreadyExists)
+
         def test_create_matching_tag(self):
             """
             If a matching tag is given the create succeeds.
@@ -322,6 +367,19 @@ def make_clientv1_tests():
             d.addCallback(got_listing)
             return d
 
+        def test_move_deleted(self):
+            """
+            ``move_dataset`` fails with ``ResponseError`` if the dataset has
+            been deleted.
+            """
+            d = self.assert_creates(self.client, primary=self.node_1.uuid)
+            d.addCallback(
+                lambda dataset: self.client.delete_dataset(dataset.dataset_id))
+            d.addCallback(
+                lambda dataset: self.client.move_dataset(
+                    self.node_2.uuid, dataset.dataset_id))
+            return self.assertFailure(d, ResponseError)
+
         def test_move_matching_tag(self):
             """
             If a matching tag is given the move succeeds.
@@ -367,6 +425,47 @@ def make_clientv1_tests():
                               states))
             return d
 
+        def test_wait_for_dataset_state_manifest(self):
+            """
+            ``wait_for_dataset_state`` returns the state of a dataset that is
+            already manifest on the given node.
+            """
+            dataset_id = uuid4()
+            d = self.assert_creates(self.client, primary=self.node_1.uuid,
+                                    maximum_size=DATASET_SIZE,
+                                    dataset_id=dataset_id)
+            d.addCallback(lambda _: self.synchronize_state())
+            d.addCallback(lambda _: self.client.wait_for_dataset_state(
+                dataset_id, self.node_1.uuid))
+            d.addCallback(self.assertEqual,
+                          DatasetState(dataset_id=dataset_id,
+                                       primary=self.node_1.uuid,
+                                       maximum_size=DATASET_SIZE,
+                                       path=FilePath(b"/flocker").child(
+                                           bytes(dataset_id))))
+            return d
+
+        def test_wait_for_dataset_state_later(self):
+            """
+            ``wait_for_dataset_state`` returns the state of a dataset once it
+            becomes manifest on the given node.
+            """
+            dataset_id = uuid4()
+            d = self.assert_creates(self.client, primary=self.node_1.uuid,
+                                    maximum_size=DATASET_SIZE,
+                                    dataset_id=dataset_id)
+
+            def created(_):
+                waiting = self.client.wait_for_dataset_state(
+                    dataset_id, self.node_1.uuid)
+                self.synchronize_state()
+                return waiting
+            d.addCallback(created)
+            d.addCallback(lambda state: self.assertEqual(
+                (dataset_id, self.node_1.uuid),
+                (state.dataset_id, state.primary)))
+            return d
+
         def test_acquire_lease_result(self):
             """
             ``acquire_lease`` returns a ``Deferred`` firing with ``Lease``
@@ -699,23 +798,20 @@ class FakeFlockerClientTests(make_clientv1_tests()):
         return self.client._configured_datasets
 
 
-class FlockerClientTests(make_clientv1_tests()):
+class ControlServiceClientTestsMixin(object):
     """
-    Interface tests for ``FlockerClient``.
+    Tests for ``FlockerClient`` talking to an in-process control service.
+
+    Mixed into ``TestCase``\ s created by ``make_clientv1_tests`` whose
+    ``create_client`` calls ``start_control_service``.
     """
-    @skipUnless(platform.isLinux(),
-                "flocker-node-era currently requires Linux.")
-    @skipUnless(which("flocker-node-era"),
-                "flocker-node-era needs to be in $PATH.")
-    def create_client(self):
+    def start_control_service(self, clock, era):
         """
-        Create a new ``FlockerClient`` instance pointing at a running control
-        service REST API.
+        Start the services that the control service's REST API uses.
 
-        :return: ``FlockerClient`` instance.
+        :param Clock clock: The clock used by the services.
+        :param UUID era: The era of ``self.node_1``.
         """
-        clock = Clock()
-        _, self.port = find_free_port()
         self.persistence_service = ConfigurationPersistenceService(
             clock, FilePath(self.mktemp()))
         self.persistence_service.startService()
@@ -724,7 +820,7 @@ class FlockerClientTests(make_clientv1_tests()):
         source = ChangeSource()
         # Prevent nodes being deleted by the state wiper.
         source.set_last_activity(reactor.seconds())
-        self.era = UUID(check_output(["flocker-node-era"]))
+        self.era = era
         self.cluster_state_service.apply_changes_from_source(
             source=source,
             changes=[
@@ -735,27 +831,6 @@ class FlockerClientTests(make_clientv1_tests()):
         )
         self.addCleanup(self.cluster_state_service.stopService)
         self.addCleanup(self.persistence_service.stopService)
-        credential_set, _ = get_credential_sets()
-        credentials_path = FilePath(self.mktemp())
-        credentials_path.makedirs()
-
-        api_service = create_api_service(
-            self.persistence_service,
-            self.cluster_state_service,
-            TCP4ServerEndpoint(reactor, self.port, interface=b"127.0.0.1"),
-            rest_api_context_factory(
-                credential_set.root.credential.certificate,
-                credential_set.control),
-            # Use consistent fake time for API results:
-            clock)
-        api_service.startService()
-        self.addCleanup(api_service.stopService)
-
-        credential_set.copy_to(credentials_path, user=True)
-        return FlockerClient(reactor, b"127.0.0.1", self.port,
-                             credentials_path.child(b"cluster.crt"),
-                             credentials_path.child(b"user.crt"),
-                             credentials_path.child(b"user.key"))
 
     def synchronize_state(self):
         deployment = self.persistence_service.get()
@@ -775,6 +850,207 @@ class FlockerClientTests(make_clientv1_tests()):
     def get_configuration_tag(self):
         return self.persistence_service.configuration_hash()
 
+    def test_wait_for_dataset_state_not_limited(self):
+        """
+        A request waiting for a dataset to become manifest does not count
+        towards the limit on concurrent requests.
+        """
+        dataset = ModelDataset(dataset_id=unicode(uuid4()))
+        waiting = self.client.wait_for_dataset_state(
+            UUID(dataset.dataset_id), self.node_1.uuid)
+        self.assertEqual(self.client._concurrency.limit,
+                         self.client._concurrency.tokens)
+        self.cluster_state_service.apply_changes([
+            NodeState(uuid=self.node_1.uuid, hostname=u"10.0.0.1",
+                      manifestations={dataset.dataset_id: Manifestation(
+                          dataset=dataset, primary=True)},
+                      paths={dataset.dataset_id: FilePath(b"/flocker")},
+                      devices={}),
+        ])
+        waiting.addCallback(lambda state: self.assertEqual(
+            UUID(dataset.dataset_id), state.dataset_id))
+        return waiting
+
+    def test_unset_primary(self):
+        """
+        If the ``FlockerClient`` receives a dataset state where primary is
+        ``None`` it parses it correctly.
+        """
+        dataset_id = uuid4()
+        self.cluster_state_service.apply_changes([
+            NonManifestDatasets(datasets={
+                unicode(dataset_id): ModelDataset(
+                    dataset_id=unicode(dataset_id)),
+                })])
+        d = self.client.list_datasets_state()
+        d.addCallback(lambda states:
+                      self.assertEqual(
+                          [DatasetState(dataset_id=dataset_id,
+                                        primary=None,
+                                        maximum_size=None,
+                                        path=None)],
+                          states))
+        return d
+
+    def test_concurrency_limit(self):
+        """
+        Requests beyond the concurrency limit wait for earlier requests to
+        finish, and are then sent.
+        """
+        self.client._concurrency = DeferredSemaphore(1)
+        original = self.client._treq.request
+        sent = []
+        first = Deferred()
+
+        def request(*args, **kwargs):
+            sent.append(args)
+            if len(sent) == 1:
+                # Hold up the first request until the second is made:
+                return first.addCallback(
+                    lambda _: original(*args, **kwargs))
+            return original(*args, **kwargs)
+        self.patch(self.client._treq, "request", request)
+        d = gatherResults([self.client.list_nodes(),
+                           self.client.list_nodes()])
+        self.assertEqual(1, len(sent))
+        first.callback(None)
+        d.addCallback(lambda results: self.assertEqual(
+            (2, results[0]), (len(sent), results[1])))
+        return d
+
+    def test_compressed_listing(self):
+        """
+        Large listings are sent gzip encoded and decoded by the client.
+        """
+        compressed = []
+
+        def compress(body, original=rest_api._compress):
+            compressed.append(body)
+            return original(body)
+        self.patch(rest_api, "_compress", compress)
+        dataset_ids = [unicode(uuid4()) for _ in range(20)]
+        self.cluster_state_service.apply_changes([
+            NonManifestDatasets(datasets={
+                dataset_id: ModelDataset(dataset_id=dataset_id)
+                for dataset_id in dataset_ids})])
+        d = self.client.list_datasets_state()
+        d.addCallback(lambda states: self.assertEqual(
+            (sorted(dataset_ids), 1),
+            (sorted(unicode(state.dataset_id) for state in states),
+             len(compressed))))
+        return d
+
+    def test_this_node_uuid_retry(self):
+        """
+        ``this_node_uuid`` retries if the node UUID is unknown.
+        """
+        # Pretend that the era for node 1 is something else; first try at
+        # getting node UUID for real era will therefore fail:
+        self.cluster_state_service.apply_changes([
+            UpdateNodeStateEra(era=uuid4(), uuid=self.node_1.uuid)])
+
+        # When we lookup the DeploymentState the first time we'll set the
+        # value to the correct one, so second try should succeed:
+        def as_deployment(original=self.cluster_state_service.as_deployment):
+            result = original()
+            self.cluster_state_service.apply_changes(changes=[
+                UpdateNodeStateEra(era=self.era, uuid=self.node_1.uuid)])
+            return result
+        self.patch(self.cluster_state_service, "as_deployment", as_deployment)
+
+        d = self.client.this_node_uuid()
+        d.addCallback(self.assertEqual, self.node_1.uuid)
+        return d
+
+    def test_this_node_uuid_no_retry_on_other_responses(self):
+        """
+        ``this_node_uuid`` doesn't retry on unexpected responses.
+        """
+        # Cause 500 errors to be raised by the API endpoint:
+        self.patch(self.cluster_state_service, "as_deployment",
+                   lambda: 1/0)
+        return self.assertFailure(self.client.this_node_uuid(),
+                                  ResponseError)
+
+    @capture_logging(None)
+    def test_queued_request_context(self, logger):
+        """
+        A request that waits for the concurrency limit is sent in the context
+        of its own action.
+        """
+        self.client._concurrency = DeferredSemaphore(1)
+        original = self.client._treq.request
+        first = Deferred()
+
+        def request(*args, **kwargs):
+            Message.new(message_type=u"test:sending").write()
+            if not first.called:
+                # Hold up the first request so that the second is queued:
+                return first.addCallback(
+                    lambda _: original(*args, **kwargs))
+            return original(*args, **kwargs)
+        self.patch(self.client._treq, "request", request)
+        d = gatherResults([self.client.list_nodes(),
+                           self.client.list_nodes()])
+        first.callback(None)
+
+        def got_results(_):
+            actions = LoggedAction.ofType(logger.messages, _LOG_HTTP_REQUEST)
+            self.assertEqual(
+                [[u"test:sending"]] * 2,
+                [[child.message[u"message_type"]
+                  for child in action.children
+                  if isinstance(child, LoggedMessage)]
+                 for action in actions])
+        d.addCallback(got_results)
+        return d
+
+
+class FlockerClientTests(ControlServiceClientTestsMixin,
+                         make_clientv1_tests()):
+    """
+    Interface tests for ``FlockerClient`` talking to a control service over
+    the network.
+    """
+    @skipUnless(platform.isLinux(),
+                "flocker-node-era currently requires Linux.")
+    @skipUnless(which("flocker-node-era"),
+                "flocker-node-era needs to be in $PATH.")
+    def create_client(self):
+        """
+        Create a new ``FlockerClient`` instance pointing at a running control
+        service REST API.
+
+        :return: ``FlockerClient`` instance.
+        """
+        clock = Clock()
+        _, self.port = find_free_port()
+        self.start_control_service(
+            clock, UUID(check_output(["flocker-node-era"])))
+        credential_set, _ = get_credential_sets()
+        credentials_path = FilePath(self.mktemp())
+        credentials_path.makedirs()
+
+        api_service = create_api_service(
+            self.persistence_service,
+            self.cluster_state_service,
+            TCP4ServerEndpoint(reactor, self.port, interface=b"127.0.0.1"),
+            rest_api_context_factory(
+                credential_set.root.credential.certificate,
+                credential_set.control),
+            # Use consistent fake time for API results:
+            clock)
+        api_service.startService()
+        self.addCleanup(api_service.stopService)
+
+        credential_set.copy_to(credentials_path, user=True)
+        client = FlockerClient(reactor, b"127.0.0.1", self.port,
+                               credentials_path.child(b"cluster.crt"),
+                               credentials_path.child(b"user.crt"),
+                               credentials_path.child(b"user.key"))
+        self.addCleanup(client.close)
+        return client
+
     @capture_logging(None)
     def test_logging(self, logger):
         """
@@ -834,58 +1110,118 @@ class FlockerClientTests(make_clientv1_tests()):
         d.addCallback(lambda exc: self.assertEqual(exc.code, BAD_REQUEST))
         return d
 
-    def test_unset_primary(self):
+    def test_connection_reused(self):
         """
-        If the ``FlockerClient`` receives a dataset state where primary is
-        ``None`` it parses it correctly.
+        Consecutive requests are sent over the same persistent connection.
         """
-        dataset_id = uuid4()
-        self.cluster_state_service.apply_changes([
-            NonManifestDatasets(datasets={
-                unicode(dataset_id): ModelDataset(
-                    dataset_id=unicode(dataset_id)),
-                })])
-        d = self.client.list_datasets_state()
-        d.addCallback(lambda states:
-                      self.assertEqual(
-                          [DatasetState(dataset_id=dataset_id,
-                                        primary=None,
-                                        maximum_size=None,
-                                        path=None)],
-                          states))
+        d = self.client.list_nodes()
+        d.addCallback(lambda _: self.client.list_nodes())
+        d.addCallback(lambda _: self.assertEqual(
+            [1], [len(connections) for connections
+                  in self.client._pool._connections.values()]))
         return d
 
-    def test_this_node_uuid_retry(self):
+
+class _PathMemoryAgent(MemoryAgent):
+    """
+    A ``MemoryAgent`` for absolute URLs, which only dispatches on their path.
+    """
+    def request(self, method, url, headers=None, body=None):
+        return MemoryAgent.request(
+            self, method, urlparse(url).path, headers, body)
+
+
+class InMemoryFlockerClientTests(ControlServiceClientTestsMixin,
+                                 make_clientv1_tests()):
+    """
+    Interface tests for ``FlockerClient`` talking to a control service in
+    memory, which run without the network or ``flocker-node-era``.
+    """
+    def create_client(self):
         """
-        ``this_node_uuid`` retries if the node UUID is unknown.
+        Create a new ``FlockerClient`` instance whose requests are rendered
+        by the control service's REST API in memory.
+
+        :return: ``FlockerClient`` instance.
         """
-        # Pretend that the era for node 1 is something else; first try at
-        # getting node UUID for real era will therefore fail:
-        self.cluster_state_service.apply_changes([
-            UpdateNodeStateEra(era=uuid4(), uuid=self.node_1.uuid)])
+        clock = Clock()
+        self.start_control_service(clock, uuid4())
+        self.patch(_client, "getProcessOutput",
+                   lambda *args, **kwargs: succeed(bytes(self.era)))
+        api_root = Resource()
+        api_root.putChild(b"v1", ConfigurationAPIUserV1(
+            self.persistence_service, self.cluster_state_service,
+            # Use consistent fake time for API results:
+            clock).app.resource())
 
-        # When we lookup the DeploymentState the first time we'll set the
-        # value to the correct one, so second try should succeed:
-        def as_deployment(original=self.cluster_state_service.as_deployment):
-            result = original()
-            self.cluster_state_service.apply_changes(changes=[
-                UpdateNodeStateEra(era=self.era, uuid=self.node_1.uuid)])
-            return result
-        self.patch(self.cluster_state_service, "as_deployment", as_deployment)
+        client = self.flocker_client()
+        client._treq = HTTPClient(_PathMemoryAgent(api_root))
+        return client
 
-        d = self.client.this_node_uuid()
-        d.addCallback(self.assertEqual, self.node_1.uuid)
-        return d
+    def flocker_client(self, **kwargs):
+        """
+        :param kwargs: Extra arguments for ``FlockerClient``.
 
-    def test_this_node_uuid_no_retry_on_other_responses(self):
+        :return: A ``FlockerClient`` with a user's credentials.
         """
-        ``this_node_uuid`` doesn't retry on unexpected responses.
+        credential_set, _ = get_credential_sets()
+        credentials_path = FilePath(self.mktemp())
+        credentials_path.makedirs()
+        credential_set.copy_to(credentials_path, user=True)
+        return FlockerClient(reactor, b"127.0.0.1", REST_API_PORT,
+                             credentials_path.child(b"cluster.crt"),
+                             credentials_path.child(b"user.crt"),
+                             credentials_path.child(b"user.key"),
+                             **kwargs)
+
+    def test_persistent_connections(self):
         """
-        # Cause 500 errors to be raised by the API endpoint:
-        self.patch(self.cluster_state_service, "as_deployment",
-                   lambda: 1/0)
-        return self.assertFailure(self.client.this_node_uuid(),
-                                  ResponseError)
+        ``FlockerClient`` keeps the given number of idle connections open for
+        the given time, and ``close`` closes them.
+        """
+        client = self.flocker_client(pool_size=3, idle_timeout=5.0)
+        closed = []
+        self.patch(client._pool, "closeCachedConnections",
+                   lambda: closed.append(True))
+        client.close()
+        self.assertEqual(
+            (True, 3, 5.0, [True]),
+            (client._pool.persistent, client._pool.maxPersistentPerHost,
+             client._pool.cachedConnectionTimeout, closed))
+
+
+class GatherTests(TestCase):
+    """
+    Tests for ``gather``.
+    """
+    def setUp(self):
+        super(GatherTests, self).setUp()
+        self.client = FakeFlockerClient()
+
+    def test_results(self):
+        """
+        ``gather`` fires with the results of the calls, in order.
+        """
+        d = self.client.create_dataset(primary=uuid4())
+        d.addCallback(lambda dataset: gather([
+            self.client.list_datasets_configuration,
+            lambda: self.client.list_leases(),
+            self.client.this_node_uuid,
+        ]))
+        results = self.successResultOf(d)
+        self.assertEqual(
+            (1, [], self.client.this_node_uuid().result),
+            (len(list(results[0])), results[1], results[2]))
+
+    def test_failure(self):
+        """
+        ``gather`` fails with the failure of a call that fails.
+        """
+        d = gather([
+            self.client.list_leases,
+            lambda: self.client.delete_dataset(uuid4()),
+        ])
+        self.failureResultOf(d, KeyError)
 
 
 class ConditionalCreateTests(TestCase):
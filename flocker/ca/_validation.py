@@ -13,6 +13,7 @@ from OpenSSL.SSL import VERIFY_PEER, VERIFY_FAIL_IF_NO_PEER_CERT
 from zope.interface import implementer
 
 from twisted.web.iweb import IPolicyForHTTPS
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
 from twisted.internet.ssl import optionsForClientTLS, Certificate
 from twisted.web.client import Agent
 
@@ -45,6 +46,59 @@ class ControlServicePolicy(PClass):
             clientCertificate=self.client_credential.private_certificate())
 
 
+@implementer(IOpenSSLClientConnectionCreator)
+class _SessionResumingCreator(object):
+    """
+    Wrap a TLS client connection creator so that each new connection offers
+    the TLS session negotiated by the previous one, allowing the server to
+    skip the full handshake.
+
+    :ivar _creator: The wrapped ``IOpenSSLClientConnectionCreator``.
+    :ivar _previous: The most recently created ``OpenSSL.SSL.Connection``,
+        or ``None``.
+    :ivar _session: The last ``OpenSSL.SSL.Session`` known, or ``None``.
+    """
+    def __init__(self, creator):
+        self._creator = creator
+        self._previous = None
+        self._session = None
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        if self._previous is not None:
+            session = self._previous.get_session()
+            if session is not None:
+                self._session = session
+        connection = self._creator.clientConnectionForTLS(tlsProtocol)
+        if self._session is not None:
+            connection.set_session(self._session)
+        self._previous = connection
+        return connection
+
+
+@implementer(IPolicyForHTTPS)
+class _SessionResumingPolicy(object):
+    """
+    HTTPS TLS policy which creates connections to each server from a single
+    TLS context, resuming earlier TLS sessions where the server allows it.
+
+    :ivar _policy: The wrapped ``IPolicyForHTTPS``.
+    :ivar dict _creators: Map ``(hostname, port)`` to the
+        ``_SessionResumingCreator`` for that server.
+    """
+    def __init__(self, policy):
+        self._policy = policy
+        self._creators = {}
+
+    def creatorForNetloc(self, hostname, port):
+        key = (hostname, port)
+        creator = self._creators.get(key)
+        if creator is None:
+            creator = _SessionResumingCreator(
+                self._policy.creatorForNetloc(hostname, port))
+            self._creators[key] = creator
+        return creator
+
+
 class _ControlServiceContextFactory(object):
     """
     Context factory that validates various kinds of clients that can
@@ -118,18 +172,22 @@ def rest_api_context_factory(ca_certificate, control_credential):
         ca_certificate, control_credential, b"user-")
 
 
-def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path):
+def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path,
+                             pool=None):
     """
     Create a ``treq``-API object that implements the REST API TLS
     authentication.
 
     That is, validating the control service as well as presenting a
-    certificate to the control service for authentication.
+    certificate to the control service for authentication.  New connections
+    to the control service try to resume the previous TLS session.
 
     :param reactor: The reactor to use.
     :param FilePath ca_path: Absolute path to the public cluster certificate.
     :param FilePath user_cert_path: Absolute path to the user certificate.
     :param FilePath user_key_path: Absolute path to the user private key.
+    :param HTTPConnectionPool pool: The connection pool to use, or ``None``
+        to use a new connection for each request.
 
     :return: ``treq`` compatible object.
     """
@@ -137,4 +195,5 @@ def treq_with_authentication(reactor, ca_path, user_cert_path, user_key_path):
     user_credential = UserCredential.from_files(user_cert_path, user_key_path)
     policy = ControlServicePolicy(
         ca_certificate=ca, client_credential=user_credential.credential)
-    return HTTPClient(Agent(reactor, contextFactory=policy))
+    return HTTPClient(Agent(
+        reactor, contextFactory=_SessionResumingPolicy(policy), pool=pool))
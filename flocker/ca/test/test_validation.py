@@ -5,6 +5,7 @@ Test validation of keys generated by flocker-ca.
 """
 
 from .. import amp_server_context_factory, rest_api_context_factory
+from .._validation import _SessionResumingPolicy, _SessionResumingCreator
 from ..testtools import get_credential_sets
 from ...testtools import TestCase
 
@@ -36,3 +37,72 @@ class ClientValidationContextFactoryTests(TestCase):
             ca_set.root.credential.certificate, ca_set.control)
         self.assertIsNot(context_factory.getContext(),
                          context_factory.getContext())
+
+
+class _FakeConnection(object):
+    """
+    Stand-in for ``OpenSSL.SSL.Connection`` which records the TLS session
+    it is asked to resume.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.resumed = None
+
+    def get_session(self):
+        return self.session
+
+    def set_session(self, session):
+        self.resumed = session
+
+
+class _FakeCreator(object):
+    """
+    Stand-in for ``IOpenSSLClientConnectionCreator`` which creates
+    connections that negotiate the given sessions, in order.
+    """
+    def __init__(self, sessions):
+        self.sessions = list(sessions)
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        return _FakeConnection(self.sessions.pop(0))
+
+
+class _FakePolicy(object):
+    """
+    Stand-in for ``IPolicyForHTTPS``.
+    """
+    def creatorForNetloc(self, hostname, port):
+        return _FakeCreator([])
+
+
+class SessionResumingTests(TestCase):
+    """
+    Tests for ``_SessionResumingPolicy`` and ``_SessionResumingCreator``.
+    """
+    def test_creator_per_server(self):
+        """
+        ``_SessionResumingPolicy.creatorForNetloc`` returns the same creator
+        for each request to the same server, and different creators for
+        different servers.
+        """
+        policy = _SessionResumingPolicy(_FakePolicy())
+        self.assertEqual(
+            (True, False),
+            (policy.creatorForNetloc(b"a", 1) is
+             policy.creatorForNetloc(b"a", 1),
+             policy.creatorForNetloc(b"a", 1) is
+             policy.creatorForNetloc(b"a", 2)))
+
+    def test_resume_previous_session(self):
+        """
+        Each connection after the first resumes the session of the connection
+        before it, or the last known session if that connection has none.
+        """
+        first, second = object(), object()
+        creator = _SessionResumingCreator(
+            _FakeCreator([first, None, second, None]))
+        connections = [creator.clientConnectionForTLS(None)
+                       for _ in range(4)]
+        self.assertEqual(
+            [None, first, first, second],
+            [connection.resumed for connection in connections])
@@ -0,0 +1,191 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_benchmark -*-
+
+"""
+Measure where time goes when the REST API answers requests for a large
+cluster.
+"""
+
+from inspect import getargspec
+from json import dumps
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+from uuid import uuid4
+
+from pyrsistent import PClass, field
+
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+
+from ..restapi import EndpointResponse
+from ..restapi._schema import getValidator
+from ._model import (
+    Application, AttachedVolume, ChangeSource, Dataset, Deployment,
+    DockerImage, Manifestation, Node, NodeState, UpdateNodeStateEra,
+)
+from ._clusterstate import ClusterStateService
+from ._persistence import ConfigurationPersistenceService
+from .httpapi import ConfigurationAPIUserV1, SCHEMAS
+
+
+class EndpointTimings(PClass):
+    """
+    Average cost in seconds of the steps of answering a request to one
+    endpoint.
+
+    :ivar unicode name: The name of the endpoint method.
+    :ivar float build: Calling the endpoint to build the response.
+    :ivar float encode: JSON encoding the response.
+    :ivar float validate: Validating the response with the precompiled
+        validator used by the API.
+    :ivar float validate_uncompiled: Validating the response with a
+        validator that resolves schema references as it goes.
+    """
+    name = field(type=unicode, mandatory=True)
+    build = field(type=float, mandatory=True)
+    encode = field(type=float, mandatory=True)
+    validate = field(type=float, mandatory=True)
+    validate_uncompiled = field(type=float, mandatory=True)
+
+
+def _time(f, repeat):
+    """
+    :param f: Zero-argument callable to time.
+    :param int repeat: How many times to call ``f``.
+
+    :return: Tuple of the average time taken by a call to ``f``, in seconds,
+        and the result of the last call.
+    """
+    start = default_timer()
+    for _ in range(repeat):
+        result = f()
+    return (default_timer() - start) / repeat, result
+
+
+def synthetic_cluster(nodes, datasets, containers):
+    """
+    Create a configuration and a matching state for a cluster.
+
+    :param int nodes: The number of nodes.
+    :param int datasets: The number of datasets, spread over the nodes.
+    :param int containers: The number of containers, spread over the nodes.
+        Each of them uses one of the datasets as a volume, so this must be
+        no greater than ``datasets``.
+
+    :return: Tuple of ``Deployment`` and list of ``IClusterStateChange``
+        describing the same cluster.
+    """
+    node_uuids = [uuid4() for _ in range(nodes)]
+    manifestations = {node_uuid: {} for node_uuid in node_uuids}
+    applications = {node_uuid: set() for node_uuid in node_uuids}
+    for i in range(datasets):
+        node_uuid = node_uuids[i % nodes]
+        manifestation = Manifestation(
+            dataset=Dataset(
+                dataset_id=unicode(uuid4()), maximum_size=1024 * 1024 * 1024,
+                metadata={u"name": u"dataset-{}".format(i)},
+            ),
+            primary=True,
+        )
+        manifestations[node_uuid][manifestation.dataset_id] = manifestation
+        if i < containers:
+            applications[node_uuid].add(Application(
+                name=u"container-{}".format(i),
+                image=DockerImage.from_string(u"clusterhq/flocker"),
+                volume=AttachedVolume(
+                    manifestation=manifestation,
+                    mountpoint=FilePath(b"/data"),
+                ),
+            ))
+    deployment = Deployment(nodes={
+        Node(uuid=node_uuid, applications=applications[node_uuid],
+             manifestations=manifestations[node_uuid])
+        for node_uuid in node_uuids
+    })
+    changes = []
+    for i, node_uuid in enumerate(node_uuids):
+        changes.append(UpdateNodeStateEra(uuid=node_uuid, era=uuid4()))
+        changes.append(NodeState(
+            uuid=node_uuid, hostname=u"10.0.{}.{}".format(i // 256, i % 256),
+            applications=applications[node_uuid],
+            manifestations=manifestations[node_uuid],
+            paths={dataset_id: FilePath(b"/flocker").child(bytes(dataset_id))
+                   for dataset_id in manifestations[node_uuid]},
+            devices={},
+        ))
+    return deployment, changes
+
+
+def _listing_endpoints():
+    """
+    :return: List of the ``ConfigurationAPIUserV1`` endpoints which take no
+        arguments, i.e. the ones that describe the cluster as a whole.
+    """
+    result = []
+    for name in sorted(dir(ConfigurationAPIUserV1)):
+        endpoint = getattr(ConfigurationAPIUserV1, name)
+        original = getattr(endpoint, "original", None)
+        if original is not None and getargspec(original).args == ["self"]:
+            result.append(endpoint)
+    return result
+
+
+def measure_endpoints(deployment, changes, repeat):
+    """
+    Measure the cost of answering requests to the listing endpoints of the
+    REST API.
+
+    :param Deployment deployment: The cluster configuration.
+    :param changes: ``IClusterStateChange`` providers describing the cluster
+        state.
+    :param int repeat: The number of times to repeat each measurement.
+
+    :return: List of ``EndpointTimings``, one per endpoint.
+    """
+    clock = Clock()
+    path = mkdtemp()
+    try:
+        persistence = ConfigurationPersistenceService(clock, FilePath(path))
+        persistence.load_configuration()
+        persistence.save(deployment)
+        cluster_state = ClusterStateService(clock)
+        cluster_state.apply_changes_from_source(ChangeSource(), changes)
+        api = ConfigurationAPIUserV1(persistence, cluster_state, clock)
+
+        timings = []
+        for endpoint in _listing_endpoints():
+            uncompiled = getValidator(endpoint.outputSchema, SCHEMAS)
+            build, result = _time(lambda: endpoint.original(api), repeat)
+            if isinstance(result, EndpointResponse):
+                result = result.result
+            timings.append(EndpointTimings(
+                name=endpoint.__name__.decode("ascii"),
+                build=build,
+                encode=_time(lambda: dumps(result), repeat)[0],
+                validate=_time(
+                    lambda: endpoint.outputValidator.validate(result),
+                    repeat)[0],
+                validate_uncompiled=_time(
+                    lambda: uncompiled.validate(result), repeat)[0],
+            ))
+        return timings
+    finally:
+        rmtree(path)
+
+
+def format_timings(timings):
+    """
+    :param timings: Iterable of ``EndpointTimings``.
+
+    :return: ``bytes`` with a table of the timings in milliseconds.
+    """
+    columns = ["build", "encode", "validate", "validate_uncompiled"]
+    lines = ["{:<32}".format("endpoint (ms)") +
+             "".join("{:>22}".format(column) for column in columns)]
+    for timing in timings:
+        lines.append(
+            "{:<32}".format(timing.name) +
+            "".join("{:>22.3f}".format(getattr(timing, column) * 1000)
+                    for column in columns))
+    return "\n".join(lines) + "\n"
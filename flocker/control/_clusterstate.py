@@ -13,6 +13,8 @@ from twisted.application.internet import TimerService
 
 from pyrsistent import PClass, field, pmap
 
+from eliot import write_traceback
+
 from . import DeploymentState, ChangeSource
 
 # Allowed inactivity period before updates are expired
@@ -55,6 +57,7 @@ class ClusterStateService(MultiService):
     :ivar PMap _information_wipers: Map (wiper class, wiper key) to
         ``_WiperAndSource``.
     :ivar _clock: ``IReactorTime`` provider.
+    :ivar list _change_callbacks: Callables to call when the state changes.
     """
     def __init__(self, reactor):
         MultiService.__init__(self)
@@ -64,12 +67,46 @@ class ClusterStateService(MultiService):
         timer.setServiceParent(self)
         self._information_wipers = pmap()
         self._clock = reactor
+        self._change_callbacks = []
+
+    def register(self, change_callback):
+        """
+        Register a function to be called whenever the state changes.
+
+        :param change_callback: Callable that takes no arguments, will be
+            called when the state changes.
+        """
+        self._change_callbacks.append(change_callback)
+
+    def unregister(self, change_callback):
+        """
+        Stop calling a function previously passed to ``register``.
+
+        :param change_callback: The registered callable.
+        """
+        self._change_callbacks.remove(change_callback)
+
+    def _notify(self, original_state):
+        """
+        Call the registered callbacks if the state has changed.
+
+        :param DeploymentState original_state: The state before the change.
+        """
+        if self._deployment_state is original_state:
+            return
+        # Callbacks may unregister themselves:
+        for callback in list(self._change_callbacks):
+            try:
+                callback()
+            except:
+                write_traceback()
 
     def _wipe_expired(self):
         """
         Clear any expired state from memory.
         """
         current_time = datetime.utcfromtimestamp(self._clock.seconds())
+        original_state = self._deployment_state
         evolver = self._information_wipers.evolver()
         for key, wipe in self._information_wipers.items():
             last_activity = wipe.last_activity()
@@ -79,6 +116,7 @@ class ClusterStateService(MultiService):
                 )
                 evolver.remove(key)
         self._information_wipers = evolver.persistent()
+        self._notify(original_state)
 
     def manifestation_path(self, node_uuid, dataset_id):
         """
@@ -113,6 +151,7 @@ class ClusterStateService(MultiService):
         # XXX: Multiple nodes may report being primary for a dataset. Enforce
         # consistency here. See
         # https://clusterhq.atlassian.net/browse/FLOC-1303
+        original_state = self._deployment_state
         for change in changes:
             self._deployment_state = change.update_cluster_state(
                 self._deployment_state
@@ -123,6 +162,32 @@ class ClusterStateService(MultiService):
             self._information_wipers = self._information_wipers.set(
                 key, _WiperAndSource(wiper=wiper, source=source)
             )
+        self._notify(original_state)
+
+    def wipe_changes_from_source(self, source, changes):
+        """
+        Forget the information some earlier changes from a source added,
+        without waiting for it to expire.
+
+        Information that was since updated by a different source is kept.
+
+        :param IClusterChangeSource source: The source the changes were
+            received from.
+        :param list changes: Some ``IClusterStateChange`` providers whose
+            information should be wiped.
+        """
+        original_state = self._deployment_state
+        for change in changes:
+            wiper = change.get_information_wipe()
+            key = (wiper.__class__, wiper.key())
+            wipe = self._information_wipers.get(key)
+            if wipe is None or wipe.source is not source:
+                continue
+            self._deployment_state = wipe.update_cluster_state(
+                self._deployment_state
+            )
+            self._information_wipers = self._information_wipers.remove(key)
+        self._notify(original_state)
 
     @deprecated(v1_0, "ClusterStateService.apply_changes_from_source")
     def apply_changes(self, changes):
@@ -0,0 +1,164 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_index -*-
+
+"""
+Secondary indexes over the desired configuration and the cluster state.
+
+``Deployment`` and ``DeploymentState`` are immutable, so an index built for
+one of them stays correct for as long as that object exists.  Each index is
+built at most once per object, the first time someone asks for it, and is
+then shared by every later lookup against the same object.  Lookups such as
+"which node is this dataset on" or "which node has this era" then cost a
+dictionary access, not a scan of every node and manifestation.
+"""
+
+from weakref import ref
+
+from pyrsistent import PClass, field, pmap, pvector, thaw
+
+
+# Metadata key holding the human-readable name of a dataset:
+NAME_METADATA_KEY = u"name"
+
+
+class DeploymentIndex(PClass):
+    """
+    Lookup tables for a ``Deployment``.
+
+    :ivar PMap nodes: Map node ``UUID`` to ``Node``.
+    :ivar PMap manifestations: Map dataset ID to a ``PVector`` of
+        ``(Manifestation, Node)`` tuples, one per node on which the
+        dataset is configured.
+    :ivar PMap primaries: Map dataset ID to the ``(Manifestation, Node)``
+        tuple for its primary manifestation.
+    :ivar PMap names: Map ``NAME_METADATA_KEY`` metadata values to the
+        dataset ID of the non-deleted dataset with that name.
+    """
+    nodes = field(mandatory=True)
+    manifestations = field(mandatory=True)
+    primaries = field(mandatory=True)
+    names = field(mandatory=True)
+
+    def primary(self, dataset_id):
+        """
+        :param unicode dataset_id: The dataset to look up.
+
+        :return: The ``(Manifestation, Node)`` of the dataset's primary
+            manifestation, or ``None`` if it has no primary manifestation.
+        """
+        return self.primaries.get(dataset_id)
+
+    def dataset_id_for_name(self, name):
+        """
+        :param unicode name: A dataset name.
+
+        :return: The ``unicode`` ID of the non-deleted dataset with the given
+            name, or ``None`` if there is no such dataset.
+        """
+        return self.names.get(name)
+
+
+class DeploymentStateIndex(PClass):
+    """
+    Lookup tables for a ``DeploymentState``.
+
+    :ivar PMap nodes: Map node ``UUID`` to ``NodeState``.
+    :ivar PMap eras: Map era ``UUID`` to node ``UUID``.
+    """
+    nodes = field(mandatory=True)
+    eras = field(mandatory=True)
+
+
+def _build_deployment_index(deployment):
+    """
+    Build a ``DeploymentIndex`` by scanning a ``Deployment`` once.
+
+    :param Deployment deployment: The configuration to index.
+    :return: The new ``DeploymentIndex``.
+    """
+    nodes = {}
+    manifestations = {}
+    primaries = {}
+    names = {}
+    for node in deployment.nodes:
+        nodes[node.uuid] = node
+        for dataset_id, manifestation in node.manifestations.items():
+            manifestations.setdefault(dataset_id, []).append(
+                (manifestation, node))
+            if manifestation.primary:
+                # There may be multiple primaries until FLOC-1303 is
+                # implemented; like the scanning code before this, we just
+                # pick the first one found.
+                primaries.setdefault(dataset_id, (manifestation, node))
+                dataset = manifestation.dataset
+                name = dataset.metadata.get(NAME_METADATA_KEY)
+                if name is not None and not dataset.deleted:
+                    names[name] = dataset_id
+    return DeploymentIndex(
+        nodes=pmap(nodes),
+        manifestations=pmap({dataset_id: pvector(instances)
+                             for dataset_id, instances
+                             in manifestations.items()}),
+        primaries=pmap(primaries),
+        names=pmap(names),
+    )
+
+
+def _build_deployment_state_index(deployment_state):
+    """
+    Build a ``DeploymentStateIndex`` by scanning a ``DeploymentState`` once.
+
+    :param DeploymentState deployment_state: The state to index.
+    :return: The new ``DeploymentStateIndex``.
+    """
+    return DeploymentStateIndex(
+        nodes=pmap({node.uuid: node for node in deployment_state.nodes}),
+        eras=pmap({era: node_uuid for (node_uuid, era)
+                   in thaw(deployment_state.node_uuid_to_era).items()}),
+    )
+
+
+# Map id() of an indexed object to a tuple of a weak reference to that object
+# and its index.  Entries are removed when the indexed object is garbage
+# collected, so an id() is never reused while its entry is still present.
+_indexes = {}
+
+
+def _cached_index(model, build):
+    """
+    Return the index for a model object, building it if necessary.
+
+    The cache is keyed on object identity rather than equality: hashing or
+    comparing a large ``Deployment`` costs as much as indexing it.
+
+    :param model: A ``Deployment`` or ``DeploymentState``.
+    :param build: One-argument callable that builds the index for ``model``.
+
+    :return: The index for ``model``.
+    """
+    key = id(model)
+    cached = _indexes.get(key)
+    if cached is not None:
+        reference, index = cached
+        if reference() is model:
+            return index
+    index = build(model)
+    _indexes[key] = (ref(model, lambda _, key=key: _indexes.pop(key, None)),
+                     index)
+    return index
+
+
+def index_deployment(deployment):
+    """
+    :param Deployment deployment: The configuration to index.
+    :return: The ``DeploymentIndex`` for ``deployment``.
+    """
+    return _cached_index(deployment, _build_deployment_index)
+
+
+def index_deployment_state(deployment_state):
+    """
+    :param DeploymentState deployment_state: The state to index.
+    :return: The ``DeploymentStateIndex`` for ``deployment_state``.
+    """
+    return _cached_index(deployment_state, _build_deployment_state_index)
@@ -25,6 +25,8 @@ from pyrsistent import (
 
 from zope.interface import Interface, implementer
 
+from ._index import index_deployment, index_deployment_state
+
 
 def _sequence_field(checked_class, suffix, item_type, optional, initial):
     """
@@ -486,12 +488,10 @@ def _get_node(default_factory):
              is found.
     """
     def get_node(deployment, uuid, **defaults):
-        nodes = list(
-            node for node in deployment.nodes if node.uuid == uuid
-        )
-        if len(nodes) == 0:
+        node = deployment.index().nodes.get(uuid)
+        if node is None:
             return default_factory(uuid=uuid, **defaults)
-        return nodes[0]
+        return node
     return get_node
 
 
@@ -623,6 +623,13 @@ class Deployment(PClass):
 
     get_node = _get_node(Node)
 
+    def index(self):
+        """
+        :return: The ``DeploymentIndex`` for this ``Deployment``.  It is only
+            built once, so repeated calls are cheap.
+        """
+        return index_deployment(self)
+
     def applications(self):
         """
         Return all applications in all nodes.
@@ -1045,6 +1052,13 @@ class DeploymentState(PClass):
 
     get_node = _get_node(NodeState)
 
+    def index(self):
+        """
+        :return: The ``DeploymentStateIndex`` for this ``DeploymentState``.
+            It is only built once, so repeated calls are cheap.
+        """
+        return index_deployment_state(self)
+
     def update_node(self, node_state):
         """
         Create new ``DeploymentState`` based on this one which updates an
@@ -152,21 +152,31 @@ class SerializableArgument(Argument):
     AMP argument that takes an object that can be serialized by the
     configuration persistence layer.
     """
-    def __init__(self, *classes):
+    def __init__(self, *classes, **kwargs):
         """
         :param *classes: The type or types of the objects we expect to
             (de)serialize. Only immutable types should be used if encoding
             caching will be enabled.
+        :param bool reuse_decoded: If true, receiving the same bytes as last
+            time returns the object decoded last time instead of decoding
+            them again.  Only immutable types should be used.
         """
         Argument.__init__(self)
         self._expected_classes = classes
+        self._reuse_decoded = kwargs.pop("reuse_decoded", False)
+        self._last_decoded = (None, None)
 
     def fromString(self, in_bytes):
+        last_bytes, last_obj = self._last_decoded
+        if self._reuse_decoded and in_bytes == last_bytes:
+            return last_obj
         obj = wire_decode(in_bytes)
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
             )
+        if self._reuse_decoded:
+            self._last_decoded = (in_bytes, obj)
         return obj
 
     def toString(self, obj):
@@ -218,10 +228,17 @@ class ClusterStatusCommand(Command):
 
     Having both as a single command simplifies the decision making process
     in the convergence agent during startup.
+
+    The configuration usually changes far less often than the state, so an
+    agent only decodes it when it differs from the one it last received.
     """
-    arguments = [('configuration', Big(SerializableArgument(Deployment))),
-                 ('state', Big(SerializableArgument(DeploymentState))),
-                 ('eliot_context', _EliotActionArgument())]
+    arguments = [
+        ('configuration',
+         Big(SerializableArgument(Deployment, reuse_decoded=True))),
+        ('state',
+         Big(SerializableArgument(DeploymentState, reuse_decoded=True))),
+        ('eliot_context', _EliotActionArgument()),
+    ]
     response = []
 
 
@@ -268,6 +285,23 @@ class NodeStateCommand(Command):
     response = []
 
 
+class ExpireNodeStateCommand(Command):
+    """
+    Used by a node's control service multiplexer to tell the control service
+    that a local agent which sent state over the multiplexer's connection has
+    gone away.
+
+    The information the given state changes added is forgotten right away,
+    as it would have expired some time after the agent's own connection was
+    lost.
+    """
+    arguments = [
+        ('state_changes', Big(SerializableArgument(list, tuple))),
+        ('eliot_context', _EliotActionArgument()),
+    ]
+    response = []
+
+
 class Timeout(object):
     """
     Call the specified action after the specified delay in seconds.
@@ -352,6 +386,14 @@ class ControlServiceLocator(CommandLocator):
             )
             return {}
 
+    @ExpireNodeStateCommand.responder
+    def node_state_expired(self, eliot_context, state_changes):
+        with eliot_context:
+            self.control_amp_service.node_state_expired(
+                self._source, state_changes,
+            )
+            return {}
+
     @SetNodeEraCommand.responder
     def set_node_era(self, era, node_uuid):
         # Further work will be done in FLOC-3380
@@ -692,6 +734,18 @@ class ControlAMPService(Service):
         self.cluster_state.apply_changes_from_source(source, state_changes)
         self._send_state_to_connections(self.connections)
 
+    def node_state_expired(self, source, state_changes):
+        """
+        State a connected client sent earlier is no longer valid.
+
+        :param IClusterStateSource source: Representation of where the
+            changes were received from.
+        :param list state_changes: The ``IClusterStateChange`` providers
+            whose information should be forgotten.
+        """
+        self.cluster_state.wipe_changes_from_source(source, state_changes)
+        self._send_state_to_connections(self.connections)
+
 
 class IConvergenceAgent(Interface):
     """
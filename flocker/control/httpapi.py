@@ -25,6 +25,7 @@ from twisted.web.server import Site
 from twisted.web.resource import Resource
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 
 from klein import Klein
 
@@ -44,6 +45,7 @@ from ._config import (
     ConfigurationError
 )
 from ._persistence import update_leases
+from ._index import NAME_METADATA_KEY
 from ._model import LeaseError
 
 from .. import __version__, REST_API_PORT as _port
@@ -75,6 +77,8 @@ LINK_ALIAS_COLLISION = make_bad_request(
 )
 DATASET_ID_COLLISION = make_bad_request(
     code=CONFLICT, description=u"The provided dataset_id is already in use.")
+DATASET_NAME_COLLISION = make_bad_request(
+    code=CONFLICT, description=u"The provided name is already in use.")
 PRIMARY_NODE_NOT_FOUND = make_bad_request(
     description=u"The provided primary node is not part of the cluster.")
 DATASET_NOT_FOUND = make_bad_request(
@@ -92,6 +96,12 @@ LEASE_HELD = make_bad_request(
     code=CONFLICT, description=u"Lease already held.")
 NODE_BY_ERA_NOT_FOUND = make_bad_request(
     code=NOT_FOUND, description=u"No node found with given era.")
+DATASET_NOT_MANIFEST = make_bad_request(
+    code=NOT_FOUND, description=u"The dataset is not manifest on the node.")
+
+# How long a request waiting for a dataset to become manifest is held open
+# before the client is told to try again:
+STATE_WAIT_TIMEOUT = 30.0
 
 _UNDEFINED_MAXIMUM_SIZE = object()
 
@@ -159,6 +169,10 @@ class ConfigurationAPIUserV1(object):
         self.persistence_service = persistence_service
         self.cluster_state_service = cluster_state_service
         self.clock = clock
+        # Callables for the requests waiting for datasets to become
+        # manifest, each called with the nodes of the cluster state by UUID
+        # whenever it changes:
+        self._dataset_state_waiters = []
 
     @app.route("/version", methods=['GET'])
     @user_documentation(
@@ -269,6 +283,60 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
+        return self._add_dataset(
+            self.persistence_service.get(), primary, dataset_id,
+            maximum_size, metadata)
+
+    @app.route("/configuration/_create_dataset_if_name_absent",
+               methods=['POST'])
+    @private_api
+    @structured(
+        inputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/'
+            'configuration_datasets_create_if_name_absent'
+        },
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_datasets'},
+        schema_store=SCHEMAS,
+    )
+    def create_dataset_if_name_absent(self, primary, metadata,
+                                      dataset_id=None, maximum_size=None):
+        """
+        Create a new dataset in the cluster configuration, unless another
+        non-deleted dataset has the same ``name`` in its metadata.
+
+        Checking and creating happen as a single change to the
+        configuration, so unlike listing the configuration and then making a
+        conditional request, concurrent creates of the same name can't race.
+
+        Takes the same parameters as ``create_dataset_configuration``, except
+        that ``metadata`` is required and must include a ``name``.
+
+        :return: A ``dict`` describing the dataset which has been added to the
+            cluster configuration or giving error information if this is not
+            possible.
+        """
+        deployment = self.persistence_service.get()
+        if deployment.index().dataset_id_for_name(
+                metadata[NAME_METADATA_KEY]) is not None:
+            raise DATASET_NAME_COLLISION
+        return self._add_dataset(
+            deployment, primary, dataset_id, maximum_size, metadata)
+
+    def _add_dataset(self, deployment, primary, dataset_id, maximum_size,
+                     metadata):
+        """
+        Add a new dataset to the cluster configuration.
+
+        :param Deployment deployment: The current configuration.
+
+        The other parameters are as for ``create_dataset_configuration``.
+
+        :return: ``Deferred`` firing with an ``EndpointResponse`` describing
+            the dataset once the new configuration has been saved.
+        """
         if dataset_id is None:
             dataset_id = unicode(uuid4())
         dataset_id = dataset_id.lower()
@@ -278,13 +346,8 @@ class ConfigurationAPIUserV1(object):
 
         primary = UUID(hex=primary)
 
-        # Use persistence_service to get a Deployment for the cluster
-        # configuration.
-        deployment = self.persistence_service.get()
-        for node in deployment.nodes:
-            for manifestation in node.manifestations.values():
-                if manifestation.dataset.dataset_id == dataset_id:
-                    raise DATASET_ID_COLLISION
+        if dataset_id in deployment.index().manifestations:
+            raise DATASET_ID_COLLISION
 
         # XXX Check cluster state to determine if the given primary node
         # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
@@ -476,27 +539,111 @@ class ConfigurationAPIUserV1(object):
         # includes metadata and deleted flags which should not be part of the
         # dataset state response.
         # Refactor. See FLOC-2207.
-        response = []
         deployment_state = self.cluster_state_service.as_deployment()
-        get_manifestation_path = self.cluster_state_service.manifestation_path
+        return [_dataset_state_response(dataset, node)
+                for dataset, node in deployment_state.all_datasets()]
 
-        for dataset, node in deployment_state.all_datasets():
-            response_dataset = dict(
-                dataset_id=dataset.dataset_id,
-            )
+    @app.route("/state/datasets/_wait/<dataset_id>/<node_uuid>",
+               methods=['GET'])
+    @private_api
+    @structured(
+        inputSchema={},
+        outputSchema={
+            '$ref': '/v1/endpoints.json#/definitions/state_dataset'
+            },
+        schema_store=SCHEMAS
+    )
+    def wait_for_dataset_state(self, dataset_id, node_uuid):
+        """
+        Wait until a dataset is manifest on a node.
+
+        This lets a client on that node, e.g. the Docker plugin, learn that
+        a dataset it moved there has arrived as soon as the control service
+        does, rather than repeatedly listing the state of every dataset.
+
+        :param unicode dataset_id: The dataset.
+        :param unicode node_uuid: The node where it should be manifest.
+
+        :return: The state of the dataset, in the same form as a member of
+            the ``state_datasets`` result, once it is manifest on the node.
+            If that does not happen within ``STATE_WAIT_TIMEOUT`` seconds a
+            ``DATASET_NOT_MANIFEST`` error is returned and the client may
+            ask again.
+        """
+        node_uuid = UUID(node_uuid)
+
+        def manifest(nodes):
+            node = nodes.get(node_uuid)
+            if (node is None or node.manifestations is None or
+                    node.paths is None or
+                    dataset_id not in node.manifestations or
+                    dataset_id not in node.paths):
+                return None
+            return _dataset_state_response(
+                node.manifestations[dataset_id].dataset, node)
+
+        result = manifest(self._state_nodes())
+        if result is not None:
+            return result
+
+        def changed(nodes):
+            result = manifest(nodes)
+            if result is not None:
+                self._stop_waiting_for_dataset_state(changed)
+                timer.cancel()
+                waiting.callback(result)
+
+        def timed_out():
+            self._stop_waiting_for_dataset_state(changed)
+            waiting.errback(DATASET_NOT_MANIFEST)
+
+        def disconnected(waiting):
+            # The client went away, so there's no need to keep waiting:
+            self._stop_waiting_for_dataset_state(changed)
+            timer.cancel()
+
+        waiting = Deferred(disconnected)
+        timer = self.clock.callLater(STATE_WAIT_TIMEOUT, timed_out)
+        self._wait_for_dataset_state(changed)
+        return waiting
+
+    def _state_nodes(self):
+        """
+        :return: The nodes of the cluster state, as a ``dict`` mapping
+            their UUIDs to ``NodeState``.
+        """
+        return self.cluster_state_service.as_deployment().index().nodes
+
+    def _dataset_states_changed(self):
+        """
+        Tell every waiting request about a change to the cluster state,
+        looking up its nodes once for all of them.
+        """
+        nodes = self._state_nodes()
+        # Waiters may stop waiting:
+        for waiter in list(self._dataset_state_waiters):
+            waiter(nodes)
 
-            if node is not None:
-                response_dataset[u"primary"] = unicode(node.uuid)
-                response_dataset[u"path"] = get_manifestation_path(
-                    node.uuid,
-                    dataset.dataset_id
-                ).path.decode("utf-8")
+    def _wait_for_dataset_state(self, waiter):
+        """
+        Start calling a waiter whenever the cluster state changes.
+
+        :param waiter: Callable taking the result of ``_state_nodes``.
+        """
+        self._dataset_state_waiters.append(waiter)
+        if len(self._dataset_state_waiters) == 1:
+            self.cluster_state_service.register(self._dataset_states_changed)
 
-            if dataset.maximum_size is not None:
-                response_dataset[u"maximum_size"] = dataset.maximum_size
+    def _stop_waiting_for_dataset_state(self, waiter):
+        """
+        Stop calling a waiter passed to ``_wait_for_dataset_state``.
 
-            response.append(response_dataset)
-        return response
+        :param waiter: The waiter.
+        """
+        self._dataset_state_waiters.remove(waiter)
+        if not self._dataset_state_waiters:
+            self.cluster_state_service.unregister(
+                self._dataset_states_changed)
 
     @app.route("/configuration/containers", methods=['GET'])
     @user_documentation(
@@ -924,11 +1071,8 @@ class ConfigurationAPIUserV1(object):
     def get_node_by_era(self, era):
         era = UUID(era)
         cluster_state = self.cluster_state_service.as_deployment()
-        era_to_node_uuid = dict(
-            (era, node_uuid) for (node_uuid, era) in
-            cluster_state.node_uuid_to_era.items())
         try:
-            node_uuid = era_to_node_uuid[era]
+            node_uuid = cluster_state.index().eras[era]
         except KeyError:
             raise NODE_BY_ERA_NOT_FOUND
         return {u"uuid": unicode(node_uuid)}
@@ -1110,17 +1254,11 @@ def _find_manifestation_and_node(deployment, dataset_id):
     :return: Tuple containing the primary ``Manifestation`` and the
         ``Node`` it is on.
     """
-    manifestations_and_nodes = manifestations_from_deployment(
-        deployment, dataset_id)
-    index = 0
-    for index, (manifestation, node) in enumerate(
-            manifestations_and_nodes):
-        if manifestation.primary:
-            primary_manifestation, origin_node = manifestation, node
-            break
-    else:
+    index = deployment.index()
+    primary = index.primary(dataset_id)
+    if primary is None:
         # There are no manifestations containing the requested dataset.
-        if index == 0:
+        if dataset_id not in index.manifestations:
             raise DATASET_NOT_FOUND
         else:
             # There were no primary manifestations
@@ -1130,7 +1268,7 @@ def _find_manifestation_and_node(deployment, dataset_id):
                     dataset_id)
             )
 
-    return primary_manifestation, origin_node
+    return primary
 
 
 def _update_dataset_primary(deployment, dataset_id, primary):
@@ -1197,9 +1335,29 @@ def manifestations_from_deployment(deployment, dataset_id):
     :return: Iterable returning all manifestations of the supplied
         ``dataset_id``.
     """
-    for node in deployment.nodes:
-        if dataset_id in node.manifestations:
-            yield node.manifestations[dataset_id], node
+    return iter(deployment.index().manifestations.get(dataset_id, ()))
+
+
+def _dataset_state_response(dataset, node):
+    """
+    Describe the state of a dataset for an API response.
+
+    :param Dataset dataset: The dataset.
+    :param NodeState node: The node on which it is manifest, or ``None`` if
+        it is not manifest anywhere.
+
+    :return: A ``dict`` matching the ``state_dataset`` schema.
+    """
+    response_dataset = dict(
+        dataset_id=dataset.dataset_id,
+    )
+    if node is not None:
+        response_dataset[u"primary"] = unicode(node.uuid)
+        response_dataset[u"path"] = node.paths[
+            dataset.dataset_id].path.decode("utf-8")
+    if dataset.maximum_size is not None:
+        response_dataset[u"maximum_size"] = dataset.maximum_size
+    return response_dataset
 
 
 def datasets_from_deployment(deployment):
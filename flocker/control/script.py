@@ -9,13 +9,17 @@ import cProfile
 import signal
 import time
 
-from twisted.python.usage import Options
+from twisted.python.usage import Options, UsageError
 from twisted.internet.endpoints import serverFromString
 from twisted.python.filepath import FilePath
 from twisted.application.service import MultiService
 from twisted.internet.ssl import Certificate
 
 from .httpapi import create_api_service, REST_API_PORT
+from ..restapi import (
+    set_response_validation_rate, set_request_logging_policy,
+    RequestLoggingPolicy,
+)
 from ._persistence import ConfigurationPersistenceService
 from ._clusterstate import ClusterStateService
 from ..common.script import (
@@ -28,6 +32,16 @@ from ..ca import (
 DEFAULT_CERTIFICATE_PATH = b"/etc/flocker"
 
 
+def _request_logging_policy(name):
+    """
+    :param bytes name: The lower case name of a ``RequestLoggingPolicy``.
+
+    :return: The ``RequestLoggingPolicy`` constant.
+    :raise ValueError: If there is no such policy.
+    """
+    return RequestLoggingPolicy.lookupByName(name.upper())
+
+
 @flocker_standard_options
 class ControlOptions(Options):
     """
@@ -44,8 +58,30 @@ class ControlOptions(Options):
          ("Absolute path to directory containing the cluster "
           "root certificate (cluster.crt) and control service certificate "
           "and private key (control-service.crt and control-service.key).")],
+        ["response-validation-rate", None, 1.0,
+         ("The fraction of REST API responses to check against their "
+          "schema, from 0 to 1. Checking every response catches bugs early "
+          "but is expensive for large clusters; production deployments can "
+          "check a sample instead."), float],
+        ["request-logging", None, RequestLoggingPolicy.FULL,
+         ("How the JSON bodies of REST API requests and responses are "
+          "logged: 'full', 'summary' (sizes and digests only), 'sampled' "
+          "(a fraction of requests, given by --request-logging-rate, in "
+          "full) or 'errors' (only the bodies of failed requests)."),
+         _request_logging_policy],
+        ["request-logging-rate", None, 0.01,
+         ("The fraction of REST API requests to log when --request-logging "
+          "is 'sampled', from 0 to 1."), float],
     ]
 
+    def postOptions(self):
+        if not 0 <= self["response-validation-rate"] <= 1:
+            raise UsageError(
+                "--response-validation-rate must be between 0 and 1.")
+        if not 0 <= self["request-logging-rate"] <= 1:
+            raise UsageError(
+                "--request-logging-rate must be between 0 and 1.")
+
 
 class ControlScript(object):
     """
@@ -60,6 +96,9 @@ class ControlScript(object):
         # flexible. https://clusterhq.atlassian.net/browse/FLOC-1865
         control_credential = ControlCredential.from_path(
             certificates_path, b"service")
+        set_response_validation_rate(options["response-validation-rate"])
+        set_request_logging_policy(
+            options["request-logging"], options["request-logging-rate"])
 
         top_service = MultiService()
         persistence = ConfigurationPersistenceService(
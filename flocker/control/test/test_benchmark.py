@@ -0,0 +1,38 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._benchmark``.
+"""
+
+from ...testtools import TestCase
+from .._benchmark import (
+    synthetic_cluster, measure_endpoints, format_timings,
+)
+
+
+class MeasureEndpointsTests(TestCase):
+    """
+    Tests for ``measure_endpoints``.
+    """
+    def test_listing_endpoints(self):
+        """
+        ``measure_endpoints`` measures every endpoint that takes no
+        arguments.
+        """
+        deployment, changes = synthetic_cluster(
+            nodes=2, datasets=4, containers=2)
+        timings = measure_endpoints(deployment, changes, repeat=1)
+        self.assertEqual(
+            [u"get_containers_configuration", u"get_containers_state",
+             u"get_dataset_configuration", u"list_current_nodes",
+             u"list_leases", u"state_datasets", u"version"],
+            [timing.name for timing in timings])
+
+    def test_format(self):
+        """
+        ``format_timings`` includes a line per endpoint, plus a header.
+        """
+        deployment, changes = synthetic_cluster(
+            nodes=1, datasets=1, containers=1)
+        output = format_timings(measure_endpoints(deployment, changes, 1))
+        self.assertEqual(8, len(output.splitlines()))
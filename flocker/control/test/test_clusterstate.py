@@ -9,6 +9,8 @@ from uuid import uuid4
 from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 
+from eliot.testing import capture_logging
+
 from .._model import ChangeSource
 from .._clusterstate import ClusterStateService
 from .. import (
@@ -253,3 +255,88 @@ class ClusterStateServiceTests(TestCase):
             service.as_deployment(),
             DeploymentState(nodes=[self.WITH_APPS]),
         )
+
+    def test_wipe_changes_from_source(self):
+        """
+        ``ClusterStateService.wipe_changes_from_source`` forgets the
+        information the given changes from a source added right away.
+        """
+        service = self.service()
+        source = ChangeSource()
+        source.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(source, [self.WITH_APPS])
+        service.wipe_changes_from_source(source, [self.WITH_APPS])
+        self.assertEqual(DeploymentState(), service.as_deployment())
+
+    def test_wipe_changes_updated_by_other_source(self):
+        """
+        ``ClusterStateService.wipe_changes_from_source`` keeps information
+        that a different source updated since.
+        """
+        service = self.service()
+        source = ChangeSource()
+        other_source = ChangeSource()
+        for s in (source, other_source):
+            s.set_last_activity(self.clock.seconds())
+            service.apply_changes_from_source(s, [self.WITH_APPS])
+        service.wipe_changes_from_source(source, [self.WITH_APPS])
+        self.assertEqual(DeploymentState(nodes=[self.WITH_APPS]),
+                         service.as_deployment())
+
+    def test_register_for_callback(self):
+        """
+        Callbacks can be registered that are called every time the state
+        changes.
+        """
+        service = self.service()
+        callbacks = []
+        service.register(lambda: callbacks.append(1))
+        service.apply_changes([self.WITH_APPS])
+        service.apply_changes([self.WITH_MANIFESTATION])
+        self.assertEqual(callbacks, [1, 1])
+
+    def test_callback_on_expiration(self):
+        """
+        Registered callbacks are called when state is wiped, but not when
+        there is nothing to wipe.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        callbacks = []
+        service.register(lambda: callbacks.append(1))
+        advance_rest(self.clock)
+        before_wipe = list(callbacks)
+        advance_some(self.clock)
+        self.assertEqual((before_wipe, callbacks), ([], [1]))
+
+    def test_unregister(self):
+        """
+        Unregistered callbacks are no longer called, even if they
+        unregister themselves while being called.
+        """
+        service = self.service()
+        callbacks = []
+
+        def callback():
+            callbacks.append(1)
+            service.unregister(callback)
+        service.register(callback)
+        service.register(lambda: callbacks.append(2))
+        service.apply_changes([self.WITH_APPS])
+        service.apply_changes([self.WITH_MANIFESTATION])
+        self.assertEqual(callbacks, [1, 2, 2])
+
+    @capture_logging(
+        lambda test, logger:
+        test.assertEqual(len(logger.flush_tracebacks(ZeroDivisionError)), 1))
+    def test_register_for_callback_failure(self, logger):
+        """
+        Failed callbacks are logged and don't prevent later callbacks from
+        being called.
+        """
+        service = self.service()
+        callbacks = []
+        service.register(lambda: 1/0)
+        service.register(lambda: callbacks.append(1))
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual(callbacks, [1])
@@ -3,6 +3,8 @@
 Tests for ``flocker.control.httpapi``.
 """
 
+from io import BytesIO
+from json import dumps
 from uuid import uuid4
 from copy import deepcopy
 from datetime import datetime
@@ -15,14 +17,15 @@ from pytz import UTC
 from zope.interface.verify import verifyObject
 
 from twisted.internet import reactor
-from twisted.internet.defer import gatherResults
+from twisted.internet.defer import CancelledError, Deferred, gatherResults
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.http import (
     CREATED, OK, CONFLICT, BAD_REQUEST, NOT_FOUND,
     NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED,
 )
-from twisted.web.client import readBody
+from twisted.web.client import FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
 from twisted.application.service import IService
 from twisted.python.filepath import FilePath
 from twisted.internet.ssl import ClientContextFactory
@@ -40,7 +43,7 @@ from .. import (
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
     api_dataset_from_dataset_and_node, container_configuration_response,
-    IF_MATCHES_HEADER,
+    IF_MATCHES_HEADER, STATE_WAIT_TIMEOUT,
 )
 from .._persistence import ConfigurationPersistenceService
 from .._clusterstate import ClusterStateService
@@ -2413,6 +2416,122 @@ RealTestsCreateDataset, MemoryTestsCreateDataset = buildIntegrationTests(
     CreateDatasetTestsMixin, "CreateDataset", _build_app)
 
 
+class CreateDatasetIfNameAbsentTestsMixin(APITestsMixin):
+    """
+    Tests for the dataset creation endpoint at
+    ``/configuration/_create_dataset_if_name_absent``.
+    """
+    PATH = b"/configuration/_create_dataset_if_name_absent"
+
+    def save_named(self, name, deleted=False):
+        """
+        Configure a dataset with the given name on node A.
+
+        :param unicode name: The name of the dataset.
+        :param bool deleted: Whether the dataset is deleted.
+
+        :return: ``Deferred`` firing once the configuration is saved.
+        """
+        manifestation = Manifestation(
+            dataset=Dataset(dataset_id=unicode(uuid4()),
+                            metadata={u"name": name}, deleted=deleted),
+            primary=True)
+        return self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations={manifestation.dataset_id: manifestation}),
+        }))
+
+    def test_missing_name(self):
+        """
+        A request without a ``name`` in its metadata is rejected.
+        """
+        return self.assertResult(
+            b"POST", self.PATH,
+            {u"primary": self.NODE_A, u"metadata": {u"foo": u"bar"}},
+            BAD_REQUEST, {
+                u'description':
+                    u"The provided JSON doesn't match the required schema.",
+                u'errors': [u"'name' is a required property"],
+            })
+
+    def test_create(self):
+        """
+        If no dataset has the given name a new dataset is created with it.
+        """
+        dataset_id = unicode(uuid4())
+        dataset = {
+            u"primary": self.NODE_A,
+            u"dataset_id": dataset_id,
+            u"metadata": {u"name": u"myvol"},
+        }
+        expected = dataset.copy()
+        expected[u"deleted"] = False
+        creating = self.save_named(u"othervol")
+        creating.addCallback(lambda _: self.assertResult(
+            b"POST", self.PATH, dataset, CREATED, expected))
+        creating.addCallback(lambda _: self.assertEqual(
+            dataset_id,
+            self.persistence_service.get().index().dataset_id_for_name(
+                u"myvol")))
+        return creating
+
+    def test_name_collision(self):
+        """
+        If a dataset already has the given name the response is an error
+        indicating the collision and no dataset is added to the
+        configuration.
+        """
+        creating = self.save_named(u"myvol")
+
+        def saved(_):
+            before = self.persistence_service.get()
+            posting = self.assertResult(
+                b"POST", self.PATH,
+                {u"primary": self.NODE_B, u"metadata": {u"name": u"myvol"}},
+                CONFLICT,
+                {u"description": u"The provided name is already in use."})
+            posting.addCallback(lambda _: self.assertEqual(
+                before, self.persistence_service.get()))
+            return posting
+        creating.addCallback(saved)
+        return creating
+
+    def test_deleted_name(self):
+        """
+        The name of a deleted dataset may be reused.
+        """
+        creating = self.save_named(u"myvol", deleted=True)
+        creating.addCallback(lambda _: self.assertResponseCode(
+            b"POST", self.PATH,
+            {u"primary": self.NODE_A, u"metadata": {u"name": u"myvol"}},
+            CREATED))
+        return creating
+
+    def test_concurrent(self):
+        """
+        Of several concurrent requests to create datasets with the same name,
+        only one succeeds.
+        """
+        body = dumps(
+            {u"primary": self.NODE_A, u"metadata": {u"name": u"myvol"}})
+        posting = gatherResults([
+            self.agent.request(
+                b"POST", self.PATH,
+                Headers({b"content-type": [b"application/json"]}),
+                FileBodyProducer(BytesIO(body)))
+            for _ in range(3)])
+        posting.addCallback(lambda responses: self.assertEqual(
+            ([CREATED, CONFLICT, CONFLICT], 1),
+            (sorted(response.code for response in responses),
+             len(self.persistence_service.get().index().names))))
+        return posting
+
+
+RealTestsCreateDatasetIfNameAbsent, MemoryTestsCreateDatasetIfNameAbsent = (
+    buildIntegrationTests(CreateDatasetIfNameAbsentTestsMixin,
+                          "CreateDatasetIfNameAbsent", _build_app))
+
+
 def _manifestation(**kwargs):
     """
     :param kwargs: Additional keyword arguments to use to initialize the
@@ -2796,6 +2915,165 @@ RealTestsDatasetsStateAPI, MemoryTestsDatasetsStateAPI = buildIntegrationTests(
     DatasetsStateTestsMixin, "DatasetsStateAPI", _build_app)
 
 
+class WaitForDatasetStateTestsMixin(APITestsMixin):
+    """
+    Tests for the endpoint at ``/state/datasets/_wait/<dataset_id>/<node>``.
+    """
+    def setUp(self):
+        super(WaitForDatasetStateTestsMixin, self).setUp()
+        self.dataset = Dataset(dataset_id=unicode(uuid4()),
+                               maximum_size=1024 * 1024 * 1024)
+        self.path = b"/state/datasets/_wait/{}/{}".format(
+            self.dataset.dataset_id, self.NODE_A)
+
+    def manifest(self):
+        """
+        Make the dataset manifest on node A in the cluster state.
+        """
+        self.cluster_state_service.apply_changes([
+            NodeState(
+                hostname=self.NODE_A_IP, uuid=self.NODE_A_UUID,
+                manifestations={self.dataset.dataset_id: Manifestation(
+                    dataset=self.dataset, primary=True)},
+                paths={self.dataset.dataset_id: FilePath(b"/path/dataset")},
+                devices={},
+            )
+        ])
+
+    def registered(self):
+        """
+        :return: A ``Deferred`` that fires once the endpoint starts watching
+            the cluster state, i.e. once the request has arrived and found
+            the dataset not yet manifest.
+        """
+        registered = Deferred()
+        original = self.cluster_state_service.register
+
+        def register(callback):
+            original(callback)
+            registered.callback(None)
+        self.patch(self.cluster_state_service, "register", register)
+        return registered
+
+    def expected(self):
+        """
+        :return: The expected response once the dataset is manifest.
+        """
+        return {u"dataset_id": self.dataset.dataset_id,
+                u"primary": self.NODE_A,
+                u"path": u"/path/dataset",
+                u"maximum_size": self.dataset.maximum_size}
+
+    def test_already_manifest(self):
+        """
+        If the dataset is already manifest on the node, its state is returned
+        immediately.
+        """
+        self.manifest()
+        return self.assertResult(
+            b"GET", self.path, None, OK, self.expected())
+
+    def test_becomes_manifest(self):
+        """
+        If the dataset is not yet manifest on the node, its state is returned
+        once it is, and the endpoint stops watching the cluster state.
+        """
+        self.registered().addCallback(lambda _: self.manifest())
+        d = self.assertResult(b"GET", self.path, None, OK, self.expected())
+        d.addCallback(lambda _: self.assertEqual(
+            ([], []),
+            (self.cluster_state_service._change_callbacks,
+             self.clock.getDelayedCalls())))
+        return d
+
+    def test_manifest_elsewhere(self):
+        """
+        A dataset manifest on a different node does not end the wait.
+        """
+        registered = self.registered()
+        registered.addCallback(lambda _: self.manifest())
+        registered.addCallback(
+            lambda _: self.clock.advance(STATE_WAIT_TIMEOUT))
+        return self.assertResult(
+            b"GET", self.path.replace(bytes(self.NODE_A), bytes(self.NODE_B)),
+            None, NOT_FOUND,
+            {u"description": u"The dataset is not manifest on the node."})
+
+    def test_timeout(self):
+        """
+        If the dataset does not become manifest on the node within
+        ``STATE_WAIT_TIMEOUT`` seconds a ``NOT_FOUND`` error is returned and
+        the endpoint stops watching the cluster state.
+        """
+        self.registered().addCallback(
+            lambda _: self.clock.advance(STATE_WAIT_TIMEOUT))
+        d = self.assertResult(
+            b"GET", self.path, None, NOT_FOUND,
+            {u"description": u"The dataset is not manifest on the node."})
+        d.addCallback(lambda _: self.assertEqual(
+            [], self.cluster_state_service._change_callbacks))
+        return d
+
+RealTestsWaitForDatasetState, MemoryTestsWaitForDatasetState = (
+    buildIntegrationTests(WaitForDatasetStateTestsMixin,
+                          "WaitForDatasetState", _build_app))
+
+
+class WaitForDatasetStateTests(TestCase):
+    """
+    Tests for ``ConfigurationAPIUserV1.wait_for_dataset_state`` that don't
+    go through HTTP.
+    """
+    def setUp(self):
+        super(WaitForDatasetStateTests, self).setUp()
+        self.clock = Clock()
+        self.cluster_state_service = ClusterStateService(Clock())
+        self.api = ConfigurationAPIUserV1(
+            None, self.cluster_state_service, self.clock)
+
+    def wait(self):
+        """
+        Wait for a dataset that isn't manifest on a node.
+
+        :return: The ``Deferred`` result of the endpoint.
+        """
+        return ConfigurationAPIUserV1.wait_for_dataset_state.original(
+            self.api, dataset_id=unicode(uuid4()), node_uuid=unicode(uuid4()))
+
+    def test_disconnect(self):
+        """
+        If the client disconnects, which cancels the result, the endpoint
+        stops watching the cluster state and stops its timeout.
+        """
+        d = self.wait()
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(
+            ([], []),
+            (self.cluster_state_service._change_callbacks,
+             self.clock.getDelayedCalls()))
+
+    def test_state_looked_up_once(self):
+        """
+        However many requests are waiting, the cluster state is looked up
+        once per change.
+        """
+        waiting = [self.wait(), self.wait()]
+        lookups = []
+        original = self.cluster_state_service.as_deployment
+
+        def as_deployment():
+            lookups.append(None)
+            return original()
+        self.patch(self.cluster_state_service, "as_deployment", as_deployment)
+        self.cluster_state_service.apply_changes([
+            NodeState(hostname=u"192.0.2.1", uuid=uuid4()),
+        ])
+        self.assertEqual(
+            (1, [False, False]),
+            (len(lookups), [d.called for d in waiting]))
+
+
 class DatasetsFromDeploymentTests(TestCase):
     """
     Tests for ``datasets_from_deployment``.
@@ -0,0 +1,189 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._index``.
+"""
+
+from uuid import uuid4
+
+from ...testtools import TestCase
+from .._index import DeploymentIndex, DeploymentStateIndex
+from .. import (
+    Deployment, DeploymentState, Node, NodeState, Manifestation, Dataset,
+)
+
+
+def _manifestation(primary=True, **kwargs):
+    """
+    Create a ``Manifestation`` of a new ``Dataset``.
+
+    :param bool primary: Whether the manifestation is primary.
+    :param kwargs: Additional arguments for ``Dataset``.
+
+    :return: The ``Manifestation``.
+    """
+    return Manifestation(
+        dataset=Dataset(dataset_id=unicode(uuid4()), **kwargs),
+        primary=primary,
+    )
+
+
+class DeploymentIndexTests(TestCase):
+    """
+    Tests for ``Deployment.index``.
+    """
+    def setUp(self):
+        super(DeploymentIndexTests, self).setUp()
+        self.primary = _manifestation(metadata={u"name": u"db"})
+        self.replica = self.primary.set(primary=False)
+        self.deleted = _manifestation(
+            deleted=True, metadata={u"name": u"gone"})
+        self.node1 = Node(
+            uuid=uuid4(),
+            manifestations={self.primary.dataset_id: self.primary,
+                            self.deleted.dataset_id: self.deleted},
+        )
+        self.node2 = Node(
+            uuid=uuid4(),
+            manifestations={self.replica.dataset_id: self.replica},
+        )
+        self.deployment = Deployment(nodes={self.node1, self.node2})
+
+    def test_type(self):
+        """
+        ``Deployment.index`` returns a ``DeploymentIndex``.
+        """
+        self.assertIsInstance(self.deployment.index(), DeploymentIndex)
+
+    def test_cached(self):
+        """
+        Repeated calls to ``Deployment.index`` on the same ``Deployment``
+        return the same index.
+        """
+        self.assertIs(self.deployment.index(), self.deployment.index())
+
+    def test_new_generation(self):
+        """
+        An updated ``Deployment`` gets an index reflecting the update.
+        """
+        self.deployment.index()
+        node3 = Node(uuid=uuid4())
+        updated = self.deployment.update_node(node3)
+        self.assertEqual(node3, updated.index().nodes[node3.uuid])
+
+    def test_nodes(self):
+        """
+        ``DeploymentIndex.nodes`` maps node UUIDs to nodes.
+        """
+        self.assertEqual(
+            {self.node1.uuid: self.node1, self.node2.uuid: self.node2},
+            dict(self.deployment.index().nodes),
+        )
+
+    def test_manifestations(self):
+        """
+        ``DeploymentIndex.manifestations`` maps a dataset ID to every
+        manifestation of the dataset and the node it is on.
+        """
+        self.assertItemsEqual(
+            [(self.primary, self.node1), (self.replica, self.node2)],
+            self.deployment.index().manifestations[self.primary.dataset_id],
+        )
+
+    def test_primary(self):
+        """
+        ``DeploymentIndex.primary`` returns the primary manifestation of a
+        dataset and the node it is on.
+        """
+        self.assertEqual(
+            (self.primary, self.node1),
+            self.deployment.index().primary(self.primary.dataset_id),
+        )
+
+    def test_primary_unknown(self):
+        """
+        ``DeploymentIndex.primary`` returns ``None`` for an unknown dataset.
+        """
+        self.assertIs(
+            None, self.deployment.index().primary(unicode(uuid4())))
+
+    def test_name(self):
+        """
+        ``DeploymentIndex.dataset_id_for_name`` returns the ID of the dataset
+        with the given name in its metadata.
+        """
+        self.assertEqual(
+            self.primary.dataset_id,
+            self.deployment.index().dataset_id_for_name(u"db"),
+        )
+
+    def test_name_deleted(self):
+        """
+        ``DeploymentIndex.dataset_id_for_name`` ignores deleted datasets.
+        """
+        self.assertIs(
+            None, self.deployment.index().dataset_id_for_name(u"gone"))
+
+    def test_first_primary(self):
+        """
+        If a dataset has more than one primary manifestation,
+        ``DeploymentIndex.primary`` returns the first one found.
+        """
+        other = self.node2.set(
+            manifestations={self.primary.dataset_id: self.primary})
+        deployment = Deployment(nodes={self.node1, other})
+        first = next(node for node in deployment.nodes)
+        self.assertEqual(
+            (self.primary, first),
+            deployment.index().primary(self.primary.dataset_id),
+        )
+
+
+class DeploymentStateIndexTests(TestCase):
+    """
+    Tests for ``DeploymentState.index``.
+    """
+    def setUp(self):
+        super(DeploymentStateIndexTests, self).setUp()
+        self.manifestation = _manifestation()
+        self.node = NodeState(
+            uuid=uuid4(), hostname=u"192.0.2.1",
+            manifestations={self.manifestation.dataset_id:
+                            self.manifestation},
+            devices={}, paths={},
+        )
+        self.ignorant = NodeState(uuid=uuid4(), hostname=u"192.0.2.2")
+        self.era = uuid4()
+        self.state = DeploymentState(
+            nodes={self.node, self.ignorant},
+            node_uuid_to_era={self.node.uuid: self.era},
+        )
+
+    def test_type(self):
+        """
+        ``DeploymentState.index`` returns a ``DeploymentStateIndex``.
+        """
+        self.assertIsInstance(self.state.index(), DeploymentStateIndex)
+
+    def test_cached(self):
+        """
+        Repeated calls to ``DeploymentState.index`` on the same
+        ``DeploymentState`` return the same index.
+        """
+        self.assertIs(self.state.index(), self.state.index())
+
+    def test_nodes(self):
+        """
+        ``DeploymentStateIndex.nodes`` maps node UUIDs to node states.
+        """
+        self.assertEqual(
+            {self.node.uuid: self.node, self.ignorant.uuid: self.ignorant},
+            dict(self.state.index().nodes),
+        )
+
+    def test_eras(self):
+        """
+        ``DeploymentStateIndex.eras`` maps eras to node UUIDs.
+        """
+        self.assertEqual({self.era: self.node.uuid},
+                         dict(self.state.index().eras))
@@ -42,7 +42,7 @@ from .._protocol import (
     NoOp, AgentAMP, ControlAMPService, ControlAMP, _AgentLocator,
     ControlServiceLocator, LOG_SEND_CLUSTER_STATE, LOG_SEND_TO_AGENT,
     AGENT_CONNECTED, caching_wire_encode, SetNodeEraCommand,
-    timeout_for_protocol,
+    timeout_for_protocol, ExpireNodeStateCommand,
 )
 from .._clusterstate import ClusterStateService
 from .. import (
@@ -365,6 +365,25 @@ class SerializationTests(TestCase):
         self.assertEqual([bytes, TEST_DEPLOYMENT],
                          [type(as_bytes), deserialized])
 
+    def test_reuse_decoded(self):
+        """
+        ``SerializableArgument`` created with ``reuse_decoded`` returns the
+        object it decoded last time when given the same bytes again.
+        """
+        argument = SerializableArgument(Deployment, reuse_decoded=True)
+        as_bytes = argument.toString(TEST_DEPLOYMENT)
+        first = argument.fromString(as_bytes)
+        self.assertIs(first, argument.fromString(bytes(bytearray(as_bytes))))
+
+    def test_decoded_again(self):
+        """
+        ``SerializableArgument`` decodes bytes again by default.
+        """
+        argument = SerializableArgument(Deployment)
+        as_bytes = argument.toString(TEST_DEPLOYMENT)
+        first = argument.fromString(as_bytes)
+        self.assertIsNot(first, argument.fromString(as_bytes))
+
     def test_nonmanifestdatasets(self):
         """
         ``SerializableArgument`` can round-trip a ``NonManifestDatasets``
@@ -700,6 +719,25 @@ class ControlAMPTests(ControlTestCase):
             self.control_amp_service.cluster_state.as_deployment(),
         )
 
+    def test_expire_node_state(self):
+        """
+        An ``ExpireNodeStateCommand`` results in the information added by
+        the given state changes sent over the same connection being
+        forgotten.
+        """
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand,
+                                   state_changes=(SIMPLE_NODE_STATE,),
+                                   eliot_context=TEST_ACTION))
+        self.successResultOf(
+            self.client.callRemote(ExpireNodeStateCommand,
+                                   state_changes=(SIMPLE_NODE_STATE,),
+                                   eliot_context=TEST_ACTION))
+        self.assertEqual(
+            DeploymentState(),
+            self.control_amp_service.cluster_state.as_deployment(),
+        )
+
     def test_set_node_era(self):
         """
         A ``SetNodeEraCommand`` results in the node's era being
@@ -1,6 +1,7 @@
 # Copyright ClusterHQ Inc.  See LICENSE file for details.
 
 from twisted.python.filepath import FilePath
+from twisted.python.usage import UsageError
 
 from ..script import ControlOptions, ControlScript
 from ...testtools import (
@@ -10,6 +11,7 @@ from .._clusterstate import ClusterStateService
 from ..httpapi import REST_API_PORT
 
 from ...ca.testtools import get_credential_sets
+from ...restapi import _infrastructure, RequestLoggingPolicy
 
 
 class ControlOptionsTests(make_standard_options_test(ControlOptions)):
@@ -69,6 +71,68 @@ class ControlOptionsTests(make_standard_options_test(ControlOptions)):
         options.parseOptions([b"--agent-port", b"tcp:1234"])
         self.assertEqual(options["agent-port"], b"tcp:1234")
 
+    def test_default_response_validation_rate(self):
+        """
+        By default every REST API response is validated.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(options["response-validation-rate"], 1.0)
+
+    def test_custom_response_validation_rate(self):
+        """
+        The ``--response-validation-rate`` command-line option is converted
+        to a ``float``.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--response-validation-rate", b"0.05"])
+        self.assertEqual(options["response-validation-rate"], 0.05)
+
+    def test_invalid_response_validation_rate(self):
+        """
+        A ``--response-validation-rate`` greater than 1 is rejected.
+        """
+        options = ControlOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--response-validation-rate", b"2"])
+
+    def test_default_request_logging(self):
+        """
+        By default the JSON bodies of REST API requests are logged in full.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(options["request-logging"], RequestLoggingPolicy.FULL)
+
+    def test_custom_request_logging(self):
+        """
+        The ``--request-logging`` command-line option is converted to a
+        ``RequestLoggingPolicy``.
+        """
+        options = ControlOptions()
+        options.parseOptions([b"--request-logging", b"summary"])
+        self.assertEqual(
+            options["request-logging"], RequestLoggingPolicy.SUMMARY)
+
+    def test_invalid_request_logging(self):
+        """
+        An unknown ``--request-logging`` policy is rejected.
+        """
+        options = ControlOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--request-logging", b"verbose"])
+
+    def test_invalid_request_logging_rate(self):
+        """
+        A negative ``--request-logging-rate`` is rejected.
+        """
+        options = ControlOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--request-logging-rate", b"-0.5"])
+
 
 class ControlScriptTests(TestCase):
     """
@@ -118,3 +182,38 @@ class ControlScriptTests(TestCase):
         service = control_resource._v1_user.cluster_state_service
         self.assertEqual((service.__class__, service.running),
                          (ClusterStateService, True))
+
+    def test_response_validation_rate(self):
+        """
+        ``ControlScript.main`` configures the REST API to validate the
+        fraction of responses given by ``--response-validation-rate``.
+        """
+        validation = _infrastructure._ResponseValidation()
+        self.patch(_infrastructure, "_response_validation", validation)
+        options = ControlOptions()
+        options.parseOptions([
+            b"--data-path", self.data_path.path,
+            b"--certificates-directory", self.certificate_path.path,
+            b"--response-validation-rate", b"0.25",
+        ])
+        self.script.main(MemoryCoreReactor(), options)
+        self.assertEqual(validation.rate, 0.25)
+
+    def test_request_logging(self):
+        """
+        ``ControlScript.main`` configures the REST API to log requests
+        according to ``--request-logging`` and ``--request-logging-rate``.
+        """
+        request_logging = _infrastructure._RequestLogging()
+        self.patch(_infrastructure, "_request_logging", request_logging)
+        options = ControlOptions()
+        options.parseOptions([
+            b"--data-path", self.data_path.path,
+            b"--certificates-directory", self.certificate_path.path,
+            b"--request-logging", b"sampled",
+            b"--request-logging-rate", b"0.1",
+        ])
+        self.script.main(MemoryCoreReactor(), options)
+        self.assertEqual(
+            (request_logging.policy, request_logging.rate),
+            (RequestLoggingPolicy.SAMPLED, 0.1))
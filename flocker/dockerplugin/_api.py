@@ -17,8 +17,12 @@ from bitmath import TiB, GiB, MiB, KiB, Byte
 from eliot import writeFailure
 from eliot.twisted import DeferredContext
 
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
-from twisted.internet.defer import CancelledError, gatherResults, maybeDeferred
+from twisted.internet.defer import (
+    CancelledError, Deferred, maybeDeferred, succeed,
+)
+from twisted.internet.error import ConnectionLost
 from twisted.web.http import OK
 
 from klein import Klein
@@ -26,7 +30,7 @@ from klein import Klein
 from ..restapi import (
     structured, EndpointResponse, BadRequest, make_bad_request,
 )
-from ..apiclient import DatasetAlreadyExists, conditional_create
+from ..apiclient import DatasetAlreadyExists, NotFound, gather
 from ..node.agents.blockdevice import PROFILE_METADATA_KEY
 from ..common import (
     RACKSPACE_MINIMUM_VOLUME_SIZE, DEVICEMAPPER_LOOPBACK_SIZE,
@@ -136,6 +140,32 @@ def _endpoint(name, ignore_body=False):
     return decorator
 
 
+def _coalesced(invalidates=()):
+    """
+    Decorator factory for ``VolumePlugin`` methods taking a volume name, so
+    that concurrent calls for the same volume share a single result.
+
+    Docker may make the same request for a volume several times at once,
+    e.g. when starting several containers that use it.  While a call is in
+    progress, identical calls wait for its result rather than repeating its
+    work, and a successful result is reused for ``_COALESCE_TTL`` seconds.
+
+    :param invalidates: Names of other coalesced methods whose reusable
+        results for the same volume become out of date once a call to this
+        one finishes.
+
+    :return: Decorator for a method taking a ``Name`` argument and
+        returning an endpoint result, or a ``Deferred`` firing with one.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapped(self, Name):
+            return self._coalesce(
+                f.__name__, Name, lambda: f(self, Name), invalidates)
+        return wrapped
+    return decorator
+
+
 NOT_FOUND_RESPONSE = make_bad_request(
     # Ought to be NOT_FOUND but Docker doesn't
     # seem to test that code path at all, whereas it does
@@ -155,20 +185,83 @@ class VolumePlugin(object):
     """
     _POLL_INTERVAL = 1.0
     _MOUNT_TIMEOUT = 120.0
+    _COALESCE_TTL = 1.0
+    _NAME_TTL = 10.0
 
     app = Klein()
 
-    def __init__(self, reactor, flocker_client, node_id):
+    def __init__(self, reactor, flocker_client, node_id,
+                 dataset_events=None):
         """
         :param IReactorTime reactor: Reactor time interface implementation.
         :param IFlockerAPIV1Client flocker_client: Client that allows
             communication with Flocker.
         :param UUID node_id: The identity of the local node this plugin is
             running on.
+        :param dataset_events: A ``DatasetEventSubscriber`` connected to
+            the local dataset agent, or ``None``.  When it is connected,
+            local mountpoints are looked up there instead of asking the
+            control service.
         """
         self._reactor = reactor
         self._flocker_client = flocker_client
         self._node_id = node_id
+        self._dataset_events = dataset_events
+        # Map volume names to a tuple of a dataset ID and the time it was
+        # learned, from the configuration or from creating a volume.  Names
+        # may be stale, e.g. if a dataset was deleted with the Flocker API
+        # and another created with the same name, so they are only used for
+        # ``_NAME_TTL`` seconds.
+        self._dataset_ids = {}
+        # Map (operation, volume name) to a list of Deferreds waiting for
+        # the result of the call in progress:
+        self._in_flight = {}
+        # Map (operation, volume name) to a tuple of the time a call
+        # finished and its successful result:
+        self._recent_results = {}
+
+    def _coalesce(self, operation, name, f, invalidates):
+        """
+        Call ``f`` unless an identical call is in progress or recently
+        succeeded, in which case share its result.
+
+        :param operation: The name of the operation.
+        :param unicode name: The name of the volume it applies to.
+        :param f: Zero-argument callable performing the operation, returning
+            an endpoint result or a ``Deferred`` firing with one.
+        :param invalidates: Names of operations whose results for the volume
+            should no longer be reused once ``f`` has finished.
+
+        :return: ``Deferred`` firing with the result.
+        """
+        key = (operation, name)
+        recent = self._recent_results.get(key)
+        if recent is not None:
+            finished, result = recent
+            if self._reactor.seconds() - finished < self._COALESCE_TTL:
+                return succeed(result)
+            del self._recent_results[key]
+
+        waiting = Deferred()
+        if key in self._in_flight:
+            self._in_flight[key].append(waiting)
+            return waiting
+        self._in_flight[key] = [waiting]
+
+        def finished(result):
+            waiters = self._in_flight.pop(key)
+            if isinstance(result, Failure):
+                for waiter in waiters:
+                    waiter.errback(result)
+                return
+            for other in invalidates:
+                self._recent_results.pop((other, name), None)
+            if result.get(u"Err") == u"":
+                self._recent_results[key] = (self._reactor.seconds(), result)
+            for waiter in waiters:
+                waiter.callback(result)
+        maybeDeferred(f).addBoth(finished)
+        return waiting
 
     @app.route("/Plugin.Activate", methods=["POST"])
     @_endpoint(u"PluginActivate", ignore_body=True)
@@ -211,12 +304,23 @@ class VolumePlugin(object):
         """
         return {u"Err": u""}
 
+    def _remember_names(self, configured):
+        """
+        Replace the cached names with those in a full configuration listing.
+
+        :param configured: Iterable of ``Dataset``.
+        """
+        now = self._reactor.seconds()
+        self._dataset_ids = {
+            dataset.metadata[NAME_FIELD]: (dataset.dataset_id, now)
+            for dataset in configured if NAME_FIELD in dataset.metadata}
+
     def _dataset_id_for_name(self, name):
         """
         Lookup a dataset's ID based on name in metadata.
 
-        If it does not exist use the hashing mechanism until that is
-        removed in FLOC-2963.
+        Names seen in the last ``_NAME_TTL`` seconds are answered from a
+        local cache; only other names require retrieving the configuration.
 
         :param name: The name of the volume, stored as ``"name"`` field in
             dataset metadata.
@@ -224,32 +328,50 @@ class VolumePlugin(object):
         :return: ``Deferred`` firing with dataset ID as ``UUID``, or
             errbacks with ``_NotFound`` if no dataset was found.
         """
+        cached = self._dataset_ids.get(name)
+        if cached is not None:
+            dataset_id, learned = cached
+            if self._reactor.seconds() - learned < self._NAME_TTL:
+                return succeed(dataset_id)
+
         listing = self._flocker_client.list_datasets_configuration()
 
         def got_configured(configured):
-            for dataset in configured:
-                if dataset.metadata.get(NAME_FIELD) == name:
-                    return dataset.dataset_id
-            raise NOT_FOUND_RESPONSE
+            self._remember_names(configured)
+            try:
+                dataset_id, _ = self._dataset_ids[name]
+            except KeyError:
+                raise NOT_FOUND_RESPONSE
+            return dataset_id
 
         listing.addCallback(got_configured)
         return listing
 
+    def _forget_name(self, reason, name):
+        """
+        Remove a name from the cache, so the next lookup of it retrieves the
+        configuration.  Useful as an errback when the cached dataset ID may
+        be stale.
+
+        :param Failure reason: The failure to pass on.
+        :param unicode name: The name of the volume.
+
+        :return: ``reason``.
+        """
+        self._dataset_ids.pop(name, None)
+        return reason
+
     @app.route("/VolumeDriver.Create", methods=["POST"])
     @_endpoint(u"Create")
     def volumedriver_create(self, Name, Opts=None):
         """
         Create a volume with the given name.
 
-        We hash the name to give a consistent dataset. This ensures that
+        The control service only creates the dataset if no other dataset
+        has the same ``"name"`` field in its metadata. This ensures that
         if due to race condition we attempt to create two volumes with
         same name only one will be created.
 
-        We also check for existence of matching dataset based on
-        ``"name"`` field in metadata, in case we're talking to cluster
-        that has datasets that weren't created with this hashing
-        mechanism.
-
         If there is a duplicate we don't return an error, but rather
         success: we will likely get unneeded creates from Docker since it
         doesn't necessarily know about existing persistent volumes.
@@ -277,18 +399,37 @@ class VolumePlugin(object):
         else:
             size = DEFAULT_SIZE
 
-        def ensure_unique_name(configured):
-            for dataset in configured:
-                if dataset.metadata.get(NAME_FIELD) == Name:
-                    raise DatasetAlreadyExists
+        creating = self._flocker_client.create_dataset_if_name_absent(
+            self._node_id, metadata, maximum_size=int(size.to_Byte()))
 
-        creating = conditional_create(
-            self._flocker_client, self._reactor, ensure_unique_name,
-            self._node_id, int(size.to_Byte()), metadata=metadata)
+        def created(dataset):
+            self._dataset_ids[Name] = (
+                dataset.dataset_id, self._reactor.seconds())
+        creating.addCallback(created)
         creating.addErrback(lambda reason: reason.trap(DatasetAlreadyExists))
         creating.addCallback(lambda _: {u"Err": u""})
         return creating
 
+    def _local_paths(self, states):
+        """
+        Find the paths of the datasets mounted on this node.
+
+        :param states: Iterable of ``DatasetState``.
+
+        :return: ``dict`` mapping dataset ``UUID`` to mountpoint ``FilePath``
+            for every dataset whose primary is this node.
+        """
+        return {state.dataset_id: state.path for state in states
+                if state.primary == self._node_id}
+
+    def _local_events_connected(self):
+        """
+        :return: Whether the local dataset agent is publishing its state to
+            us.
+        """
+        return (self._dataset_events is not None and
+                self._dataset_events.connected)
+
     def _get_path_from_dataset_id(self, dataset_id):
         """
         Return a dataset's path if available.
@@ -299,20 +440,51 @@ class VolumePlugin(object):
             ``None`` if the dataset is not locally mounted, or errbacks
             with ``_NotFound`` if it is does not exist at all.
         """
+        if self._local_events_connected():
+            return succeed(self._dataset_events.path(unicode(dataset_id)))
         d = self._flocker_client.list_datasets_state()
+        d.addCallback(
+            lambda states: self._local_paths(states).get(dataset_id))
+        return d
 
-        def got_state(datasets):
-            datasets = [dataset for dataset in datasets
-                        if dataset.dataset_id == dataset_id]
-            if datasets and datasets[0].primary == self._node_id:
-                return datasets[0].path
-            else:
+    def _wait_for_path(self, dataset_id):
+        """
+        Wait for a dataset to be mounted locally and return its path.
+
+        The control service tells us as soon as the dataset arrives, so
+        there is no need to repeatedly list the state of every dataset.
+
+        :param UUID dataset_id: The dataset to wait for.
+
+        :return: ``Deferred`` that fires with the mountpoint ``FilePath``,
+            or ``None`` if the dataset is not yet locally mounted.
+        """
+        if self._local_events_connected():
+            # The dataset agent on this node will tell us directly:
+            d = self._dataset_events.wait_for_path(unicode(dataset_id))
+
+            def lost(failure):
+                # Try again, via the control service if it doesn't come
+                # back:
+                failure.trap(ConnectionLost)
                 return None
-        d.addCallback(got_state)
+            d.addErrback(lost)
+            return d
+        d = self._flocker_client.wait_for_dataset_state(
+            dataset_id, self._node_id)
+        d.addCallback(lambda state: state.path)
+
+        def not_yet(failure):
+            # The control service gave up waiting (or is too old to support
+            # waiting), so check once in the same way ``Path`` does:
+            failure.trap(NotFound)
+            return self._get_path_from_dataset_id(dataset_id)
+        d.addErrback(not_yet)
         return d
 
     @app.route("/VolumeDriver.Mount", methods=["POST"])
     @_endpoint(u"Mount")
+    @_coalesced(invalidates=["volumedriver_path"])
     def volumedriver_mount(self, Name):
         """
         Move a volume with the given name to the current node and mount it.
@@ -324,19 +496,45 @@ class VolumePlugin(object):
 
         :return: Result that includes the mountpoint.
         """
+        def move(dataset_id):
+            moving = self._flocker_client.move_dataset(
+                self._node_id, dataset_id)
+            moving.addErrback(stale, dataset_id)
+            return moving
+
+        def stale(reason, dataset_id):
+            # The cached dataset may have been deleted since, and the name
+            # given to another dataset, so look the name up again and try
+            # once more if that's the case:
+            self._forget_name(reason, Name)
+            if reason.check(CancelledError):
+                return reason
+            d = self._dataset_id_for_name(Name)
+
+            def got_dataset_id(new_dataset_id):
+                if new_dataset_id == dataset_id:
+                    return reason
+                return self._flocker_client.move_dataset(
+                    self._node_id, new_dataset_id)
+            d.addCallback(got_dataset_id)
+            d.addErrback(self._forget_name, Name)
+            return d
+
         d = DeferredContext(self._dataset_id_for_name(Name))
-        d.addCallback(lambda dataset_id:
-                      self._flocker_client.move_dataset(self._node_id,
-                                                        dataset_id))
+        d.addCallback(move)
         d.addCallback(lambda dataset: dataset.dataset_id)
 
         d.addCallback(lambda dataset_id: loop_until(
             self._reactor,
-            lambda: self._get_path_from_dataset_id(dataset_id),
+            lambda: self._wait_for_path(dataset_id),
             repeat(self._POLL_INTERVAL)))
         d.addCallback(lambda p: {u"Err": u"", u"Mountpoint": p.path})
 
-        timeout(self._reactor, d.result, self._MOUNT_TIMEOUT)
+        # Cancelling an outstanding request to the control service may fail
+        # with some other exception, so make sure a timeout is reported as
+        # such:
+        timeout(self._reactor, d.result, self._MOUNT_TIMEOUT,
+                CancelledError())
 
         def handleCancel(failure):
             failure.trap(CancelledError)
@@ -347,6 +545,7 @@ class VolumePlugin(object):
 
     @app.route("/VolumeDriver.Path", methods=["POST"])
     @_endpoint(u"Path")
+    @_coalesced()
     def volumedriver_path(self, Name):
         """
         Return the path of a locally mounted volume if possible.
@@ -405,28 +604,25 @@ class VolumePlugin(object):
 
         :return: Result indicating success.
         """
-        listing = DeferredContext(
-            self._flocker_client.list_datasets_configuration())
-
-        def got_configured(configured):
-            results = []
+        # Fetch the configuration and the state once each, concurrently,
+        # and join them locally:
+        listing = DeferredContext(gather([
+            self._flocker_client.list_datasets_configuration,
+            self._flocker_client.list_datasets_state,
+        ]))
+
+        def got_listings((configured, states)):
+            self._remember_names(configured)
+            paths = self._local_paths(states)
+            volumes = []
             for dataset in configured:
                 # Datasets without a name can't be used by the Docker plugin:
                 if NAME_FIELD not in dataset.metadata:
                     continue
-                name = dataset.metadata[NAME_FIELD]
-                d = self._get_path_from_dataset_id(dataset.dataset_id)
-                d.addCallback(lambda path: (path, name))
-                results.append(d)
-            return gatherResults(results)
-
-        listing.addCallback(got_configured)
-
-        def got_paths(results):
-            return {u"Err": u"",
-                    u"Volumes": sorted([
-                        {u"Name": name,
-                         u"Mountpoint": u"" if path is None else path.path}
-                        for (path, name) in results])}
-        listing.addCallback(got_paths)
+                path = paths.get(dataset.dataset_id)
+                volumes.append(
+                    {u"Name": dataset.metadata[NAME_FIELD],
+                     u"Mountpoint": u"" if path is None else path.path})
+            return {u"Err": u"", u"Volumes": sorted(volumes)}
+        listing.addCallback(got_listings)
         return listing.result
@@ -10,6 +10,7 @@ from stat import S_IRUSR, S_IWUSR, S_IXUSR
 from twisted.python.usage import Options
 from twisted.internet.endpoints import serverFromString
 from twisted.application.internet import StreamServerEndpointService
+from twisted.application.service import MultiService, Service
 from twisted.web.server import Site
 from twisted.python.filepath import FilePath
 
@@ -17,6 +18,7 @@ from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, main_for_service)
 from ._api import VolumePlugin
 from ..node.script import get_configuration
+from ..node._events import DatasetEventSubscriber
 from ..apiclient import FlockerClient
 from ..control.httpapi import REST_API_PORT
 
@@ -39,6 +41,21 @@ class DockerPluginOptions(Options):
         self['agent-config'] = FilePath(self['agent-config'])
 
 
+class _ClientService(Service):
+    """
+    Close a ``FlockerClient``'s idle connections when the service stops.
+    """
+    def __init__(self, client):
+        """
+        :param FlockerClient client: The client to close.
+        """
+        self._client = client
+
+    def stopService(self):
+        Service.stopService(self)
+        return self._client.close()
+
+
 class DockerPluginScript(object):
     """
     Start the Docker plugin.
@@ -76,10 +93,17 @@ class DockerPluginScript(object):
         getting_id = flocker_client.this_node_uuid()
 
         def run_service(node_id):
+            service = MultiService()
+            # Added first so that it is stopped after the plugin's server:
+            _ClientService(flocker_client).setServiceParent(service)
+            dataset_events = DatasetEventSubscriber(reactor)
+            dataset_events.setServiceParent(service)
             endpoint = serverFromString(
                 reactor, "unix:{}:mode=600".format(PLUGIN_PATH.path))
-            service = StreamServerEndpointService(endpoint, Site(
-                VolumePlugin(reactor, flocker_client, node_id).app.resource()))
+            StreamServerEndpointService(endpoint, Site(
+                VolumePlugin(reactor, flocker_client, node_id,
+                             dataset_events).app.resource())
+            ).setServiceParent(service)
             return main_for_service(reactor, service)
         getting_id.addCallback(run_service)
         return getting_id
@@ -10,7 +10,9 @@ from bitmath import TiB, GiB, MiB, KiB, Byte
 
 from twisted.web.http import OK, NOT_ALLOWED, NOT_FOUND
 from twisted.internet.task import Clock, LoopingCall
-from twisted.internet.defer import gatherResults
+from twisted.internet.defer import Deferred, fail, gatherResults
+from twisted.python.filepath import FilePath
+from twisted.test.proto_helpers import MemoryReactor
 
 from hypothesis import given
 from hypothesis.strategies import (
@@ -22,8 +24,12 @@ from pyrsistent import pmap
 from eliot.testing import capture_logging
 
 from .._api import VolumePlugin, DEFAULT_SIZE, parse_num, NAME_FIELD
-from ...apiclient import FakeFlockerClient, Dataset, DatasetsConfiguration
-from ...testtools import CustomException, random_name
+from ...apiclient import FakeFlockerClient, Dataset, NotFound
+from ...control import (
+    NodeState, Manifestation, Dataset as DatasetModel,
+)
+from ...node._events import DatasetEventSubscriber, dataset_events
+from ...testtools import CustomException, TestCase, random_name
 
 from ...restapi import make_bad_request
 from ...restapi.testtools import (
@@ -85,9 +91,9 @@ class APITestsMixin(APIAssertionsMixin):
         """
         self.volume_plugin_reactor = Clock()
         self.flocker_client = SimpleCountingProxy(FakeFlockerClient())
-        # The conditional_create operation used by the plugin relies on
-        # the passage of time... so make sure time passes! We still use a
-        # fake clock since some tests want to skip ahead.
+        # Some operations used by the plugin rely on the passage of
+        # time... so make sure time passes! We still use a fake clock since
+        # some tests want to skip ahead.
         self.looping = LoopingCall(
             lambda: self.volume_plugin_reactor.advance(0.001))
         self.looping.start(0.001)
@@ -276,22 +282,34 @@ class APITestsMixin(APIAssertionsMixin):
         """
         name = u"thename"
 
-        # Create a dataset out-of-band with matching dataset ID and name
-        # which the docker plugin won't be able to see.
-        def create_after_list():
-            # Clean up the patched version:
-            del self.flocker_client.list_datasets_configuration
-            # But first time we're called, we create dataset and lie about
-            # its existence:
-            d = self.flocker_client.create_dataset(
+        # Create a dataset out-of-band with matching name just before the
+        # plugin's create reaches the control service:
+        client = self.flocker_client._wrapped
+        original = client.create_dataset_if_name_absent
+
+        def create_first(*args, **kwargs):
+            d = client.create_dataset(
                 self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
                 metadata={NAME_FIELD: name})
-            d.addCallback(lambda _: DatasetsConfiguration(
-                tag=u"1234", datasets={}))
+            d.addCallback(lambda _: original(*args, **kwargs))
             return d
-        self.flocker_client.list_datasets_configuration = create_after_list
+        self.patch(client, "create_dataset_if_name_absent", create_first)
 
-        return self.create(name)
+        d = self.create(name)
+        d.addCallback(
+            lambda _: self.flocker_client.list_datasets_configuration())
+        d.addCallback(lambda results: self.assertEqual(len(list(results)), 1))
+        return d
+
+    def test_create_no_listing(self):
+        """
+        ``/VolumeDriver.Create`` leaves checking that the name is unique to
+        the control service rather than retrieving the configuration.
+        """
+        d = self.create(u"myvol")
+        d.addCallback(lambda _: self.assertEqual(
+            0, self.flocker_client.num_calls("list_datasets_configuration")))
+        return d
 
     def _flush_volume_plugin_reactor_on_endpoint_render(self):
         """
@@ -346,14 +364,72 @@ class APITestsMixin(APIAssertionsMixin):
             self.assertEqual([self.NODE_A],
                              [d.primary for d in datasets
                               if d.dataset_id == dataset_id])
-            # There should be less than 20 calls to list_datasets_state over
-            # the course of 5 seconds.
-            self.assertLess(
-                self.flocker_client.num_calls('list_datasets_state'), 20)
+            # The plugin waits for the dataset to arrive rather than
+            # polling the state; the only listing is the one above:
+            self.assertEqual(
+                self.flocker_client.num_calls('list_datasets_state'), 1)
         d.addCallback(final_assertions)
 
         return d
 
+    def test_mount_wait_gives_up(self):
+        """
+        If the control service stops waiting for the dataset to arrive,
+        ``/VolumeDriver.Mount`` checks the state itself and keeps trying
+        until the dataset arrives.
+        """
+        name = u"myvol"
+        dataset_id = uuid4()
+        self.patch(self.flocker_client._wrapped, "wait_for_dataset_state",
+                   lambda dataset_id, primary: fail(NotFound()))
+        d = self.flocker_client.create_dataset(
+            self.NODE_B, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name},
+            dataset_id=dataset_id)
+
+        self._flush_volume_plugin_reactor_on_endpoint_render()
+        self.volume_plugin_reactor.callLater(
+            5.0, self.flocker_client.synchronize_state)
+
+        d.addCallback(lambda _:
+                      self.assertResult(
+                          b"POST", b"/VolumeDriver.Mount",
+                          {u"Name": name}, OK,
+                          {u"Err": u"",
+                           u"Mountpoint": u"/flocker/{}".format(dataset_id)}))
+        d.addCallback(lambda _: self.assertNotEqual(
+            0, self.flocker_client.num_calls('list_datasets_state')))
+        return d
+
+    def test_mount_name_reused(self):
+        """
+        If the dataset with a cached name was deleted and another created
+        with the same name, ``/VolumeDriver.Mount`` looks the name up again
+        and mounts the new dataset.
+        """
+        name = u"myvol"
+        dataset_id = uuid4()
+        d = self.create(name)
+        d.addCallback(
+            lambda _: self.flocker_client.list_datasets_configuration())
+        d.addCallback(lambda configured: self.flocker_client.delete_dataset(
+            list(configured)[0].dataset_id))
+        d.addCallback(lambda _: self.flocker_client.create_dataset(
+            self.NODE_B, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name}, dataset_id=dataset_id))
+
+        self._flush_volume_plugin_reactor_on_endpoint_render()
+        d.addCallback(lambda _: self.volume_plugin_reactor.callLater(
+            5.0, self.flocker_client.synchronize_state))
+
+        d.addCallback(lambda _:
+                      self.assertResult(
+                          b"POST", b"/VolumeDriver.Mount",
+                          {u"Name": name}, OK,
+                          {u"Err": u"",
+                           u"Mountpoint": u"/flocker/{}".format(dataset_id)}))
+        return d
+
     def test_mount_timeout(self):
         """
         ``/VolumeDriver.Mount`` sets the primary of the dataset with matching
@@ -414,6 +490,33 @@ class APITestsMixin(APIAssertionsMixin):
         d.addCallback(created)
         return d
 
+    def test_mount_reused(self):
+        """
+        A ``/VolumeDriver.Mount`` shortly after another for the same volume
+        reuses its result rather than moving the dataset again.
+        """
+        name = u"myvol"
+        d = self.flocker_client.create_dataset(
+            self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name})
+
+        def created(dataset):
+            self.flocker_client.synchronize_state()
+            expected = {u"Err": u"",
+                        u"Mountpoint": u"/flocker/{}".format(
+                            dataset.dataset_id)}
+            result = self.assertResult(
+                b"POST", b"/VolumeDriver.Mount", {u"Name": name}, OK,
+                expected)
+            result.addCallback(lambda _: self.assertResult(
+                b"POST", b"/VolumeDriver.Mount", {u"Name": name}, OK,
+                expected))
+            result.addCallback(lambda _: self.assertEqual(
+                1, self.flocker_client.num_calls("move_dataset")))
+            return result
+        d.addCallback(created)
+        return d
+
     def test_unknown_mount(self):
         """
         ``/VolumeDriver.Mount`` returns an error when asked to mount a
@@ -471,6 +574,81 @@ class APITestsMixin(APIAssertionsMixin):
         d.addCallback(created)
         return d
 
+    def test_path_cached(self):
+        """
+        Repeated ``/VolumeDriver.Path`` calls for the same volume only
+        retrieve the configuration once.
+        """
+        name = u"myvol"
+        d = self.flocker_client.create_dataset(
+            self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name})
+        for _ in range(3):
+            d.addCallback(lambda _: self.assertResponseCode(
+                b"POST", b"/VolumeDriver.Path", {u"Name": name}, OK))
+        d.addCallback(lambda _: self.assertEqual(
+            1, self.flocker_client.num_calls("list_datasets_configuration")))
+        return d
+
+    def test_path_after_create_cached(self):
+        """
+        ``/VolumeDriver.Path`` for a volume created by the plugin does not
+        need to retrieve the configuration again.
+        """
+        name = u"myvol"
+        d = self.create(name)
+
+        def created(_):
+            calls = self.flocker_client.num_calls(
+                "list_datasets_configuration")
+            result = self.assertResponseCode(
+                b"POST", b"/VolumeDriver.Path", {u"Name": name}, OK)
+            result.addCallback(lambda _: self.assertEqual(
+                calls,
+                self.flocker_client.num_calls("list_datasets_configuration")))
+            return result
+        d.addCallback(created)
+        return d
+
+    def test_path_new_name_refreshes(self):
+        """
+        A volume created by someone else after the plugin cached the names
+        it knew about is found by retrieving the configuration again.
+        """
+        d = self.create(u"first")
+        d.addCallback(lambda _: self.flocker_client.create_dataset(
+            self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: u"second"}))
+
+        def created(dataset):
+            self.flocker_client.synchronize_state()
+            return self.assertResult(
+                b"POST", b"/VolumeDriver.Path",
+                {u"Name": u"second"}, OK,
+                {u"Err": u"",
+                 u"Mountpoint": u"/flocker/{}".format(dataset.dataset_id)})
+        d.addCallback(created)
+        return d
+
+    def test_path_cache_expires(self):
+        """
+        ``/VolumeDriver.Path`` retrieves the configuration again once the
+        cached name is ``VolumePlugin._NAME_TTL`` seconds old.
+        """
+        name = u"myvol"
+        d = self.flocker_client.create_dataset(
+            self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name})
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"POST", b"/VolumeDriver.Path", {u"Name": name}, OK))
+        d.addCallback(lambda _: self.volume_plugin_reactor.advance(
+            VolumePlugin._NAME_TTL))
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"POST", b"/VolumeDriver.Path", {u"Name": name}, OK))
+        d.addCallback(lambda _: self.assertEqual(
+            2, self.flocker_client.num_calls("list_datasets_configuration")))
+        return d
+
     def test_unknown_path(self):
         """
         ``/VolumeDriver.Path`` returns an error when asked for the mount path
@@ -694,6 +872,25 @@ class APITestsMixin(APIAssertionsMixin):
                            ])}))
         return d
 
+    def test_list_single_fetch(self):
+        """
+        ``/VolumeDriver.List`` retrieves the configuration and the state
+        once each, however many volumes there are.
+        """
+        d = gatherResults([
+            self.flocker_client.create_dataset(
+                self.NODE_A, int(DEFAULT_SIZE.to_Byte()),
+                metadata={NAME_FIELD: u"myvol{}".format(i)})
+            for i in range(5)])
+        d.addCallback(lambda _: self.flocker_client.synchronize_state())
+        d.addCallback(lambda _: self.assertResponseCode(
+            b"POST", b"/VolumeDriver.List", {}, OK))
+        d.addCallback(lambda _: self.assertEqual(
+            (1, 1),
+            (self.flocker_client.num_calls("list_datasets_configuration"),
+             self.flocker_client.num_calls("list_datasets_state"))))
+        return d
+
     def test_list_no_metadata_name(self):
         """
         ``/VolumeDriver.List`` omits volumes that don't have a metadata field
@@ -716,3 +913,181 @@ def _build_app(test):
     return VolumePlugin(
         test.volume_plugin_reactor, test.flocker_client, test.NODE_A).app
 RealTestsAPI = build_UNIX_integration_tests(APITestsMixin, "API", _build_app)
+
+
+class CoalesceTests(TestCase):
+    """
+    Tests for ``VolumePlugin._coalesce``.
+    """
+    def setUp(self):
+        super(CoalesceTests, self).setUp()
+        self.clock = Clock()
+        self.plugin = VolumePlugin(self.clock, FakeFlockerClient(), uuid4())
+        self.calls = []
+
+    def coalesce(self, operation=u"op", name=u"myvol", invalidates=()):
+        """
+        Coalesce a call that returns a new unfired ``Deferred``, recorded in
+        ``self.calls``.
+
+        :return: The ``Deferred`` returned by ``_coalesce``.
+        """
+        def call():
+            d = Deferred()
+            self.calls.append(d)
+            return d
+        return self.plugin._coalesce(operation, name, call, invalidates)
+
+    def test_concurrent(self):
+        """
+        Concurrent calls for the same operation and volume share the result
+        of a single call.
+        """
+        first = self.coalesce()
+        second = self.coalesce()
+        self.calls[0].callback({u"Err": u""})
+        self.assertEqual(
+            (1, {u"Err": u""}, {u"Err": u""}),
+            (len(self.calls), self.successResultOf(first),
+             self.successResultOf(second)))
+
+    def test_different_volumes(self):
+        """
+        Calls for different volumes or operations are not coalesced.
+        """
+        self.coalesce(name=u"a")
+        self.coalesce(name=u"b")
+        self.coalesce(operation=u"other", name=u"a")
+        self.assertEqual(3, len(self.calls))
+
+    def test_reused(self):
+        """
+        A successful result is reused until ``_COALESCE_TTL`` seconds have
+        passed.
+        """
+        self.coalesce()
+        self.calls[0].callback({u"Err": u""})
+        self.clock.advance(self.plugin._COALESCE_TTL - 0.1)
+        reused = self.coalesce()
+        self.clock.advance(0.1)
+        self.coalesce()
+        self.assertEqual(
+            ({u"Err": u""}, 2),
+            (self.successResultOf(reused), len(self.calls)))
+
+    def test_error_not_reused(self):
+        """
+        A result reporting an error to Docker is not reused.
+        """
+        self.coalesce()
+        self.calls[0].callback({u"Err": u"Volume not available."})
+        self.coalesce()
+        self.assertEqual(2, len(self.calls))
+
+    def test_failure(self):
+        """
+        A failure is passed to every concurrent caller and not reused.
+        """
+        first = self.coalesce()
+        second = self.coalesce()
+        self.calls[0].errback(CustomException())
+        self.failureResultOf(first, CustomException)
+        self.failureResultOf(second, CustomException)
+        self.coalesce()
+        self.assertEqual(2, len(self.calls))
+
+    def test_invalidates(self):
+        """
+        Once a call finishes, the reusable results of the operations it
+        invalidates for the same volume are discarded.
+        """
+        self.coalesce(operation=u"read")
+        self.calls[0].callback({u"Err": u""})
+        self.coalesce(operation=u"write", invalidates=[u"read"])
+        self.calls[1].callback({u"Err": u""})
+        self.coalesce(operation=u"read")
+        self.assertEqual(3, len(self.calls))
+
+
+class DatasetEventsTests(TestCase):
+    """
+    Tests for ``VolumePlugin`` with a ``DatasetEventSubscriber``.
+    """
+    def setUp(self):
+        super(DatasetEventsTests, self).setUp()
+        self.node_id = uuid4()
+        self.dataset_id = uuid4()
+        self.flocker_client = SimpleCountingProxy(FakeFlockerClient())
+        self.dataset_events = DatasetEventSubscriber(MemoryReactor())
+        self.plugin = VolumePlugin(Clock(), self.flocker_client, self.node_id,
+                                   self.dataset_events)
+        self.path = FilePath(b"/flocker").child(bytes(self.dataset_id))
+
+    def publish(self, paths):
+        """
+        Pretend the dataset agent published local state.
+
+        :param paths: ``dict`` mapping dataset ``UUID`` to mountpoint.
+        """
+        old = self.dataset_events.node_state
+        new = NodeState(
+            uuid=self.node_id, hostname=u"192.0.2.1",
+            manifestations={
+                unicode(dataset_id): Manifestation(
+                    dataset=DatasetModel(dataset_id=unicode(dataset_id)),
+                    primary=True)
+                for dataset_id in paths},
+            paths={unicode(dataset_id): path
+                   for dataset_id, path in paths.items()},
+            devices={},
+        )
+        self.dataset_events.local_state_changed(
+            new, dataset_events(old, new))
+
+    def test_wait_for_path_local(self):
+        """
+        When the dataset agent is publishing local state the plugin waits for
+        it to report the dataset is mounted, without asking the control
+        service.
+        """
+        self.publish({})
+        d = self.plugin._wait_for_path(self.dataset_id)
+        self.assertNoResult(d)
+        self.publish({self.dataset_id: self.path})
+        self.assertEqual(
+            (self.path, 0),
+            (self.successResultOf(d),
+             self.flocker_client.num_calls("wait_for_dataset_state")))
+
+    def test_wait_for_path_connection_lost(self):
+        """
+        If the connection to the dataset agent is lost while waiting, the
+        wait gives up without a result so it can be retried.
+        """
+        self.publish({})
+        d = self.plugin._wait_for_path(self.dataset_id)
+        self.dataset_events.connection_lost(None)
+        self.assertIs(None, self.successResultOf(d))
+
+    def test_wait_for_path_not_connected(self):
+        """
+        When the dataset agent isn't publishing local state the plugin waits
+        using the control service.
+        """
+        self.plugin._wait_for_path(self.dataset_id)
+        self.assertEqual(
+            1, self.flocker_client.num_calls("wait_for_dataset_state"))
+
+    def test_path_local(self):
+        """
+        When the dataset agent is publishing local state, dataset paths are
+        looked up there rather than by listing the state of every dataset.
+        """
+        self.publish({self.dataset_id: self.path})
+        self.assertEqual(
+            (self.path, None, 0),
+            (self.successResultOf(
+                self.plugin._get_path_from_dataset_id(self.dataset_id)),
+             self.successResultOf(
+                 self.plugin._get_path_from_dataset_id(uuid4())),
+             self.flocker_client.num_calls("list_datasets_state")))
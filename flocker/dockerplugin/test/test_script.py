@@ -4,10 +4,11 @@
 Unit tests for the Docker plugin script.
 """
 
+from twisted.internet.defer import Deferred
 from twisted.python.filepath import FilePath
 
 from ...testtools import TestCase
-from .._script import DockerPluginScript
+from .._script import DockerPluginScript, _ClientService
 
 
 class DockerPluginScriptTests(TestCase):
@@ -41,3 +42,25 @@ class DockerPluginScriptTests(TestCase):
         DockerPluginScript()._create_listening_directory(path)
         path.restat()
         self.assertEqual(path.getPermissions().shorthand(), "rwx------")
+
+
+class ClientServiceTests(TestCase):
+    """
+    Tests for ``_ClientService``.
+    """
+    def test_stop_closes_client(self):
+        """
+        Stopping the service closes the client, and the result of
+        ``stopService`` fires when the client has been closed.
+        """
+        closing = Deferred()
+
+        class Client(object):
+            def close(self):
+                return closing
+
+        service = _ClientService(Client())
+        service.startService()
+        stopping = service.stopService()
+        self.assertEqual(
+            (service.running, stopping), (False, closing))
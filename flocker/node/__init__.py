@@ -6,6 +6,7 @@ Local node manager for Flocker.
 
 from ._change import (
     IStateChange, in_parallel, sequentially, run_state_change, NoOp,
+    ChangePolicy, StateChangeExecutor,
 )
 
 from ._deploy import (
@@ -27,6 +28,7 @@ __all__ = [
     'P2PManifestationDeployer',
     'ApplicationNodeDeployer',
     'run_state_change', 'in_parallel', 'sequentially',
+    'ChangePolicy', 'StateChangeExecutor',
     'BackendDescription', 'DeployerType',
 
     'dockerpy_client',
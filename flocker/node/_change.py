@@ -11,19 +11,25 @@ More complex changes can be composed from individual ``IStateChange``
 providers.
 
 ``run_state_change`` can be used to execute such a complex collection of
-changes.
+changes.  ``StateChangeExecutor`` does the same but limits how many changes
+of each type run at once, and which go first.
 """
 
+from bisect import insort
 from datetime import timedelta
+from itertools import count
 
 from zope.interface import Interface, Attribute, implementer
 
-from pyrsistent import PVector, pvector, field, PClass
+from pyrsistent import PVector, pmap, pvector, field, PClass
 
-from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.python.failure import Failure
 
 from eliot.twisted import DeferredContext
-from eliot import ActionType
+from eliot import (
+    ActionType, Field, MessageType, preserve_context, write_failure,
+)
 
 from ..common import gather_deferreds
 
@@ -195,3 +201,294 @@ class NoOp(PClass):
 
     def run(self, deployer):
         return succeed(None)
+
+
+class ChangePolicy(PClass):
+    """
+    How a ``StateChangeExecutor`` schedules one type of ``IStateChange``.
+
+    :ivar int priority: Queued changes with a lower priority are started
+        before those with a higher priority.
+    :ivar concurrency: The most changes of the type that may run at once, or
+        ``None`` for no limit.
+    :ivar bool background: Whether nothing on this node waits for changes of
+        the type, so that the convergence loop need not wait for them to
+        finish before its next iteration.
+    """
+    priority = field(type=int, initial=0, mandatory=True)
+    concurrency = field(type=(int, type(None)), initial=None, mandatory=True)
+    background = field(type=bool, initial=False, mandatory=True)
+
+
+_DEFAULT_POLICY = ChangePolicy()
+
+
+LOG_EXECUTOR_STATE = MessageType(
+    u"flocker:node:executor:state",
+    [Field.for_types(u"change_type", [unicode],
+                     u"The type of the change that started or finished."),
+     Field.for_types(u"queued", [int],
+                     u"How many changes are waiting to start."),
+     Field.for_types(u"in_flight", [int],
+                     u"How many changes are running.")],
+    u"A state change started or finished running.")
+
+
+class _Submission(object):
+    """
+    A leaf ``IStateChange`` submitted to a ``StateChangeExecutor``.
+
+    :ivar change: The ``IStateChange``.
+    :ivar ChangePolicy policy: The policy for the change's type.
+    :ivar start: No-argument callable that runs the change in the context it
+        was submitted in.
+    :ivar tuple order: Sort key for starting queued submissions.
+    :ivar list waiters: ``Deferred``\ s to fire with the result.  A queued
+        submission always has at least one.
+    :ivar bool running: Whether the change has started.
+    """
+    def __init__(self, change, policy, start, sequence):
+        self.change = change
+        self.policy = policy
+        self.start = start
+        self.order = (policy.priority, sequence)
+        self.waiters = []
+        self.running = False
+
+
+def _add(counts, change_type, amount):
+    """
+    Change the count for a change type, forgetting types whose count drops
+    to zero.
+
+    :param dict counts: Mapping from change types to counts.
+    :param type change_type: The change type.
+    :param int amount: How much to add to its count.
+    """
+    total = counts.get(change_type, 0) + amount
+    if total:
+        counts[change_type] = total
+    else:
+        del counts[change_type]
+
+
+def _copy_result(result):
+    """
+    :param result: The result of a ``Deferred``.
+
+    :return: ``result``, or a new ``Failure`` for the same exception if it
+        is a ``Failure``, so that several ``Deferred``\ s can be given the
+        result without handling one ``Failure`` between them.
+    """
+    if isinstance(result, Failure):
+        return Failure(result.value, result.type,
+                       result.getTracebackObject())
+    return result
+
+
+class StateChangeExecutor(object):
+    """
+    Run ``IStateChange`` trees, as built by ``in_parallel`` and
+    ``sequentially``, while limiting how many changes of each type run at
+    once and letting more important types of change go first.
+
+    Changes that are waiting to start can be cancelled by cancelling the
+    ``Deferred`` returned by ``run``.  A change that is equal to one that is
+    already queued or running, e.g. because a later convergence iteration
+    calculated it again, is not run a second time; it gets the result of
+    the existing one.
+
+    :ivar policies: ``PMap`` mapping ``IStateChange`` types to their
+        ``ChangePolicy``.  Other types are not limited.
+    :ivar concurrency: The most changes of any type that may run at once,
+        or ``None`` for no limit.
+    """
+    def __init__(self, policies=pmap(), concurrency=None):
+        """
+        :param policies: See ``policies`` above.
+        :param concurrency: See ``concurrency`` above.
+        """
+        self.policies = pmap(policies)
+        self.concurrency = concurrency
+        # Queued and running submissions, in the order they were submitted:
+        self._submissions = []
+        # Queued submissions, as (order, submission) tuples in the order
+        # they should start:
+        self._queue = []
+        self._queued = {}
+        self._in_flight = {}
+        self._running = 0
+        # How many queued and running submissions aren't background ones,
+        # and the Deferreds to fire when there are none:
+        self._foreground = 0
+        self._foreground_waiters = []
+        self._sequence = count()
+
+    def queued(self):
+        """
+        :return: ``dict`` mapping change types to how many changes of that
+            type are waiting to start.
+        """
+        return dict(self._queued)
+
+    def in_flight(self):
+        """
+        :return: ``dict`` mapping change types to how many changes of that
+            type are running.
+        """
+        return dict(self._in_flight)
+
+    def wait_for_foreground(self):
+        """
+        :return: ``Deferred`` that fires once the only changes queued or
+            running, if any, are those whose policy marks them as background
+            changes.
+        """
+        if not self._foreground:
+            return succeed(None)
+        waiting = Deferred()
+        self._foreground_waiters.append(waiting)
+        return waiting
+
+    def _done(self, submission):
+        """
+        Count a submission that was cancelled or has finished as done.
+        """
+        if submission.policy.background:
+            return
+        self._foreground -= 1
+        if not self._foreground:
+            waiters, self._foreground_waiters = self._foreground_waiters, []
+            for waiting in waiters:
+                waiting.callback(None)
+
+    def cancel_queued(self):
+        """
+        Cancel every change that hasn't started yet.
+        """
+        for submission in list(self._submissions):
+            if not submission.running:
+                for waiter in list(submission.waiters):
+                    waiter.cancel()
+
+    def run(self, change, deployer):
+        """
+        Apply a change to local state.
+
+        :param change: Either an ``IStateChange`` provider or the result of
+            an ``in_parallel`` or ``sequentially`` call.
+        :param IDeployer deployer: The ``IDeployer`` to use.
+
+        :return: ``Deferred`` firing when the change is done.
+        """
+        if isinstance(change, _InParallel):
+            run = lambda: gather_deferreds([
+                self.run(subchange, deployer)
+                for subchange in change.changes
+            ])
+        elif isinstance(change, _Sequentially):
+            def run():
+                d = DeferredContext(succeed(None))
+                for subchange in change.changes:
+                    d.addCallback(
+                        lambda _, subchange=subchange: self.run(
+                            subchange, deployer))
+                return d.result
+        else:
+            return self._submit(change, deployer)
+        with change.eliot_action.context():
+            context = DeferredContext(run())
+            context.addActionFinish()
+            return context.result
+
+    def _submit(self, change, deployer):
+        """
+        Queue a leaf change, or join an equal one that is already queued or
+        running.
+
+        :return: ``Deferred`` firing with the change's result.
+        """
+        for submission in self._submissions:
+            if submission.change == change:
+                break
+        else:
+            policy = self.policies.get(type(change), _DEFAULT_POLICY)
+            submission = _Submission(
+                change, policy,
+                preserve_context(lambda: run_state_change(change, deployer)),
+                next(self._sequence))
+            self._submissions.append(submission)
+            insort(self._queue, (submission.order, submission))
+            _add(self._queued, type(change), 1)
+            if not policy.background:
+                self._foreground += 1
+
+        def cancel(waiter):
+            submission.waiters.remove(waiter)
+            if not submission.waiters and not submission.running:
+                self._queue.remove((submission.order, submission))
+                _add(self._queued, type(submission.change), -1)
+                self._submissions.remove(submission)
+                self._done(submission)
+        waiter = Deferred(cancel)
+        submission.waiters.append(waiter)
+        self._start_queued()
+        return waiter
+
+    def _start_queued(self):
+        """
+        Start queued changes, most important first, as long as their type
+        is below its concurrency limit.
+        """
+        for _, submission in list(self._queue):
+            if submission.running or not submission.waiters:
+                # Started by a change that finished synchronously, or
+                # cancelled by something waiting for one.
+                continue
+            if (self.concurrency is not None and
+                    self._running >= self.concurrency):
+                return
+            limit = submission.policy.concurrency
+            if limit is not None and self._in_flight.get(
+                    type(submission.change), 0) >= limit:
+                continue
+            self._start(submission)
+
+    def _log_state(self, change_type):
+        LOG_EXECUTOR_STATE(
+            change_type=change_type.__name__.decode("ascii"),
+            queued=len(self._queue),
+            in_flight=self._running,
+        ).write()
+
+    def _start(self, submission):
+        """
+        Run a queued change.
+        """
+        change_type = type(submission.change)
+        submission.running = True
+        self._queue.remove((submission.order, submission))
+        _add(self._queued, change_type, -1)
+        _add(self._in_flight, change_type, 1)
+        self._running += 1
+        self._log_state(change_type)
+        d = maybeDeferred(submission.start)
+
+        def finished(result):
+            self._submissions.remove(submission)
+            _add(self._in_flight, change_type, -1)
+            self._running -= 1
+            self._log_state(change_type)
+            if not submission.waiters and isinstance(result, Failure):
+                # Everyone waiting for it gave up:
+                write_failure(result)
+            for waiter in list(submission.waiters):
+                # Each waiter gets its own result, and a waiter may have been
+                # cancelled by the callbacks of an earlier one:
+                if not waiter.called:
+                    waiter.callback(_copy_result(result))
+            # Only once the waiters have run, so that changes they go on to
+            # submit count as foreground changes still to be done:
+            self._done(submission)
+            self._start_queued()
+        d.addBoth(finished)
@@ -0,0 +1,474 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_events -*-
+
+"""
+Node-local notification of dataset lifecycle events.
+
+Other processes on a node (the container agent, the Docker plugin) want to
+know when a dataset has been mounted on that node.  Without this module they
+only learn about it once the dataset agent has reported its state to the
+control service and the control service has broadcast the new cluster state
+back, which adds at least one round trip and the control service's update
+delay.
+
+Instead, the dataset agent runs a ``DatasetEventPublisher`` listening on a
+Unix socket.  Whenever its convergence loop discovers new local state the
+publisher pushes that state, along with the dataset events it implies, to
+every connected ``DatasetEventSubscriber``.  Subscribers can also ask where a
+particular dataset is mounted.
+"""
+
+from errno import EEXIST
+
+from pyrsistent import PClass, field
+
+from eliot import writeFailure, write_traceback
+
+from twisted.application.internet import StreamServerEndpointService
+from twisted.application.service import Service
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.internet.error import ConnectionLost
+from twisted.internet.protocol import ReconnectingClientFactory, ServerFactory
+from twisted.protocols.amp import AMP, AmpList, Command, Unicode
+from twisted.python.constants import Names, NamedConstant
+from twisted.python.filepath import FilePath
+
+from ..control import NodeState
+from ..control._protocol import Big, SerializableArgument
+
+
+# The Unix socket on which the dataset agent publishes events:
+DATASET_EVENTS_SOCKET = FilePath(b"/var/run/flocker/dataset-events.sock")
+
+
+class DatasetEventType(Names):
+    """
+    The kinds of change that can happen to a dataset on a node.
+    """
+    # A block device for the dataset has appeared on the node:
+    ATTACHED = NamedConstant()
+    # The dataset's filesystem is mounted on the node:
+    MOUNTED = NamedConstant()
+    # The dataset's filesystem is no longer mounted on the node:
+    UNMOUNTED = NamedConstant()
+    # The dataset's block device is no longer on the node:
+    DETACHED = NamedConstant()
+
+
+class DatasetEvent(PClass):
+    """
+    Something happened to a dataset on this node.
+
+    :ivar unicode dataset_id: The dataset concerned.
+    :ivar NamedConstant event_type: A ``DatasetEventType`` constant.
+    :ivar path: The mountpoint ``FilePath`` for ``MOUNTED`` events,
+        otherwise ``None``.
+    """
+    dataset_id = field(type=unicode, mandatory=True)
+    event_type = field(type=NamedConstant, mandatory=True)
+    path = field(initial=None)
+
+
+def dataset_events(old_state, new_state):
+    """
+    Work out which dataset events happened between two discoveries of the
+    local node's state.
+
+    :param old_state: The previously discovered ``NodeState``, or ``None``
+        if there was none.
+    :param NodeState new_state: The newly discovered ``NodeState``.
+
+    :return: ``list`` of ``DatasetEvent``, unmounts and detaches first.
+    """
+    def known(state, attribute):
+        if state is None or getattr(state, attribute) is None:
+            return {}
+        return getattr(state, attribute)
+
+    old_devices = {unicode(dataset_id) for dataset_id
+                   in known(old_state, "devices")}
+    new_devices = {unicode(dataset_id) for dataset_id
+                   in known(new_state, "devices")}
+    old_paths = known(old_state, "paths")
+    new_paths = known(new_state, "paths")
+
+    events = []
+    for dataset_id in sorted(old_paths):
+        if old_paths[dataset_id] != new_paths.get(dataset_id):
+            events.append(DatasetEvent(
+                dataset_id=dataset_id,
+                event_type=DatasetEventType.UNMOUNTED))
+    for dataset_id in sorted(old_devices - new_devices):
+        events.append(DatasetEvent(
+            dataset_id=dataset_id, event_type=DatasetEventType.DETACHED))
+    for dataset_id in sorted(new_devices - old_devices):
+        events.append(DatasetEvent(
+            dataset_id=dataset_id, event_type=DatasetEventType.ATTACHED))
+    for dataset_id in sorted(new_paths):
+        if old_paths.get(dataset_id) != new_paths[dataset_id]:
+            events.append(DatasetEvent(
+                dataset_id=dataset_id, event_type=DatasetEventType.MOUNTED,
+                path=new_paths[dataset_id]))
+    return events
+
+
+def _path_to_wire(path):
+    """
+    :param path: A ``FilePath`` or ``None``.
+    :return: ``unicode`` path suitable for an AMP ``Unicode`` argument, or
+        ``None``.
+    """
+    if path is None:
+        return None
+    return path.path.decode("utf-8")
+
+
+def _path_from_wire(path):
+    """
+    The inverse of ``_path_to_wire``.
+    """
+    if path is None:
+        return None
+    return FilePath(path.encode("utf-8"))
+
+
+class LocalStateCommand(Command):
+    """
+    Sent by the dataset agent to subscribers when it discovers a change in
+    the local node's state, and when a subscriber connects.
+
+    :ivar node_state: The ``NodeState`` discovered by the dataset agent.
+    :ivar events: The ``DatasetEvent``\ s since the state last sent.
+    """
+    arguments = [
+        ('node_state', Big(SerializableArgument(NodeState))),
+        ('events', AmpList([('dataset_id', Unicode()),
+                            ('event_type', Unicode()),
+                            ('path', Unicode(optional=True))])),
+    ]
+    response = []
+
+
+class DatasetPathCommand(Command):
+    """
+    Ask the dataset agent where a dataset is mounted on this node.
+    """
+    arguments = [('dataset_id', Unicode())]
+    response = [('path', Unicode(optional=True))]
+
+
+class _PublisherAMP(AMP):
+    """
+    The dataset agent's side of a connection from a subscriber.
+    """
+    def __init__(self, publisher):
+        """
+        :param DatasetEventPublisher publisher: The publisher to register
+            with.
+        """
+        AMP.__init__(self)
+        self._publisher = publisher
+
+    def connectionMade(self):
+        AMP.connectionMade(self)
+        self._publisher.subscribed(self)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self._publisher.unsubscribed(self)
+
+    @DatasetPathCommand.responder
+    def dataset_path(self, dataset_id):
+        return {"path": _path_to_wire(self._publisher.path(dataset_id))}
+
+
+class DatasetEventPublisher(object):
+    """
+    Push the dataset agent's discovered local state to subscribers.
+
+    :ivar node_state: The most recently discovered ``NodeState`` of this
+        node, or ``None`` if discovery has not yet completed.
+    """
+    def __init__(self):
+        self.node_state = None
+        self._subscribers = set()
+
+    def local_state_changed(self, node_state):
+        """
+        Record newly discovered local state and notify subscribers if it
+        changed.
+
+        :param NodeState node_state: The discovered state of this node.
+        """
+        if node_state == self.node_state:
+            return
+        events = dataset_events(self.node_state, node_state)
+        self.node_state = node_state
+        for protocol in list(self._subscribers):
+            self._send(protocol, events)
+
+    def path(self, dataset_id):
+        """
+        :param unicode dataset_id: A dataset.
+
+        :return: The ``FilePath`` where the dataset is mounted on this node,
+            or ``None`` if it is not mounted here or that is not yet known.
+        """
+        if self.node_state is None or self.node_state.paths is None:
+            return None
+        return self.node_state.paths.get(dataset_id)
+
+    def subscribed(self, protocol):
+        """
+        A subscriber connected; bring it up to date.
+
+        :param AMP protocol: The connection to the subscriber.
+        """
+        self._subscribers.add(protocol)
+        if self.node_state is not None:
+            self._send(protocol, dataset_events(None, self.node_state))
+
+    def unsubscribed(self, protocol):
+        """
+        A subscriber disconnected.
+
+        :param AMP protocol: The connection to the subscriber.
+        """
+        self._subscribers.discard(protocol)
+
+    def _send(self, protocol, events):
+        d = protocol.callRemote(
+            LocalStateCommand,
+            node_state=self.node_state,
+            events=[{u"dataset_id": event.dataset_id,
+                     u"event_type": event.event_type.name.decode("ascii"),
+                     u"path": _path_to_wire(event.path)}
+                    for event in events],
+        )
+        d.addErrback(writeFailure)
+
+
+class _UnixSocketService(StreamServerEndpointService):
+    """
+    Listen on a Unix socket, creating its parent directory if necessary.
+    """
+    def __init__(self, endpoint, factory, socket_path):
+        StreamServerEndpointService.__init__(self, endpoint, factory)
+        self._socket_path = socket_path
+
+    def privilegedStartService(self):
+        try:
+            self._socket_path.parent().makedirs()
+        except OSError as e:
+            if e.errno != EEXIST:
+                raise
+        return StreamServerEndpointService.privilegedStartService(self)
+
+
+def dataset_event_publisher_service(reactor, publisher,
+                                    socket_path=DATASET_EVENTS_SOCKET):
+    """
+    Create a service that lets subscribers connect to a publisher.
+
+    :param reactor: The reactor to listen with.
+    :param DatasetEventPublisher publisher: The publisher to expose.
+    :param FilePath socket_path: The Unix socket to listen on.
+
+    :return: An ``IService`` provider.
+    """
+    return _UnixSocketService(
+        UNIXServerEndpoint(reactor, socket_path.path, mode=0600,
+                           wantPID=True),
+        ServerFactory.forProtocol(lambda: _PublisherAMP(publisher)),
+        socket_path,
+    )
+
+
+class _SubscriberAMP(AMP):
+    """
+    A subscriber's side of the connection to the dataset agent.
+    """
+    def __init__(self, subscriber):
+        """
+        :param DatasetEventSubscriber subscriber: The subscriber to notify.
+        """
+        AMP.__init__(self)
+        self._subscriber = subscriber
+
+    def connectionMade(self):
+        AMP.connectionMade(self)
+        self._subscriber.connection_made(self)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self._subscriber.connection_lost(self)
+
+    @LocalStateCommand.responder
+    def local_state(self, node_state, events):
+        self._subscriber.local_state_changed(node_state, [
+            DatasetEvent(
+                dataset_id=event[u"dataset_id"],
+                event_type=DatasetEventType.lookupByName(
+                    event[u"event_type"].encode("ascii")),
+                path=_path_from_wire(event.get(u"path")))
+            for event in events
+        ])
+        return {}
+
+
+class DatasetEventSubscriber(Service):
+    """
+    Keep a connection to the local dataset agent and track the local
+    dataset state it publishes.
+
+    :ivar node_state: The last ``NodeState`` published by the dataset
+        agent, or ``None`` if we are not connected or have not heard from it
+        since connecting.
+    :ivar factory: The factory used to connect to the dataset agent.
+    """
+    def __init__(self, reactor, socket_path=DATASET_EVENTS_SOCKET):
+        """
+        :param reactor: The reactor to connect with.
+        :param FilePath socket_path: The dataset agent's Unix socket.
+        """
+        self._reactor = reactor
+        self._socket_path = socket_path
+        self.node_state = None
+        self._protocol = None
+        self._observers = []
+        # Map dataset ID to a list of Deferreds waiting for it to be
+        # mounted:
+        self._path_waiters = {}
+        self.factory = ReconnectingClientFactory.forProtocol(
+            lambda: _SubscriberAMP(self))
+        # The dataset agent may be restarted; don't wait too long before
+        # noticing it is back:
+        self.factory.maxDelay = 30
+
+    def startService(self):
+        Service.startService(self)
+        self._reactor.connectUNIX(self._socket_path.path, self.factory)
+
+    def stopService(self):
+        Service.stopService(self)
+        self.factory.stopTrying()
+        if self._protocol is not None:
+            self._protocol.transport.loseConnection()
+
+    @property
+    def connected(self):
+        """
+        Whether the dataset agent is connected and has published its state.
+        """
+        return self.node_state is not None
+
+    def observe(self, callback):
+        """
+        Call a function whenever the published local state changes.
+
+        :param callback: Callable taking the new ``NodeState`` and a
+            ``list`` of ``DatasetEvent``.  It is called with ``None`` and an
+            empty list when the connection to the dataset agent is lost.
+        """
+        self._observers.append(callback)
+
+    def path(self, dataset_id):
+        """
+        :param unicode dataset_id: A dataset.
+
+        :return: The ``FilePath`` where the dataset is mounted on this node
+            according to the last published state, or ``None``.
+        """
+        if self.node_state is None or self.node_state.paths is None:
+            return None
+        return self.node_state.paths.get(dataset_id)
+
+    def query_path(self, dataset_id):
+        """
+        Ask the dataset agent where a dataset is mounted on this node.
+
+        :param unicode dataset_id: A dataset.
+
+        :return: ``Deferred`` firing with the mountpoint ``FilePath`` or
+            ``None``.  It fails with ``ConnectionLost`` if the dataset agent
+            is not connected.
+        """
+        if self._protocol is None:
+            return fail(ConnectionLost())
+        d = self._protocol.callRemote(DatasetPathCommand,
+                                      dataset_id=dataset_id)
+        d.addCallback(lambda response: _path_from_wire(response.get("path")))
+        return d
+
+    def wait_for_path(self, dataset_id):
+        """
+        Wait for a dataset to be mounted on this node.
+
+        :param unicode dataset_id: A dataset.
+
+        :return: ``Deferred`` firing with the mountpoint ``FilePath``.  It
+            fails with ``ConnectionLost`` if the dataset agent is or
+            becomes disconnected before the dataset is mounted.
+        """
+        if not self.connected:
+            return fail(ConnectionLost())
+        path = self.path(dataset_id)
+        if path is not None:
+            return succeed(path)
+
+        def cancel(d):
+            waiters = self._path_waiters.get(dataset_id, [])
+            if d in waiters:
+                waiters.remove(d)
+            if not waiters:
+                self._path_waiters.pop(dataset_id, None)
+        d = Deferred(canceller=cancel)
+        self._path_waiters.setdefault(dataset_id, []).append(d)
+        return d
+
+    def connection_made(self, protocol):
+        """
+        Called when a connection to the dataset agent is made.
+
+        :param AMP protocol: The new connection.
+        """
+        self.factory.resetDelay()
+        self._protocol = protocol
+
+    def connection_lost(self, protocol):
+        """
+        Called when the connection to the dataset agent is lost.
+
+        :param AMP protocol: The lost connection.
+        """
+        if protocol is not self._protocol:
+            return
+        self._protocol = None
+        self.node_state = None
+        waiters, self._path_waiters = self._path_waiters, {}
+        for ds in waiters.values():
+            for d in ds:
+                d.errback(ConnectionLost())
+        self._notify(None, [])
+
+    def local_state_changed(self, node_state, events):
+        """
+        Called when the dataset agent publishes new local state.
+
+        :param NodeState node_state: The published state.
+        :param events: ``list`` of ``DatasetEvent`` since the last update.
+        """
+        self.node_state = node_state
+        for event in events:
+            if event.event_type is DatasetEventType.MOUNTED:
+                for d in self._path_waiters.pop(event.dataset_id, []):
+                    d.callback(event.path)
+        self._notify(node_state, events)
+
+    def _notify(self, node_state, events):
+        for callback in list(self._observers):
+            try:
+                callback(node_state, events)
+            except:
+                write_traceback()
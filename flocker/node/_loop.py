@@ -37,15 +37,16 @@ from machinist import (
 
 from twisted.application.service import MultiService
 from twisted.python.constants import Names, NamedConstant
-from twisted.internet.defer import succeed, maybeDeferred
+from twisted.internet.defer import DeferredList, succeed, maybeDeferred
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.protocols.tls import TLSMemoryBIOFactory
 
-from . import run_state_change, NoOp
+from . import NoOp, StateChangeExecutor
 
 from ..common import gather_deferreds
 from ..control import (
-    NodeStateCommand, IConvergenceAgent, AgentAMP, SetNodeEraCommand,
+    NodeState, NodeStateCommand, IConvergenceAgent, AgentAMP,
+    SetNodeEraCommand,
 )
 from ..control._persistence import to_unserialized_json
 
@@ -228,6 +229,9 @@ class ConvergenceLoopInputs(Names):
     SLEEP = NamedConstant()
     # Stop sleeping:
     WAKEUP = NamedConstant()
+    # Something changed on this node, e.g. a device appeared or a
+    # filesystem was mounted, so local state should be rediscovered soon:
+    LOCAL_CHANGE = NamedConstant()
 
 
 @attributes(["client", "configuration", "state"])
@@ -268,6 +272,16 @@ class _Sleep(trivialInput(ConvergenceLoopInputs.SLEEP)):
 # converged so want to do another iteration again soon:
 _UNCONVERGED_DELAY = _Sleep(delay_seconds=0.1)
 
+# How many seconds to sleep when only background changes are still running;
+# the loop is woken up sooner when they finish:
+_BACKGROUND_DELAY = _Sleep(delay_seconds=10.0)
+
+# The minimum number of seconds between the start of one iteration and the
+# start of an iteration caused by a local change, so that a burst of
+# changes (e.g. udev creating many device nodes) results in a single
+# iteration rather than one per change:
+_LOCAL_CHANGE_INTERVAL = 1.0
+
 
 class ConvergenceLoopStates(Names):
     """
@@ -299,6 +313,12 @@ class ConvergenceLoopOutputs(Names):
     CLEAR_WAKEUP = NamedConstant()
     # Check if we need to wakeup due to update from AMP client:
     UPDATE_MAYBE_WAKEUP = NamedConstant()
+    # Wake up early, but no sooner than the minimum interval after the last
+    # iteration started:
+    SCHEDULE_LOCAL_WAKEUP = NamedConstant()
+    # Remember that a local change happened during an iteration, so the
+    # following sleep is shortened:
+    STORE_LOCAL_CHANGE = NamedConstant()
 
 
 _FIELD_CONNECTION = Field(
@@ -367,21 +387,42 @@ class ConvergenceLoop(object):
 
     :ivar _sleep_timeout: Current ``IDelayedCall`` for sleep timeout, or
         ``None`` if not in SLEEPING state.
+
+    :ivar _last_iteration: The time the most recent iteration started, or
+        ``None`` if none has been started.
+
+    :ivar bool _local_change_pending: Whether a local change was reported
+        during the current iteration.
+
+    :ivar StateChangeExecutor executor: Runs the calculated changes.
     """
-    def __init__(self, reactor, deployer):
+    def __init__(self, reactor, deployer, local_state_observers=(),
+                 executor=None):
         """
         :param IReactorTime reactor: Used to schedule delays in the loop.
 
         :param IDeployer deployer: Used to discover local state and calculate
             necessary changes to match desired configuration.
+
+        :param local_state_observers: One-argument callables to call with
+            this node's ``NodeState`` every time local state is discovered.
+
+        :param executor: See ``executor`` above.  By default changes are not
+            limited.
         """
+        if executor is None:
+            executor = StateChangeExecutor()
         self.reactor = reactor
         self.deployer = deployer
+        self.executor = executor
+        self.local_state_observers = list(local_state_observers)
         self.cluster_state = None
         self.client = None
         self._last_discovered_local_state = None
         self._last_acknowledged_state = None
         self._sleep_timeout = None
+        self._last_iteration = None
+        self._local_change_pending = False
 
     def output_STORE_INFO(self, context):
         old_client = self.client
@@ -458,7 +499,24 @@ class ConvergenceLoop(object):
         else:
             return succeed(None)
 
+    def _notify_local_state_observers(self, state_changes):
+        """
+        Tell local state observers about this node's discovered state.
+
+        :param state_changes: The discovered ``IClusterStateChange``\ s.
+        """
+        for state in state_changes:
+            if not (isinstance(state, NodeState) and
+                    state.uuid == self.deployer.node_uuid):
+                continue
+            for observer in self.local_state_observers:
+                try:
+                    observer(state)
+                except:
+                    write_traceback(self.fsm.logger)
+
     def output_CONVERGE(self, context):
+        self._last_iteration = self.reactor.seconds()
         with LOG_CONVERGE(self.fsm.logger, cluster_state=self.cluster_state,
                           desired_configuration=self.configuration).context():
             with LOG_DISCOVERY(self.fsm.logger).context():
@@ -480,6 +538,7 @@ class ConvergenceLoop(object):
                 self.cluster_state = state.update_cluster_state(
                     self.cluster_state
                 )
+            self._notify_local_state_observers(cluster_state_changes)
 
             # XXX And for this update to be the side-effect of an output
             # resulting.
@@ -502,14 +561,32 @@ class ConvergenceLoop(object):
 
             LOG_CALCULATED_ACTIONS(calculated_actions=action).write(
                 self.fsm.logger)
-            ran_state_change = run_state_change(action, self.deployer)
+            ran_state_change = self.executor.run(action, self.deployer)
             DeferredContext(ran_state_change).addErrback(
                 writeFailure, self.fsm.logger)
 
+            # Background changes, e.g. creating volumes, may be held up by
+            # the backend's limits and nothing on this node waits for them,
+            # so they shouldn't hold up changes that the next iteration
+            # finds.  Only the other changes are waited for; the loop is
+            # woken up when the background ones finish:
+            ran_foreground = DeferredList(
+                [ran_state_change, self.executor.wait_for_foreground()],
+                fireOnOneCallback=True)
+
+            def ran(_):
+                if ran_state_change.called:
+                    return sleep_duration
+                ran_state_change.addCallback(
+                    lambda _: self.fsm.receive(
+                        ConvergenceLoopInputs.LOCAL_CHANGE))
+                return _BACKGROUND_DELAY
+            ran_foreground.addCallback(ran)
+
             # Wait for the control node to acknowledge the new
             # state, and for the convergence actions to run.
-            result = gather_deferreds([sent_state, ran_state_change])
-            result.addCallback(lambda _: sleep_duration)
+            result = gather_deferreds([sent_state, ran_foreground])
+            result.addCallback(lambda results: results[1])
             return result
         d.addCallback(got_local_state)
 
@@ -526,10 +603,33 @@ class ConvergenceLoop(object):
             lambda delay: self.fsm.receive(delay))
         d.addActionFinish()
 
+    def _local_change_delay(self):
+        """
+        :return: How many seconds from now an iteration caused by a local
+            change may start.
+        """
+        if self._last_iteration is None:
+            return 0
+        return max(0, self._last_iteration + _LOCAL_CHANGE_INTERVAL -
+                   self.reactor.seconds())
+
     def output_SCHEDULE_WAKEUP(self, context):
+        delay = context.delay_seconds
+        if self._local_change_pending:
+            # Local state may have changed after it was discovered:
+            self._local_change_pending = False
+            delay = min(delay, self._local_change_delay())
         self._sleep_timeout = self.reactor.callLater(
-            context.delay_seconds,
-            lambda: self.fsm.receive(ConvergenceLoopInputs.WAKEUP))
+            delay, lambda: self.fsm.receive(ConvergenceLoopInputs.WAKEUP))
+
+    def output_SCHEDULE_LOCAL_WAKEUP(self, context):
+        remaining = self._sleep_timeout.getTime() - self.reactor.seconds()
+        delay = self._local_change_delay()
+        if delay < remaining:
+            self._sleep_timeout.reset(delay)
+
+    def output_STORE_LOCAL_CHANGE(self, context):
+        self._local_change_pending = True
 
     def output_CLEAR_WAKEUP(self, context):
         if self._sleep_timeout.active():
@@ -549,18 +649,23 @@ def _build_convergence_loop_table():
     S = ConvergenceLoopStates
 
     table = TransitionTable()
-    table = table.addTransition(
-        S.STOPPED, I.STATUS_UPDATE, [O.STORE_INFO, O.CONVERGE], S.CONVERGING)
+    table = table.addTransitions(
+        S.STOPPED, {
+            I.STATUS_UPDATE: ([O.STORE_INFO, O.CONVERGE], S.CONVERGING),
+            I.LOCAL_CHANGE: ([], S.STOPPED),
+        })
     table = table.addTransitions(
         S.CONVERGING, {
             I.STATUS_UPDATE: ([O.STORE_INFO], S.CONVERGING),
             I.STOP: ([], S.CONVERGING_STOPPING),
             I.SLEEP: ([O.SCHEDULE_WAKEUP], S.SLEEPING),
+            I.LOCAL_CHANGE: ([O.STORE_LOCAL_CHANGE], S.CONVERGING),
         })
     table = table.addTransitions(
         S.CONVERGING_STOPPING, {
             I.STATUS_UPDATE: ([O.STORE_INFO], S.CONVERGING),
             I.SLEEP: ([], S.STOPPED),
+            I.LOCAL_CHANGE: ([], S.CONVERGING_STOPPING),
         })
     table = table.addTransitions(
         S.SLEEPING, {
@@ -568,6 +673,7 @@ def _build_convergence_loop_table():
             I.STOP: ([O.CLEAR_WAKEUP], S.STOPPED),
             I.STATUS_UPDATE: (
                 [O.STORE_INFO, O.UPDATE_MAYBE_WAKEUP], S.SLEEPING),
+            I.LOCAL_CHANGE: ([O.SCHEDULE_LOCAL_WAKEUP], S.SLEEPING),
             })
     return table
 
@@ -575,7 +681,8 @@ def _build_convergence_loop_table():
 _CONVERGENCE_LOOP_FSM_TABLE = _build_convergence_loop_table()
 
 
-def build_convergence_loop_fsm(reactor, deployer):
+def build_convergence_loop_fsm(reactor, deployer, local_state_observers=(),
+                               executor=None):
     """
     Create a convergence loop FSM.
 
@@ -600,12 +707,24 @@ def build_convergence_loop_fsm(reactor, deployer):
     update requires us to do something; a recently cached version should
     suffice.
 
+    A local change, e.g. a new device or a mounted filesystem, noticed
+    while sleeping cuts the sleep short, though the next iteration won't
+    start until ``_LOCAL_CHANGE_INTERVAL`` seconds after the previous one
+    started.  The sleep is still bounded by the ``NoOp`` duration, so
+    changes that aren't noticed locally are still discovered.
+
     :param IReactorTime reactor: Used to schedule delays in the loop.
 
     :param IDeployer deployer: Used to discover local state and calcualte
         necessary changes to match desired configuration.
+
+    :param local_state_observers: One-argument callables to call with this
+        node's ``NodeState`` every time local state is discovered.
+
+    :param executor: The ``StateChangeExecutor`` to run changes with, or
+        ``None`` to run them without limits.
     """
-    loop = ConvergenceLoop(reactor, deployer)
+    loop = ConvergenceLoop(reactor, deployer, local_state_observers, executor)
     fsm = constructFiniteStateMachine(
         inputs=ConvergenceLoopInputs,
         outputs=ConvergenceLoopOutputs,
@@ -631,20 +750,46 @@ class AgentLoopService(MultiService, object):
     :ivar host: Host to connect to.
     :ivar port: Port to connect to.
     :ivar cluster_status: A cluster status FSM.
+    :ivar convergence_loop: The convergence loop FSM.
     :ivar factory: The factory used to connect to the control service.
     :ivar reconnecting_factory: The underlying factory used to connect to
         the control service, without the TLS wrapper.
     :ivar UUID era: This node's era.
+    :ivar local_state_observers: One-argument callables to call with this
+        node's ``NodeState`` every time the convergence loop discovers it.
+    :ivar control_socket: The ``FilePath`` of the Unix socket of a
+        ``ControlServiceMultiplexer`` to connect to instead of connecting to
+        the control service directly, or ``None``.
+    :ivar StateChangeExecutor executor: Runs the changes calculated by the
+        convergence loop.  Changes that haven't started are cancelled when
+        the service stops.
     """
 
-    def __init__(self, context_factory):
+    def __init__(self, context_factory, control_socket=None, executor=None):
         """
         :param context_factory: TLS context factory for the AMP client.
+        :param control_socket: See ``control_socket`` above.
+        :param executor: See ``executor`` above.  By default changes are not
+            limited.
         """
         MultiService.__init__(self)
+        if executor is None:
+            executor = StateChangeExecutor()
+        self.control_socket = control_socket
+        self.executor = executor
+        self.local_state_observers = []
+        # The most recent update from the control service, as a tuple of
+        # configuration and state, or ``None`` if none has arrived yet:
+        self._last_update = None
+        # Local dataset state received directly from the dataset agent on
+        # this node, which is fresher than what the control service has:
+        self._dataset_state = None
         convergence_loop = build_convergence_loop_fsm(
-            self.reactor, self.deployer
+            self.reactor, self.deployer,
+            [self._local_state_discovered],
+            executor,
         )
+        self.convergence_loop = convergence_loop
         self.logger = convergence_loop.logger
         self.cluster_status = build_cluster_status_fsm(convergence_loop)
         self.reconnecting_factory = ReconnectingClientFactory.forProtocol(
@@ -655,12 +800,18 @@ class AgentLoopService(MultiService, object):
 
     def startService(self):
         MultiService.startService(self)
-        self.reactor.connectTCP(self.host, self.port, self.factory)
+        if self.control_socket is not None:
+            # The multiplexer is on this node and takes care of TLS:
+            self.reactor.connectUNIX(self.control_socket.path,
+                                     self.reconnecting_factory)
+        else:
+            self.reactor.connectTCP(self.host, self.port, self.factory)
 
     def stopService(self):
         MultiService.stopService(self)
         self.reconnecting_factory.stopTrying()
         self.cluster_status.receive(ClusterStatusInputs.SHUTDOWN)
+        self.executor.cancel_queued()
 
     # IConvergenceAgent methods:
 
@@ -675,10 +826,58 @@ class AgentLoopService(MultiService, object):
         self.cluster_status.receive(_ConnectedToControlService(client=client))
 
     def disconnected(self):
+        # Configuration and state from the old connection shouldn't be
+        # resent with the next update from the dataset agent:
+        self._last_update = None
         self.cluster_status.receive(
             ClusterStatusInputs.DISCONNECTED_FROM_CONTROL_SERVICE)
 
     def cluster_updated(self, configuration, cluster_state):
+        self._last_update = (configuration, cluster_state)
+        self._send_status_update()
+
+    def local_change_detected(self):
+        """
+        Something changed on this node that may affect its local state, so
+        the convergence loop should wake up early.
+        """
+        self.convergence_loop.receive(ConvergenceLoopInputs.LOCAL_CHANGE)
+
+    def dataset_state_changed(self, node_state, events=()):
+        """
+        The dataset agent on this node published its discovered state.
+
+        The state is applied on top of the cluster state received from the
+        control service, so the convergence loop can react to e.g. a newly
+        mounted dataset without waiting for the control service to hear
+        about it.
+
+        :param node_state: The dataset agent's ``NodeState`` for this node,
+            or ``None`` if the dataset agent is no longer connected.
+        :param events: The ``DatasetEvent``\ s that caused the update.
+        """
+        node_uuid = self.deployer.node_uuid
+        if node_state is not None and node_state.uuid != node_uuid:
+            return
+        self._dataset_state = node_state
+        self._send_status_update()
+
+    def _local_state_discovered(self, node_state):
+        """
+        Pass this node's discovered state on to the local state observers.
+
+        :param NodeState node_state: The discovered state.
+        """
+        for observer in self.local_state_observers:
+            observer(node_state)
+
+    def _send_status_update(self):
+        """
+        Tell the convergence loop about the latest configuration and state.
+        """
+        if self._last_update is None:
+            return
+        configuration, cluster_state = self._last_update
         # Filter out state for this node if the era doesn't match. Since
         # the era doesn't match ours that means it's old pre-reboot state
         # that hasn't expired yet and is likely wrong, so we don't want to
@@ -686,5 +885,8 @@ class AgentLoopService(MultiService, object):
         node_uuid = self.deployer.node_uuid
         if self.era != cluster_state.node_uuid_to_era.get(node_uuid):
             cluster_state = cluster_state.remove_node(node_uuid)
+        if self._dataset_state is not None:
+            cluster_state = self._dataset_state.update_cluster_state(
+                cluster_state)
         self.cluster_status.receive(_StatusUpdate(configuration=configuration,
                                                   state=cluster_state))
@@ -0,0 +1,513 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_multiplexer -*-
+
+"""
+A node-local multiplexer for connections to the control service.
+
+Every convergence agent on a node normally keeps its own TLS connection to
+the control service, and the control service sends every one of them a copy
+of each cluster status update.  ``ControlServiceMultiplexer`` instead keeps
+a single connection to the control service and lets the agents on its node
+connect to it over a Unix socket, using the same AMP protocol they would use
+with the control service:
+
+* ``ClusterStatusCommand``\ s are relayed to the local agents without being
+  decoded or re-encoded by the multiplexer.  Only the most recent update is
+  sent to an agent that is still processing an earlier one, and an update
+  identical to the one an agent last received is not sent to it again.
+* ``NodeStateCommand``\ s from the local agents are merged: uploads that
+  arrive while another upload is in progress are sent to the control
+  service together, as a single command, once it finishes.
+* ``SetNodeEraCommand`` is sent to the control service only when the era
+  changes.
+
+This halves the connections the control service keeps and the cluster
+status updates it sends.  The agents are separate processes, so the
+multiplexer can't decode updates once on their behalf; decoding on the node
+is instead reduced by not relaying updates an agent already has, and by
+agents only decoding the configuration when it has changed (see
+``ClusterStatusCommand``).  Each agent still decodes every changed state.
+
+Local agents are disconnected whenever the connection to the control service
+is lost, so they behave as they would have without the multiplexer.  The
+control service only expires state some time after the connection it was
+sent over is lost, so when an agent that sent state disconnects, an
+``ExpireNodeStateCommand`` tells the control service to forget the state only
+that agent sent.
+"""
+
+from eliot import ActionType, Field, Logger, writeFailure
+from eliot.twisted import DeferredContext
+
+from twisted.application.service import MultiService
+from twisted.internet.defer import Deferred, fail, maybeDeferred, succeed
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.internet.error import ConnectionLost
+from twisted.internet.protocol import ReconnectingClientFactory, ServerFactory
+from twisted.protocols.amp import AMP, Command, CommandLocator, String
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.python.filepath import FilePath
+
+from ..control import NodeStateCommand, SetNodeEraCommand
+from ..control._protocol import (
+    Big, ClusterStatusCommand, ExpireNodeStateCommand, NoOp, Pinger,
+    PING_INTERVAL, _EliotActionArgument, timeout_for_protocol,
+)
+from ._events import _UnixSocketService
+
+
+# The Unix socket on which the multiplexer accepts connections from agents:
+CONTROL_MULTIPLEXER_SOCKET = FilePath(
+    b"/var/run/flocker/control-multiplexer.sock")
+
+
+class _RawClusterStatusCommand(Command):
+    """
+    ``ClusterStatusCommand`` with the configuration and state left in their
+    serialized form, so that they can be relayed without decoding them.
+    """
+    commandName = ClusterStatusCommand.commandName
+    arguments = [('configuration', Big(String())),
+                 ('state', Big(String())),
+                 ('eliot_context', _EliotActionArgument())]
+    response = []
+
+
+_AGENT = Field(
+    u"agent", lambda protocol: str(protocol.transport.getPeer()),
+    u"The local agent we're sending to.")
+
+_CHANGES = Field.for_types(
+    u"changes", [int], u"The number of state changes being sent.")
+
+LOG_RELAY_CLUSTER_STATE = ActionType(
+    u"flocker:node:multiplexer:relay_cluster_state",
+    [_AGENT],
+    [],
+    u"Relay the cluster configuration and state to a local agent.")
+
+LOG_SEND_MERGED_STATE = ActionType(
+    u"flocker:node:multiplexer:send_merged_state",
+    [_CHANGES],
+    [],
+    u"Send the merged local state of the node's agents to the control "
+    u"service.")
+
+LOG_EXPIRE_AGENT_STATE = ActionType(
+    u"flocker:node:multiplexer:expire_agent_state",
+    [_AGENT, _CHANGES],
+    [],
+    u"Tell the control service to forget the state sent by a local agent "
+    u"that disconnected.")
+
+
+class _UpstreamLocator(CommandLocator):
+    """
+    Command locator for the connection to the control service.
+    """
+    def __init__(self, multiplexer, timeout):
+        """
+        :param ControlServiceMultiplexer multiplexer: The multiplexer to
+            notify.
+        :param Timeout timeout: A ``Timeout`` to reset when a message is
+            received.
+        """
+        CommandLocator.__init__(self)
+        self.multiplexer = multiplexer
+        self._timeout = timeout
+
+    def locateResponder(self, name):
+        self._timeout.reset()
+        return CommandLocator.locateResponder(self, name)
+
+    @property
+    def logger(self):
+        return self.multiplexer.logger
+
+    @NoOp.responder
+    def noop(self):
+        return {}
+
+    @_RawClusterStatusCommand.responder
+    def cluster_updated(self, eliot_context, configuration, state):
+        with eliot_context:
+            self.multiplexer.cluster_updated(configuration, state)
+            return {}
+
+
+class _UpstreamAMP(AMP):
+    """
+    The multiplexer's connection to the control service.
+    """
+    def __init__(self, reactor, multiplexer):
+        """
+        :param IReactorTime reactor: Used to schedule pings.
+        :param ControlServiceMultiplexer multiplexer: The multiplexer to
+            notify.
+        """
+        AMP.__init__(self, locator=_UpstreamLocator(
+            multiplexer, timeout_for_protocol(reactor, self)))
+        self.multiplexer = multiplexer
+        self._pinger = Pinger(reactor)
+
+    def connectionMade(self):
+        AMP.connectionMade(self)
+        self.multiplexer.connected(self)
+        self._pinger.start(self, PING_INTERVAL)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self.multiplexer.disconnected()
+        self._pinger.stop()
+
+
+class _DownstreamLocator(CommandLocator):
+    """
+    Command locator for a connection from a local agent, answering the
+    commands the control service would.
+    """
+    def __init__(self, multiplexer, protocol, timeout):
+        """
+        :param ControlServiceMultiplexer multiplexer: The multiplexer to
+            pass commands on to.
+        :param AMP protocol: The connection to the agent.
+        :param Timeout timeout: A ``Timeout`` to reset when a message is
+            received.
+        """
+        CommandLocator.__init__(self)
+        self.multiplexer = multiplexer
+        self._protocol = protocol
+        self._timeout = timeout
+
+    def locateResponder(self, name):
+        self._timeout.reset()
+        return CommandLocator.locateResponder(self, name)
+
+    @property
+    def logger(self):
+        return self.multiplexer.logger
+
+    @NoOp.responder
+    def noop(self):
+        return {}
+
+    @SetNodeEraCommand.responder
+    def set_node_era(self, era, node_uuid):
+        d = self.multiplexer.set_node_era(era, node_uuid)
+        d.addCallback(lambda _: {})
+        return d
+
+    @NodeStateCommand.responder
+    def node_changed(self, eliot_context, state_changes):
+        with eliot_context:
+            d = self.multiplexer.node_changed(self._protocol, state_changes)
+            d.addCallback(lambda _: {})
+            return d
+
+
+class _DownstreamAMP(AMP):
+    """
+    The multiplexer's side of a connection from a local agent.
+    """
+    def __init__(self, reactor, multiplexer):
+        """
+        :param IReactorTime reactor: Used to schedule pings.
+        :param ControlServiceMultiplexer multiplexer: The multiplexer to
+            notify.
+        """
+        AMP.__init__(self, locator=_DownstreamLocator(
+            multiplexer, self, timeout_for_protocol(reactor, self)))
+        self.multiplexer = multiplexer
+        self._pinger = Pinger(reactor)
+
+    def connectionMade(self):
+        AMP.connectionMade(self)
+        self.multiplexer.agent_connected(self)
+        self._pinger.start(self, PING_INTERVAL)
+
+    def connectionLost(self, reason):
+        AMP.connectionLost(self, reason)
+        self.multiplexer.agent_disconnected(self)
+        self._pinger.stop()
+
+
+class ControlServiceMultiplexer(MultiService, object):
+    """
+    Share one connection to the control service between the convergence
+    agents on a node.
+
+    Cluster status updates are relayed as they were received, so each agent
+    decodes the ones it is sent itself.
+
+    :ivar reconnecting_factory: The factory used to connect to the control
+        service, without the TLS wrapper.
+    :ivar agents: The ``set`` of connections from local agents.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, host, port, context_factory,
+                 socket_path=CONTROL_MULTIPLEXER_SOCKET):
+        """
+        :param reactor: The reactor to use.
+        :param host: The control service's host.
+        :param port: The control service's port.
+        :param context_factory: TLS context factory for the connection to
+            the control service.
+        :param FilePath socket_path: The Unix socket on which to accept
+            connections from local agents.
+        """
+        MultiService.__init__(self)
+        self.reactor = reactor
+        self.host = host
+        self.port = port
+        self.reconnecting_factory = ReconnectingClientFactory.forProtocol(
+            lambda: _UpstreamAMP(self.reactor, self))
+        self._factory = TLSMemoryBIOFactory(
+            context_factory, True, self.reconnecting_factory)
+        self.agents = set()
+        self._upstream = None
+        # The serialized (configuration, state) most recently received from
+        # the control service over the current connection:
+        self._latest = None
+        # Map agent connections to ``True`` if they should be sent the
+        # latest update once they acknowledge the one they are processing:
+        self._relaying = {}
+        # Map agent connections to the serialized (configuration, state) most
+        # recently sent to them:
+        self._relayed = {}
+        # The (era, node_uuid) most recently sent by an agent, and the one
+        # most recently sent over the current upstream connection:
+        self._era = None
+        self._sent_era = None
+        self._uploading = False
+        # Map agent connections to a tuple of their most recent state
+        # changes not yet sent to the control service and a list of
+        # ``Deferred``\ s to fire when they have been:
+        self._pending_uploads = {}
+        # Map the agent connections which sent state over the current
+        # upstream connection to a ``dict`` mapping the keys of the
+        # information wipes of the changes they sent to those changes:
+        self._uploaded = {}
+        _UnixSocketService(
+            UNIXServerEndpoint(reactor, socket_path.path, mode=0600,
+                               wantPID=True),
+            ServerFactory.forProtocol(
+                lambda: _DownstreamAMP(self.reactor, self)),
+            socket_path,
+        ).setServiceParent(self)
+
+    def startService(self):
+        MultiService.startService(self)
+        self.reactor.connectTCP(self.host, self.port, self._factory)
+
+    def stopService(self):
+        self.reconnecting_factory.stopTrying()
+        if self._upstream is not None:
+            self._upstream.transport.loseConnection()
+        return MultiService.stopService(self)
+
+    # The connection to the control service:
+
+    def connected(self, upstream):
+        """
+        The connection to the control service was made.
+
+        :param AMP upstream: The connection.
+        """
+        self.reconnecting_factory.resetDelay()
+        self._upstream = upstream
+        self._latest = None
+        self._sent_era = None
+        self._uploaded = {}
+        if self._era is not None:
+            self.set_node_era(*self._era)
+
+    def disconnected(self):
+        """
+        The connection to the control service was lost.
+        """
+        self._upstream = None
+        self._latest = None
+        self._uploaded = {}
+        pending, self._pending_uploads = self._pending_uploads, {}
+        for _, waiting in pending.values():
+            for d in waiting:
+                d.errback(ConnectionLost())
+        # Let the agents know, the same way they would without us:
+        for agent in list(self.agents):
+            agent.transport.loseConnection()
+
+    def cluster_updated(self, configuration, state):
+        """
+        The control service sent a cluster status update.
+
+        :param bytes configuration: The serialized configuration.
+        :param bytes state: The serialized cluster state.
+        """
+        self._latest = (configuration, state)
+        for agent in self.agents:
+            self._relay(agent)
+
+    # Connections from local agents:
+
+    def agent_connected(self, agent):
+        """
+        A local agent connected.
+
+        :param AMP agent: The connection from the agent.
+        """
+        self.agents.add(agent)
+        self._relay(agent)
+
+    def agent_disconnected(self, agent):
+        """
+        A local agent disconnected.
+
+        :param AMP agent: The connection from the agent.
+        """
+        self.agents.discard(agent)
+        self._relaying.pop(agent, None)
+        self._relayed.pop(agent, None)
+        uploaded = self._uploaded.pop(agent, {})
+        if not uploaded or self._upstream is None:
+            return
+        # The control service would keep the agent's state for as long as
+        # the shared connection stays up.  Have it forget the information
+        # only this agent sent, keeping anything the remaining agents sent
+        # too:
+        for changes in self._uploaded.values():
+            for key in changes:
+                uploaded.pop(key, None)
+        if not uploaded:
+            return
+        state_changes = list(uploaded.values())
+        action = LOG_EXPIRE_AGENT_STATE(
+            self.logger, agent=agent, changes=len(state_changes))
+        with action.context():
+            d = DeferredContext(maybeDeferred(
+                self._upstream.callRemote, ExpireNodeStateCommand,
+                state_changes=state_changes, eliot_context=action))
+            d.addActionFinish()
+        d.result.addErrback(
+            writeFailure, self.logger,
+            u"Failed to expire a local agent's state on the control node.")
+
+    def _relay(self, agent):
+        """
+        Send the latest cluster status to an agent, or once it acknowledges
+        the update it is processing.
+
+        :param AMP agent: The connection to the agent.
+        """
+        if self._latest is None:
+            return
+        if agent in self._relaying:
+            self._relaying[agent] = True
+            return
+        if self._relayed.get(agent) == self._latest:
+            # The agent already has this update, there's no point in having
+            # it decode it again:
+            return
+        self._relaying[agent] = False
+        self._relayed[agent] = self._latest
+        configuration, state = self._latest
+        action = LOG_RELAY_CLUSTER_STATE(self.logger, agent=agent)
+        with action.context():
+            d = DeferredContext(maybeDeferred(
+                agent.callRemote, _RawClusterStatusCommand,
+                configuration=configuration, state=state,
+                eliot_context=action))
+            d.addActionFinish()
+
+        def relayed(_):
+            if self._relaying.pop(agent, False) and agent in self.agents:
+                self._relay(agent)
+        d.result.addBoth(relayed)
+
+    def set_node_era(self, era, node_uuid):
+        """
+        A local agent told us the node's era.
+
+        :param unicode era: The era.
+        :param unicode node_uuid: The node's UUID.
+
+        :return: ``Deferred`` that fires when the control service knows the
+            era.
+        """
+        self._era = (era, node_uuid)
+        if self._sent_era == self._era:
+            return succeed(None)
+        if self._upstream is None:
+            return fail(ConnectionLost())
+        self._sent_era = self._era
+        d = self._upstream.callRemote(
+            SetNodeEraCommand, era=era, node_uuid=node_uuid)
+
+        def failed(reason):
+            self._sent_era = None
+            return reason
+        d.addErrback(failed)
+        return d
+
+    def node_changed(self, agent, state_changes):
+        """
+        A local agent sent its state.
+
+        :param AMP agent: The connection from the agent.
+        :param state_changes: Sequence of ``IClusterStateChange``.
+
+        :return: ``Deferred`` that fires when the control service has
+            acknowledged the state.
+        """
+        if self._upstream is None:
+            return fail(ConnectionLost())
+        uploaded = self._uploaded.setdefault(agent, {})
+        for change in state_changes:
+            wiper = change.get_information_wipe()
+            uploaded[(wiper.__class__, wiper.key())] = change
+        d = Deferred()
+        waiting = self._pending_uploads.get(agent, (None, []))[1]
+        # A newer upload from the same agent supersedes an older one:
+        self._pending_uploads[agent] = (state_changes, waiting + [d])
+        if not self._uploading:
+            self._upload()
+        return d
+
+    def _upload(self):
+        """
+        Send all pending state changes to the control service in a single
+        ``NodeStateCommand``.
+        """
+        pending, self._pending_uploads = self._pending_uploads, {}
+        if not pending:
+            return
+        state_changes = []
+        waiting = []
+        for changes, ds in pending.values():
+            state_changes.extend(changes)
+            waiting.extend(ds)
+        self._uploading = True
+        action = LOG_SEND_MERGED_STATE(self.logger,
+                                       changes=len(state_changes))
+        with action.context():
+            d = DeferredContext(maybeDeferred(
+                self._upstream.callRemote, NodeStateCommand,
+                state_changes=state_changes, eliot_context=action))
+            d.addActionFinish()
+
+        def uploaded(result):
+            self._uploading = False
+            for waiter in waiting:
+                waiter.callback(None)
+            if self._upstream is not None:
+                self._upload()
+
+        def upload_failed(reason):
+            self._uploading = False
+            for waiter in waiting:
+                waiter.errback(reason)
+            writeFailure(reason, self.logger,
+                         u"Failed to send local state to control node.")
+            if self._upstream is not None:
+                self._upload()
+        d.result.addCallbacks(uploaded, upload_failed)
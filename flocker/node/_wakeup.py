@@ -0,0 +1,282 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_wakeup -*-
+
+"""
+Sources of local changes that should wake up the convergence loop.
+
+Between iterations the convergence loop sleeps for as long as the deployer's
+``NoOp`` says, and only wakes early when the control service sends an
+update.  The services in this module watch for changes on the node itself,
+like a block device appearing, a filesystem being mounted or a container
+stopping, and call a callback (typically
+``AgentLoopService.local_change_detected``) so that local state is
+rediscovered right away.  The callback is rate limited by the convergence
+loop, so these services report every change they see.
+"""
+
+from eliot import Field, Logger, MessageType, writeFailure
+
+from twisted.application.service import Service
+from twisted.internet.defer import Deferred
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import LoopingCall
+from twisted.python.filepath import FilePath
+from twisted.web.client import Agent
+
+try:
+    from twisted.internet.inotify import INotify, IN_CREATE, IN_DELETE
+except ImportError as e:
+    # This platform doesn't have inotify.
+    INotify = None
+    _missing_inotify_reason = str(e)
+    del e
+
+
+# Where the kernel and udev create block devices:
+DEV = FilePath(b"/dev")
+
+# The mount table of this process' mount namespace:
+MOUNTINFO = FilePath(b"/proc/self/mountinfo")
+
+# The Docker daemon's API socket:
+DOCKER_SOCKET = FilePath(b"/var/run/docker.sock")
+
+_SOURCE = Field.for_types(
+    u"source", [unicode], u"The kind of local change that was noticed.")
+
+LOG_LOCAL_CHANGE = MessageType(
+    u"flocker:node:wakeup:local_change", [_SOURCE],
+    u"A local change was noticed that may affect this node's state.")
+
+LOG_WATCH_UNAVAILABLE = MessageType(
+    u"flocker:node:wakeup:unavailable",
+    [_SOURCE, Field.for_types(u"reason", [unicode, bytes],
+                              u"Why the change source can't be used.")],
+    u"A source of local changes can't be used on this node, so its changes "
+    u"will only be noticed by the convergence loop's regular polling.")
+
+
+class DeviceWatcher(Service, object):
+    """
+    Notice block devices being added to or removed from the node by watching
+    a directory with inotify.
+
+    :ivar changed: No-argument callable to call when a change is noticed.
+    :ivar FilePath path: The directory to watch.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, changed, path=DEV):
+        """
+        :param reactor: The reactor.
+        :param changed: See ``changed`` above.
+        :param path: See ``path`` above.
+        """
+        self._reactor = reactor
+        self.changed = changed
+        self.path = path
+        self._notifier = None
+
+    def startService(self):
+        Service.startService(self)
+        if INotify is None:
+            LOG_WATCH_UNAVAILABLE(
+                source=u"devices", reason=_missing_inotify_reason,
+            ).write(self.logger)
+            return
+        try:
+            notifier = INotify(self._reactor)
+        except Exception as e:
+            # E.g. the limit on inotify instances has been reached:
+            LOG_WATCH_UNAVAILABLE(
+                source=u"devices", reason=unicode(e),
+            ).write(self.logger)
+            return
+        try:
+            notifier.watch(self.path, mask=IN_CREATE | IN_DELETE,
+                           callbacks=[self._path_changed])
+        except Exception as e:
+            notifier.loseConnection()
+            LOG_WATCH_UNAVAILABLE(
+                source=u"devices", reason=unicode(e),
+            ).write(self.logger)
+            return
+        notifier.startReading()
+        self._notifier = notifier
+
+    def stopService(self):
+        Service.stopService(self)
+        if self._notifier is not None:
+            self._notifier.loseConnection()
+            self._notifier = None
+
+    def _path_changed(self, ignored, path, mask):
+        LOG_LOCAL_CHANGE(source=u"devices").write(self.logger)
+        self.changed()
+
+
+class MountInfoPoller(Service, object):
+    """
+    Notice filesystems being mounted or unmounted by polling the mount
+    table.
+
+    Reading ``/proc/self/mountinfo`` doesn't involve any I/O, so this is
+    much cheaper than rediscovering local state as often.
+
+    :ivar changed: No-argument callable to call when a change is noticed.
+    :ivar FilePath path: The mount table to poll.
+    :ivar float interval: Seconds between polls.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, changed, path=MOUNTINFO, interval=1.0):
+        """
+        :param reactor: The reactor.
+        :param changed: See ``changed`` above.
+        :param path: See ``path`` above.
+        :param interval: See ``interval`` above.
+        """
+        self.changed = changed
+        self.path = path
+        self.interval = interval
+        self._mounts = None
+        self._poll = LoopingCall(self._check)
+        self._poll.clock = reactor
+
+    def startService(self):
+        Service.startService(self)
+        self._mounts = self._read()
+        self._poll.start(self.interval, now=False)
+
+    def stopService(self):
+        Service.stopService(self)
+        self._poll.stop()
+
+    def _read(self):
+        """
+        :return: The contents of the mount table, or ``None`` if it can't be
+            read.
+        """
+        try:
+            return self.path.getContent()
+        except IOError:
+            return None
+
+    def _check(self):
+        mounts = self._read()
+        if mounts != self._mounts:
+            self._mounts = mounts
+            LOG_LOCAL_CHANGE(source=u"mounts").write(self.logger)
+            self.changed()
+
+
+class _DockerEventsProtocol(Protocol):
+    """
+    Receive the body of a Docker ``/events`` response, which is a stream of
+    JSON objects, one per event.
+
+    :ivar watcher: The ``DockerEventsWatcher`` to tell about events.
+    :ivar Deferred finished: Fires when the response ends.
+    """
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.finished = Deferred()
+
+    def dataReceived(self, data):
+        self.watcher._event()
+
+    def connectionLost(self, reason):
+        self.finished.callback(None)
+
+
+class DockerEventsWatcher(Service, object):
+    """
+    Notice containers starting, stopping or going away by following the
+    Docker daemon's event stream.
+
+    The stream is reconnected if it ends, e.g. because the Docker daemon
+    restarted.
+
+    :ivar changed: No-argument callable to call when a change is noticed.
+    :ivar float reconnect_delay: Seconds to wait before reconnecting.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, changed, socket_path=DOCKER_SOCKET,
+                 reconnect_delay=5.0):
+        """
+        :param reactor: The reactor.
+        :param changed: See ``changed`` above.
+        :param FilePath socket_path: The Docker daemon's API socket.
+        :param reconnect_delay: See ``reconnect_delay`` above.
+        """
+        self._reactor = reactor
+        self.changed = changed
+        self.reconnect_delay = reconnect_delay
+        self._agent = Agent.usingEndpointFactory(
+            reactor, _UNIXEndpointFactory(reactor, socket_path))
+        self._request = None
+        self._body = None
+        self._reconnect = None
+
+    def startService(self):
+        Service.startService(self)
+        self._follow()
+
+    def stopService(self):
+        Service.stopService(self)
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        if self._body is not None:
+            self._body.transport.stopProducing()
+        if self._request is not None:
+            self._request.cancel()
+
+    def _follow(self):
+        """
+        Request the event stream and follow it until it ends.
+        """
+        self._reconnect = None
+        d = self._request = self._agent.request(
+            b"GET", b"http://docker/events")
+
+        def got_response(response):
+            self._request = None
+            self._body = _DockerEventsProtocol(self)
+            response.deliverBody(self._body)
+            return self._body.finished
+        d.addCallback(got_response)
+
+        def failed(reason):
+            if self.running:
+                writeFailure(reason, self.logger,
+                             u"Failed to follow Docker events.")
+        d.addErrback(failed)
+
+        def finished(ignored):
+            self._request = self._body = None
+            if self.running:
+                self._reconnect = self._reactor.callLater(
+                    self.reconnect_delay, self._follow)
+        d.addCallback(finished)
+
+    def _event(self):
+        LOG_LOCAL_CHANGE(source=u"docker").write(self.logger)
+        self.changed()
+
+
+class _UNIXEndpointFactory(object):
+    """
+    An endpoint factory for ``Agent`` that connects to a Unix socket no
+    matter what URL is requested.
+
+    :ivar FilePath socket_path: The socket to connect to.
+    """
+    def __init__(self, reactor, socket_path):
+        self._reactor = reactor
+        self.socket_path = socket_path
+
+    def endpointForURI(self, uri):
+        return UNIXClientEndpoint(self._reactor, self.socket_path.path)
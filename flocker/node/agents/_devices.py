@@ -0,0 +1,270 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.agents.test.test_devices -*-
+
+"""
+Notification of block devices being added to or removed from this node.
+
+After asking the backend to attach a volume, a backend waits for the new
+block device to appear.  Rather than each waiting thread polling the list
+of block devices, ``DeviceArrivals`` watches ``/dev`` with inotify and wakes
+up every waiting thread when a device is added or removed.
+"""
+
+from collections import deque
+from os import close, read
+from select import POLLIN, poll
+from struct import unpack_from
+from threading import Condition
+from time import time
+
+from pyrsistent import PClass, field
+
+from twisted.python.filepath import FilePath
+
+from .._wakeup import DEV, LOG_WATCH_UNAVAILABLE
+
+try:
+    from twisted.python._inotify import INotifyError, add, init
+    from twisted.internet.inotify import (
+        IN_CREATE, IN_DELETE, IN_Q_OVERFLOW,
+    )
+except ImportError as e:
+    # This platform doesn't have inotify.
+    init = None
+    _missing_inotify_reason = str(e)
+    del e
+
+
+# Where the kernel lists block devices:
+SYS_BLOCK = FilePath(b"/sys/block")
+
+# How many recent events are kept for threads that haven't seen them yet:
+_RECENT_EVENTS = 256
+
+# The size of the header of each inotify event:
+_EVENT_HEADER_SIZE = 16
+
+
+class DeviceEvent(PClass):
+    """
+    A block device was added to or removed from this node.
+
+    :ivar bytes name: The kernel's name for the device, e.g. ``b"xvdf"``.
+    :ivar bool added: Whether the device was added, rather than removed.
+    :ivar size: The size of an added device in bytes, or ``None`` if it is
+        unknown.
+    :ivar serial: The serial number of an added device, as ``bytes``, or
+        ``None`` if it doesn't have one (only some drivers, e.g.
+        ``virtio_blk``, report one).
+    """
+    name = field(type=bytes, mandatory=True)
+    added = field(type=bool, mandatory=True)
+    size = field(type=(int, long, type(None)), initial=None)
+    serial = field(type=(bytes, type(None)), initial=None)
+
+
+def _read_attribute(device, attribute):
+    """
+    :param FilePath device: A device's directory in ``/sys/block``.
+    :param bytes attribute: The name of one of its attributes.
+
+    :return: The stripped value of the attribute, or ``None`` if it can't
+        be read.
+    """
+    try:
+        return device.child(attribute).getContent().strip()
+    except (IOError, OSError):
+        return None
+
+
+class DeviceArrivals(object):
+    """
+    Block devices being added to and removed from this node, shared by every
+    thread that is waiting for devices.
+
+    There is no watching thread: the first waiting thread reads the inotify
+    events on behalf of all of them, and the others wait for it.  If inotify
+    can't be used, waiting threads just sleep for ``poll_interval`` so that
+    they poll the block devices as they would without a watcher.
+
+    :ivar FilePath dev: The directory where device nodes are created.
+    :ivar FilePath sys_block: Where the kernel lists block devices.
+    :ivar float poll_interval: Seconds to wait at most if inotify can't be
+        used.
+    """
+    def __init__(self, dev=DEV, sys_block=SYS_BLOCK, poll_interval=0.1,
+                 clock=time):
+        """
+        :param dev: See ``dev`` above.
+        :param sys_block: See ``sys_block`` above.
+        :param poll_interval: See ``poll_interval`` above.
+        :param clock: No-argument callable returning the current time in
+            seconds.
+        """
+        self.dev = dev
+        self.sys_block = sys_block
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._condition = Condition()
+        self._opened = False
+        self._fd = None
+        self._reading = False
+        # The names of the block devices known to exist:
+        self._known = set()
+        # Each event is numbered, so that threads can tell which events they
+        # haven't seen:
+        self._generation = 0
+        self._events = deque(maxlen=_RECENT_EVENTS)
+
+    def _open(self):
+        """
+        Start watching for devices, if that hasn't been tried yet.  Called
+        with the lock held.
+        """
+        if self._opened:
+            return
+        self._opened = True
+        if init is None:
+            LOG_WATCH_UNAVAILABLE(
+                source=u"device arrivals", reason=_missing_inotify_reason,
+            ).write()
+            return
+        fd = None
+        try:
+            fd = init()
+            add(fd, self.dev.path, IN_CREATE | IN_DELETE)
+        except INotifyError as e:
+            # E.g. the limit on inotify instances has been reached:
+            if fd is not None:
+                close(fd)
+            LOG_WATCH_UNAVAILABLE(
+                source=u"device arrivals", reason=unicode(e),
+            ).write()
+            return
+        self._fd = fd
+        try:
+            self._known = set(
+                device.basename() for device in self.sys_block.children())
+        except OSError:
+            pass
+
+    @property
+    def watching(self):
+        """
+        Whether inotify is being used to watch for devices.
+        """
+        with self._condition:
+            self._open()
+            return self._fd is not None
+
+    def close(self):
+        """
+        Stop watching for devices.  Watching starts again if the watcher is
+        used again.
+        """
+        with self._condition:
+            if self._fd is not None:
+                close(self._fd)
+            self._fd = None
+            self._opened = False
+
+    def cursor(self):
+        """
+        :return: An opaque value to pass to ``wait`` to wait for events that
+            happen after this call.
+        """
+        with self._condition:
+            self._open()
+            return self._generation
+
+    def _event(self, name, mask):
+        """
+        Record the event for a name created or deleted in ``dev``, if it is
+        a block device.  Called with the lock held.
+
+        :param bytes name: The name.
+        :param int mask: The inotify event mask.
+        """
+        if mask & IN_CREATE:
+            device = self.sys_block.child(name)
+            if not device.exists():
+                # Not a block device, e.g. a terminal or a directory.
+                return
+            self._known.add(name)
+            size = _read_attribute(device, b"size")
+            if size is not None:
+                # Sizes are always given in 512 byte sectors:
+                size = int(size) * 512
+            event = DeviceEvent(
+                name=name, added=True, size=size,
+                serial=_read_attribute(device, b"serial") or None)
+        elif name in self._known:
+            self._known.discard(name)
+            event = DeviceEvent(name=name, added=False)
+        else:
+            return
+        self._generation += 1
+        self._events.append((self._generation, event))
+
+    def _read(self, timeout):
+        """
+        Wait for inotify events and record them.  Called with the lock held,
+        which is released while waiting.
+
+        :param float timeout: Seconds to wait at most.
+        """
+        self._reading = True
+        fd = self._fd
+        self._condition.release()
+        data = b""
+        try:
+            poller = poll()
+            poller.register(fd, POLLIN)
+            if poller.poll(timeout * 1000):
+                data = read(fd, 64 * 1024)
+        finally:
+            self._condition.acquire()
+            self._reading = False
+            self._condition.notify_all()
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = unpack_from(b"=LLLL", data, offset)
+            name = data[offset + _EVENT_HEADER_SIZE:
+                        offset + _EVENT_HEADER_SIZE + length].rstrip(b"\0")
+            offset += _EVENT_HEADER_SIZE + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so waiters should look for themselves:
+                self._generation += 1
+            elif name:
+                self._event(name, mask)
+
+    def wait(self, cursor, timeout):
+        """
+        Wait until a block device is added or removed.
+
+        :param cursor: The result of an earlier call to ``cursor``; only
+            events after that call are waited for.
+        :param float timeout: Seconds to wait at most.  If inotify can't be
+            used then no more than ``poll_interval`` seconds are waited.
+
+        :return: A ``list`` of the ``DeviceEvent``\ s that happened after
+            ``cursor`` that are still known, which is empty if none happened
+            (or events were lost).
+        """
+        with self._condition:
+            self._open()
+            if self._fd is None:
+                timeout = min(timeout, self.poll_interval)
+            deadline = self._clock() + timeout
+            while self._generation == cursor:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    break
+                if self._fd is None or self._reading:
+                    self._condition.wait(remaining)
+                else:
+                    self._read(remaining)
+            return [
+                event for (generation, event) in self._events
+                if generation > cursor
+            ]
@@ -0,0 +1,274 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.agents.test.test_mounttable -*-
+
+"""
+A cached view of the mount table.
+
+The kernel describes the mounts of a process' mount namespace in
+``/proc/self/mountinfo``, and signals ``POLLPRI`` and ``POLLERR`` on an
+open file descriptor for it whenever a mount is added, removed or changed.
+``MountTable`` keeps such a descriptor open and only parses the table again
+after such a change, so that looking up mounts is cheap even on nodes with
+many mounts (e.g. Docker's bind mounts).
+"""
+
+import re
+from os import O_RDONLY, close, lseek, open as os_open, read, SEEK_SET
+from select import POLLERR, POLLPRI, poll
+from threading import Lock
+
+from pyrsistent import PClass, field, freeze, pmap, pvector
+
+from twisted.python.filepath import FilePath
+
+
+# The mount table of this process' mount namespace:
+MOUNTINFO = FilePath(b"/proc/self/mountinfo")
+
+# The filesystem types known to the kernel:
+FILESYSTEMS = FilePath(b"/proc/filesystems")
+
+
+class MountEntry(PClass):
+    """
+    A mount, as described by a line of ``/proc/self/mountinfo``.
+
+    :ivar int mount_id: The kernel's identifier for the mount.
+    :ivar int parent_id: The ``mount_id`` of the mount this one is mounted
+        on.
+    :ivar bytes device: The device number of the filesystem, as
+        ``b"major:minor"``.
+    :ivar FilePath root: The directory of the filesystem that is mounted,
+        e.g. something other than ``/`` for a bind mount.
+    :ivar FilePath mountpoint: Where the filesystem is mounted.
+    :ivar bytes options: The options of this mount, e.g. ``b"rw,noatime"``.
+    :ivar bytes filesystem_type: The type of the filesystem, e.g.
+        ``b"ext4"``.
+    :ivar bytes source: What was mounted, e.g. the path of a blockdevice.
+    :ivar bytes super_options: The options of the filesystem.
+    """
+    mount_id = field(type=int, mandatory=True)
+    parent_id = field(type=int, mandatory=True)
+    device = field(type=bytes, mandatory=True)
+    root = field(type=FilePath, mandatory=True)
+    mountpoint = field(type=FilePath, mandatory=True)
+    options = field(type=bytes, mandatory=True)
+    filesystem_type = field(type=bytes, mandatory=True)
+    source = field(type=bytes, mandatory=True)
+    super_options = field(type=bytes, mandatory=True)
+
+
+# Characters that would be ambiguous in mountinfo are written as octal
+# escapes, e.g. a space as ``\040``:
+_ESCAPE = re.compile(br"\\([0-7]{3})")
+
+
+def _unescape(value):
+    """
+    :param bytes value: A field from a line of ``/proc/self/mountinfo``.
+
+    :returns: ``value`` with octal escapes replaced by the characters they
+        stand for.
+    """
+    return _ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), value)
+
+
+def parse_mountinfo(content):
+    """
+    Parse the contents of ``/proc/self/mountinfo``.
+
+    :param bytes content: The contents.
+
+    :returns: ``list`` of ``MountEntry``, in the order they are listed.
+    """
+    entries = []
+    for line in content.splitlines():
+        fields = line.split(b" ")
+        # A variable number of optional fields is terminated by a lone
+        # "-":
+        separator = fields.index(b"-", 6)
+        (mount_id, parent_id, device, root, mountpoint, options) = fields[:6]
+        filesystem_type, source, super_options = fields[separator + 1:]
+        entries.append(MountEntry(
+            mount_id=int(mount_id),
+            parent_id=int(parent_id),
+            device=device,
+            root=FilePath(_unescape(root)),
+            mountpoint=FilePath(_unescape(mountpoint)),
+            options=options,
+            filesystem_type=_unescape(filesystem_type),
+            source=_unescape(source),
+            super_options=super_options,
+        ))
+    return entries
+
+
+def _device_filesystem_types(content):
+    """
+    Parse the contents of ``/proc/filesystems``.
+
+    :param bytes content: The contents.
+
+    :returns: ``set`` of the filesystem types that are stored on a device,
+        rather than being virtual (``nodev``) filesystems like ``tmpfs``.
+    """
+    types = set()
+    for line in content.splitlines():
+        flags, _, filesystem_type = line.rpartition(b"\t")
+        if flags.strip() != b"nodev":
+            types.add(filesystem_type.strip())
+    return types
+
+
+class _Snapshot(PClass):
+    """
+    A parsed mount table, with indexes.
+
+    :ivar entries: ``PVector`` of all the ``MountEntry``.
+    :ivar by_source: ``PMap`` mapping each mount source to a ``PVector`` of
+        its ``MountEntry``.
+    :ivar by_mountpoint: ``PMap`` mapping each mountpoint to the
+        ``MountEntry`` visible there.
+    :ivar device_entries: ``PVector`` of the ``MountEntry`` of filesystems
+        that are stored on a device.
+    """
+    entries = field(mandatory=True)
+    by_source = field(mandatory=True)
+    by_mountpoint = field(mandatory=True)
+    device_entries = field(mandatory=True)
+
+    @classmethod
+    def from_entries(cls, entries, device_types):
+        """
+        :param entries: ``list`` of ``MountEntry`` in mount table order.
+        :param device_types: ``set`` of the filesystem types that are stored
+            on a device.
+
+        :returns: A ``_Snapshot`` of them.
+        """
+        by_source = {}
+        by_mountpoint = {}
+        for entry in entries:
+            by_source.setdefault(entry.source, []).append(entry)
+            # Later mounts hide earlier ones at the same mountpoint:
+            by_mountpoint[entry.mountpoint] = entry
+        return cls(
+            entries=pvector(entries),
+            by_source=freeze(by_source),
+            by_mountpoint=pmap(by_mountpoint),
+            device_entries=pvector(
+                entry for entry in entries
+                if entry.filesystem_type in device_types and
+                entry.source not in (b"", b"none")
+            ),
+        )
+
+
+class MountTable(object):
+    """
+    The mounts of this process' mount namespace, parsed again only after
+    the kernel reports a change.
+
+    The table is read on first use, so creating a ``MountTable`` is cheap
+    and works on any platform.  Lookups are made from multiple threads, so
+    reading the table is protected by a lock.
+
+    :ivar FilePath path: The mount table.
+    :ivar FilePath filesystems_path: The list of filesystem types.
+    :ivar int reads: How many times the mount table has been parsed.
+    """
+    def __init__(self, path=MOUNTINFO, filesystems_path=FILESYSTEMS):
+        """
+        :param path: See ``path`` above.
+        :param filesystems_path: See ``filesystems_path`` above.
+        """
+        self.path = path
+        self.filesystems_path = filesystems_path
+        self.reads = 0
+        self._lock = Lock()
+        self._fd = None
+        self._poller = None
+        self._snapshot = None
+
+    def close(self):
+        """
+        Close the mount table.  It will be opened again if it is used again.
+        """
+        with self._lock:
+            if self._fd is not None:
+                close(self._fd)
+            self._fd = self._poller = self._snapshot = None
+
+    def _changed(self):
+        """
+        :returns: Whether the mount table may have changed since it was last
+            read.
+        """
+        if self._snapshot is None:
+            return True
+        return bool(self._poller.poll(0))
+
+    def _read(self):
+        """
+        Read and parse the mount table.
+
+        :returns: ``_Snapshot`` of the table.
+        """
+        if self._fd is None:
+            self._fd = os_open(self.path.path, O_RDONLY)
+            self._poller = poll()
+            self._poller.register(self._fd, POLLERR | POLLPRI)
+        lseek(self._fd, 0, SEEK_SET)
+        chunks = []
+        while True:
+            chunk = read(self._fd, 64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.reads += 1
+        # Filesystem modules can be loaded at any time, so the known types
+        # are read again too:
+        return _Snapshot.from_entries(
+            parse_mountinfo(b"".join(chunks)),
+            _device_filesystem_types(self.filesystems_path.getContent()),
+        )
+
+    def _current(self):
+        """
+        :returns: An up to date ``_Snapshot`` of the mount table.
+        """
+        with self._lock:
+            if self._changed():
+                self._snapshot = self._read()
+            return self._snapshot
+
+    def entries(self):
+        """
+        :returns: ``PVector`` of every ``MountEntry``, in the order they were
+            mounted.
+        """
+        return self._current().entries
+
+    def by_source(self, source):
+        """
+        :param FilePath source: What was mounted, e.g. a blockdevice.
+
+        :returns: ``PVector`` of each ``MountEntry`` of ``source``.
+        """
+        return self._current().by_source.get(source.path, pvector())
+
+    def by_mountpoint(self, mountpoint):
+        """
+        :param FilePath mountpoint: A mountpoint.
+
+        :returns: The ``MountEntry`` visible at ``mountpoint``, or ``None``
+            if nothing is mounted there.
+        """
+        return self._current().by_mountpoint.get(mountpoint)
+
+    def device_entries(self):
+        """
+        :returns: ``PVector`` of each ``MountEntry`` of a filesystem that is
+            stored on a device, e.g. excluding ``proc`` or ``tmpfs`` mounts.
+        """
+        return self._current().device_entries
@@ -0,0 +1,183 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.agents.test.test_poller -*-
+
+"""
+Batched polling of the state of backend resources.
+
+Backends wait for volumes (or operations) to change state by polling them.
+When many volumes are being created or attached at once, polling each one
+separately makes a number of API calls proportional to the number of
+volumes in flight, and invites throttling.  ``BatchedStatePoller`` instead
+collects every resource that is being waited on and describes them all
+with a single call.
+
+Waiting happens in the reactor rather than in threads, so the number of
+threads used doesn't grow with the number of resources being waited for
+either: only the ``describe`` call itself needs one, once per poll.
+"""
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+from eliot import Field, MessageType
+
+
+LOG_POLLED = MessageType(
+    u"agent:blockdevice:poller:polled",
+    [Field.for_types(u"resources", [int],
+                     u"How many resources were described."),
+     Field.for_types(u"interval", [float],
+                     u"Seconds until the next poll at the earliest.")],
+    u"The state of the resources being waited for was polled in one call.")
+
+
+class BatchedStatePoller(object):
+    """
+    Describe all the resources that are being waited for with one call per
+    poll.
+
+    Polls are scheduled with the reactor whenever something is waiting.
+    The interval between polls starts at ``minimum_interval`` and doubles,
+    up to ``maximum_interval``, while polls find nothing changed; it drops
+    back as soon as something changes or a new resource is waited for.
+
+    :ivar describe: One-argument callable taking a ``list`` of resource
+        identifiers and returning a ``dict`` (or a ``Deferred`` that fires
+        with a ``dict``) mapping the identifier of each of them that exists
+        to its description.  Backends run their synchronous API calls in a
+        thread pool here.
+    :ivar float minimum_interval: The shortest time between polls, in
+        seconds.
+    :ivar float maximum_interval: The longest time between polls, in
+        seconds.
+    :ivar float interval: The current time between polls, in seconds.
+    :ivar int polls: How many times ``describe`` has been called.
+    """
+    def __init__(self, reactor, describe, minimum_interval=1.0,
+                 maximum_interval=8.0):
+        """
+        :param IReactorTime reactor: The reactor used to schedule polls.
+        :param describe: See ``describe`` above.
+        :param minimum_interval: See ``minimum_interval`` above.
+        :param maximum_interval: See ``maximum_interval`` above.
+        """
+        self.describe = describe
+        self.minimum_interval = minimum_interval
+        self.maximum_interval = maximum_interval
+        self.interval = minimum_interval
+        self.polls = 0
+        self._reactor = reactor
+        # Identifiers mapped to the ``Deferred``\ s waiting for the next poll
+        # that includes them:
+        self._waiters = {}
+        self._polling = False
+        self._next_poll = None
+        self._last_poll = None
+        self._polled = frozenset()
+        self._descriptions = {}
+
+    def _schedule(self):
+        """
+        Make sure a poll is scheduled for the resources being waited for, no
+        sooner than the interval after the last one ended.
+        """
+        if self._polling or not self._waiters:
+            # Polls are scheduled again when the current one finishes.
+            return
+        if not self._polled.issuperset(self._waiters):
+            # Something new is being waited for, so poll promptly:
+            self.interval = self.minimum_interval
+        now = self._reactor.seconds()
+        if self._last_poll is None:
+            due = now
+        else:
+            due = max(now, self._last_poll + self.interval)
+        if self._next_poll is None:
+            self._next_poll = self._reactor.callLater(due - now, self._poll)
+        elif self._next_poll.getTime() > due:
+            self._next_poll.reset(due - now)
+
+    def _poll(self):
+        """
+        Describe every resource that is waited for, and give the waiters
+        their descriptions.
+        """
+        self._next_poll = None
+        self._polling = True
+        waiters, self._waiters = self._waiters, {}
+        identifiers = sorted(waiters)
+        polling = maybeDeferred(self.describe, identifiers)
+
+        def polled(result):
+            self.polls += 1
+            self._polling = False
+            self._last_poll = self._reactor.seconds()
+            self._polled = frozenset(identifiers)
+            if not isinstance(result, Failure):
+                changed = any(
+                    result.get(identifier) !=
+                    self._descriptions.get(identifier)
+                    for identifier in identifiers)
+                self._descriptions = result
+                if changed:
+                    self.interval = self.minimum_interval
+                else:
+                    self.interval = min(
+                        self.maximum_interval, self.interval * 2)
+            LOG_POLLED(resources=len(identifiers),
+                       interval=float(self.interval)).write()
+            # Resources that started being waited for during the poll:
+            self._schedule()
+            for identifier, deferreds in waiters.items():
+                for d in deferreds:
+                    if isinstance(result, Failure):
+                        d.errback(result)
+                    else:
+                        d.callback(result.get(identifier))
+        polling.addBoth(polled)
+
+    def refresh(self, identifier):
+        """
+        Wait for the next poll, and get the description of a resource.
+
+        :param identifier: The identifier of the resource.
+
+        :return: A ``Deferred`` that fires with the description of the
+            resource, or ``None`` if it doesn't exist, or fails with whatever
+            ``describe`` raised if the poll failed.
+        """
+        waiting = Deferred()
+        self._waiters.setdefault(identifier, []).append(waiting)
+        self._schedule()
+        return waiting
+
+
+def wait_for_state(poller, identifier, reached):
+    """
+    Refresh a resource with every poll until it reaches some state.
+
+    :param BatchedStatePoller poller: The poller of the resource.
+    :param identifier: The identifier of the resource.
+    :param reached: One-argument callable taking the latest description of
+        the resource (or ``None`` if it doesn't exist) and returning whether
+        the wait is over.  It may raise an exception to give up instead,
+        e.g. on reaching an unexpected state or timing out.
+
+    :return: A ``Deferred`` that fires with the description for which
+        ``reached`` returned ``True``, or fails with whatever ``reached`` or
+        ``describe`` raised.
+    """
+    waiting = Deferred()
+
+    def check(description):
+        if reached(description):
+            waiting.callback(description)
+        else:
+            refresh()
+
+    def refresh():
+        refreshing = poller.refresh(identifier)
+        refreshing.addCallback(check)
+        refreshing.addErrback(waiting.errback)
+    refresh()
+    return waiting
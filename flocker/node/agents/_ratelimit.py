@@ -0,0 +1,385 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.agents.test.test_ratelimit -*-
+
+"""
+Rate limiting of requests to a storage backend's API.
+
+Cloud APIs throttle clients that make too many requests, and a throttled
+client that just retries makes things worse for itself and every other
+client of the same account.  ``RateLimiter`` is a token bucket shared by
+every request the dataset agent makes to its backend, whose rate adapts to
+throttling: it is halved whenever the backend throttles a request and grows
+back slowly as requests succeed (additive increase, multiplicative
+decrease).
+
+Backends charge the bucket for each request their client sends, including
+every page of a listing and every poll of a volume's state, so nothing a
+backend method does internally bypasses the budget.  Charging never blocks
+the thread the request is made in; calls that have to wait for the budget
+wait in the reactor before they are started.
+"""
+
+from threading import Lock
+
+from eliot import Field, MessageType, preserve_context
+
+from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.components import proxyForInterface
+from twisted.python.failure import Failure
+
+from zope.interface import alsoProvides, implementer
+
+from ...common import interface_decorator
+from .blockdevice import (
+    IBlockDeviceAPI, IBlockDeviceAsyncAPI, INativeAsyncBlockDeviceAPI,
+    IProfiledBlockDeviceAPI,
+)
+
+
+# The slowest rate, in requests per second, that throttling reduces the
+# rate to:
+_MINIMUM_RATE = 0.1
+
+# The rate is multiplied by this when the backend throttles a request:
+_DECREASE_FACTOR = 0.5
+
+# The fraction of the configured rate that the rate grows by after each
+# request that isn't throttled:
+_INCREASE_FRACTION = 0.05
+
+# How many times a throttled lookup is made before giving up:
+_THROTTLED_ATTEMPTS = 5
+
+# A fraction of a token that is close enough to a whole one, so that
+# rounding errors don't schedule another wait of a few nanoseconds:
+_TOKEN_TOLERANCE = 1e-6
+
+
+_RATE = Field.for_types(
+    u"rate", [float], u"The requests per second currently allowed.")
+
+LOG_RATE_LIMITED = MessageType(
+    u"agent:blockdevice:rate_limit:wait",
+    [Field.for_types(u"delay", [float],
+                     u"Seconds the call waits before being started."),
+     _RATE],
+    u"A call to the backend was delayed to stay within the rate limit.")
+
+LOG_THROTTLED = MessageType(
+    u"agent:blockdevice:rate_limit:throttled",
+    [Field.for_types(u"throttled", [int, long],
+                     u"How many requests the backend has throttled."),
+     _RATE],
+    u"The backend throttled a request, so the rate was reduced.")
+
+
+class RateLimiter(object):
+    """
+    A token bucket limiting the rate of requests to a backend, which slows
+    down when the backend throttles requests.
+
+    Requests are made from multiple threads, so the bucket is protected by a
+    lock.  A request always takes its token straight away, leaving the
+    bucket in debt if it was empty; ``wait`` is how calls that are about to
+    make requests stay within the rate, by waiting in the reactor until the
+    debt is paid off.
+
+    :ivar float maximum_rate: Requests per second allowed when the backend
+        isn't throttling requests.
+    :ivar int burst: How many requests can be made at once after a quiet
+        period.
+    :ivar throttled: One-argument callable that returns whether an exception
+        raised by a request means the backend throttled it.
+    :ivar float rate: The requests per second currently allowed.
+    :ivar int calls: How many requests have been made.
+    :ivar int throttles: How many requests the backend has throttled.
+    :ivar float waited: Total seconds calls have waited for the rate limit.
+    """
+    def __init__(self, maximum_rate, burst, throttled, reactor):
+        """
+        :param maximum_rate: See ``maximum_rate`` above.
+        :param burst: See ``burst`` above.
+        :param throttled: See ``throttled`` above.
+        :param IReactorTime reactor: The reactor used to measure time and to
+            schedule waits.
+        """
+        self.maximum_rate = float(maximum_rate)
+        self.burst = burst
+        self.throttled = throttled
+        self.rate = self.maximum_rate
+        self.calls = 0
+        self.throttles = 0
+        self.waited = 0.0
+        self._reactor = reactor
+        self._lock = Lock()
+        self._tokens = float(burst)
+        self._updated = reactor.seconds()
+
+    def _refill(self):
+        """
+        Add the tokens earned since the bucket was last updated.
+        """
+        now = self._reactor.seconds()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def charge(self):
+        """
+        Take a token for a request that is about to be made, without
+        waiting for one.
+
+        This may be called in any thread.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            self.calls += 1
+
+    def answered(self, exception=None):
+        """
+        Adjust the rate after the backend answered a request.
+
+        A throttled request reduces the rate and empties the bucket, so that
+        calls wait before making more requests.  Any other answer grows the
+        rate back towards ``maximum_rate``.
+
+        This may be called in any thread.
+
+        :param exception: The exception the request raised, or ``None`` if
+            it succeeded.
+        """
+        with self._lock:
+            self._refill()
+            if exception is not None and self.throttled(exception):
+                self.rate = max(_MINIMUM_RATE, self.rate * _DECREASE_FACTOR)
+                self._tokens = min(self._tokens, 0.0)
+                self.throttles += 1
+                LOG_THROTTLED(throttled=self.throttles, rate=self.rate).write()
+            elif exception is None:
+                self.rate = min(
+                    self.maximum_rate,
+                    self.rate + self.maximum_rate * _INCREASE_FRACTION)
+
+    def request(self, function, *args, **kwargs):
+        """
+        Make a request to the backend, charging the bucket for it.
+
+        This never waits, so it may be called in any thread.  A throttled
+        request isn't made again: the exception is raised, and it is up to
+        the caller to wait and try again if that is safe.
+
+        :param function: The function that makes exactly one request, to
+            call with the remaining arguments.
+
+        :return: The result of ``function``.
+        """
+        self.charge()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self.answered(e)
+            raise
+        self.answered()
+        return result
+
+    def wait(self):
+        """
+        Wait until the bucket has a token for the next request.
+
+        The token isn't taken, since the request takes it when it is made.
+        This must be called in the reactor thread.
+
+        :return: A ``Deferred`` that fires with ``None`` when requests can be
+            made again.
+        """
+        with self._lock:
+            self._refill()
+            delay = (1 - self._tokens) / self.rate
+            if self._tokens >= 1 - _TOKEN_TOLERANCE:
+                delay = 0.0
+            else:
+                self.waited += delay
+                LOG_RATE_LIMITED(delay=delay, rate=self.rate).write()
+        if not delay:
+            return succeed(None)
+        # Other requests may have been made in the meantime:
+        return deferLater(self._reactor, delay, self.wait)
+
+
+def _rate_limited_method(method_name, original_name):
+    """
+    Make a request by calling a method of the wrapped object through the
+    wrapper's ``RateLimiter``.
+
+    :param str method_name: The name of the method of the wrapped object to
+        call.
+    :param str original_name: The name of the attribute of self where the
+        wrapped object can be found.
+
+    :return: A function which will call the method of the wrapped object
+        through ``self._rate_limiter``.
+    """
+    def _run_rate_limited(self, *args, **kwargs):
+        method = getattr(getattr(self, original_name), method_name)
+        return self._rate_limiter.request(method, *args, **kwargs)
+    return _run_rate_limited
+
+
+def auto_rate_limiting(interface, original):
+    """
+    Create a class decorator which makes every method of ``interface`` a
+    request through a ``RateLimiter``, for wrapping the client objects that
+    a backend makes its requests with.
+
+    :param zope.interface.InterfaceClass interface: The interface from which
+        to take methods.  Each method should make a single request.
+    :param str original: The name of an attribute on instances of the
+        decorated class, which refers to a provider of ``interface``.
+        Instances must also have a ``_rate_limiter`` attribute.
+
+    :return: The class decorator.
+    """
+    return interface_decorator(
+        "auto_rate_limiting",
+        interface,
+        _rate_limited_method,
+        original,
+    )
+
+
+# The methods of ``IBlockDeviceAsyncAPI`` that only look things up, so they
+# can be made again if the backend throttles them:
+_LOOKUPS = frozenset([
+    "compute_instance_id", "list_volumes", "get_device_path",
+])
+
+
+@implementer(INativeAsyncBlockDeviceAPI)
+class RateLimitedBlockDeviceAPI(proxyForInterface(IBlockDeviceAPI, "_api")):
+    """
+    An ``IBlockDeviceAPI`` whose calls stay within the rate limit of a
+    ``RateLimiter``.
+
+    Backends that charge the limiter for each request they make themselves
+    (``charged``) are called directly.  Otherwise each call is charged as a
+    single request.
+
+    The asynchronous methods (see ``native_async_methods``) wait in the
+    reactor for the limiter before calling the backend, so that is where
+    calls are delayed; the synchronous methods never wait.  The wrapped
+    API's own native asynchronous methods are used where it has them.
+
+    Only the calls that just look things up are made again when they are
+    throttled: a throttled create, destroy, attach or detach may still have
+    happened, so it is left to the next convergence iteration to try it
+    again.
+    ``allocation_unit`` doesn't call the backend, so it isn't limited.
+
+    :ivar _api: Wrapped ``IBlockDeviceAPI`` provider.  If it also provides
+        ``IProfiledBlockDeviceAPI`` then so does this object.
+    :ivar RateLimiter limiter: The rate limiter.
+    :ivar bool charged: Whether ``_api`` makes its requests through
+        ``limiter`` itself.
+    """
+    def __init__(self, api, limiter, charged=False):
+        self._api = api
+        self.limiter = limiter
+        self.charged = charged
+        if IProfiledBlockDeviceAPI.providedBy(api):
+            alsoProvides(self, IProfiledBlockDeviceAPI)
+
+    def _call(self, method_name, *args, **kwargs):
+        """
+        Call a method of the wrapped API, charging the limiter for it unless
+        the API does so itself.
+        """
+        method = getattr(self._api, method_name)
+        if self.charged:
+            return method(*args, **kwargs)
+        return self.limiter.request(method, *args, **kwargs)
+
+    def compute_instance_id(self):
+        return self._call("compute_instance_id")
+
+    def create_volume(self, dataset_id, size):
+        return self._call("create_volume", dataset_id=dataset_id, size=size)
+
+    def create_volume_with_profile(self, dataset_id, size, profile_name):
+        return self._call(
+            "create_volume_with_profile", dataset_id=dataset_id, size=size,
+            profile_name=profile_name)
+
+    def destroy_volume(self, blockdevice_id):
+        return self._call("destroy_volume", blockdevice_id)
+
+    def attach_volume(self, blockdevice_id, attach_to):
+        return self._call("attach_volume", blockdevice_id, attach_to)
+
+    def detach_volume(self, blockdevice_id):
+        return self._call("detach_volume", blockdevice_id)
+
+    def list_volumes(self):
+        return self._call("list_volumes")
+
+    def get_device_path(self, blockdevice_id):
+        return self._call("get_device_path", blockdevice_id)
+
+    def native_async_methods(self, reactor, threadpool):
+        """
+        Every method that calls the backend waits for the limiter in the
+        reactor, and only then calls the wrapped API: its native method if it
+        has one, otherwise its synchronous method in ``threadpool``.
+        Throttled lookups wait again before they are retried.
+        """
+        native = {}
+        if INativeAsyncBlockDeviceAPI.providedBy(self._api):
+            native = self._api.native_async_methods(reactor, threadpool)
+
+        def answered(result):
+            if isinstance(result, Failure):
+                self.limiter.answered(result.value)
+            else:
+                self.limiter.answered()
+            return result
+
+        def start(method_name, args, kwargs):
+            if method_name not in native:
+                return deferToThreadPool(
+                    reactor, threadpool,
+                    preserve_context(getattr(self, method_name)),
+                    *args, **kwargs)
+            if self.charged:
+                return native[method_name](*args, **kwargs)
+            self.limiter.charge()
+            calling = maybeDeferred(native[method_name], *args, **kwargs)
+            calling.addBoth(answered)
+            return calling
+
+        def limited(method_name):
+            def call(*args, **kwargs):
+                def attempt(_, attempts_left):
+                    calling = start(method_name, args, kwargs)
+                    if method_name in _LOOKUPS and attempts_left > 1:
+                        calling.addErrback(retry, attempts_left - 1)
+                    return calling
+
+                def retry(failure, attempts_left):
+                    if not self.limiter.throttled(failure.value):
+                        return failure
+                    waiting = self.limiter.wait()
+                    waiting.addCallback(attempt, attempts_left)
+                    return waiting
+
+                waiting = self.limiter.wait()
+                waiting.addCallback(attempt, _THROTTLED_ATTEMPTS)
+                return waiting
+            return call
+
+        methods = dict(native)
+        for method_name in IBlockDeviceAsyncAPI.names():
+            if method_name != "allocation_unit":
+                methods[method_name] = limited(method_name)
+        return methods
@@ -0,0 +1,100 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.agents.test.test_threadpool -*-
+
+"""
+A thread pool dedicated to the calls made to a storage backend.
+
+Block device backends make blocking calls to cloud APIs.  If they are made
+in the reactor's thread pool, a slow cloud can use up every thread and hold
+up everything else that uses that pool, like DNS lookups.  A
+``BackendThreadPool`` gives the backend its own, separately sized, pool and
+measures how long calls wait for a thread so that a pool that is too small
+shows up in the logs.
+"""
+
+from threading import Lock
+from time import time
+
+from eliot import Field, MessageType
+
+from twisted.python.threadpool import ThreadPool
+
+
+# Calls that wait at least this many seconds for a thread are logged:
+_SLOW_QUEUE = 1.0
+
+
+LOG_QUEUED = MessageType(
+    u"agent:blockdevice:threadpool:queued",
+    [Field.for_types(u"name", [unicode, bytes], u"The name of the pool."),
+     Field.for_types(u"waited", [float],
+                     u"Seconds the call waited for a thread."),
+     Field.for_types(u"queued", [int],
+                     u"How many calls are still waiting for a thread.")],
+    u"A call to the backend waited a long time for a thread, so the pool "
+    u"may be too small.")
+
+
+class BackendThreadPool(ThreadPool, object):
+    """
+    A ``ThreadPool`` for the calls to one backend, which counts the calls
+    waiting for and running in its threads and measures how long they take.
+
+    The pool starts when it is first used and stops when the reactor shuts
+    down, like the reactor's own thread pool.
+
+    :ivar int queued: How many calls are waiting for a thread.
+    :ivar int running: How many calls are running.
+    :ivar int calls: How many calls have finished.
+    :ivar float waited: Total seconds finished and running calls waited for
+        a thread.
+    :ivar float busy: Total seconds finished calls ran for.
+    """
+    def __init__(self, reactor, threads, name, clock=time):
+        """
+        :param reactor: The reactor whose shutdown stops the pool.
+        :param int threads: The most threads the pool runs.
+        :param bytes name: The name of the pool, used to name its threads.
+        :param clock: No-argument callable returning the current time in
+            seconds.
+        """
+        ThreadPool.__init__(self, minthreads=0, maxthreads=threads,
+                            name=name)
+        self._reactor = reactor
+        self._clock = clock
+        self._lock = Lock()
+        self.queued = 0
+        self.running = 0
+        self.calls = 0
+        self.waited = 0.0
+        self.busy = 0.0
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        if not self.started:
+            self.start()
+            self._reactor.addSystemEventTrigger(
+                "during", "shutdown", self.stop)
+        submitted = self._clock()
+        with self._lock:
+            self.queued += 1
+
+        def measured(*args, **kw):
+            started = self._clock()
+            waited = started - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.waited += waited
+                queued = self.queued
+            if waited >= _SLOW_QUEUE:
+                LOG_QUEUED(name=self.name, waited=waited,
+                           queued=queued).write()
+            try:
+                return func(*args, **kw)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.calls += 1
+                    self.busy += self._clock() - started
+        ThreadPool.callInThreadWithCallback(
+            self, onResult, measured, *args, **kw)
@@ -8,21 +8,28 @@ devices.
 """
 
 from uuid import UUID
+from time import time
+from threading import Lock
 from stat import S_IRWXU, S_IRWXG, S_IRWXO
 from errno import EEXIST
 from datetime import timedelta
 
-from eliot import MessageType, ActionType, Field, Logger
+from eliot import MessageType, ActionType, Field, Logger, preserve_context
 from eliot.serializers import identity
 
-from zope.interface import implementer, Interface, provider
+from zope.interface import alsoProvides, implementer, Interface, provider
 
-from pyrsistent import PClass, field, pmap_field, pset_field, thaw, CheckedPMap
+from pyrsistent import (
+    PClass, field, pmap, pmap_field, pset_field, thaw, CheckedPMap,
+)
 
 from characteristic import with_cmp
 
 from twisted.python.reflect import safe_repr
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import (
+    DeferredSemaphore, gatherResults, maybeDeferred, succeed, fail,
+)
+from twisted.internet.threads import deferToThreadPool
 from twisted.python.filepath import FilePath
 from twisted.python.components import proxyForInterface
 from twisted.python.constants import (
@@ -33,13 +40,16 @@ from twisted.python.constants import (
 from .blockdevice_manager import BlockDeviceManager
 
 from .. import (
-    IDeployer, ILocalState, IStateChange, in_parallel, NoOp,
+    IDeployer, ILocalState, IStateChange, in_parallel, NoOp, ChangePolicy,
 )
 from .._deploy import NotInUseDatasets
 
 from ...control import NodeState, Manifestation, Dataset, NonManifestDatasets
 from ...control._model import pvector_field
-from ...common import RACKSPACE_MINIMUM_VOLUME_SIZE, auto_threaded, provides
+from ...common import (
+    RACKSPACE_MINIMUM_VOLUME_SIZE, auto_threaded, interface_decorator,
+    provides,
+)
 from ...common.algebraic import TaggedUnionInvariant
 
 
@@ -421,6 +431,18 @@ DISCOVERED_RAW_STATE = MessageType(
     [Field(u"raw_state", safe_repr)],
     u"The discovered raw state of the node's block device volumes.")
 
+DISCOVERY_TIMINGS = MessageType(
+    u"agent:blockdevice:discover_state:timings",
+    [Field.for_types(
+        u"durations", [dict],
+        u"Seconds taken by each phase of discovery, keyed by phase name.")],
+    u"How long the phases of discovering the node's raw state took.  "
+    u"Phases run concurrently, so durations overlap.")
+
+# The maximum number of calls to the block device API and the block device
+# manager which discovery makes at the same time:
+_DISCOVERY_CONCURRENCY = 10
+
 
 def _volume_field():
     """
@@ -866,6 +888,33 @@ class CreateBlockDeviceDataset(PClass):
         return self._create_volume(deployer)
 
 
+# The most calls that change volumes which the dataset agent makes to the
+# backend at the same time; cloud APIs throttle clients that make too many:
+_BACKEND_CHANGE_CONCURRENCY = 5
+
+# The most block device changes the convergence loop runs at the same time:
+BLOCK_DEVICE_CHANGE_CONCURRENCY = 10
+
+# How the convergence loop schedules block device changes.  Changes that
+# only involve this node, and which applications are waiting for, go first;
+# volumes are created and destroyed last since nothing on this node waits for
+# them, and for the same reason the convergence loop doesn't wait for them
+# either:
+BLOCK_DEVICE_CHANGE_POLICIES = pmap({
+    UnmountBlockDevice: ChangePolicy(priority=0),
+    MountBlockDevice: ChangePolicy(priority=0),
+    CreateFilesystem: ChangePolicy(priority=1),
+    DetachVolume: ChangePolicy(
+        priority=1, concurrency=_BACKEND_CHANGE_CONCURRENCY),
+    AttachVolume: ChangePolicy(
+        priority=1, concurrency=_BACKEND_CHANGE_CONCURRENCY),
+    DestroyVolume: ChangePolicy(
+        priority=2, concurrency=_BACKEND_CHANGE_CONCURRENCY, background=True),
+    CreateBlockDeviceDataset: ChangePolicy(
+        priority=2, concurrency=_BACKEND_CHANGE_CONCURRENCY, background=True),
+})
+
+
 class IBlockDeviceAsyncAPI(Interface):
     """
     Common operations provided by all block device backends, exposed via
@@ -935,6 +984,29 @@ class IBlockDeviceAsyncAPI(Interface):
         """
 
 
+class INativeAsyncBlockDeviceAPI(Interface):
+    """
+    Optionally provided by an ``IBlockDeviceAPI`` provider that can make some
+    of its calls without blocking a thread, e.g. by using a non-blocking
+    client for the backend's API.
+
+    Those calls are made directly rather than in a thread, so a slow backend
+    ties up fewer threads.
+    """
+    def native_async_methods(reactor, threadpool):
+        """
+        :param reactor: The reactor the native methods may use, e.g. to
+            schedule polls of the backend.
+        :param threadpool: The thread pool that the other methods are called
+            in, which native methods may also use for any synchronous calls
+            they make.
+
+        :returns: A ``dict`` mapping the names of some of the methods of
+            ``IBlockDeviceAsyncAPI`` (e.g. ``"list_volumes"``) to callables
+            that take the same arguments and return a ``Deferred``.
+        """
+
+
 class IBlockDeviceAPI(Interface):
     """
     Common operations provided by all block device backends, exposed via
@@ -1213,6 +1285,62 @@ class _SyncToThreadedAsyncAPIAdapter(PClass):
     _threadpool = field()
 
 
+def _native_or_threaded_method(method_name, native_name, threaded_name):
+    """
+    Create a method that calls a native asynchronous method if there is one,
+    or else the thread-based one.
+
+    :param str method_name: The name of the method.
+    :param str native_name: The name of the attribute of ``self`` that maps
+        method names to native asynchronous methods.
+    :param str threaded_name: The name of the attribute of ``self`` that
+        has thread-based versions of all the methods.
+
+    :return: The new method.
+    """
+    def _native_or_threaded(self, *args, **kwargs):
+        native = getattr(self, native_name).get(method_name)
+        if native is None:
+            threaded = getattr(self, threaded_name)
+            return getattr(threaded, method_name)(*args, **kwargs)
+        return maybeDeferred(native, *args, **kwargs)
+    return _native_or_threaded
+
+
+@implementer(IBlockDeviceAsyncAPI)
+@interface_decorator(
+    "native_or_threaded", IBlockDeviceAsyncAPI, _native_or_threaded_method,
+    "_native", "_threaded",
+)
+class _NativeAsyncAPIAdapter(PClass):
+    """
+    Adapt an ``INativeAsyncBlockDeviceAPI`` provider to
+    ``IBlockDeviceAsyncAPI`` by calling its native asynchronous methods, and
+    the rest of its methods in threads.
+
+    :ivar _native: ``PMap`` of the native asynchronous methods, as returned
+        by ``INativeAsyncBlockDeviceAPI.native_async_methods``.
+    :ivar _SyncToThreadedAsyncAPIAdapter _threaded: Thread-based versions of
+        all of the methods.
+    """
+    _native = field(factory=pmap)
+    _threaded = field()
+
+
+def _gather(deferreds):
+    """
+    Wait for several ``Deferred``\ s.
+
+    :param list deferreds: The ``Deferred``\ s to wait for.
+
+    :return: ``Deferred`` that fires with a ``list`` of their results, or
+        with the first failure if any of them fail.
+    """
+    gathering = gatherResults(deferreds, consumeErrors=True)
+    gathering.addErrback(lambda failure: failure.value.subFailure)
+    return gathering
+
+
 def check_for_existing_dataset(api, dataset_id):
     """
     :param IBlockDeviceAPI api: The ``api`` for listing the existing volumes.
@@ -1511,6 +1639,8 @@ class BlockDeviceDeployer(PClass):
     :ivar _async_block_device_api: An object to override the value of the
         ``async_block_device_api`` property.  Used by tests.  Should be
         ``None`` in real-world use.
+    :ivar threadpool: The ``ThreadPool`` in which calls to
+        ``block_device_api`` are made, or ``None`` to use the reactor's.
     :ivar block_device_manager: An ``IBlockDeviceManager`` implementation used
         to interact with the system regarding block devices.
     :ivar ICalculator calculator: The object to use to calculate dataset
@@ -1521,6 +1651,7 @@ class BlockDeviceDeployer(PClass):
     block_device_api = field(mandatory=True)
     _profiled_blockdevice_api = field(mandatory=True, initial=None)
     _async_block_device_api = field(mandatory=True, initial=None)
+    threadpool = field(initial=None)
     mountroot = field(type=FilePath, initial=FilePath(b"/flocker"))
     block_device_manager = field(initial=BlockDeviceManager())
     calculator = field(
@@ -1553,34 +1684,78 @@ class BlockDeviceDeployer(PClass):
         for this deployer.
 
         During real operation, this is a threadpool-based wrapper around the
-        ``IBlockDeviceAPI`` provider.  For testing purposes it can be
+        ``IBlockDeviceAPI`` provider, which makes any native asynchronous
+        calls the provider offers directly.  For testing purposes it can be
         overridden with a different object entirely (and this large amount of
         support code for this is necessary because this class is a ``PClass``
         subclass).
         """
         if self._async_block_device_api is None:
             from twisted.internet import reactor
-            return _SyncToThreadedAsyncAPIAdapter(
+            threadpool = self.threadpool
+            if threadpool is None:
+                threadpool = reactor.getThreadPool()
+            threaded = _SyncToThreadedAsyncAPIAdapter(
                 _sync=self.block_device_api,
                 _reactor=reactor,
-                _threadpool=reactor.getThreadPool(),
+                _threadpool=threadpool,
             )
+            if INativeAsyncBlockDeviceAPI.providedBy(self.block_device_api):
+                return _NativeAsyncAPIAdapter(
+                    _native=self.block_device_api.native_async_methods(
+                        reactor, threadpool),
+                    _threaded=threaded,
+                )
+            return threaded
         return self._async_block_device_api
 
+    def _call_block_device_manager(self, method_name, *args):
+        """
+        Call an ``IBlockDeviceManager`` method without blocking the reactor.
+
+        The call is made in the thread pool used by
+        ``async_block_device_api`` if it is thread based, otherwise it is
+        made directly.
+
+        :param str method_name: The method to call.
+        :param args: Positional arguments for the method.
+
+        :return: ``Deferred`` that fires with the method's result.
+        """
+        method = getattr(self.block_device_manager, method_name)
+        async_api = self.async_block_device_api
+        if isinstance(async_api, _NativeAsyncAPIAdapter):
+            async_api = async_api._threaded
+        if isinstance(async_api, _SyncToThreadedAsyncAPIAdapter):
+            return deferToThreadPool(
+                async_api._reactor, async_api._threadpool,
+                preserve_context(method), *args)
+        return maybeDeferred(method, *args)
+
     def _discover_raw_state(self):
         """
         Find the state of this node that is relevant to determining which
-        datasets are on this node, and return a ``RawState`` containing that
-        information.
-        """
-        # FLOC-1819 Make this asynchronous
-        api = self.block_device_api
-        compute_instance_id = api.compute_instance_id()
-        volumes = api.list_volumes()
-        system_mounts = {
-            mount.blockdevice: mount.mountpoint
-            for mount in self.block_device_manager.get_mounts()
-        }
+        datasets are on this node.
+
+        Listing volumes, reading the mount table and finding the device of
+        each attached volume run concurrently, no more than
+        ``_DISCOVERY_CONCURRENCY`` calls at a time.  Once all the devices are
+        known they are checked for filesystems with a single call.
+
+        :return: ``Deferred`` that fires with a ``RawState`` containing that
+            information.
+        """
+        api = self.async_block_device_api
+        semaphore = DeferredSemaphore(_DISCOVERY_CONCURRENCY)
+        durations = {}
+
+        def timed(phase, d):
+            start = time()
+
+            def finished(result):
+                durations[phase] = time() - start
+                return result
+            return d.addBoth(finished)
 
         def is_existing_block_device(dataset_id, path):
             if isinstance(path, FilePath) and path.isBlockDevice():
@@ -1590,33 +1765,91 @@ class BlockDeviceDeployer(PClass):
             ).write(_logger)
             return False
 
-        # XXX This should probably just be included in
-        # BlockDeviceVolume for attached volumes.
-        devices = {}
-        for volume in volumes:
-            dataset_id = volume.dataset_id
-            if volume.attached_to == compute_instance_id:
-                device_path = api.get_device_path(volume.blockdevice_id)
-                if is_existing_block_device(dataset_id, device_path):
-                    devices[dataset_id] = device_path
-                else:
+        def discover_device(volume):
+            """
+            :return: ``Deferred`` firing with the device path, or ``None`` if
+                there is no usable device.
+            """
+            d = semaphore.run(api.get_device_path, volume.blockdevice_id)
+
+            def got_device_path(device_path):
+                if not is_existing_block_device(
+                        volume.dataset_id, device_path):
                     # XXX We will detect this as NON_MANIFEST, but this is
                     # probably an intermediate state where the device is
                     # externally attached but the device hasn't shown up
                     # in the filesystem yet.
-                    pass
-
-        result = RawState(
-            compute_instance_id=compute_instance_id,
-            volumes=volumes,
-            devices=devices,
-            system_mounts=system_mounts,
-            devices_with_filesystems=[
-                device for device in devices.values()
-                if self.block_device_manager.has_filesystem(device)],
-        )
-        DISCOVERED_RAW_STATE(raw_state=result).write()
-        return result
+                    return None
+                return device_path
+            return d.addCallback(got_device_path)
+
+        def probe_filesystems(device_paths):
+            """
+            :return: ``Deferred`` firing with a ``list`` of tuples of each
+                device path and whether it has a filesystem.
+            """
+            probing = self._call_block_device_manager(
+                "probe_filesystems",
+                [path for path in device_paths if path is not None])
+            probing.addCallback(lambda has_filesystem: [
+                (path, path is not None and has_filesystem[path])
+                for path in device_paths
+            ])
+            return probing
+
+        instance_id = timed(
+            u"compute_instance_id",
+            semaphore.run(api.compute_instance_id))
+        volumes = timed(u"list_volumes", semaphore.run(api.list_volumes))
+        mounts = timed(u"get_mounts", semaphore.run(
+            self._call_block_device_manager, "get_mounts"))
+
+        def got_volumes(results):
+            compute_instance_id, volumes = results
+            # XXX This should probably just be included in
+            # BlockDeviceVolume for attached volumes.
+            attached = [volume for volume in volumes
+                        if volume.attached_to == compute_instance_id]
+            devices = _gather(
+                [discover_device(volume) for volume in attached])
+            devices = timed(u"devices", devices.addCallback(
+                probe_filesystems))
+            devices.addCallback(
+                lambda found: (compute_instance_id, volumes,
+                               zip(attached, found)))
+            return devices
+        devices = _gather([instance_id, volumes])
+        devices.addCallback(got_volumes)
+
+        def got_everything(results):
+            (compute_instance_id, volumes, found), system_mounts = results
+            devices = {}
+            devices_with_filesystems = []
+            for volume, (device_path, has_filesystem) in found:
+                if device_path is None:
+                    continue
+                devices[volume.dataset_id] = device_path
+                if has_filesystem:
+                    devices_with_filesystems.append(device_path)
+            result = RawState(
+                compute_instance_id=compute_instance_id,
+                volumes=volumes,
+                devices=devices,
+                system_mounts={
+                    mount.blockdevice: mount.mountpoint
+                    for mount in system_mounts
+                },
+                devices_with_filesystems=devices_with_filesystems,
+            )
+            DISCOVERED_RAW_STATE(raw_state=result).write()
+            return result
+        result = timed(u"total", _gather([devices, mounts]))
+        result.addCallback(got_everything)
+
+        def log_timings(passthrough):
+            DISCOVERY_TIMINGS(durations=durations).write()
+            return passthrough
+        return result.addBoth(log_timings)
 
     def discover_state(self, cluster_state):
         """
@@ -1624,8 +1857,18 @@ class BlockDeviceDeployer(PClass):
         return a ``BlockDeviceDeployerLocalState`` containing all the datasets
         that are not manifest or are located on this node.
         """
-        raw_state = self._discover_raw_state()
+        discovering = self._discover_raw_state()
+        discovering.addCallback(self._local_state_from_raw_state)
+        return discovering
+
+    def _local_state_from_raw_state(self, raw_state):
+        """
+        Work out the state of the datasets on this node.
+
+        :param RawState raw_state: The discovered raw state of this node.
 
+        :return: A ``BlockDeviceDeployerLocalState``.
+        """
         datasets = {}
         for volume in raw_state.volumes:
             dataset_id = volume.dataset_id
@@ -1677,14 +1920,12 @@ class BlockDeviceDeployer(PClass):
                         blockdevice_id=volume.blockdevice_id,
                     )
 
-        local_state = BlockDeviceDeployerLocalState(
+        return BlockDeviceDeployerLocalState(
             node_uuid=self.node_uuid,
             hostname=self.hostname,
             datasets=datasets,
         )
 
-        return succeed(local_state)
-
     def _mountpath_for_dataset_id(self, dataset_id):
         """
         Calculate the mountpoint for a dataset.
@@ -1807,7 +2048,8 @@ class ProcessLifetimeCache(proxyForInterface(IBlockDeviceAPI, "_api")):
     A transparent caching layer around an ``IBlockDeviceAPI`` instance,
     intended to exist for the lifetime of the process.
 
-    :ivar _api: Wrapped ``IBlockDeviceAPI`` provider.
+    :ivar _api: Wrapped ``IBlockDeviceAPI`` provider.  If it also provides
+        ``INativeAsyncBlockDeviceAPI`` then so does this object.
     :ivar _instance_id: Cached result of ``compute_instance_id``.
     :ivar _device_paths: Mapping from blockdevice ids to cached device path.
     """
@@ -1815,6 +2057,8 @@ class ProcessLifetimeCache(proxyForInterface(IBlockDeviceAPI, "_api")):
         self._api = api
         self._instance_id = None
         self._device_paths = {}
+        if INativeAsyncBlockDeviceAPI.providedBy(api):
+            alsoProvides(self, INativeAsyncBlockDeviceAPI)
 
     def compute_instance_id(self):
         """
@@ -1838,8 +2082,322 @@ class ProcessLifetimeCache(proxyForInterface(IBlockDeviceAPI, "_api")):
         """
         Clear the cached device path, if it was cached.
         """
-        try:
-            del self._device_paths[blockdevice_id]
-        except KeyError:
-            pass
+        self._device_paths.pop(blockdevice_id, None)
         return self._api.detach_volume(blockdevice_id)
+
+    def native_async_methods(self, reactor, threadpool):
+        """
+        The wrapped API's native methods, with the same caching as the
+        synchronous methods.
+        """
+        native = self._api.native_async_methods(reactor, threadpool)
+        methods = dict(native)
+
+        def _cache_instance_id(instance_id):
+            self._instance_id = instance_id
+            return instance_id
+
+        def compute_instance_id():
+            if self._instance_id is not None:
+                return succeed(self._instance_id)
+            computing = native["compute_instance_id"]()
+            computing.addCallback(_cache_instance_id)
+            return computing
+
+        def get_device_path(blockdevice_id):
+            if blockdevice_id in self._device_paths:
+                return succeed(self._device_paths[blockdevice_id])
+            getting = native["get_device_path"](blockdevice_id)
+            getting.addCallback(
+                lambda path: self._device_paths.setdefault(
+                    blockdevice_id, path))
+            return getting
+
+        def detach_volume(blockdevice_id):
+            self._device_paths.pop(blockdevice_id, None)
+            return native["detach_volume"](blockdevice_id)
+
+        for method in [compute_instance_id, get_device_path, detach_volume]:
+            if method.__name__ in native:
+                methods[method.__name__] = method
+        return methods
+
+
+LIST_VOLUMES_CACHE = MessageType(
+    u"agent:blockdevice:list_volumes_cache",
+    [Field.for_types(u"hit", [bool],
+                     u"Whether the volumes were answered from the cache."),
+     Field.for_types(u"hits", [int, long],
+                     u"How many calls have been answered from the cache."),
+     Field.for_types(u"misses", [int, long],
+                     u"How many calls have listed volumes from the backend.")],
+    u"A call to the cached list_volumes.")
+
+
+class VolumeListCache(proxyForInterface(IBlockDeviceAPI, "_api")):
+    """
+    A caching layer for ``list_volumes`` around an ``IBlockDeviceAPI``
+    instance.
+
+    The cached list is used for ``ttl`` seconds.  Volumes created,
+    attached, detached or destroyed through this object are updated in the
+    cached list as they are changed, so only changes made elsewhere (e.g. by
+    another node) are noticed late.  If one of those calls fails the
+    backend's state is unknown, so the cache is dropped.
+
+    Calls come from multiple threads, so the cache is protected by a lock.
+
+    :ivar _api: Wrapped ``IBlockDeviceAPI`` provider.  If it also provides
+        ``INativeAsyncBlockDeviceAPI`` then so does this object.
+    :ivar _profiled_api: ``IProfiledBlockDeviceAPI`` provider used to
+        create volumes with profiles, or ``None``.  If given, this object
+        provides ``IProfiledBlockDeviceAPI`` too.
+    :ivar float ttl: Seconds to use a listing for.
+    :ivar _clock: ``IReactorTime`` provider used to expire the listing.
+    :ivar _volumes: The cached ``list`` of ``BlockDeviceVolume``, or
+        ``None``.
+    :ivar _expires: When ``_volumes`` expires.
+    :ivar int _generation: Incremented whenever volumes are changed through
+        this object.
+    :ivar int hits: Number of ``list_volumes`` calls answered from the
+        cache.
+    :ivar int misses: Number of ``list_volumes`` calls passed on to
+        ``_api``.
+    """
+    def __init__(self, api, ttl, clock, profiled_api=None):
+        self._api = api
+        self._profiled_api = profiled_api
+        if profiled_api is not None:
+            alsoProvides(self, IProfiledBlockDeviceAPI)
+        if INativeAsyncBlockDeviceAPI.providedBy(api):
+            alsoProvides(self, INativeAsyncBlockDeviceAPI)
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._volumes = None
+        self._expires = None
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """
+        Drop the cached listing, so that the next ``list_volumes`` call asks
+        the backend.
+        """
+        with self._lock:
+            self._generation += 1
+            self._volumes = None
+
+    def _lookup(self):
+        """
+        Count a ``list_volumes`` call, and find the cached listing if it
+        hasn't expired.
+
+        :return: A ``tuple`` of a copy of the cached ``list`` of volumes, or
+            ``None`` if the backend has to be asked, and the arguments to
+            pass to ``_store`` along with the backend's answer.
+        """
+        with self._lock:
+            hit = (self._volumes is not None and
+                   self._clock.seconds() < self._expires)
+            volumes = None
+            if hit:
+                self.hits += 1
+                volumes = list(self._volumes)
+            else:
+                self.misses += 1
+            LIST_VOLUMES_CACHE(
+                hit=hit, hits=self.hits, misses=self.misses).write()
+            return (volumes,
+                    (self._generation, self._clock.seconds() + self.ttl))
+
+    def _store(self, volumes, generation, expires):
+        """
+        Cache a listing of the backend's volumes.
+
+        :param list volumes: The ``BlockDeviceVolume``\ s listed.
+        :param int generation: ``_generation`` when the listing started.
+        :param expires: When the listing expires.
+
+        :return: ``volumes``.
+        """
+        with self._lock:
+            # A listing that overlapped with a change may or may not include
+            # it, so only cache listings that didn't:
+            if generation == self._generation:
+                self._volumes = list(volumes)
+                self._expires = expires
+        return volumes
+
+    def list_volumes(self):
+        volumes, store_args = self._lookup()
+        if volumes is not None:
+            return volumes
+        return self._store(self._api.list_volumes(), *store_args)
+
+    def _changed(self, update, result):
+        """
+        Update the cached listing after a volume was changed.
+
+        :param update: One-argument callable taking ``result`` that returns
+            a function that transforms the cached ``list`` of volumes, or
+            ``None`` if the result doesn't say how the volumes changed and
+            the cached listing must be dropped.
+        :param result: The result of the change.
+
+        :return: ``result``.
+        """
+        with self._lock:
+            self._generation += 1
+            if self._volumes is not None:
+                transform = update(result)
+                if transform is None:
+                    self._volumes = None
+                else:
+                    self._volumes = transform(self._volumes)
+        return result
+
+    def _update(self, update, change, *args, **kwargs):
+        """
+        Call ``change``, and update the cached listing with its result.
+
+        :param update: See ``_changed``.
+        :param change: Callable that changes a volume, called with the
+            remaining arguments.
+
+        :return: The result of ``change``.
+        """
+        try:
+            result = change(*args, **kwargs)
+        except:
+            self.invalidate()
+            raise
+        return self._changed(update, result)
+
+    def _update_async(self, update, change, *args, **kwargs):
+        """
+        Like ``_update``, for a ``change`` that returns a ``Deferred``.
+
+        :return: A ``Deferred`` that fires with the result of ``change``.
+        """
+        def failed(reason):
+            self.invalidate()
+            return reason
+        changing = maybeDeferred(change, *args, **kwargs)
+        changing.addCallbacks(
+            lambda result: self._changed(update, result), failed)
+        return changing
+
+    def create_volume(self, dataset_id, size):
+        return self._update(
+            _added_volume, self._api.create_volume,
+            dataset_id=dataset_id, size=size)
+
+    def create_volume_with_profile(self, dataset_id, size, profile_name):
+        return self._update(
+            _added_volume, self._profiled_api.create_volume_with_profile,
+            dataset_id=dataset_id, size=size, profile_name=profile_name)
+
+    def attach_volume(self, blockdevice_id, attach_to):
+        return self._update(
+            _added_volume, self._api.attach_volume, blockdevice_id,
+            attach_to)
+
+    def detach_volume(self, blockdevice_id):
+        return self._update(
+            _detached_volume(blockdevice_id),
+            self._api.detach_volume, blockdevice_id)
+
+    def destroy_volume(self, blockdevice_id):
+        return self._update(
+            _destroyed_volume(blockdevice_id),
+            self._api.destroy_volume, blockdevice_id)
+
+    def native_async_methods(self, reactor, threadpool):
+        """
+        The wrapped API's native methods, with the listing cached and updated
+        as by the synchronous methods.
+        """
+        native = self._api.native_async_methods(reactor, threadpool)
+        methods = dict(native)
+
+        def list_volumes():
+            volumes, store_args = self._lookup()
+            if volumes is not None:
+                return succeed(volumes)
+            listing = native["list_volumes"]()
+            listing.addCallback(self._store, *store_args)
+            return listing
+
+        def create_volume(dataset_id, size):
+            return self._update_async(
+                _added_volume, native["create_volume"],
+                dataset_id=dataset_id, size=size)
+
+        def attach_volume(blockdevice_id, attach_to):
+            return self._update_async(
+                _added_volume, native["attach_volume"], blockdevice_id,
+                attach_to)
+
+        def detach_volume(blockdevice_id):
+            return self._update_async(
+                _detached_volume(blockdevice_id), native["detach_volume"],
+                blockdevice_id)
+
+        def destroy_volume(blockdevice_id):
+            return self._update_async(
+                _destroyed_volume(blockdevice_id), native["destroy_volume"],
+                blockdevice_id)
+
+        for method in [list_volumes, create_volume, attach_volume,
+                       detach_volume, destroy_volume]:
+            if method.__name__ in native:
+                methods[method.__name__] = method
+        return methods
+
+
+def _added_volume(new_volume):
+    """
+    :param BlockDeviceVolume new_volume: A volume that was created or
+        changed, or ``None`` if the backend didn't return one (e.g. EBS when
+        it has no free device to attach a volume to).
+
+    :return: A function that puts ``new_volume`` into a ``list`` of volumes
+        in place of the old version of it, if any, or ``None`` if
+        ``new_volume`` is ``None``.
+    """
+    if new_volume is None:
+        return None
+
+    def update(volumes):
+        return [
+            volume for volume in volumes
+            if volume.blockdevice_id != new_volume.blockdevice_id
+        ] + [new_volume]
+    return update
+
+
+def _detached_volume(blockdevice_id):
+    """
+    :param unicode blockdevice_id: The volume that was detached.
+
+    :return: A ``VolumeListCache`` update that marks the volume detached in
+        a ``list`` of volumes.
+    """
+    return lambda ignored: lambda volumes: [
+        volume.set(attached_to=None)
+        if volume.blockdevice_id == blockdevice_id else volume
+        for volume in volumes]
+
+
+def _destroyed_volume(blockdevice_id):
+    """
+    :param unicode blockdevice_id: The volume that was destroyed.
+
+    :return: A ``VolumeListCache`` update that removes the volume from a
+        ``list`` of volumes.
+    """
+    return lambda ignored: lambda volumes: [
+        volume for volume in volumes
+        if volume.blockdevice_id != blockdevice_id]
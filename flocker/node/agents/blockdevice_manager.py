@@ -6,8 +6,12 @@ Interactions between the OS pertaining to block devices.
 This controls actions such as formatting and mounting a blockdevice.
 """
 
-import psutil
-from subprocess import CalledProcessError, check_output, STDOUT
+import os
+from ctypes import CDLL, c_char_p, c_int, c_ulong, c_void_p, get_errno
+from errno import EINVAL, ENODEV
+from stat import S_ISBLK
+from subprocess import CalledProcessError, check_output, PIPE, Popen, STDOUT
+from threading import Lock
 
 from zope.interface import Interface, implementer
 
@@ -18,6 +22,8 @@ from twisted.python.constants import ValueConstant, Values
 
 from characteristic import attributes
 
+from ._mounttable import FILESYSTEMS, MountTable, _device_filesystem_types
+
 
 class Permissions(Values):
     """
@@ -149,6 +155,19 @@ class IBlockDeviceManager(Interface):
         :returns: True if the blockdevice has a filesystem.
         """
 
+    def probe_filesystems(blockdevices):
+        """
+        Find out which of several blockdevices have a filesystem.
+
+        This is the same as calling ``has_filesystem`` for each blockdevice,
+        but cheaper.
+
+        :param blockdevices: Iterable of ``FilePath`` of the blockdevices to
+            query for a filesystem.
+        :returns: ``dict`` mapping each of ``blockdevices`` to ``True`` if it
+            has a filesystem, or ``False`` otherwise.
+        """
+
     def mount(blockdevice, mountpoint):
         """
         Mounts the blockdevice at blockdevice.path at mountpoint.path.
@@ -250,11 +269,181 @@ def _run_command(command_arg_list):
     return _CommandResult(succeeded=True)
 
 
+# Where the kernel describes each blockdevice, by device number:
+_SYS_DEV_BLOCK = FilePath(b"/sys/dev/block")
+
+
+def _optional_content(path):
+    """
+    :param FilePath path: A file which may not exist.
+
+    :returns: The contents of the file, or ``None`` if it doesn't exist.
+    """
+    try:
+        return path.getContent()
+    except IOError:
+        return None
+
+
+def _device_identity(blockdevice):
+    """
+    Identify the device currently at a path.
+
+    A device number can be reused for a different device, e.g. when a
+    volume is detached and another one attached.  Hotplugged devices get new
+    device nodes and ``sysfs`` entries, so their inodes change.  Loop
+    devices keep theirs, so their backing file is part of the identity too.
+    Newer kernels also number each medium a device has had (``diskseq``).
+
+    :param FilePath blockdevice: The path to the blockdevice.
+
+    :returns: A value that differs if a different device, or the same device
+        with a different size, is found at ``blockdevice``, or ``None`` if it
+        can't be identified.
+    """
+    try:
+        info = os.stat(blockdevice.path)
+    except OSError:
+        return None
+    if not S_ISBLK(info.st_mode):
+        return (info.st_dev, info.st_ino, info.st_size)
+    sys = _SYS_DEV_BLOCK.child(b"%d:%d" % (
+        os.major(info.st_rdev), os.minor(info.st_rdev)))
+    try:
+        sys_inode = os.stat(sys.path).st_ino
+        # The size of a blockdevice isn't in its inode, but the kernel
+        # reports it (in 512 byte sectors) without having to open it:
+        size = int(sys.child(b"size").getContent())
+    except (OSError, IOError, ValueError):
+        return None
+    return (
+        info.st_rdev, info.st_ino, sys_inode, size,
+        _optional_content(sys.child(b"diskseq")),
+        _optional_content(sys.child(b"loop").child(b"backing_file")),
+    )
+
+
+class _FilesystemProbeCache(object):
+    """
+    The results of probing blockdevices for filesystems.
+
+    Probing is done from multiple threads, so results are protected by a
+    lock.
+
+    :ivar _results: ``dict`` mapping the ``FilePath`` of a blockdevice to a
+        tuple of its identity, as returned by ``_device_identity``, and
+        whether it has a filesystem.
+    :ivar int generation: Incremented whenever a result is forgotten.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._results = {}
+        self.generation = 0
+
+    def get(self, blockdevice, identity):
+        """
+        :param FilePath blockdevice: The path to the blockdevice.
+        :param identity: The current identity of the blockdevice.
+
+        :returns: Whether the blockdevice has a filesystem, or ``None`` if it
+            hasn't been probed since it last changed identity.
+        """
+        with self._lock:
+            cached_identity, has_filesystem = self._results.get(
+                blockdevice, (None, None))
+        if identity is None or identity != cached_identity:
+            return None
+        return has_filesystem
+
+    def set(self, blockdevice, identity, has_filesystem, generation):
+        """
+        Remember the result of probing a blockdevice.
+
+        :param FilePath blockdevice: The path to the blockdevice.
+        :param identity: The identity of the blockdevice before it was
+            probed.
+        :param bool has_filesystem: Whether it has a filesystem.
+        :param int generation: ``generation`` before it was probed.  If a
+            result has been forgotten since, the probe may have overlapped
+            with a filesystem being created so the result isn't remembered.
+        """
+        if identity is None:
+            return
+        with self._lock:
+            if generation == self.generation:
+                self._results[blockdevice] = (identity, has_filesystem)
+
+    def forget(self, blockdevice):
+        """
+        Forget the result of probing a blockdevice, e.g. because a
+        filesystem is being created on it.
+
+        :param FilePath blockdevice: The path to the blockdevice.
+        """
+        with self._lock:
+            self.generation += 1
+            self._results.pop(blockdevice, None)
+
+
+# Filesystem probe results shared by every ``BlockDeviceManager`` in the
+# process, since they describe the node's devices:
+_FILESYSTEM_PROBES = _FilesystemProbeCache()
+
+# Likewise, the mount table of the process:
+_MOUNT_TABLE = MountTable()
+
+
+def _blkid_filesystems(blockdevices):
+    """
+    Run a single ``blkid`` to probe blockdevices for filesystems.
+
+    ``blkid -p`` stops at the first device without a filesystem, so not
+    every device may have been probed.
+
+    :param blockdevices: ``list`` of ``FilePath`` of blockdevices.
+
+    :raises CalledProcessError: If ``blkid`` fails for some other reason.
+    :returns: A tuple of a ``dict`` mapping the probed blockdevices to
+        whether they have a filesystem, and a ``list`` of the remaining
+        blockdevices.
+    """
+    command = [b"blkid", b"-p", b"-u", b"filesystem", b"-o", b"export"]
+    command.extend(blockdevice.path for blockdevice in blockdevices)
+    process = Popen(command, stdout=PIPE, stderr=PIPE)
+    output, error = process.communicate()
+    # According to the man page, exit status 2 means:
+    #   the specified token was not found, or no (specified) devices could
+    #   be identified
+    #
+    # Experimentation shows that there is no output on stderr in the case of
+    # the former, and an error printed to stderr in the case of the latter.
+    if process.returncode not in (0, 2) or error:
+        raise CalledProcessError(
+            process.returncode, command, output=output + error)
+    found = set(
+        FilePath(line[len(b"DEVNAME="):])
+        for line in output.splitlines() if line.startswith(b"DEVNAME=")
+    )
+    results = {}
+    for index, blockdevice in enumerate(blockdevices):
+        results[blockdevice] = blockdevice in found
+        if process.returncode == 2 and blockdevice not in found:
+            # This is where blkid stopped.
+            return results, blockdevices[index + 1:]
+    return results, []
+
+
 @implementer(IBlockDeviceManager)
 class BlockDeviceManager(PClass):
     """
     Real implementation of IBlockDeviceManager.
+
+    :ivar _filesystem_probes: ``_FilesystemProbeCache`` used to avoid probing
+        unchanged blockdevices for filesystems again.
+    :ivar _mount_table: ``MountTable`` used to find mounts.
     """
+    _filesystem_probes = field(initial=_FILESYSTEM_PROBES, mandatory=True)
+    _mount_table = field(initial=_MOUNT_TABLE, mandatory=True)
 
     def make_filesystem(self, blockdevice, filesystem):
         result = _run_command([
@@ -266,32 +455,43 @@ class BlockDeviceManager(PClass):
             b"-F",
             blockdevice.path
         ])
+        # Even a failed mkfs may have written a filesystem, and a probe that
+        # overlapped with it may have cached the wrong answer:
+        self._filesystem_probes.forget(blockdevice)
         if not result.succeeded:
             raise MakeFilesystemError(blockdevice=blockdevice,
                                       source_message=result.error_message)
 
     def has_filesystem(self, blockdevice):
-        try:
-            check_output(
-                [b"blkid", b"-p", b"-u", b"filesystem", blockdevice.path],
-                stderr=STDOUT,
-            )
-        except CalledProcessError as e:
-            # According to the man page:
-            #   the specified token was not found, or no (specified) devices
-            #   could be identified
-            #
-            # Experimentation shows that there is no output in the case of the
-            # former, and an error printed to stderr in the case of the
-            # latter.
-            #
+        # This is checked before creating a filesystem, so it always probes
+        # the device rather than trusting the cache:
+        probed, _ = _blkid_filesystems([blockdevice])
+        return probed[blockdevice]
+
+    def probe_filesystems(self, blockdevices):
+        results = {}
+        identities = {}
+        generation = self._filesystem_probes.generation
+        for blockdevice in blockdevices:
+            identity = identities[blockdevice] = _device_identity(blockdevice)
+            has_filesystem = self._filesystem_probes.get(
+                blockdevice, identity)
+            if has_filesystem is not None:
+                results[blockdevice] = has_filesystem
+        remaining = [
+            blockdevice for blockdevice in identities
+            if blockdevice not in results
+        ]
+        while remaining:
             # FLOC-2388: We're assuming an interface. We should test this
             # assumption.
-            if e.returncode == 2 and not e.output:
-                # There is no filesystem on this device.
-                return False
-            raise
-        return True
+            probed, remaining = _blkid_filesystems(remaining)
+            for blockdevice, has_filesystem in probed.items():
+                self._filesystem_probes.set(
+                    blockdevice, identities[blockdevice], has_filesystem,
+                    generation)
+            results.update(probed)
+        return results
 
     def mount(self, blockdevice, mountpoint):
         result = _run_command([b"mount", blockdevice.path, mountpoint.path])
@@ -306,10 +506,9 @@ class BlockDeviceManager(PClass):
                                source_message=result.error_message)
 
     def get_mounts(self):
-        mounts = psutil.disk_partitions()
-        return (MountInfo(blockdevice=FilePath(mount.device),
-                          mountpoint=FilePath(mount.mountpoint))
-                for mount in mounts)
+        return (MountInfo(blockdevice=FilePath(entry.source),
+                          mountpoint=entry.mountpoint)
+                for entry in self._mount_table.device_entries())
 
     def bind_mount(self, source_path, mountpoint):
         result = _run_command(
@@ -333,3 +532,254 @@ class BlockDeviceManager(PClass):
         if not result.succeeded:
             raise MakeTmpfsMountError(mountpoint=mountpoint,
                                       source_message=result.error_message)
+
+
+def _libc_function(name, argtypes):
+    """
+    Find a function in the C library.
+
+    :param bytes name: The name of the function.
+    :param argtypes: ``list`` of the ``ctypes`` types of its arguments.
+
+    :returns: The function, which returns ``int`` and sets ``errno``, or
+        ``None`` if it isn't available on this platform.
+    """
+    try:
+        # The C library is already loaded by Python itself:
+        function = getattr(CDLL(None, use_errno=True), name)
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = argtypes
+    function.restype = c_int
+    return function
+
+
+_mount = _libc_function(
+    b"mount", [c_char_p, c_char_p, c_char_p, c_ulong, c_void_p])
+_umount2 = _libc_function(b"umount2", [c_char_p, c_int])
+
+# Flags for mount(2), from <sys/mount.h>:
+_MS_RDONLY = 1
+_MS_REMOUNT = 32
+_MS_BIND = 4096
+
+# The options shown in the mount table for flags that apply to a single
+# mount, which have to be passed again when remounting so that they are
+# kept:
+_MOUNT_OPTION_FLAGS = {
+    b"nosuid": 2,
+    b"nodev": 4,
+    b"noexec": 8,
+    b"sync": 16,
+    b"mand": 64,
+    b"dirsync": 128,
+    b"noatime": 1024,
+    b"nodiratime": 2048,
+    b"relatime": 1 << 21,
+    b"strictatime": 1 << 24,
+}
+
+
+# Where the superblock of an ext2, ext3 or ext4 filesystem is, and the magic
+# number in it that identifies the filesystem:
+_EXT_MAGIC_OFFSET = 1024 + 56
+_EXT_MAGIC = b"\x53\xef"
+
+# Options in the mount table that are set by the ``MS_RDONLY`` flag rather
+# than passed to the filesystem:
+_READ_WRITE_OPTIONS = frozenset([b"ro", b"rw"])
+
+
+def _detect_filesystem_type(blockdevice):
+    """
+    Detect the type of the filesystem on a blockdevice, as ``mount(8)``
+    does before mounting it.
+
+    The ext4 filesystems Flocker creates are recognized without running
+    anything; other filesystems are probed with ``blkid``.
+
+    :param FilePath blockdevice: The blockdevice.
+
+    :returns: The ``bytes`` filesystem type, or ``None`` if it can't be
+        detected.
+    """
+    try:
+        with blockdevice.open() as device:
+            device.seek(_EXT_MAGIC_OFFSET)
+            if device.read(len(_EXT_MAGIC)) == _EXT_MAGIC:
+                # The ext4 driver mounts ext2 and ext3 filesystems too:
+                return b"ext4"
+    except (IOError, OSError):
+        pass
+    process = Popen(
+        [b"blkid", b"-p", b"-u", b"filesystem", b"-s", b"TYPE", b"-o",
+         b"value", blockdevice.path],
+        stdout=PIPE, stderr=PIPE)
+    output, _ = process.communicate()
+    if process.returncode != 0:
+        return None
+    return output.strip() or None
+
+
+def _remount_arguments(entry, permissions):
+    """
+    Calculate the arguments to ``mount(2)`` for remounting a mount with new
+    permissions, keeping its other options as ``mount(8)`` does.
+
+    :param MountEntry entry: The mount.
+    :param Permissions permissions: The new permissions.
+
+    :returns: A tuple of the ``int`` flags and the ``bytes`` filesystem
+        options to pass, or ``None`` if there aren't any.
+    """
+    flags = _MS_REMOUNT
+    for option in entry.options.split(b","):
+        flags |= _MOUNT_OPTION_FLAGS.get(option, 0)
+    if permissions is Permissions.READ_ONLY:
+        flags |= _MS_RDONLY
+    if entry.root != FilePath(b"/"):
+        # Only change this bind mount, not every mount of the filesystem
+        # (like ``mount -o remount,bind``).  The filesystem's options can't
+        # be changed this way, so they aren't passed:
+        return flags | _MS_BIND, None
+    data = b",".join(
+        option for option in entry.super_options.split(b",")
+        if option not in _READ_WRITE_OPTIONS)
+    return flags, data or None
+
+
+def _syscall(function, *args):
+    """
+    Call a function from ``_libc_function``.
+
+    :raises OSError: If it fails.
+    """
+    if function(*args) != 0:
+        errno = get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def _error_message(call, error):
+    """
+    :param unicode call: A description of the failed call.
+    :param OSError error: How it failed.
+
+    :returns: ``unicode`` message describing the failure.
+    """
+    return u"{} failed: {}".format(call, error.strerror.decode("utf-8"))
+
+
+@implementer(IBlockDeviceManager)
+class SyscallBlockDeviceManager(BlockDeviceManager):
+    """
+    An ``IBlockDeviceManager`` that mounts and unmounts by calling
+    ``mount(2)`` and ``umount2(2)`` directly, rather than running
+    ``mount(8)`` and ``umount(8)``.
+
+    If those functions aren't available it behaves like
+    ``BlockDeviceManager``.
+
+    :ivar FilePath _filesystems_path: The list of filesystem types, which
+        are tried in turn to mount a blockdevice whose filesystem type
+        can't be detected.
+    """
+    _filesystems_path = field(initial=FILESYSTEMS, mandatory=True)
+
+    def _filesystem_types(self):
+        """
+        :returns: ``list`` of the filesystem types to try when mounting a
+            blockdevice, starting with the type Flocker creates.
+        """
+        types = _device_filesystem_types(self._filesystems_path.getContent())
+        types.discard(b"ext4")
+        return [b"ext4"] + sorted(types)
+
+    def mount(self, blockdevice, mountpoint):
+        if _mount is None:
+            return BlockDeviceManager.mount(self, blockdevice, mountpoint)
+        # Like mount(8), detect the type of the filesystem, or if it can't
+        # be detected try each type the kernel knows about.  The wrong type
+        # is rejected with EINVAL, or ENODEV if the kernel can't actually
+        # mount it.
+        filesystem_type = _detect_filesystem_type(blockdevice)
+        if filesystem_type is None:
+            filesystem_types = self._filesystem_types()
+        else:
+            filesystem_types = [filesystem_type]
+        for filesystem_type in filesystem_types:
+            try:
+                _syscall(_mount, blockdevice.path, mountpoint.path,
+                         filesystem_type, 0, None)
+                return
+            except OSError as e:
+                error = e
+                if e.errno not in (EINVAL, ENODEV):
+                    break
+        raise MountError(
+            blockdevice=blockdevice, mountpoint=mountpoint,
+            source_message=_error_message(
+                u"mount({}, {})".format(blockdevice.path, mountpoint.path),
+                error))
+
+    def unmount(self, blockdevice):
+        if _umount2 is None:
+            return BlockDeviceManager.unmount(self, blockdevice)
+        # Like umount(8), accept either a mountpoint or a blockdevice, in
+        # which case its latest mount is unmounted:
+        target = blockdevice
+        path = FilePath(os.path.realpath(blockdevice.path))
+        if self._mount_table.by_mountpoint(path) is None:
+            mounts = self._mount_table.by_source(path)
+            if mounts:
+                target = mounts[-1].mountpoint
+        try:
+            _syscall(_umount2, target.path, 0)
+        except OSError as e:
+            raise UnmountError(
+                blockdevice=blockdevice,
+                source_message=_error_message(
+                    u"umount2({})".format(target.path), e))
+
+    def bind_mount(self, source_path, mountpoint):
+        if _mount is None:
+            return BlockDeviceManager.bind_mount(
+                self, source_path, mountpoint)
+        try:
+            _syscall(_mount, source_path.path, mountpoint.path, None,
+                     _MS_BIND, None)
+        except OSError as e:
+            raise BindMountError(
+                source_path=source_path, mountpoint=mountpoint,
+                source_message=_error_message(
+                    u"bind mount({}, {})".format(
+                        source_path.path, mountpoint.path), e))
+
+    def remount(self, mountpoint, permissions):
+        if _mount is None:
+            return BlockDeviceManager.remount(self, mountpoint, permissions)
+        call = u"remount({}, {})".format(mountpoint.path, permissions.value)
+        entry = self._mount_table.by_mountpoint(
+            FilePath(os.path.realpath(mountpoint.path)))
+        if entry is None:
+            raise RemountError(
+                mountpoint=mountpoint, permissions=permissions,
+                source_message=_error_message(
+                    call, OSError(EINVAL, b"not mounted")))
+        flags, data = _remount_arguments(entry, permissions)
+        try:
+            _syscall(_mount, None, mountpoint.path, None, flags, data)
+        except OSError as e:
+            raise RemountError(
+                mountpoint=mountpoint, permissions=permissions,
+                source_message=_error_message(call, e))
+
+    def make_tmpfs_mount(self, mountpoint):
+        if _mount is None:
+            return BlockDeviceManager.make_tmpfs_mount(self, mountpoint)
+        try:
+            _syscall(_mount, b"tmpfs", mountpoint.path, b"tmpfs", 0, None)
+        except OSError as e:
+            raise MakeTmpfsMountError(
+                mountpoint=mountpoint,
+                source_message=_error_message(
+                    u"tmpfs mount({})".format(mountpoint.path), e))
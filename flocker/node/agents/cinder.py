@@ -10,7 +10,7 @@ from uuid import UUID
 
 from bitmath import Byte, GiB
 
-from eliot import Message
+from eliot import Message, preserve_context
 
 from pyrsistent import PClass, field
 
@@ -23,11 +23,15 @@ from keystoneclient.session import Session
 from keystoneclient_rackspace.v2_0 import RackspaceAuth
 from cinderclient.client import Client as CinderClient
 from cinderclient.exceptions import NotFound as CinderClientNotFound
+from cinderclient.exceptions import OverLimit as CinderOverLimit
 from novaclient.client import Client as NovaClient
 from novaclient.exceptions import NotFound as NovaNotFound
+from novaclient.exceptions import OverLimit as NovaOverLimit
+from novaclient.exceptions import RateLimit as NovaRateLimit
 from novaclient.exceptions import ClientException as NovaClientException
 
 from twisted.python.filepath import FilePath
+from twisted.internet.threads import deferToThreadPool
 
 from zope.interface import implementer, Interface
 
@@ -38,7 +42,10 @@ from ...common import (
 from .blockdevice import (
     IBlockDeviceAPI, BlockDeviceVolume, UnknownVolume, AlreadyAttachedVolume,
     UnattachedVolume, UnknownInstanceID, get_blockdevice_volume, ICloudAPI,
+    INativeAsyncBlockDeviceAPI,
 )
+from ._poller import BatchedStatePoller, wait_for_state
+from ._ratelimit import auto_rate_limiting
 from ._logging import (
     NOVA_CLIENT_EXCEPTION, KEYSTONE_HTTP_ERROR, COMPUTE_INSTANCE_ID_NOT_FOUND,
     OPENSTACK_ACTION, CINDER_CREATE
@@ -150,10 +157,13 @@ class ICinderVolumeManager(Interface):
         :rtype: :class:`Volume`
         """
 
-    def list():
+    def list(search_opts=None):
         """
         Lists all volumes.
 
+        :param dict search_opts: Filters for the volumes to list, e.g.
+            ``{"metadata": {"key": "value"}}`` to only list volumes with
+            that metadata.
         :rtype: list of :class:`Volume`
         """
 
@@ -282,7 +292,9 @@ class UnexpectedStateException(Exception):
 class VolumeStateMonitor:
     """
     Monitor a volume until it reaches a nominated state.
-    :ivar ICinderVolumeManager volume_manager: An API for listing volumes.
+    :ivar ICinderVolumeManager volume_manager: An API for listing volumes,
+        or ``None`` if the volume is looked up elsewhere and only given to
+        ``check_volume``.
     :ivar Volume expected_volume: The ``Volume`` to wait for.
     :ivar unicode desired_state: The ``Volume.status`` to wait for.
     :ivar transient_states: A sequence of valid intermediate states.
@@ -315,6 +327,21 @@ class VolumeStateMonitor:
         try:
             existing_volume = self.volume_manager.get(self.expected_volume.id)
         except CinderClientNotFound:
+            existing_volume = None
+        return self.check_volume(existing_volume)
+
+    def check_volume(self, existing_volume):
+        """
+        Test whether the desired state has been reached, given the latest
+        state of the volume.
+
+        Raise an exception if a non-valid state is reached or if the
+        desired state is not reached within the supplied time limit.
+
+        :param existing_volume: The latest ``Volume``, or ``None`` if it
+            isn't listed.
+        """
+        if existing_volume is None:
             elapsed_time = time.time() - self.start_time
             if elapsed_time > self.time_limit:
                 raise TimeoutException(
@@ -359,6 +386,28 @@ def wait_for_volume_state(volume_manager, expected_volume, desired_state,
     return poll_until(waiter.reached_desired_state, repeat(1))
 
 
+def poll_for_volume_state(poller, expected_volume, desired_state,
+                          transient_states=(), time_limit=CINDER_TIMEOUT):
+    """
+    Wait for a volume like ``wait_for_volume_state``, but without blocking
+    a thread: the volume is found by the next poll of all the volumes being
+    waited for.
+
+    :param BatchedStatePoller poller: The poller of Cinder volumes.
+
+    See ``wait_for_volume_state`` for the other parameters.
+
+    :returns: ``Deferred`` that fires with the listed ``Volume`` that matches
+        ``expected_volume``, or fails with the exceptions
+        ``wait_for_volume_state`` raises.
+    """
+    waiter = VolumeStateMonitor(
+        None, expected_volume, desired_state, transient_states, time_limit)
+    return wait_for_state(
+        poller, expected_volume.id,
+        lambda volume: waiter.check_volume(volume) is not None)
+
+
 def _extract_nova_server_addresses(addresses):
     """
     :param dict addresses: A ``dict`` mapping OpenStack network names
@@ -378,6 +427,7 @@ def _extract_nova_server_addresses(addresses):
 
 
 @implementer(IBlockDeviceAPI)
+@implementer(INativeAsyncBlockDeviceAPI)
 @implementer(ICloudAPI)
 class CinderBlockDeviceAPI(object):
     """
@@ -409,6 +459,10 @@ class CinderBlockDeviceAPI(object):
         if time_module is None:
             time_module = time
         self._time = time_module
+        # Volumes changed by the native asynchronous methods are polled
+        # together, with one call listing all of them, by a poller created
+        # along with those methods:
+        self._volume_poller = None
 
     def allocation_unit(self):
         """
@@ -465,6 +519,23 @@ class CinderBlockDeviceAPI(object):
 
         http://docs.rackspace.com/cbs/api/v1.0/cbs-devguide/content/POST_createVolume_v1__tenant_id__volumes_volumes.html
         """
+        requested_volume = self._start_create_volume(dataset_id, size)
+        created_volume = wait_for_volume_state(
+            volume_manager=self.cinder_volume_manager,
+            expected_volume=requested_volume,
+            desired_state=u'available',
+            transient_states=(u'creating',),
+        )
+        return _blockdevicevolume_from_cinder_volume(
+            cinder_volume=created_volume,
+        )
+
+    def _start_create_volume(self, dataset_id, size):
+        """
+        Request a new volume, without waiting for it to be created.
+
+        :returns: The requested ``Volume``.
+        """
         metadata = {
             CLUSTER_ID_LABEL: unicode(self.cluster_id),
             DATASET_ID_LABEL: unicode(dataset_id),
@@ -476,14 +547,25 @@ class CinderBlockDeviceAPI(object):
         )
         Message.new(message_type=CINDER_CREATE,
                     blockdevice_id=requested_volume.id).write()
-        created_volume = wait_for_volume_state(
-            volume_manager=self.cinder_volume_manager,
-            expected_volume=requested_volume,
-            desired_state=u'available',
-            transient_states=(u'creating',),
-        )
-        return _blockdevicevolume_from_cinder_volume(
-            cinder_volume=created_volume,
+        return requested_volume
+
+    def _describe_volumes(self, volume_ids):
+        """
+        Get several of this cluster's volumes with one call.
+
+        :param list volume_ids: The IDs of the volumes to get.
+
+        :return: A ``dict`` mapping the ID of each of the volumes that exists
+            to its ``Volume``.
+        """
+        wanted = set(volume_ids)
+        cinder_volumes = self.cinder_volume_manager.list(search_opts={
+            'metadata': {CLUSTER_ID_LABEL: unicode(self.cluster_id)},
+        })
+        return dict(
+            (cinder_volume.id, cinder_volume)
+            for cinder_volume in cinder_volumes
+            if cinder_volume.id in wanted
         )
 
     def list_volumes(self):
@@ -496,7 +578,14 @@ class CinderBlockDeviceAPI(object):
         http://docs.rackspace.com/cbs/api/v1.0/cbs-devguide/content/GET_getVolumesDetail_v1__tenant_id__volumes_detail_volumes.html
         """
         flocker_volumes = []
-        for cinder_volume in self.cinder_volume_manager.list():
+        # Cinder filters by metadata itself, so the volumes of other clusters
+        # and other users of the tenant aren't retrieved at all.  Clouds that
+        # don't support the filter ignore it, so the volumes are checked
+        # here too.  Version 1 of the API doesn't paginate.
+        cinder_volumes = self.cinder_volume_manager.list(search_opts={
+            'metadata': {CLUSTER_ID_LABEL: unicode(self.cluster_id)},
+        })
+        for cinder_volume in cinder_volumes:
             if _is_cluster_volume(self.cluster_id, cinder_volume):
                 flocker_volume = _blockdevicevolume_from_cinder_volume(
                     cinder_volume
@@ -516,6 +605,24 @@ class CinderBlockDeviceAPI(object):
         #
         # See
         # http://www.florentflament.com/blog/openstack-volume-in-use-although-vm-doesnt-exist.html
+        unattached_volume, nova_volume = self._start_attach_volume(
+            blockdevice_id, attach_to)
+        wait_for_volume_state(
+            volume_manager=self.cinder_volume_manager,
+            expected_volume=nova_volume,
+            desired_state=u'in-use',
+            transient_states=(u'available', u'attaching',),
+        )
+        return unattached_volume.set('attached_to', attach_to)
+
+    def _start_attach_volume(self, blockdevice_id, attach_to):
+        """
+        Request that a volume be attached to an instance, without waiting
+        for it to be.
+
+        :returns: A ``tuple`` of the unattached ``BlockDeviceVolume`` and the
+            Nova ``Volume``.
+        """
         unattached_volume = get_blockdevice_volume(self, blockdevice_id)
         if unattached_volume.attached_to is not None:
             raise AlreadyAttachedVolume(blockdevice_id)
@@ -527,18 +634,26 @@ class CinderBlockDeviceAPI(object):
             # Have Nova assign a device file for us.
             device=None,
         )
-        attached_volume = wait_for_volume_state(
+        return unattached_volume, nova_volume
+
+    def detach_volume(self, blockdevice_id):
+        cinder_volume = self._start_detach_volume(blockdevice_id)
+
+        # This'll blow up if the volume is deleted from elsewhere.  FLOC-1882.
+        wait_for_volume_state(
             volume_manager=self.cinder_volume_manager,
-            expected_volume=nova_volume,
-            desired_state=u'in-use',
-            transient_states=(u'available', u'attaching',),
+            expected_volume=cinder_volume,
+            desired_state=u'available',
+            transient_states=(u'in-use', u'detaching')
         )
 
-        attached_volume = unattached_volume.set('attached_to', attach_to)
-
-        return attached_volume
+    def _start_detach_volume(self, blockdevice_id):
+        """
+        Request that a volume be detached from this node, without waiting
+        for it to be.
 
-    def detach_volume(self, blockdevice_id):
+        :returns: The Cinder ``Volume``.
+        """
         our_id = self.compute_instance_id()
         try:
             cinder_volume = self.cinder_volume_manager.get(blockdevice_id)
@@ -552,14 +667,7 @@ class CinderBlockDeviceAPI(object):
             )
         except NovaNotFound:
             raise UnattachedVolume(blockdevice_id)
-
-        # This'll blow up if the volume is deleted from elsewhere.  FLOC-1882.
-        wait_for_volume_state(
-            volume_manager=self.cinder_volume_manager,
-            expected_volume=cinder_volume,
-            desired_state=u'available',
-            transient_states=(u'in-use', u'detaching')
-        )
+        return cinder_volume
 
     def destroy_volume(self, blockdevice_id):
         """
@@ -573,10 +681,7 @@ class CinderBlockDeviceAPI(object):
             the timeout, the volume can still be listed. The volume will not
             be deleted unless further action is taken.
         """
-        try:
-            self.cinder_volume_manager.delete(blockdevice_id)
-        except CinderNotFound:
-            raise UnknownVolume(blockdevice_id)
+        self._start_destroy_volume(blockdevice_id)
         start_time = self._time.time()
         # Wait until the volume is not there or until the operation
         # timesout
@@ -593,6 +698,15 @@ class CinderBlockDeviceAPI(object):
             self._time.time() - start_time
         )
 
+    def _start_destroy_volume(self, blockdevice_id):
+        """
+        Request that a volume be deleted, without waiting for it to be.
+        """
+        try:
+            self.cinder_volume_manager.delete(blockdevice_id)
+        except CinderNotFound:
+            raise UnknownVolume(blockdevice_id)
+
     def _get_device_path_virtio_blk(self, volume):
         """
         The virtio_blk driver allows a serial number to be assigned to virtual
@@ -686,11 +800,107 @@ class CinderBlockDeviceAPI(object):
 
         return device_path
 
+    # INativeAsyncBlockDeviceAPI:
+    def native_async_methods(self, reactor, threadpool):
+        """
+        Volumes are created, attached, detached and destroyed with calls made
+        in ``threadpool``, but waiting for them to change state happens in
+        the reactor: all the volumes being waited for are found by listing
+        the cluster's volumes once per poll, so no thread is tied up per
+        volume.
+
+        The poller is created with the first methods and shared by later
+        ones, so all of them should be given the same reactor and thread
+        pool.
+        """
+        if self._volume_poller is None:
+            self._volume_poller = BatchedStatePoller(
+                reactor, lambda volume_ids: deferToThreadPool(
+                    reactor, threadpool,
+                    preserve_context(self._describe_volumes), volume_ids))
+        poller = self._volume_poller
+
+        def in_thread(function, *args):
+            return deferToThreadPool(
+                reactor, threadpool, preserve_context(function), *args)
+
+        def create_volume(dataset_id, size):
+            creating = in_thread(self._start_create_volume, dataset_id, size)
+            creating.addCallback(
+                lambda requested_volume: poll_for_volume_state(
+                    poller, requested_volume, desired_state=u'available',
+                    transient_states=(u'creating',)))
+            creating.addCallback(_blockdevicevolume_from_cinder_volume)
+            return creating
+
+        def attach_volume(blockdevice_id, attach_to):
+            attaching = in_thread(
+                self._start_attach_volume, blockdevice_id, attach_to)
+
+            def started(result):
+                unattached_volume, nova_volume = result
+                waiting = poll_for_volume_state(
+                    poller, nova_volume, desired_state=u'in-use',
+                    transient_states=(u'available', u'attaching'))
+                waiting.addCallback(
+                    lambda _: unattached_volume.set('attached_to', attach_to))
+                return waiting
+            attaching.addCallback(started)
+            return attaching
+
+        def detach_volume(blockdevice_id):
+            detaching = in_thread(self._start_detach_volume, blockdevice_id)
+            detaching.addCallback(
+                lambda cinder_volume: poll_for_volume_state(
+                    poller, cinder_volume, desired_state=u'available',
+                    transient_states=(u'in-use', u'detaching')))
+            detaching.addCallback(lambda _: None)
+            return detaching
+
+        def destroy_volume(blockdevice_id):
+            destroying = in_thread(
+                self._start_destroy_volume, blockdevice_id)
+
+            def started(_):
+                start_time = reactor.seconds()
+
+                def deleted(cinder_volume):
+                    if cinder_volume is None:
+                        return True
+                    elapsed_time = reactor.seconds() - start_time
+                    if elapsed_time >= self._timeout:
+                        raise TimeoutException(
+                            blockdevice_id, None, elapsed_time)
+                    return False
+                waiting = wait_for_state(poller, blockdevice_id, deleted)
+                waiting.addCallback(lambda _: None)
+                return waiting
+            destroying.addCallback(started)
+            return destroying
+
+        return {
+            "create_volume": create_volume,
+            "attach_volume": attach_volume,
+            "detach_volume": detach_volume,
+            "destroy_volume": destroy_volume,
+        }
+
     # ICloudAPI:
     def list_live_nodes(self):
         return list(server.id for server in self.nova_server_manager.list())
 
 
+def is_throttled(exception):
+    """
+    :param Exception exception: An exception raised by a Cinder or Nova API
+        call.
+
+    :return: Whether ``exception`` means that the API rate limited the call.
+    """
+    return isinstance(
+        exception, (CinderOverLimit, NovaOverLimit, NovaRateLimit))
+
+
 def _is_virtio_blk(device_path):
     """
     Check whether the supplied device path is a virtio_blk device.
@@ -760,6 +970,24 @@ class _LoggingNovaServerManager(PClass):
     _nova_servers = field(mandatory=True)
 
 
+@auto_rate_limiting(ICinderVolumeManager, "_cinder_volumes")
+class _RateLimitedCinderVolumeManager(PClass):
+    _cinder_volumes = field(mandatory=True)
+    _rate_limiter = field(mandatory=True)
+
+
+@auto_rate_limiting(INovaVolumeManager, "_nova_volumes")
+class _RateLimitedNovaVolumeManager(PClass):
+    _nova_volumes = field(mandatory=True)
+    _rate_limiter = field(mandatory=True)
+
+
+@auto_rate_limiting(INovaServerManager, "_nova_servers")
+class _RateLimitedNovaServerManager(PClass):
+    _nova_servers = field(mandatory=True)
+    _rate_limiter = field(mandatory=True)
+
+
 def _openstack_auth_from_config(auth_plugin='password', **config):
     """
     Create an OpenStack authentication plugin from the given configuration.
@@ -872,13 +1100,16 @@ def get_nova_v2_client(session, region):
     )
 
 
-def cinder_from_configuration(region, cluster_id, **config):
+def cinder_from_configuration(region, cluster_id, rate_limiter=None,
+                              **config):
     """
     Build a ``CinderBlockDeviceAPI`` using configuration and credentials
     in ``config``.
 
     :param str region: The Openstack region to access.
     :param cluster_id: The unique identifier for the cluster to access.
+    :param RateLimiter rate_limiter: If not ``None``, every request to Cinder
+        and Nova is made through this.
     :param config: A dictionary of configuration options for Openstack.
     """
     session = get_keystone_session(**config)
@@ -895,6 +1126,15 @@ def cinder_from_configuration(region, cluster_id, **config):
     logging_nova_server_manager = _LoggingNovaServerManager(
         _nova_servers=nova_client.servers
     )
+    if rate_limiter is not None:
+        logging_cinder = _RateLimitedCinderVolumeManager(
+            _cinder_volumes=logging_cinder, _rate_limiter=rate_limiter)
+        logging_nova_volume_manager = _RateLimitedNovaVolumeManager(
+            _nova_volumes=logging_nova_volume_manager,
+            _rate_limiter=rate_limiter)
+        logging_nova_server_manager = _RateLimitedNovaServerManager(
+            _nova_servers=logging_nova_server_manager,
+            _rate_limiter=rate_limiter)
     return CinderBlockDeviceAPI(
         cinder_volume_manager=logging_cinder,
         nova_volume_manager=logging_nova_volume_manager,
@@ -6,7 +6,6 @@ An EBS implementation of the ``IBlockDeviceAPI``.
 """
 
 from types import NoneType
-from subprocess import check_output
 import threading
 import time
 import logging
@@ -28,25 +27,28 @@ from uuid import UUID
 from bitmath import Byte, GiB
 
 from characteristic import with_cmp
-from pyrsistent import PClass, field, pset, pmap, thaw
+from pyrsistent import PClass, field, pmap
 from zope.interface import implementer
 from twisted.python.constants import (
     Names, NamedConstant, Values, ValueConstant
 )
 from twisted.python.filepath import FilePath
+from twisted.internet.threads import deferToThreadPool
 
-from eliot import Message, register_exception_extractor
+from eliot import Message, register_exception_extractor, preserve_context
 
 from .blockdevice import (
-    IBlockDeviceAPI, IProfiledBlockDeviceAPI, BlockDeviceVolume, UnknownVolume,
-    AlreadyAttachedVolume, UnattachedVolume, UnknownInstanceID,
-    MandatoryProfiles, ICloudAPI,
+    IBlockDeviceAPI, IProfiledBlockDeviceAPI, INativeAsyncBlockDeviceAPI,
+    BlockDeviceVolume, UnknownVolume, AlreadyAttachedVolume,
+    UnattachedVolume, UnknownInstanceID, MandatoryProfiles, ICloudAPI,
 )
 
 from ..exceptions import StorageInitializationError
 
 from ...control import pmap_field
 
+from ._devices import SYS_BLOCK, DeviceArrivals
+from ._poller import BatchedStatePoller, wait_for_state
 from ._logging import (
     AWS_ACTION, NO_AVAILABLE_DEVICE,
     NO_NEW_DEVICE_IN_OS, WAITING_FOR_VOLUME_STATUS_CHANGE,
@@ -66,6 +68,19 @@ BOTO_NUM_RETRIES = 20
 VOLUME_STATE_CHANGE_TIMEOUT = 300
 MAX_ATTACH_RETRIES = 3
 
+# The most volumes EC2 returns in one page of a ``DescribeVolumes`` call:
+LIST_VOLUMES_PAGE_SIZE = 500
+
+# The most volume IDs that one ``DescribeVolumes`` filter can match:
+DESCRIBE_VOLUMES_BATCH_SIZE = 200
+
+# The longest time, in seconds, to wait for a notification of a new device
+# before looking for it again:
+_DEVICE_RESCAN_INTERVAL = 1.0
+
+# Notification of new devices, shared by all the attaches in this process:
+_DEVICE_ARRIVALS = DeviceArrivals()
+
 # Minimum IOPS per second for a provisioned IOPS volume.
 IOPS_MIN_IOPS = 100
 # Minimum size in GiB for a provisioned IPS volume.
@@ -78,6 +93,9 @@ INVALID_PARAMETER_VALUE = u'InvalidParameterValue'
 
 VOLUME_ATTACHMENT_BUSY = u"busy"
 
+# The error codes EC2 uses when it throttles API calls:
+THROTTLED = frozenset({u'RequestLimitExceeded', u'Throttling'})
+
 
 # Register Eliot field extractor for ClientError responses.
 register_exception_extractor(
@@ -548,6 +566,41 @@ def boto3_log(method):
     return _run_with_logging
 
 
+def is_throttled(exception):
+    """
+    :param Exception exception: An exception raised by an EC2 API call.
+
+    :return: Whether ``exception`` means that EC2 throttled the call.
+    """
+    return (isinstance(exception, ClientError) and
+            exception.response['Error']['Code'] in THROTTLED)
+
+
+def _limit_requests(client, rate_limiter):
+    """
+    Make every request a boto3 EC2 client sends, including each page of a
+    paginated listing, go through a ``RateLimiter``.
+
+    botocore retries some failed requests itself; the limiter sees the
+    final answer.
+
+    :param botocore.client.BaseClient client: The client.
+    :param RateLimiter rate_limiter: The rate limiter to charge for each
+        request, and to tell about each answer.
+    """
+    def before_call(**kwargs):
+        rate_limiter.charge()
+
+    def after_call(http_response, parsed, model, **kwargs):
+        if http_response.status_code >= 300:
+            rate_limiter.answered(ClientError(parsed, model.name))
+        else:
+            rate_limiter.answered()
+
+    client.meta.events.register('before-call.ec2', before_call)
+    client.meta.events.register('after-call.ec2', after_call)
+
+
 def _get_volume_tag(volume, name):
     """
     Retrieve the tag from the specified volume with the specified name.
@@ -637,8 +690,6 @@ def _should_finish(operation, volume, update, start_time,
     start_state = state_flow.start_state.value
     transient_state = state_flow.transient_state.value
     end_state = state_flow.end_state.value
-    sets_attach = state_flow.sets_attach
-    unsets_attach = state_flow.unsets_attach
 
     if time.time() - start_time > timeout:
         # We either:
@@ -657,6 +708,31 @@ def _should_finish(operation, volume, update, start_time,
         if e.response['Error']['Code'] == NOT_FOUND:
             raise UnknownVolume(volume.id)
 
+    return _reached_end_state(operation, volume)
+
+
+def _reached_end_state(operation, volume):
+    """
+    Determine whether a volume has reached the expected end state of an
+    operation, given its latest state.
+
+    :param NamedConstant operation: Operation performed on given volume.
+    :param boto3.resources.factory.ec2.Volume: Target volume of given
+        operation, with its latest state.
+
+    :raises UnexpectedStateException: If the volume is in a state that the
+        operation doesn't lead through.
+
+    :returns: True or False indicating end of wait for volume state transition.
+    :rtype: bool
+    """
+    state_flow = VOLUME_STATE_TABLE.table[operation]
+    start_state = state_flow.start_state.value
+    transient_state = state_flow.transient_state.value
+    end_state = state_flow.end_state.value
+    sets_attach = state_flow.sets_attach
+    unsets_attach = state_flow.unsets_attach
+
     if volume.state not in [start_state, transient_state, end_state]:
         raise UnexpectedStateException(unicode(volume.id), operation,
                                        start_state, transient_state, end_state,
@@ -715,7 +791,53 @@ def _wait_for_volume_state_change(operation,
                                          wait_time=(time.time() - start_time))
 
 
-def _get_device_size(device):
+def _poll_for_volume_state_change(reactor, poller, operation, volume,
+                                  timeout=VOLUME_STATE_CHANGE_TIMEOUT):
+    """
+    Wait for a given volume to change state like
+    ``_wait_for_volume_state_change``, but without blocking a thread: the
+    volume is described by the next poll of all the volumes being waited
+    for.
+
+    :param IReactorTime reactor: The reactor used to measure the timeout.
+    :param BatchedStatePoller poller: The poller of EBS volumes, which
+        describes them as ``DescribeVolumes`` does.
+    :param NamedConstant operation: Operation triggering volume state change.
+        A value from ``VolumeOperations``.
+    :param boto3.resources.factory.ec2.Volume: Volume to check status for.
+    :param int timeout: Seconds to wait for volume operation to succeed.
+
+    :returns: ``Deferred`` that fires with the updated volume, or fails with
+        ``UnknownVolume`` if it no longer exists, or with the exceptions
+        ``_wait_for_volume_state_change`` raises.
+    """
+    state_flow = VOLUME_STATE_TABLE.table[operation]
+    start_time = reactor.seconds()
+
+    def reached(description):
+        if description is None:
+            raise UnknownVolume(volume.id)
+        volume.meta.data = description
+        if _reached_end_state(operation, volume):
+            return True
+        wait_time = reactor.seconds() - start_time
+        if wait_time > timeout:
+            raise TimeoutException(
+                unicode(volume.id), operation, state_flow.start_state.value,
+                state_flow.transient_state.value,
+                state_flow.end_state.value, volume.state)
+        WAITING_FOR_VOLUME_STATUS_CHANGE(
+            volume_id=volume.id, status=volume.state,
+            target_status=state_flow.end_state.value,
+            needs_attach_data=state_flow.sets_attach,
+            wait_time=int(wait_time)).write()
+        return False
+    waiting = wait_for_state(poller, volume.id, reached)
+    waiting.addCallback(lambda description: volume)
+    return waiting
+
+
+def _get_device_size(device, sys_block=SYS_BLOCK):
     """
     Helper function to fetch the size of given block device.
 
@@ -732,15 +854,17 @@ def _get_device_size(device):
     * https://github.com/karelzak/util-linux/tree/master/disk-utils
 
     :param unicode device: Name of the block device to fetch size for.
+    :param FilePath sys_block: Where the kernel lists block devices.
 
     :returns: Size, in SI metric bytes, of device we are interested in.
     :rtype: int
     """
-    size_file = FilePath('/sys/block/{}/size'.format(device))
+    size_file = sys_block.child(device).child(b"size")
     return int(size_file.getContent()) * 512
 
 
-def _wait_for_new_device(base, expected_size, time_limit=60):
+def _wait_for_new_device(base, expected_size, time_limit=60,
+                         names=None, arrivals=None, sys_block=SYS_BLOCK):
     """
     Helper function to wait for up to 60s for new
     EBS block device (`/dev/sd*` or `/dev/xvd*`) to
@@ -753,20 +877,38 @@ def _wait_for_new_device(base, expected_size, time_limit=60):
         manifest in the OS.
     :param int time_limit: Time, in seconds, to wait for
         new device to manifest. Defaults to 60s.
+    :param names: The kernel names the device may be given, as a
+        ``frozenset`` of ``bytes``, or ``None`` to accept any ``sd*`` or
+        ``xvd*`` device.  Concurrent attaches must each give the names of
+        their own device, so that they can't mistake the device another
+        attach is waiting for for theirs.
+    :param DeviceArrivals arrivals: Notification of new devices, or
+        ``None`` to use the one shared by this process.
+    :param FilePath sys_block: Where the kernel lists block devices.
 
     :returns: The path of the new block device file.
     :rtype: ``FilePath``
     """
+    if arrivals is None:
+        arrivals = _DEVICE_ARRIVALS
     start_time = time.time()
     elapsed_time = time.time() - start_time
     while elapsed_time < time_limit:
-        for device in list(set(FilePath(b"/sys/block").children()) -
-                           set(base)):
+        # Devices added after this won't be missed by ``arrivals.wait``:
+        cursor = arrivals.cursor()
+        for device in list(set(sys_block.children()) - set(base)):
             device_name = device.basename()
-            if (device_name.startswith((b"sd", b"xvd")) and
-                    _get_device_size(device_name) == expected_size):
+            if names is None:
+                wanted = device_name.startswith((b"sd", b"xvd"))
+            else:
+                wanted = device_name in names
+            if wanted and _get_device_size(
+                    device_name, sys_block) == expected_size:
                 return FilePath(b"/dev").child(device_name)
-        time.sleep(0.1)
+        # Look again when a device is added, or after a while anyway in
+        # case a notification was missed:
+        arrivals.wait(
+            cursor, min(_DEVICE_RESCAN_INTERVAL, time_limit - elapsed_time))
         elapsed_time = time.time() - start_time
 
     # If we failed to find a new device of expected size,
@@ -774,10 +916,10 @@ def _wait_for_new_device(base, expected_size, time_limit=60):
     # for debuggability.
     new_devices = list(
         device.basename()
-        for device in set(FilePath(b"/sys/block").children()) - set(base)
+        for device in set(sys_block.children()) - set(base)
     )
     new_devices_size = list(
-        _get_device_size(device_name)
+        _get_device_size(device_name, sys_block)
         for device_name in new_devices
     )
     NO_NEW_DEVICE_IN_OS(new_devices=new_devices,
@@ -813,7 +955,8 @@ def _is_cluster_volume(cluster_id, ebs_volume):
 
 
 def _attach_volume_and_wait_for_device(
-    volume, attach_to, attach_volume, detach_volume, device, blockdevices
+    volume, attach_to, attach_volume, detach_volume, device, blockdevices,
+    names=None,
 ):
     """
     Attempt to attach an EBS volume to an EC2 instance and wait for the
@@ -828,6 +971,8 @@ def _attach_volume_and_wait_for_device(
     :param list blockdevices: The OS device paths (as ``FilePath``) which are
         already present on the system before this operation is attempted
         (primarily useful to make testing easier).
+    :param names: The kernel names the device may be given, or ``None`` to
+        accept any new device; see ``_wait_for_new_device``.
     :raise: Anything ``attach_volume`` can raise.  Or
         ``AttachedUnexpectedDevice`` if the volume appears to become attached
         to the wrong OS device file.
@@ -851,10 +996,12 @@ def _attach_volume_and_wait_for_device(
         # picked (http://docs.aws.amazon.com/AWSEC2/latest/
         # UserGuide/device_naming.html), wait for new block device
         # to be available to the OS, and interpret it as ours.
-        # Wait under lock scope to reduce false positives.
+        # Only the names ``device`` may be given are accepted, so that a
+        # device attached by another attach isn't mistaken for ours.
         device_path = _wait_for_new_device(
             base=blockdevices,
             expected_size=volume.size,
+            names=names,
         )
         # We do, however, expect the attached device name to follow
         # a certain simple pattern.  Verify that now and signal an
@@ -884,26 +1031,130 @@ def _get_blockdevices():
     return FilePath(b"/sys/block").children()
 
 
+def _kernel_device_names(device):
+    """
+    :param unicode device: An EBS device name, e.g. ``u"/dev/sdf"``.
+
+    :return: A ``frozenset`` of the names the kernel may give the device,
+        e.g. ``{b"sdf", b"xvdf"}``.
+    """
+    suffix = device[len(u"/dev/sd"):].encode("ascii")
+    return frozenset([b"sd" + suffix, b"xvd" + suffix])
+
+
+class _DeviceReservations(object):
+    """
+    The EBS device names chosen by the attaches in progress on this node.
+
+    An attach reserves a device name until the volume is attached or the
+    attach fails, so that concurrent attaches choose different names without
+    having to wait for each other.  The devices in ``/sys/block`` are in use
+    whether or not they are reserved, so a name is only free if the kernel
+    doesn't have it either.
+
+    Devices available for EBS volume usage are ``/dev/sd[f-p]``.
+    XXX: Handle lack of free devices in ``/dev/sd[f-p]`` range
+    (see https://clusterhq.atlassian.net/browse/FLOC-1887).
+
+    :ivar blockdevices: No-argument callable returning the ``FilePath`` of
+        each block device in ``/sys/block``.
+    """
+    def __init__(self, blockdevices=_get_blockdevices):
+        """
+        :param blockdevices: See ``blockdevices`` above.
+        """
+        self.blockdevices = blockdevices
+        self._lock = threading.Lock()
+        # Reserved device names mapped to the volume being attached:
+        self._reserved = {}
+
+    def _free(self):
+        """
+        Find a device name that is neither in use nor reserved.  Called with
+        the lock held.
+
+        :returns: The ``unicode`` device name, or ``None`` if there aren't
+            any free device names.
+        """
+        in_use = set(device.basename() for device in self.blockdevices())
+        for device in self._reserved:
+            in_use |= _kernel_device_names(device)
+        sorted_devices = sorted(
+            device for device in in_use if device.startswith((b"xvd", b"sd"))
+        )
+        IN_USE_DEVICES(devices=sorted_devices).write()
+
+        for suffix in b"fghijklmonp":
+            file_name = u'/dev/sd' + unicode(suffix)
+            if not _kernel_device_names(file_name) & in_use:
+                return file_name
+
+        # Could not find any suitable device that is available
+        # for attachment. Log to Eliot before giving up.
+        NO_AVAILABLE_DEVICE(devices=sorted_devices).write()
+        return None
+
+    def next_device(self):
+        """
+        :returns: The ``unicode`` device name that will be reserved next, or
+            ``None`` if there aren't any free device names.
+        """
+        with self._lock:
+            return self._free()
+
+    def reserve(self, blockdevice_id):
+        """
+        Reserve a free device name.
+
+        :param unicode blockdevice_id: The volume that will be attached.
+
+        :returns: The reserved ``unicode`` device name, or ``None`` if there
+            aren't any free device names.
+        """
+        with self._lock:
+            device = self._free()
+            if device is not None:
+                self._reserved[device] = blockdevice_id
+            return device
+
+    def release(self, device):
+        """
+        Release a reserved device name.
+
+        :param unicode device: The device name.
+        """
+        with self._lock:
+            del self._reserved[device]
+
+
 @implementer(IBlockDeviceAPI)
 @implementer(IProfiledBlockDeviceAPI)
+@implementer(INativeAsyncBlockDeviceAPI)
 @implementer(ICloudAPI)
 class EBSBlockDeviceAPI(object):
     """
     An EBS implementation of ``IBlockDeviceAPI`` which creates
     block devices in an EC2 cluster using Boto APIs.
     """
-    def __init__(self, ec2_client, cluster_id):
+    def __init__(self, ec2_client, cluster_id, rate_limiter=None):
         """
         Initialize EBS block device API instance.
 
         :param _EC2 ec2_client: A record of EC2 connection and zone.
         :param UUID cluster_id: UUID of cluster for this
             API instance.
+        :param RateLimiter rate_limiter: If not ``None``, every request to
+            EC2 is made through this.
         """
         self.connection = ec2_client.connection
+        if rate_limiter is not None:
+            _limit_requests(self.connection.meta.client, rate_limiter)
         self.zone = ec2_client.zone
         self.cluster_id = cluster_id
-        self.lock = threading.Lock()
+        self._devices = _DeviceReservations()
+        # Volumes changed by the native asynchronous methods are polled
+        # together, by a poller created along with those methods:
+        self._volume_poller = None
 
     def allocation_unit(self):
         """
@@ -969,20 +1220,52 @@ class EBSBlockDeviceAPI(object):
         return volume
 
     @boto3_log
-    def _list_ebs_volumes(self, page_size=100):
+    def _list_ebs_volumes(self, page_size=LIST_VOLUMES_PAGE_SIZE):
         """
-        List all the volumes associated with this client's region.
-        Volumes are retrieved in lists limited to the specified page size,
-        then amalgamated to return a single list of all volumes.
+        List the volumes in this client's region that are tagged as
+        belonging to this cluster.  EC2 filters the volumes by tag, so the
+        volumes of other clusters or other users of the account aren't
+        retrieved at all.  Volumes are retrieved in lists limited to the
+        specified page size, then amalgamated to return a single list.
+
+        Each page is requested with a token from the previous one, so pages
+        can't be requested concurrently.
 
         :param int page_size: Maximum page size of each list of volumes.
 
         :return: A ``list`` of ``Volume`` objects.
         """
-        return list(itertools.chain.from_iterable(list(
-            volumes for volumes in
-            self.connection.volumes.page_size(page_size).pages()
-        )))
+        volumes = self.connection.volumes.filter(Filters=[{
+            'Name': 'tag:' + CLUSTER_ID_LABEL,
+            'Values': [unicode(self.cluster_id)],
+        }])
+        return list(itertools.chain.from_iterable(
+            volumes.page_size(page_size).pages()
+        ))
+
+    @boto3_log
+    def _describe_volumes(self, volume_ids):
+        """
+        Describe several volumes with as few calls as possible.  Volumes
+        are matched with a filter rather than by ID, so that EC2 leaves out
+        volumes that don't exist instead of failing the call.
+
+        :param list volume_ids: The IDs of the volumes to describe.
+
+        :return: A ``dict`` mapping the ID of each of the volumes that exists
+            to its description, as returned by ``DescribeVolumes``.
+        """
+        client = self.connection.meta.client
+        descriptions = {}
+        batch_size = DESCRIBE_VOLUMES_BATCH_SIZE
+        for start in range(0, len(volume_ids), batch_size):
+            response = client.describe_volumes(Filters=[{
+                'Name': 'volume-id',
+                'Values': volume_ids[start:start + batch_size],
+            }])
+            for description in response['Volumes']:
+                descriptions[description['VolumeId']] = description
+        return descriptions
 
     @boto3_log
     def _get_ebs_volume(self, blockdevice_id):
@@ -1037,47 +1320,12 @@ class EBSBlockDeviceAPI(object):
         """
         Get the next available EBS device name for this EC2 instance.
 
-        Devices available for EBS volume usage are ``/dev/sd[f-p]``.
-        Find the first device from this set that is currently not
-        in use.
-        XXX: Handle lack of free devices in ``/dev/sd[f-p]`` range
-        (see https://clusterhq.atlassian.net/browse/FLOC-1887).
-
         :returns unicode file_name: available device name for attaching
             EBS volume.
         :returns ``None`` if suitable EBS device names on this EC2
             instance are currently occupied.
         """
-
-        command = [b"/bin/lsblk", b"--output", b"KNAME"]
-        # Command result returns a list of kernel device names
-        # separated by line breaks, with KNAME as the output of the
-        # header row. The top line is therefore ignored in the filter
-        # below.
-        command_result = check_output(command)
-        local_devices = pset(filter(
-            lambda d: d.startswith(b"xvd") or d.startswith('sd'),
-            command_result.split("\n")[1:]
-        ))
-        sorted_devices = sorted(list(thaw(local_devices)))
-        IN_USE_DEVICES(devices=sorted_devices).write()
-
-        for suffix in b"fghijklmonp":
-            next_local_device = b'xvd' + suffix
-            next_local_sd_device = b'sd' + suffix
-            file_name = u'/dev/sd' + unicode(suffix)
-            possible_devices = [
-                next_local_device, next_local_sd_device
-            ]
-            if not any(
-                list(device in local_devices for device in possible_devices)
-            ):
-                return file_name
-
-        # Could not find any suitable device that is available
-        # for attachment. Log to Eliot before giving up.
-        NO_AVAILABLE_DEVICE(devices=sorted_devices).write()
-        return None
+        return self._devices.next_device()
 
     def create_volume(self, dataset_id, size):
         """
@@ -1093,6 +1341,23 @@ class EBSBlockDeviceAPI(object):
         as volume tag data.
         Open issues: https://clusterhq.atlassian.net/browse/FLOC-1792
         """
+        requested_volume = self._start_create_volume(
+            dataset_id, size, profile_name)
+
+        # Wait for created volume to reach 'available' state.
+        _wait_for_volume_state_change(VolumeOperations.CREATE,
+                                      requested_volume)
+
+        # Return created volume in BlockDeviceVolume format.
+        return _blockdevicevolume_from_ebs_volume(requested_volume)
+
+    def _start_create_volume(self, dataset_id, size, profile_name):
+        """
+        Request a new volume and tag it, without waiting for it to be
+        created.
+
+        :returns: The requested ``boto3.resources.factory.ec2.Volume``.
+        """
         requested_size = int(Byte(size).to_GiB().value)
         try:
             volume_type, iops = _volume_type_and_iops_for_profile_name(
@@ -1149,13 +1414,7 @@ class EBSBlockDeviceAPI(object):
             requested_volume=requested_volume.id,
             tags=metadata
         ).write()
-
-        # Wait for created volume to reach 'available' state.
-        _wait_for_volume_state_change(VolumeOperations.CREATE,
-                                      requested_volume)
-
-        # Return created volume in BlockDeviceVolume format.
-        return _blockdevicevolume_from_ebs_volume(requested_volume)
+        return requested_volume
 
     def list_volumes(self):
         """
@@ -1178,6 +1437,8 @@ class EBSBlockDeviceAPI(object):
 
         volumes = []
         for ebs_volume in ebs_volumes:
+            # EC2 already filtered by cluster, but tag filters match the
+            # value's text rather than the cluster's UUID:
             if _is_cluster_volume(self.cluster_id, ebs_volume):
                 volumes.append(
                     _blockdevicevolume_from_ebs_volume(ebs_volume)
@@ -1207,6 +1468,24 @@ class EBSBlockDeviceAPI(object):
             indicates use on an unsupported OS, a misunderstanding of the EBS
             device assignment rules, or some other bug in this implementation.
         """
+        attaching = self._start_attach_volume(blockdevice_id, attach_to)
+        if attaching is None:
+            return None
+        ebs_volume, attached_volume = attaching
+        _wait_for_volume_state_change(VolumeOperations.ATTACH, ebs_volume)
+        return attached_volume
+
+    def _start_attach_volume(self, blockdevice_id, attach_to):
+        """
+        Attach an EBS volume and wait for its device to appear, without
+        waiting for EBS to report it attached.
+
+        See ``attach_volume`` for the exceptions raised.
+
+        :returns: A ``tuple`` of the ``boto3.resources.factory.ec2.Volume``
+            and the attached ``BlockDeviceVolume``, or ``None`` if there was
+            no free device to attach it to.
+        """
         ebs_volume = self._get_ebs_volume(blockdevice_id)
         volume = _blockdevicevolume_from_ebs_volume(ebs_volume)
         if (volume.attached_to is not None or
@@ -1220,26 +1499,27 @@ class EBSBlockDeviceAPI(object):
 
         attached = False
         for attach_attempt in range(3):
-            with self.lock:
-                device = self._next_device()
-                if device is None:
-                    # XXX: Handle lack of free devices in ``/dev/sd[f-p]``.
-                    # (https://clusterhq.atlassian.net/browse/FLOC-1887).
-                    # No point in attempting an ``attach_volume``, return.
-                    return
+            # Attaches to different devices proceed concurrently: the
+            # device name is reserved rather than attaching under a lock.
+            device = self._devices.reserve(blockdevice_id)
+            if device is None:
+                # XXX: Handle lack of free devices in ``/dev/sd[f-p]``.
+                # (https://clusterhq.atlassian.net/browse/FLOC-1887).
+                # No point in attempting an ``attach_volume``, return.
+                return
+            try:
                 blockdevices = _get_blockdevices()
                 attached = _attach_volume_and_wait_for_device(
                     volume, attach_to,
                     self._attach_ebs_volume,
                     self._detach_ebs_volume,
                     device, blockdevices,
+                    names=_kernel_device_names(device),
                 )
-                if attached:
-                    _wait_for_volume_state_change(
-                        VolumeOperations.ATTACH, ebs_volume,
-                    )
-                    attached_volume = volume.set('attached_to', attach_to)
-                    return attached_volume
+            finally:
+                self._devices.release(device)
+            if attached:
+                return ebs_volume, volume.set('attached_to', attach_to)
 
         raise AttachFailed(volume.blockdevice_id, attach_to, device)
 
@@ -1255,6 +1535,17 @@ class EBSBlockDeviceAPI(object):
             blockdevice_id is not currently 'in-use'.
         :raises VolumeBusy: If the volume's attachment state is busy.
         """
+        ebs_volume = self._start_detach_volume(blockdevice_id)
+        _wait_for_volume_state_change(VolumeOperations.DETACH, ebs_volume)
+
+    def _start_detach_volume(self, blockdevice_id):
+        """
+        Request that an EBS volume be detached, without waiting for it to be.
+
+        See ``detach_volume`` for the exceptions raised.
+
+        :returns: The ``boto3.resources.factory.ec2.Volume``.
+        """
         ebs_volume = self._get_ebs_volume(blockdevice_id)
         if ebs_volume.state != VolumeStates.IN_USE.value:
             raise UnattachedVolume(blockdevice_id)
@@ -1285,8 +1576,7 @@ class EBSBlockDeviceAPI(object):
                 raise VolumeBusy(ebs_volume)
 
         self._detach_ebs_volume(blockdevice_id)
-
-        _wait_for_volume_state_change(VolumeOperations.DETACH, ebs_volume)
+        return ebs_volume
 
     @boto3_log
     def destroy_volume(self, blockdevice_id):
@@ -1300,6 +1590,22 @@ class EBSBlockDeviceAPI(object):
         :raises Exception: If we failed to destroy Flocker cluster volume
             corresponding to input blockdevice_id.
         """
+        ebs_volume = self._start_destroy_volume(blockdevice_id)
+        try:
+            _wait_for_volume_state_change(VolumeOperations.DESTROY,
+                                          ebs_volume)
+        except UnknownVolume:
+            return
+
+    @boto3_log
+    def _start_destroy_volume(self, blockdevice_id):
+        """
+        Request that an EBS volume be deleted, without waiting for it to be.
+
+        See ``destroy_volume`` for the exceptions raised.
+
+        :returns: The ``boto3.resources.factory.ec2.Volume``.
+        """
         destroy_result = None
         ebs_volume = self._get_ebs_volume(blockdevice_id)
         ebs_volume.load()
@@ -1308,16 +1614,11 @@ class EBSBlockDeviceAPI(object):
         else:
             raise InvalidStateException(
                 ebs_volume, ebs_volume.state, ['available'])
-        if destroy_result:
-            try:
-                _wait_for_volume_state_change(VolumeOperations.DESTROY,
-                                              ebs_volume)
-            except UnknownVolume:
-                return
-        else:
+        if not destroy_result:
             raise Exception(
                 'Failed to delete volume: {!r}'.format(blockdevice_id)
             )
+        return ebs_volume
 
     def get_device_path(self, blockdevice_id):
         """
@@ -1348,6 +1649,83 @@ class EBSBlockDeviceAPI(object):
 
         return _expected_device(ebs_volume.attachments[0]['Device'])
 
+    # INativeAsyncBlockDeviceAPI:
+    def native_async_methods(self, reactor, threadpool):
+        """
+        Volumes are created, attached, detached and destroyed with calls made
+        in ``threadpool``, but waiting for them to change state happens in
+        the reactor: all the volumes being waited for are described together
+        by one poll, so no thread is tied up per volume.
+
+        The poller is created with the first methods and shared by later
+        ones, so all of them should be given the same reactor and thread
+        pool.
+        """
+        if self._volume_poller is None:
+            self._volume_poller = BatchedStatePoller(
+                reactor, lambda volume_ids: deferToThreadPool(
+                    reactor, threadpool,
+                    preserve_context(self._describe_volumes), volume_ids))
+        poller = self._volume_poller
+
+        def in_thread(function, *args):
+            return deferToThreadPool(
+                reactor, threadpool, preserve_context(function), *args)
+
+        def wait(operation, ebs_volume):
+            return _poll_for_volume_state_change(
+                reactor, poller, operation, ebs_volume)
+
+        def create_volume(dataset_id, size):
+            creating = in_thread(
+                self._start_create_volume, dataset_id, size,
+                MandatoryProfiles.DEFAULT.value)
+            creating.addCallback(
+                lambda ebs_volume: wait(VolumeOperations.CREATE, ebs_volume))
+            creating.addCallback(_blockdevicevolume_from_ebs_volume)
+            return creating
+
+        def attach_volume(blockdevice_id, attach_to):
+            attaching = in_thread(
+                self._start_attach_volume, blockdevice_id, attach_to)
+
+            def started(result):
+                if result is None:
+                    return None
+                ebs_volume, attached_volume = result
+                waiting = wait(VolumeOperations.ATTACH, ebs_volume)
+                waiting.addCallback(lambda _: attached_volume)
+                return waiting
+            attaching.addCallback(started)
+            return attaching
+
+        def detach_volume(blockdevice_id):
+            detaching = in_thread(self._start_detach_volume, blockdevice_id)
+            detaching.addCallback(
+                lambda ebs_volume: wait(VolumeOperations.DETACH, ebs_volume))
+            detaching.addCallback(lambda _: None)
+            return detaching
+
+        def destroy_volume(blockdevice_id):
+            destroying = in_thread(
+                self._start_destroy_volume, blockdevice_id)
+
+            def started(ebs_volume):
+                waiting = wait(VolumeOperations.DESTROY, ebs_volume)
+                # The volume is gone once it can't be described any more:
+                waiting.addErrback(lambda failure: failure.trap(UnknownVolume))
+                waiting.addCallback(lambda _: None)
+                return waiting
+            destroying.addCallback(started)
+            return destroying
+
+        return {
+            "create_volume": create_volume,
+            "attach_volume": attach_volume,
+            "detach_volume": detach_volume,
+            "destroy_volume": destroy_volume,
+        }
+
     # ICloudAPI:
     @boto3_log
     def list_live_nodes(self):
@@ -1358,7 +1736,7 @@ class EBSBlockDeviceAPI(object):
 
 def aws_from_configuration(
     region, zone, access_key_id, secret_access_key, cluster_id,
-    session_token=None, validate_region=True
+    session_token=None, validate_region=True, rate_limiter=None
 ):
     """
     Build an ``EBSBlockDeviceAPI`` instance using configuration and
@@ -1377,6 +1755,8 @@ def aws_from_configuration(
     :param str session_token: The EC2 session token.
     :param bool validate_region: If False, do not attempt to validate the
         region and zone by calling out to AWS. Useful for testing.
+    :param RateLimiter rate_limiter: If not ``None``, every request to EC2
+        is made through this.
 
     :return: A ``EBSBlockDeviceAPI`` instance using the given parameters.
     """
@@ -1391,6 +1771,7 @@ def aws_from_configuration(
                 validate_region=validate_region,
             ),
             cluster_id=cluster_id,
+            rate_limiter=rate_limiter,
         )
     except (InvalidRegionError, InvalidZoneError) as e:
         raise StorageInitializationError(
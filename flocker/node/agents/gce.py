@@ -19,15 +19,19 @@ from googleapiclient import discovery
 from googleapiclient.errors import HttpError
 from oauth2client.gce import AppAssertionCredentials
 from socket import gethostname
+from twisted.internet.threads import deferToThreadPool
 from twisted.python.filepath import FilePath
 from uuid import UUID
 from zope.interface import implementer
+from eliot import preserve_context
 
 from .blockdevice import (
-    IBlockDeviceAPI, BlockDeviceVolume, AlreadyAttachedVolume, UnknownVolume,
-    UnattachedVolume
+    IBlockDeviceAPI, INativeAsyncBlockDeviceAPI, BlockDeviceVolume,
+    AlreadyAttachedVolume, UnknownVolume, UnattachedVolume
 )
+from ._poller import BatchedStatePoller, wait_for_state
 from ...common import poll_until
+from ...common._retry import LoopExceeded
 
 # GCE instances have a metadata server that can be queried for information
 # about the instance the code is being run on.
@@ -57,6 +61,46 @@ def _get_metadata_path(path):
 # The prefix added to dataset_ids to turn them into blockdevice_ids.
 _PREFIX = 'flocker-v1-'
 
+# The most disks GCE returns in one page of a list call:
+_LIST_PAGE_SIZE = 500
+
+# Seconds between polls of the operations being waited for.  Operations
+# usually finish within seconds, so polls don't back off:
+_OPERATION_POLL_INTERVAL = 1.0
+
+# How many polls an operation is waited for before giving up:
+_OPERATION_POLLS = 35
+
+
+def _poll_for_operation(poller, operation):
+    """
+    Wait for a GCE operation to complete without blocking a thread: the
+    operation is found by the next poll of all the operations being waited
+    for.
+
+    :param BatchedStatePoller poller: The poller of zone operations.
+    :param dict operation: The GCE operation resource dict of the operation
+        that was started.
+
+    :raises LoopExceeded: If the operation isn't done after
+        ``_OPERATION_POLLS`` polls.
+
+    :returns: ``Deferred`` that fires with a dict representing the concluded
+        GCE operation resource.
+    """
+    polls = []
+
+    def finished(latest_operation):
+        # TODO Logging
+        if (latest_operation is not None and
+                latest_operation['status'] == 'DONE'):
+            return True
+        polls.append(latest_operation)
+        if len(polls) >= _OPERATION_POLLS:
+            raise LoopExceeded(finished, latest_operation)
+        return False
+    return wait_for_state(poller, operation['name'], finished)
+
 
 def _blockdevice_id_to_dataset_id(blockdevice_id):
     """
@@ -100,6 +144,7 @@ def _extract_attached_to(disk):
 
 
 @implementer(IBlockDeviceAPI)
+@implementer(INativeAsyncBlockDeviceAPI)
 class GCEBlockDeviceAPI(object):
     """
     A GCE Persistent Disk (PD) implementation of ``IBlockDeviceAPI`` which
@@ -152,23 +197,30 @@ class GCEBlockDeviceAPI(object):
     """
     # TODO(mewert): Logging throughout.
 
-    def __init__(self, cluster_id, project, zone):
+    def __init__(self, cluster_id, project, zone, compute=None):
         """
         Initialize the GCEBlockDeviceAPI.
 
         :param unicode project: The project where all GCE operations will take
             place.
         :param unicode zone: The zone where all GCE operations will take place.
+        :param compute: The GCE compute API client, or ``None`` to create one
+            using this instance's service account.
         """
-        # TODO(mewert): Also enable credentials via service account private
-        # keys.
-        credentials = AppAssertionCredentials(
-            "https://www.googleapis.com/auth/cloud-platform")
-        self._compute = discovery.build(
-            'compute', 'v1', credentials=credentials)
+        if compute is None:
+            # TODO(mewert): Also enable credentials via service account
+            # private keys.
+            credentials = AppAssertionCredentials(
+                "https://www.googleapis.com/auth/cloud-platform")
+            compute = discovery.build(
+                'compute', 'v1', credentials=credentials)
+        self._compute = compute
         self._project = project
         self._zone = zone
         self._cluster_id = cluster_id
+        # Operations started by the native asynchronous methods are polled
+        # together, by a poller created along with those methods:
+        self._operation_poller = None
 
     def _disk_resource_description(self):
         """
@@ -179,9 +231,33 @@ class GCEBlockDeviceAPI(object):
         """
         return u"flocker-v1-cluster-id: " + unicode(self._cluster_id)
 
-    def _do_blocking_operation(self, function, **kwargs):
+    def _describe_operations(self, operation_names):
+        """
+        Get several zone operations with as few calls as possible.
+
+        :param list operation_names: The names of the operations to get.
+
+        :returns dict: A ``dict`` mapping the name of each of the operations
+            that was found to its GCE operation resource dict.
+        """
+        operations = self._compute.zoneOperations()
+        # Names only contain letters, digits and hyphens, so they can be
+        # used as regular expressions as they are:
+        request = operations.list(
+            project=self._project, zone=self._zone,
+            filter=u"name eq (%s)" % (u"|".join(operation_names),),
+            maxResults=_LIST_PAGE_SIZE)
+        descriptions = {}
+        while request is not None:
+            result = request.execute()
+            for operation in result.get('items', []):
+                descriptions[operation['name']] = operation
+            request = operations.list_next(request, result)
+        return descriptions
+
+    def _start_operation(self, function, **kwargs):
         """
-        Perform a GCE operation, blocking until the operation completes.
+        Start a GCE operation, without waiting for it to complete.
 
         This will call `function` with the passed in keyword arguments plus
         additional keyword arguments for project and zone which come from the
@@ -189,15 +265,25 @@ class GCEBlockDeviceAPI(object):
         `function` returns an object that has an `execute()` method that
         returns a GCE operation resource dict.
 
-        This function will then poll the operation until it reaches state
-        'DONE' or times out, and then returns the final operation resource
-        dict.
-
         :param function: Callable that takes keyword arguments project and
             zone, and returns an executable that results in a GCE operation
             resource dict as described above.
         :param kwargs: Additional keyword arguments to pass to function.
 
+        :returns dict: A dict representing the GCE operation resource.
+        """
+        args = dict(project=self._project, zone=self._zone)
+        args.update(kwargs)
+        return function(**args).execute()
+
+    def _wait_for_operation(self, operation):
+        """
+        Block until a GCE operation completes, by polling the operation until
+        it reaches state 'DONE' or times out.
+
+        :param dict operation: The GCE operation resource dict of the
+            operation that was started.
+
         :returns dict: A dict representing the concluded GCE operation
             resource.
         """
@@ -206,9 +292,6 @@ class GCEBlockDeviceAPI(object):
         # operation to specify its own timeout. Also pass a reactor in so you
         # can test the timeout error paths in unit tests. Also document what
         # happens on timeout.
-        args = dict(project=self._project, zone=self._zone)
-        args.update(kwargs)
-        operation = function(**args).execute()
         operation_name = operation['name']
 
         def finished_operation_result():
@@ -225,7 +308,8 @@ class GCEBlockDeviceAPI(object):
         # operations within GCE and use that information to determine
         # an appropriate timeout. Until that is done, use the
         # following arbitrary timeout.
-        return poll_until(finished_operation_result, [1]*35)
+        return poll_until(finished_operation_result,
+                          [_OPERATION_POLL_INTERVAL] * _OPERATION_POLLS)
 
     def allocation_unit(self):
         """
@@ -236,21 +320,51 @@ class GCEBlockDeviceAPI(object):
         """
         return int(GiB(1).to_Byte().value)
 
+    def _disk_resource_filter(self):
+        """
+        Returns a filter expression for listing only the disk resources of
+        this cluster.
+
+        Filter values are regular expressions that must match the whole
+        field, and can't contain spaces, so the space in the description is
+        matched by ``.``.
+
+        :returns unicode: The filter expression.
+        """
+        return u"description eq " + (
+            self._disk_resource_description().replace(u" ", u"."))
+
     def list_volumes(self):
-        # TODO(mewert) Walk the pages.
-        result = self._compute.disks().list(project=self._project,
-                                            zone=self._zone).execute()
-        return list(
-            BlockDeviceVolume(
-                blockdevice_id=unicode(disk['name']),
-                size=int(GiB(int(disk['sizeGb'])).to_Byte()),
-                attached_to=_extract_attached_to(disk),
-                dataset_id=_blockdevice_id_to_dataset_id(disk['name'])
+        """
+        Return the disks of this cluster.  GCE filters the disks by
+        description, so the disks of other clusters or other users of the
+        project aren't retrieved at all.
+
+        Each page is requested with a token from the previous one, so pages
+        can't be requested concurrently.
+        """
+        disks = self._compute.disks()
+        request = disks.list(project=self._project, zone=self._zone,
+                             filter=self._disk_resource_filter(),
+                             maxResults=_LIST_PAGE_SIZE)
+        volumes = []
+        while request is not None:
+            result = request.execute()
+            volumes.extend(
+                BlockDeviceVolume(
+                    blockdevice_id=unicode(disk['name']),
+                    size=int(GiB(int(disk['sizeGb'])).to_Byte()),
+                    attached_to=_extract_attached_to(disk),
+                    dataset_id=_blockdevice_id_to_dataset_id(disk['name'])
+                )
+                # There are no items at all if no disks matched:
+                for disk in result.get('items', [])
+                if (disk['name'].startswith(_PREFIX) and
+                    disk['description'] ==
+                    self._disk_resource_description())
             )
-            for disk in result['items']
-            if (disk['name'].startswith(_PREFIX) and
-                disk['description'] == self._disk_resource_description())
-        )
+            request = disks.list_next(request, result)
+        return volumes
 
     def compute_instance_id(self):
         """
@@ -262,6 +376,17 @@ class GCEBlockDeviceAPI(object):
         return unicode(gethostname())
 
     def create_volume(self, dataset_id, size):
+        operation, volume = self._start_create_volume(dataset_id, size)
+        self._wait_for_operation(operation)
+        return volume
+
+    def _start_create_volume(self, dataset_id, size):
+        """
+        Start creating a disk, without waiting for it to be created.
+
+        :returns: A ``tuple`` of the GCE operation resource dict and the
+            ``BlockDeviceVolume`` that will be created.
+        """
         blockdevice_id = _dataset_id_to_blockdevice_id(dataset_id)
         sizeGiB = int(Byte(size).to_GiB())
         config = dict(
@@ -270,13 +395,13 @@ class GCEBlockDeviceAPI(object):
             description=self._disk_resource_description(),
         )
         # TODO(mewert): Verify timeout and error conditions.
-        self._do_blocking_operation(
+        operation = self._start_operation(
             self._compute.disks().insert, body=config)
 
         # TODO(mewert): Test creating a volume in cluster A in this project
         # with the same UUID as a volume in cluster B in the same project.
         # make that the logs and errors make this error obvious to the user
-        return BlockDeviceVolume(
+        return operation, BlockDeviceVolume(
             blockdevice_id=blockdevice_id,
             size=int(GiB(sizeGiB).to_Byte()),
             attached_to=None,
@@ -284,6 +409,19 @@ class GCEBlockDeviceAPI(object):
         )
 
     def attach_volume(self, blockdevice_id, attach_to):
+        result = self._wait_for_operation(
+            self._start_attach_volume(blockdevice_id, attach_to))
+        return self._attached_volume(blockdevice_id, attach_to, result)
+
+    def _start_attach_volume(self, blockdevice_id, attach_to):
+        """
+        Start attaching a disk to an instance, without waiting for it to be
+        attached.
+
+        :raises UnknownVolume: If the disk doesn't exist.
+
+        :returns dict: The GCE operation resource dict.
+        """
         config = dict(
             deviceName=blockdevice_id,
             autoDelete=False,
@@ -297,7 +435,7 @@ class GCEBlockDeviceAPI(object):
             # TODO(mewert): Verify timeout and error conditions.
             # TODO(mewert): Test what happens when disk is attached RW to a
             #               different instance, raise the correct error.
-            result = self._do_blocking_operation(
+            return self._start_operation(
                 self._compute.instances().attachDisk,
                 instance=attach_to,
                 body=config
@@ -309,6 +447,18 @@ class GCEBlockDeviceAPI(object):
                 raise UnknownVolume(blockdevice_id)
             else:
                 raise e
+
+    def _attached_volume(self, blockdevice_id, attach_to, result):
+        """
+        Get the attached volume once an attach operation has completed.
+
+        :param dict result: The concluded GCE operation resource dict.
+
+        :raises AlreadyAttachedVolume: If the disk was attached to another
+            instance.
+
+        :returns BlockDeviceVolume: The attached volume.
+        """
         errors = result.get('error', {}).get('errors', [])
         for e in errors:
             if e.get('code') == u"RESOURCE_IN_USE_BY_ANOTHER_RESOURCE":
@@ -355,14 +505,22 @@ class GCEBlockDeviceAPI(object):
         return attached_to
 
     def detach_volume(self, blockdevice_id):
+        self._wait_for_operation(self._start_detach_volume(blockdevice_id))
+        return None
+
+    def _start_detach_volume(self, blockdevice_id):
+        """
+        Start detaching a disk, without waiting for it to be detached.
+
+        :returns dict: The GCE operation resource dict.
+        """
         attached_to = self._get_attached_to(blockdevice_id)
         # TODO(mewert): Test this race (something else detaches right at this
         # point). Might involve putting all GCE interactions behind a zope
         # interface and then using a proxy implementation to inject code.
-        self._do_blocking_operation(
+        return self._start_operation(
             self._compute.instances().detachDisk, instance=attached_to,
             deviceName=blockdevice_id)
-        return None
 
     def get_device_path(self, blockdevice_id):
         # TODO(mewert): Verify that we need this extra API call.
@@ -373,9 +531,20 @@ class GCEBlockDeviceAPI(object):
         return FilePath(u"/dev/disk/by-id/google-" + blockdevice_id)
 
     def destroy_volume(self, blockdevice_id):
+        self._wait_for_operation(self._start_destroy_volume(blockdevice_id))
+        return None
+
+    def _start_destroy_volume(self, blockdevice_id):
+        """
+        Start deleting a disk, without waiting for it to be deleted.
+
+        :raises UnknownVolume: If the disk doesn't exist.
+
+        :returns dict: The GCE operation resource dict.
+        """
         try:
             # TODO(mewert) verify timeouts and error conditions.
-            self._do_blocking_operation(
+            return self._start_operation(
                 self._compute.disks().delete,
                 disk=blockdevice_id
             )
@@ -384,4 +553,73 @@ class GCEBlockDeviceAPI(object):
                 raise UnknownVolume(blockdevice_id)
             else:
                 raise e
-        return None
+
+    # INativeAsyncBlockDeviceAPI:
+    def native_async_methods(self, reactor, threadpool):
+        """
+        Disks are created, attached, detached and destroyed with calls made
+        in ``threadpool``, but waiting for the operations to complete
+        happens in the reactor: all the operations being waited for are
+        found by one poll, so no thread is tied up per operation.
+
+        The poller is created with the first methods and shared by later
+        ones, so all of them should be given the same reactor and thread
+        pool.
+        """
+        if self._operation_poller is None:
+            self._operation_poller = BatchedStatePoller(
+                reactor, lambda operation_names: deferToThreadPool(
+                    reactor, threadpool,
+                    preserve_context(self._describe_operations),
+                    operation_names),
+                minimum_interval=_OPERATION_POLL_INTERVAL,
+                maximum_interval=_OPERATION_POLL_INTERVAL)
+        poller = self._operation_poller
+
+        def in_thread(function, *args):
+            return deferToThreadPool(
+                reactor, threadpool, preserve_context(function), *args)
+
+        def create_volume(dataset_id, size):
+            creating = in_thread(self._start_create_volume, dataset_id, size)
+
+            def started(result):
+                operation, volume = result
+                waiting = _poll_for_operation(poller, operation)
+                waiting.addCallback(lambda _: volume)
+                return waiting
+            creating.addCallback(started)
+            return creating
+
+        def attach_volume(blockdevice_id, attach_to):
+            attaching = in_thread(
+                self._start_attach_volume, blockdevice_id, attach_to)
+            attaching.addCallback(
+                lambda operation: _poll_for_operation(poller, operation))
+            attaching.addCallback(
+                lambda result: in_thread(
+                    self._attached_volume, blockdevice_id, attach_to,
+                    result))
+            return attaching
+
+        def detach_volume(blockdevice_id):
+            detaching = in_thread(self._start_detach_volume, blockdevice_id)
+            detaching.addCallback(
+                lambda operation: _poll_for_operation(poller, operation))
+            detaching.addCallback(lambda _: None)
+            return detaching
+
+        def destroy_volume(blockdevice_id):
+            destroying = in_thread(
+                self._start_destroy_volume, blockdevice_id)
+            destroying.addCallback(
+                lambda operation: _poll_for_operation(poller, operation))
+            destroying.addCallback(lambda _: None)
+            return destroying
+
+        return {
+            "create_volume": create_volume,
+            "attach_volume": attach_volume,
+            "detach_volume": detach_volume,
+            "destroy_volume": destroy_volume,
+        }
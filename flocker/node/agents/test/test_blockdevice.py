@@ -38,7 +38,8 @@ from testtools.deferredruntest import SynchronousDeferredRunTest
 from testtools.matchers import Equals
 
 from twisted.internet import reactor
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.task import Clock
 from twisted.python.components import proxyForInterface
 from twisted.python.runtime import platform
 from twisted.python.filepath import FilePath
@@ -46,7 +47,7 @@ from twisted.python.filepath import FilePath
 from eliot import start_action, write_traceback, Message, Logger
 from eliot.testing import (
     validate_logging, capture_logging,
-    LoggedAction, assertHasMessage, assertHasAction
+    LoggedAction, LoggedMessage, assertHasMessage, assertHasAction
 )
 
 from .strategies import blockdevice_volumes
@@ -75,12 +76,18 @@ from ..blockdevice import (
     INVALID_DEVICE_PATH,
     CREATE_VOLUME_PROFILE_DROPPED,
     DISCOVERED_RAW_STATE,
+    DISCOVERY_TIMINGS,
     ATTACH_VOLUME,
+    _DISCOVERY_CONCURRENCY,
 
     IBlockDeviceAsyncAPI,
     _SyncToThreadedAsyncAPIAdapter,
+    INativeAsyncBlockDeviceAPI,
+    _NativeAsyncAPIAdapter,
     allocated_size,
     ProcessLifetimeCache,
+    ProfiledBlockDeviceAPIAdapter,
+    VolumeListCache,
     FilesystemExists,
     UnknownInstanceID,
     get_blockdevice_volume,
@@ -107,7 +114,7 @@ from ...testtools import (
 )
 from ....testtools import (
     REALISTIC_BLOCKDEVICE_SIZE, run_process, make_with_init_tests, random_name,
-    AsyncTestCase, TestCase,
+    AsyncTestCase, TestCase, CustomException,
 )
 from ....control import (
     Dataset, Manifestation, Node, NodeState, Deployment, DeploymentState,
@@ -629,6 +636,76 @@ class BlockDeviceDeployerAsyncAPITests(TestCase):
         )
         self.assertIs(async_api, deployer.async_block_device_api)
 
+    def test_threadpool(self):
+        """
+        If the deployer has a thread pool of its own, the
+        ``_SyncToThreadedAsyncAPIAdapter`` uses it instead of the global
+        reactor's.
+        """
+        threadpool = NonThreadPool()
+        deployer = BlockDeviceDeployer(
+            hostname=u"192.0.2.1",
+            node_uuid=uuid4(),
+            block_device_api=UnusableAPI(),
+            threadpool=threadpool,
+        )
+        self.assertIs(
+            threadpool, deployer.async_block_device_api._threadpool)
+
+    def test_native(self):
+        """
+        If ``block_device_api`` provides ``INativeAsyncBlockDeviceAPI``, its
+        native asynchronous methods are called directly, and its other
+        methods are called in threads of the thread pool the native methods
+        are given.
+        """
+        volumes = [
+            BlockDeviceVolume(
+                blockdevice_id=u"123",
+                size=int(REALISTIC_BLOCKDEVICE_SIZE.to_Byte()),
+                dataset_id=uuid4()),
+        ]
+
+        @implementer(INativeAsyncBlockDeviceAPI)
+        class NativeAPI(UnusableAPI):
+            def native_async_methods(self, reactor, threadpool):
+                self.threadpool = threadpool
+                return {"list_volumes": lambda: succeed(volumes)}
+
+        threadpool = NonThreadPool()
+        api = NativeAPI()
+        deployer = BlockDeviceDeployer(
+            hostname=u"192.0.2.1",
+            node_uuid=uuid4(),
+            block_device_api=api,
+            threadpool=threadpool,
+        )
+        async_api = deployer.async_block_device_api
+        self.assertEqual(
+            (_NativeAsyncAPIAdapter, volumes, api, threadpool, threadpool),
+            (type(async_api),
+             self.successResultOf(async_api.list_volumes()),
+             async_api._threaded._sync, async_api._threaded._threadpool,
+             api.threadpool))
+
+    def test_native_through_caches(self):
+        """
+        The native asynchronous methods of the backend are used through the
+        caches that wrap it.
+        """
+        native_api = NativeProxy(loopbackblockdeviceapi_for_test(self))
+        deployer = BlockDeviceDeployer(
+            hostname=u"192.0.2.1",
+            node_uuid=uuid4(),
+            block_device_api=VolumeListCache(
+                ProcessLifetimeCache(native_api), ttl=10, clock=Clock()),
+            threadpool=NonThreadPool(),
+        )
+        listing = deployer.async_block_device_api.list_volumes()
+        self.assertEqual(
+            ([], [u"list_volumes"]),
+            (self.successResultOf(listing), native_api.native_calls))
+
 
 def assert_discovered_state(
     case,
@@ -685,6 +762,10 @@ class BlockDeviceDeployerDiscoverRawStateTests(TestCase):
             node_uuid=self.expected_uuid,
             hostname=self.expected_hostname,
             block_device_api=self.api,
+            _async_block_device_api=_SyncToThreadedAsyncAPIAdapter(
+                _sync=self.api, _reactor=NonReactor(),
+                _threadpool=NonThreadPool(),
+            ),
             mountroot=mountroot_for_test(self),
         )
 
@@ -693,7 +774,8 @@ class BlockDeviceDeployerDiscoverRawStateTests(TestCase):
         ``BlockDeviceDeployer._discover_raw_state`` returns a ``RawState``
         with the ``compute_instance_id`` that the ``api`` reports.
         """
-        raw_state = self.deployer._discover_raw_state()
+        raw_state = self.successResultOf(
+            self.deployer._discover_raw_state())
         self.assertEqual(
             raw_state.compute_instance_id,
             self.api.compute_instance_id(),
@@ -705,7 +787,8 @@ class BlockDeviceDeployerDiscoverRawStateTests(TestCase):
         ``RawState`` with empty ``volumes`` if the ``api`` reports
         no attached volumes.
         """
-        raw_state = self.deployer._discover_raw_state()
+        raw_state = self.successResultOf(
+            self.deployer._discover_raw_state())
         self.assertEqual(raw_state.volumes, [])
 
     def test_unattached_unmounted_device(self):
@@ -717,7 +800,8 @@ class BlockDeviceDeployerDiscoverRawStateTests(TestCase):
             dataset_id=uuid4(),
             size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
         )
-        raw_state = self.deployer._discover_raw_state()
+        raw_state = self.successResultOf(
+            self.deployer._discover_raw_state())
         self.assertEqual(raw_state.volumes, [
             unmounted,
         ])
@@ -742,8 +826,8 @@ class BlockDeviceDeployerDiscoverRawStateTests(TestCase):
         without_fs = self.api.attach_volume(without_fs.blockdevice_id,
                                             self.api.compute_instance_id())
         without_fs_device = self.api.get_device_path(without_fs.blockdevice_id)
-        devices_with_filesystems = self.deployer._discover_raw_state(
-            ).devices_with_filesystems
+        devices_with_filesystems = self.successResultOf(
+            self.deployer._discover_raw_state()).devices_with_filesystems
 
         self.assertEqual(
             dict(
@@ -756,6 +840,166 @@ class BlockDeviceDeployerDiscoverRawStateTests(TestCase):
                 without_fs=False))
 
 
+class _DeferredAsyncAPI(object):
+    """
+    An ``IBlockDeviceAsyncAPI``-alike whose discovery methods return
+    ``Deferred``\ s that the test fires.
+
+    :ivar list calls: Tuples of method name, argument and the ``Deferred``
+        returned.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def _call(self, name, argument=None):
+        d = Deferred()
+        self.calls.append((name, argument, d))
+        return d
+
+    def compute_instance_id(self):
+        return self._call("compute_instance_id")
+
+    def list_volumes(self):
+        return self._call("list_volumes")
+
+    def get_device_path(self, blockdevice_id):
+        return self._call("get_device_path", blockdevice_id)
+
+    def pending(self, name):
+        """
+        :return: ``list`` of the unfired ``Deferred``\ s for calls to the
+            named method.
+        """
+        return [d for (call, _, d) in self.calls
+                if call == name and not d.called]
+
+
+class _EmptyBlockDeviceManager(object):
+    """
+    An ``IBlockDeviceManager``-alike for a node with no mounts or
+    filesystems.
+
+    :ivar list probed: The ``list`` of blockdevices passed to each
+        ``probe_filesystems`` call.
+    """
+    def __init__(self):
+        self.probed = []
+
+    def get_mounts(self):
+        return []
+
+    def has_filesystem(self, blockdevice):
+        return False
+
+    def probe_filesystems(self, blockdevices):
+        self.probed.append(list(blockdevices))
+        return {blockdevice: False for blockdevice in blockdevices}
+
+
+class _FakeBlockDevicePath(FilePath):
+    """
+    A path that claims to be a block device.
+    """
+    def isBlockDevice(self):
+        return True
+
+
+class BlockDeviceDeployerConcurrentDiscoveryTests(TestCase):
+    """
+    Tests for the concurrency of ``BlockDeviceDeployer._discover_raw_state``.
+    """
+    def setUp(self):
+        super(BlockDeviceDeployerConcurrentDiscoveryTests, self).setUp()
+        self.api = _DeferredAsyncAPI()
+        self.manager = _EmptyBlockDeviceManager()
+        self.deployer = BlockDeviceDeployer(
+            node_uuid=uuid4(),
+            hostname=u"192.0.2.123",
+            block_device_api=UnusableAPI(),
+            _async_block_device_api=self.api,
+            block_device_manager=self.manager,
+        )
+        self.volumes = [
+            BlockDeviceVolume(
+                blockdevice_id=u"vol-%d" % (i,), size=int(GiB(1).bytes),
+                attached_to=u"this-node", dataset_id=uuid4())
+            for i in range(_DISCOVERY_CONCURRENCY + 5)
+        ]
+
+    def test_listing_concurrent(self):
+        """
+        The instance ID and the volumes are requested at the same time.
+        """
+        self.deployer._discover_raw_state()
+        self.assertEqual(
+            ["compute_instance_id", "list_volumes"],
+            [name for (name, _, _) in self.api.calls])
+
+    def test_device_paths_bounded(self):
+        """
+        The device paths of attached volumes are requested concurrently, but
+        no more than ``_DISCOVERY_CONCURRENCY`` at a time.
+        """
+        discovering = self.deployer._discover_raw_state()
+        [instance_id] = self.api.pending("compute_instance_id")
+        instance_id.callback(u"this-node")
+        [volumes] = self.api.pending("list_volumes")
+        volumes.callback(self.volumes)
+        outstanding = len(self.api.pending("get_device_path"))
+        while self.api.pending("get_device_path"):
+            self.api.pending("get_device_path")[0].callback(None)
+        raw_state = self.successResultOf(discovering)
+        self.assertEqual(
+            (_DISCOVERY_CONCURRENCY,
+             [volume.blockdevice_id for volume in self.volumes],
+             {}),
+            (outstanding,
+             [argument for (name, argument, _) in self.api.calls
+              if name == "get_device_path"],
+             raw_state.devices))
+
+    def test_filesystems_probed_together(self):
+        """
+        Once the device paths of all attached volumes are known, they are
+        checked for filesystems with a single ``probe_filesystems`` call.
+        """
+        discovering = self.deployer._discover_raw_state()
+        self.api.pending("compute_instance_id")[0].callback(u"this-node")
+        self.api.pending("list_volumes")[0].callback(self.volumes)
+        paths = []
+        while self.api.pending("get_device_path"):
+            path = _FakeBlockDevicePath(b"/dev/sd%d" % (len(paths),))
+            paths.append(path)
+            self.api.pending("get_device_path")[0].callback(path)
+        self.successResultOf(discovering)
+        self.assertEqual(
+            [set(paths)], [set(probed) for probed in self.manager.probed])
+
+    def test_failure(self):
+        """
+        If one of the calls fails, discovery fails with that failure.
+        """
+        discovering = self.deployer._discover_raw_state()
+        self.api.pending("list_volumes")[0].errback(CustomException())
+        self.api.pending("compute_instance_id")[0].callback(u"this-node")
+        self.failureResultOf(discovering, CustomException)
+
+    @capture_logging(None)
+    def test_timings(self, logger):
+        """
+        The duration of each phase of discovery is logged.
+        """
+        discovering = self.deployer._discover_raw_state()
+        self.api.pending("compute_instance_id")[0].callback(u"this-node")
+        self.api.pending("list_volumes")[0].callback([])
+        self.successResultOf(discovering)
+        [message] = LoggedMessage.of_type(logger.messages, DISCOVERY_TIMINGS)
+        self.assertEqual(
+            {u"compute_instance_id", u"list_volumes", u"get_mounts",
+             u"devices", u"total"},
+            set(message.message[u"durations"]))
+
+
 class BlockDeviceDeployerDiscoverStateTests(TestCase):
     """
     Tests for ``BlockDeviceDeployer.discover_state``.
@@ -770,6 +1014,10 @@ class BlockDeviceDeployerDiscoverStateTests(TestCase):
             node_uuid=self.expected_uuid,
             hostname=self.expected_hostname,
             block_device_api=self.api,
+            _async_block_device_api=_SyncToThreadedAsyncAPIAdapter(
+                _sync=self.api, _reactor=NonReactor(),
+                _threadpool=NonThreadPool(),
+            ),
             mountroot=mountroot_for_test(self),
         )
 
@@ -5264,6 +5512,29 @@ class CountingProxy(object):
         return counting_proxy
 
 
+@implementer(INativeAsyncBlockDeviceAPI)
+class NativeProxy(proxyForInterface(IBlockDeviceAPI, "_api")):
+    """
+    An ``IBlockDeviceAPI`` whose methods are also offered as native
+    asynchronous methods, which call the synchronous ones.
+
+    :ivar _api: Wrapped ``IBlockDeviceAPI`` provider.
+    :ivar list native_calls: The names of the native methods called.
+    """
+    def __init__(self, api):
+        self._api = api
+        self.native_calls = []
+
+    def native_async_methods(self, reactor, threadpool):
+        def native(name):
+            def call(*args, **kwargs):
+                self.native_calls.append(name)
+                return maybeDeferred(getattr(self._api, name), *args, **kwargs)
+            return call
+        return dict(
+            (name, native(name)) for name in IBlockDeviceAsyncAPI.names())
+
+
 class ProcessLifetimeCacheTests(TestCase):
     """
     Tests for the caching logic in ``ProcessLifetimeCache``.
@@ -5336,6 +5607,260 @@ class ProcessLifetimeCacheTests(TestCase):
         self.assertRaises(UnattachedVolume,
                           self.cache.get_device_path, attached_id1)
 
+    def test_native_not_provided(self):
+        """
+        ``ProcessLifetimeCache`` only provides ``INativeAsyncBlockDeviceAPI``
+        if the wrapped API does.
+        """
+        self.assertEqual(
+            (False, True),
+            (INativeAsyncBlockDeviceAPI.providedBy(self.cache),
+             INativeAsyncBlockDeviceAPI.providedBy(
+                 ProcessLifetimeCache(NativeProxy(self.api)))))
+
+    def test_native_cached(self):
+        """
+        The native ``compute_instance_id`` and ``get_device_path`` of the
+        wrapped API are cached like the synchronous ones, and the native
+        ``detach_volume`` drops the cached device path.
+        """
+        native_api = NativeProxy(self.counting_proxy)
+        cache = ProcessLifetimeCache(native_api)
+        methods = cache.native_async_methods(NonReactor(), NonThreadPool())
+        instance_ids = [
+            self.successResultOf(methods["compute_instance_id"]())
+            for _ in range(3)]
+        this_node = instance_ids[0]
+        volume = self.api.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE)
+        self.api.attach_volume(volume.blockdevice_id, this_node)
+        paths = [
+            self.successResultOf(
+                methods["get_device_path"](volume.blockdevice_id))
+            for _ in range(3)]
+        self.successResultOf(methods["detach_volume"](volume.blockdevice_id))
+        self.failureResultOf(
+            methods["get_device_path"](volume.blockdevice_id),
+            UnattachedVolume)
+        self.assertEqual(
+            ([this_node] * 3, [paths[0]] * 3,
+             [u"compute_instance_id", u"get_device_path", u"detach_volume",
+              u"get_device_path"]),
+            (instance_ids, paths, native_api.native_calls))
+
+
+class VolumeListCacheIBlockDeviceAPITests(
+        make_iblockdeviceapi_tests(
+            blockdevice_api_factory=lambda test_case: VolumeListCache(
+                loopbackblockdeviceapi_for_test(
+                    test_case, allocation_unit=LOOPBACK_ALLOCATION_UNIT
+                ), ttl=60, clock=Clock()),
+            minimum_allocatable_size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            device_allocation_unit=None,
+            unknown_blockdevice_id_factory=lambda test: unicode(uuid4()),
+        )
+):
+    """
+    Interface adherence Tests for ``VolumeListCache``.
+    """
+
+
+class VolumeListCacheTests(TestCase):
+    """
+    Tests for the caching logic in ``VolumeListCache``.
+    """
+    def setUp(self):
+        super(VolumeListCacheTests, self).setUp()
+        self.api = loopbackblockdeviceapi_for_test(self)
+        self.counting_proxy = CountingProxy(self.api)
+        self.clock = Clock()
+        self.cache = VolumeListCache(
+            self.counting_proxy, ttl=10, clock=self.clock)
+
+    def create_volume(self):
+        """
+        :return: A new ``BlockDeviceVolume`` created without going through
+            the cache.
+        """
+        return self.api.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE)
+
+    def test_cached_until_ttl(self):
+        """
+        ``list_volumes`` is only called on the wrapped API again once the TTL
+        has passed.
+        """
+        self.cache.list_volumes()
+        self.create_volume()
+        self.clock.advance(9)
+        cached = self.cache.list_volumes()
+        self.clock.advance(1)
+        refreshed = self.cache.list_volumes()
+        self.assertEqual(
+            ([], self.api.list_volumes(),
+             self.counting_proxy.num_calls("list_volumes"),
+             (self.cache.hits, self.cache.misses)),
+            (cached, refreshed, 2, (1, 2)))
+
+    def assert_updated(self):
+        """
+        The cached listing matches the wrapped API's, without having been
+        refreshed.
+        """
+        self.assertItemsEqual(self.api.list_volumes(),
+                              self.cache.list_volumes())
+        self.assertEqual(1, self.counting_proxy.num_calls("list_volumes"))
+
+    def test_create_volume(self):
+        """
+        A volume created through the cache is added to the cached listing.
+        """
+        self.cache.list_volumes()
+        self.cache.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE)
+        self.assert_updated()
+
+    def test_attach_detach_volume(self):
+        """
+        Volumes attached and detached through the cache are updated in the
+        cached listing.
+        """
+        attached = self.create_volume()
+        detached = self.create_volume()
+        this_node = self.api.compute_instance_id()
+        self.api.attach_volume(detached.blockdevice_id, this_node)
+        self.cache.list_volumes()
+        self.cache.attach_volume(attached.blockdevice_id, this_node)
+        self.cache.detach_volume(detached.blockdevice_id)
+        self.assert_updated()
+
+    def test_destroy_volume(self):
+        """
+        A volume destroyed through the cache is removed from the cached
+        listing.
+        """
+        volume = self.create_volume()
+        self.cache.list_volumes()
+        self.cache.destroy_volume(volume.blockdevice_id)
+        self.assert_updated()
+
+    def test_failure_invalidates(self):
+        """
+        If changing a volume fails the cached listing is dropped.
+        """
+        self.cache.list_volumes()
+        self.assertRaises(
+            UnknownVolume, self.cache.destroy_volume, unicode(uuid4()))
+        self.cache.list_volumes()
+        self.assertEqual(2, self.counting_proxy.num_calls("list_volumes"))
+
+    def test_no_volume_returned(self):
+        """
+        If the wrapped API doesn't return a volume after attaching one, the
+        cached listing is dropped.
+        """
+        volume = self.create_volume()
+        self.patch(self.counting_proxy, "attach_volume",
+                   lambda blockdevice_id, attach_to: None)
+        self.cache.list_volumes()
+        result = self.cache.attach_volume(
+            volume.blockdevice_id, self.api.compute_instance_id())
+        self.cache.list_volumes()
+        self.assertEqual(
+            (None, 2),
+            (result, self.counting_proxy.num_calls("list_volumes")))
+
+    def test_profiled(self):
+        """
+        If given an ``IProfiledBlockDeviceAPI`` provider, volumes created with
+        a profile are added to the cached listing.
+        """
+        profiled_api = ProfiledBlockDeviceAPIAdapter(_blockdevice_api=self.api)
+        cache = VolumeListCache(
+            self.counting_proxy, ttl=10, clock=self.clock,
+            profiled_api=profiled_api)
+        cache.list_volumes()
+        volume = cache.create_volume_with_profile(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            profile_name=u"gold")
+        self.assertEqual(
+            (True, False, [volume]),
+            (IProfiledBlockDeviceAPI.providedBy(cache),
+             IProfiledBlockDeviceAPI.providedBy(self.cache),
+             cache.list_volumes()))
+
+    def native_methods(self):
+        """
+        :return: The native asynchronous methods of a ``VolumeListCache``
+            around a ``NativeProxy`` of the wrapped API.
+        """
+        self.native_api = NativeProxy(self.counting_proxy)
+        self.cache = VolumeListCache(
+            self.native_api, ttl=10, clock=self.clock)
+        return self.cache.native_async_methods(NonReactor(), NonThreadPool())
+
+    def test_native_not_provided(self):
+        """
+        ``VolumeListCache`` only provides ``INativeAsyncBlockDeviceAPI`` if
+        the wrapped API does.
+        """
+        uncached = self.cache
+        self.native_methods()
+        self.assertEqual(
+            (False, True),
+            (INativeAsyncBlockDeviceAPI.providedBy(uncached),
+             INativeAsyncBlockDeviceAPI.providedBy(self.cache)))
+
+    def test_native_list_volumes(self):
+        """
+        The wrapped API's native ``list_volumes`` is cached like the
+        synchronous one, and its other native methods are passed on.
+        """
+        methods = self.native_methods()
+        volume = self.create_volume()
+        listings = [
+            self.successResultOf(methods["list_volumes"]()) for _ in range(2)]
+        self.successResultOf(methods["compute_instance_id"]())
+        self.assertEqual(
+            ([[volume]] * 2, [u"list_volumes", u"compute_instance_id"],
+             (1, 1)),
+            (listings, self.native_api.native_calls,
+             (self.cache.hits, self.cache.misses)))
+
+    def test_native_changes(self):
+        """
+        Volumes changed with the wrapped API's native methods are updated in
+        the cached listing.
+        """
+        methods = self.native_methods()
+        destroyed = self.create_volume()
+        this_node = self.api.compute_instance_id()
+        self.successResultOf(methods["list_volumes"]())
+        created = self.successResultOf(methods["create_volume"](
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE))
+        self.successResultOf(
+            methods["attach_volume"](created.blockdevice_id, this_node))
+        self.successResultOf(methods["detach_volume"](created.blockdevice_id))
+        self.successResultOf(
+            methods["destroy_volume"](destroyed.blockdevice_id))
+        self.assertEqual(
+            (u"create_volume", u"attach_volume", u"detach_volume",
+             u"destroy_volume"),
+            tuple(self.native_api.native_calls[1:]))
+        self.assert_updated()
+
+    def test_native_failure_invalidates(self):
+        """
+        If changing a volume with a native method fails the cached listing is
+        dropped.
+        """
+        methods = self.native_methods()
+        self.successResultOf(methods["list_volumes"]())
+        self.failureResultOf(
+            methods["destroy_volume"](unicode(uuid4())), UnknownVolume)
+        self.successResultOf(methods["list_volumes"]())
+        self.assertEqual(2, self.counting_proxy.num_calls("list_volumes"))
+
 
 def make_icloudapi_tests(
         blockdevice_api_factory,
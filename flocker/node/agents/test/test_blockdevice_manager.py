@@ -4,6 +4,7 @@
 Tests for ``flocker.node.agents.blockdevice_manager``.
 """
 
+from subprocess import STDOUT, check_call, check_output
 from uuid import uuid4
 
 from testtools import ExpectedException
@@ -12,6 +13,9 @@ from testtools.matchers import Not, FileExists
 from zope.interface.verify import verifyObject
 
 from ....testtools import TestCase
+from twisted.python.filepath import FilePath
+
+from .._mounttable import MountEntry, MountTable
 
 from ..blockdevice_manager import (
     BindMountError,
@@ -23,7 +27,11 @@ from ..blockdevice_manager import (
     MountInfo,
     Permissions,
     RemountError,
+    SyscallBlockDeviceManager,
     UnmountError,
+    _FilesystemProbeCache,
+    _MS_BIND, _MS_RDONLY, _MS_REMOUNT, _MOUNT_OPTION_FLAGS,
+    _detect_filesystem_type, _remount_arguments,
 )
 
 from .test_blockdevice import (
@@ -36,7 +44,10 @@ from .test_blockdevice import (
 class BlockDeviceManagerTests(TestCase):
     """
     Tests for flocker.node.agents.blockdevice_manager.BlockDeviceManager.
+
+    :cvar manager_type: The ``IBlockDeviceManager`` implementation to test.
     """
+    manager_type = BlockDeviceManager
 
     def setUp(self):
         """
@@ -44,7 +55,8 @@ class BlockDeviceManagerTests(TestCase):
         """
         super(BlockDeviceManagerTests, self).setUp()
         self.loopback_api = loopbackblockdeviceapi_for_test(self)
-        self.manager_under_test = BlockDeviceManager()
+        self.manager_under_test = self.manager_type(
+            _filesystem_probes=_FilesystemProbeCache())
         self.mountroot = mountroot_for_test(self)
 
     def _get_directory_for_mount(self):
@@ -258,3 +270,199 @@ class BlockDeviceManagerTests(TestCase):
         non_existent = self._get_directory_for_mount().child('non_existent')
         with ExpectedException(MakeTmpfsMountError, '.*non_existent.*'):
             self.manager_under_test.make_tmpfs_mount(non_existent)
+
+    def test_probe_filesystems(self):
+        """
+        ``probe_filesystems`` reports which of the given blockdevices have a
+        filesystem.
+        """
+        blockdevices = [self._get_free_blockdevice() for _ in range(4)]
+        for blockdevice in blockdevices[1::2]:
+            self.manager_under_test.make_filesystem(blockdevice, 'ext4')
+        self.assertEqual(
+            {blockdevice: index % 2 == 1
+             for index, blockdevice in enumerate(blockdevices)},
+            self.manager_under_test.probe_filesystems(blockdevices))
+
+    def test_probe_filesystems_cached(self):
+        """
+        ``probe_filesystems`` doesn't probe an unchanged blockdevice again,
+        except after ``make_filesystem`` was called for it.
+        """
+        blockdevice = self._get_free_blockdevice()
+
+        def probe():
+            return self.manager_under_test.probe_filesystems(
+                [blockdevice])[blockdevice]
+        probe()
+        check_output([b"mkfs", b"-t", b"ext4", b"-F", blockdevice.path],
+                     stderr=STDOUT)
+        cached = probe()
+        self.manager_under_test.make_filesystem(blockdevice, 'ext4')
+        self.assertEqual((False, True), (cached, probe()))
+
+    def test_has_filesystem_uncached(self):
+        """
+        ``has_filesystem`` always probes the blockdevice, since it is used
+        to make sure a filesystem isn't overwritten.
+        """
+        blockdevice = self._get_free_blockdevice()
+        self.manager_under_test.probe_filesystems([blockdevice])
+        check_output([b"mkfs", b"-t", b"ext4", b"-F", blockdevice.path],
+                     stderr=STDOUT)
+        self.assertTrue(self.manager_under_test.has_filesystem(blockdevice))
+
+
+class SyscallBlockDeviceManagerTests(BlockDeviceManagerTests):
+    """
+    Tests for ``SyscallBlockDeviceManager``.
+    """
+    manager_type = SyscallBlockDeviceManager
+
+    def test_remount_keeps_options(self):
+        """
+        Options of a mount are kept when it is remounted.
+        """
+        mountpoint = self._get_directory_for_mount()
+        check_call([b"mount", b"-t", b"tmpfs", b"-o", b"nosuid,noexec",
+                    b"tmpfs", mountpoint.path])
+        self.addCleanup(self.manager_under_test.unmount, mountpoint)
+        self.manager_under_test.remount(mountpoint, Permissions.READ_ONLY)
+        table = MountTable()
+        self.addCleanup(table.close)
+        self.assertEqual(
+            {b"ro", b"nosuid", b"noexec"},
+            {b"ro", b"nosuid", b"noexec"} & set(
+                table.by_mountpoint(mountpoint).options.split(b",")))
+
+
+class RemountArgumentsTests(TestCase):
+    """
+    Tests for ``_remount_arguments``.
+    """
+    def entry(self, root=b"/"):
+        """
+        :param bytes root: The directory of the filesystem that is mounted.
+
+        :return: A ``MountEntry`` for an ext4 filesystem mounted
+            ``noexec``.
+        """
+        return MountEntry(
+            mount_id=40, parent_id=20, device=b"202:80", root=FilePath(root),
+            mountpoint=FilePath(b"/flocker/x"), options=b"rw,noexec",
+            filesystem_type=b"ext4", source=b"/dev/xvdf",
+            super_options=b"rw,data=ordered")
+
+    def test_options_kept(self):
+        """
+        The flags for the mount's options and the filesystem's options are
+        passed again, except for whether it is read-only.
+        """
+        self.assertEqual(
+            (_MS_REMOUNT | _MS_RDONLY | _MOUNT_OPTION_FLAGS[b"noexec"],
+             b"data=ordered"),
+            _remount_arguments(self.entry(), Permissions.READ_ONLY))
+
+    def test_bind_mount(self):
+        """
+        A bind mount is remounted with ``MS_BIND`` so that only it changes,
+        without the filesystem's options.
+        """
+        self.assertEqual(
+            (_MS_REMOUNT | _MS_BIND | _MOUNT_OPTION_FLAGS[b"noexec"], None),
+            _remount_arguments(self.entry(b"/data"), Permissions.READ_WRITE))
+
+
+class DetectFilesystemTypeTests(TestCase):
+    """
+    Tests for ``_detect_filesystem_type``, using regular files in place of
+    blockdevices.
+    """
+    def test_ext4(self):
+        """
+        ext4 filesystems are detected.
+        """
+        image = self.make_temporary_file()
+        with image.open("w") as f:
+            f.truncate(1024 * 1024)
+        check_output([b"mkfs", b"-t", b"ext4", b"-F", image.path],
+                     stderr=STDOUT)
+        self.assertEqual(b"ext4", _detect_filesystem_type(image))
+
+    def test_unknown(self):
+        """
+        ``None`` is returned if there's no filesystem.
+        """
+        image = self.make_temporary_file()
+        with image.open("w") as f:
+            f.truncate(1024 * 1024)
+        self.assertIs(None, _detect_filesystem_type(image))
+
+
+class FilesystemProbeCacheTests(TestCase):
+    """
+    Tests for the caching of filesystem probes by ``BlockDeviceManager``,
+    using regular files in place of blockdevices.
+    """
+    def setUp(self):
+        super(FilesystemProbeCacheTests, self).setUp()
+        self.manager = BlockDeviceManager(
+            _filesystem_probes=_FilesystemProbeCache())
+        self.image = self.make_temporary_file()
+        self.resize(self.image, 1024 * 1024)
+
+    def resize(self, image, size):
+        """
+        Change the size of a file.
+
+        :param FilePath image: The file.
+        :param int size: Its new size in bytes.
+        """
+        with image.open("r+") as f:
+            f.truncate(size)
+
+    def probe(self):
+        """
+        :returns: Whether ``probe_filesystems`` reports a filesystem on the
+            image.
+        """
+        return self.manager.probe_filesystems([self.image])[self.image]
+
+    def format_externally(self, image):
+        """
+        Create a filesystem on a file without ``BlockDeviceManager``.
+        """
+        check_output([b"mkfs", b"-t", b"ext4", b"-F", image.path],
+                     stderr=STDOUT)
+
+    def test_replaced(self):
+        """
+        A different device at the same path is probed again.
+        """
+        self.probe()
+        replacement = self.make_temporary_file()
+        self.resize(replacement, 1024 * 1024)
+        self.format_externally(replacement)
+        replacement.moveTo(self.image)
+        self.assertTrue(self.probe())
+
+    def test_resized(self):
+        """
+        A device whose size changed is probed again.
+        """
+        self.probe()
+        self.format_externally(self.image)
+        self.resize(self.image, 2 * 1024 * 1024)
+        self.assertTrue(self.probe())
+
+    def test_overlapping_make_filesystem(self):
+        """
+        The result of a probe that started before ``make_filesystem`` was
+        called for any device is not cached.
+        """
+        cache = self.manager._filesystem_probes
+        generation = cache.generation
+        identity = object()
+        self.manager.make_filesystem(self.image, 'ext4')
+        cache.set(self.image, identity, False, generation)
+        self.assertIs(None, cache.get(self.image, identity))
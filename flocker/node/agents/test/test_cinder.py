@@ -4,8 +4,25 @@
 Tests for ``flocker.node.agents.cinder``.
 """
 
-from ..cinder import _openstack_verify_from_config
+from uuid import uuid4
 
+from cinderclient.exceptions import OverLimit, NotFound
+from novaclient.exceptions import RateLimit
+
+from twisted.internet.task import Clock
+
+from ..cinder import (
+    CLUSTER_ID_LABEL, DATASET_ID_LABEL, CinderBlockDeviceAPI,
+    UnexpectedStateException, _openstack_verify_from_config, is_throttled,
+    poll_for_volume_state, _RateLimitedCinderVolumeManager,
+)
+from ..testtools import (
+    FakeCinderVolume, FakeCinderVolumeManager, NonThreadedClock,
+)
+from .._poller import BatchedStatePoller
+from .._ratelimit import RateLimiter
+
+from ....common.test.test_thread import NonThreadPool
 from ....testtools import TestCase
 
 
@@ -61,3 +78,152 @@ class VerifyTests(TestCase):
             'verify_ca_path': '/a/path'
         }
         self.assertEqual(_openstack_verify_from_config(**config), False)
+
+
+class IsThrottledTests(TestCase):
+    """
+    Tests for ``is_throttled``.
+    """
+    def test_throttled(self):
+        """
+        Cinder's and Nova's rate limiting errors mean a call was throttled,
+        but other errors don't.
+        """
+        self.assertEqual(
+            [True, True, False],
+            [is_throttled(OverLimit(413)), is_throttled(RateLimit(429)),
+             is_throttled(NotFound(404))])
+
+
+class RateLimitedManagerTests(TestCase):
+    """
+    Tests for the rate limited wrappers of the Cinder and Nova clients.
+    """
+    def test_requests(self):
+        """
+        Each call to the Cinder volume manager is a request through the
+        ``RateLimiter``.
+        """
+        volume = FakeCinderVolume(id=unicode(uuid4()), size=1, metadata={})
+        limiter = RateLimiter(1000, 1000, is_throttled, Clock())
+        manager = _RateLimitedCinderVolumeManager(
+            _cinder_volumes=FakeCinderVolumeManager([volume]),
+            _rate_limiter=limiter)
+        manager.delete(volume.id)
+        self.assertEqual(([], 2),
+                         (manager.list(), limiter.calls))
+
+
+class ListVolumesTests(TestCase):
+    """
+    Tests for ``CinderBlockDeviceAPI.list_volumes``.
+    """
+    def test_filtered_by_cinder(self):
+        """
+        Only the volumes of this cluster are retrieved from Cinder.
+        """
+        cluster_id = uuid4()
+
+        def volume(cluster_id):
+            return FakeCinderVolume(
+                id=unicode(uuid4()), size=1,
+                metadata={CLUSTER_ID_LABEL: unicode(cluster_id),
+                          DATASET_ID_LABEL: unicode(uuid4())})
+        ours = [volume(cluster_id) for _ in range(3)]
+        others = [volume(uuid4()) for _ in range(10)]
+        manager = FakeCinderVolumeManager(others + ours)
+        api = CinderBlockDeviceAPI(
+            cinder_volume_manager=manager, nova_volume_manager=None,
+            nova_server_manager=None, cluster_id=cluster_id)
+        self.assertEqual(
+            (sorted(volume.id for volume in ours), 3),
+            (sorted(volume.blockdevice_id for volume in api.list_volumes()),
+             manager.returned))
+
+
+class PolledVolumesTests(TestCase):
+    """
+    Tests for ``CinderBlockDeviceAPI._describe_volumes`` and the native
+    asynchronous methods that poll with it.
+    """
+    def setUp(self):
+        super(PolledVolumesTests, self).setUp()
+        self.cluster_id = uuid4()
+        self.volumes = [
+            FakeCinderVolume(
+                id=unicode(uuid4()), size=1,
+                metadata={CLUSTER_ID_LABEL: unicode(self.cluster_id)})
+            for _ in range(5)]
+        self.manager = FakeCinderVolumeManager(self.volumes)
+        self.api = CinderBlockDeviceAPI(
+            cinder_volume_manager=self.manager, nova_volume_manager=None,
+            nova_server_manager=None, cluster_id=self.cluster_id)
+
+    def test_describe(self):
+        """
+        The requested volumes are found with one call, and other volumes
+        and volumes that don't exist are left out.
+        """
+        ids = [volume.id for volume in self.volumes[:3]] + [u"missing"]
+        self.assertEqual(
+            (sorted(ids[:-1]), 5),
+            (sorted(self.api._describe_volumes(ids)), self.manager.returned))
+
+    def test_native_destroy(self):
+        """
+        The native ``destroy_volume`` deletes the volume in the thread pool,
+        and its ``Deferred`` fires once a poll no longer finds the volume.
+        """
+        reactor = NonThreadedClock()
+        threadpool = NonThreadPool()
+        destroy_volume = self.api.native_async_methods(
+            reactor, threadpool)["destroy_volume"]
+        destroying = destroy_volume(self.volumes[0].id)
+        self.assertNoResult(destroying)
+        reactor.advance(0)
+        self.assertEqual(
+            (None, 4, 2),
+            (self.successResultOf(destroying), len(self.manager.volumes),
+             threadpool.calls))
+
+
+class PollForVolumeStateTests(TestCase):
+    """
+    Tests for ``poll_for_volume_state``.
+    """
+    def setUp(self):
+        super(PollForVolumeStateTests, self).setUp()
+        self.clock = Clock()
+        self.volume = FakeCinderVolume(
+            id=unicode(uuid4()), size=1, metadata={}, status=u"creating")
+        self.poller = BatchedStatePoller(
+            self.clock, lambda volume_ids: {self.volume.id: self.volume},
+            maximum_interval=1.0)
+
+    def test_reached(self):
+        """
+        The volume is polled until it reaches the desired state, and the
+        ``Deferred`` fires with it.
+        """
+        waiting = poll_for_volume_state(
+            self.poller, self.volume, desired_state=u"available",
+            transient_states=(u"creating",))
+        self.clock.advance(0)
+        self.assertNoResult(waiting)
+        self.volume.status = u"available"
+        self.clock.advance(1)
+        self.assertEqual(
+            (self.volume, 2),
+            (self.successResultOf(waiting), self.poller.polls))
+
+    def test_unexpected_state(self):
+        """
+        If the volume reaches a state other than the desired or transient
+        ones, the ``Deferred`` fails with ``UnexpectedStateException``.
+        """
+        self.volume.status = u"error"
+        waiting = poll_for_volume_state(
+            self.poller, self.volume, desired_state=u"available",
+            transient_states=(u"creating",))
+        self.clock.advance(0)
+        self.failureResultOf(waiting, UnexpectedStateException)
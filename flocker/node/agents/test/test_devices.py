@@ -0,0 +1,89 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.agents._devices``.
+"""
+
+from unittest import skipIf
+
+from ....testtools import TestCase
+from .. import _devices
+from .._devices import DeviceArrivals, DeviceEvent
+
+
+class DeviceArrivalsTests(TestCase):
+    """
+    Tests for ``DeviceArrivals``.
+    """
+    def setUp(self):
+        super(DeviceArrivalsTests, self).setUp()
+        self.dev = self.make_temporary_directory()
+        self.sys_block = self.make_temporary_directory()
+        self.arrivals = DeviceArrivals(
+            dev=self.dev, sys_block=self.sys_block)
+        self.addCleanup(self.arrivals.close)
+
+    def add_device(self, name, sectors, serial=None):
+        """
+        Make a block device appear.
+
+        :param bytes name: The kernel's name for the device.
+        :param int sectors: Its size in 512 byte sectors.
+        :param bytes serial: Its serial number, if it has one.
+        """
+        device = self.sys_block.child(name)
+        device.makedirs()
+        device.child(b"size").setContent(b"%d\n" % (sectors,))
+        if serial is not None:
+            device.child(b"serial").setContent(serial + b"\n")
+        self.dev.child(name).touch()
+
+    @skipIf(_devices.init is None, "inotify is not available.")
+    def test_added(self):
+        """
+        ``DeviceArrivals.wait`` returns an event for each block device added
+        after the cursor was taken, with its size and serial number, and
+        ignores other files.
+        """
+        cursor = self.arrivals.cursor()
+        self.dev.child(b"tty0").touch()
+        self.add_device(b"vdb", 4, b"0123456789")
+        self.add_device(b"xvdf", 8)
+        self.assertEqual(
+            [DeviceEvent(name=b"vdb", added=True, size=2048,
+                         serial=b"0123456789"),
+             DeviceEvent(name=b"xvdf", added=True, size=4096)],
+            self.arrivals.wait(cursor, 5.0))
+
+    @skipIf(_devices.init is None, "inotify is not available.")
+    def test_removed(self):
+        """
+        ``DeviceArrivals.wait`` returns an event for a block device that is
+        removed.
+        """
+        self.add_device(b"xvdf", 8)
+        cursor = self.arrivals.cursor()
+        self.dev.child(b"xvdf").remove()
+        self.assertEqual(
+            [DeviceEvent(name=b"xvdf", added=False)],
+            self.arrivals.wait(cursor, 5.0))
+
+    def test_timeout(self):
+        """
+        ``DeviceArrivals.wait`` returns no events if nothing happens before
+        the timeout.
+        """
+        cursor = self.arrivals.cursor()
+        self.assertEqual([], self.arrivals.wait(cursor, 0.01))
+
+    def test_unavailable(self):
+        """
+        If the directory can't be watched, ``DeviceArrivals.wait`` only
+        waits for ``poll_interval`` seconds, so that callers poll instead.
+        """
+        arrivals = DeviceArrivals(
+            dev=self.dev.child(b"missing"), sys_block=self.sys_block,
+            poll_interval=0.0)
+        self.assertEqual(
+            (False, []),
+            (arrivals.watching, arrivals.wait(arrivals.cursor(), 60.0)))
@@ -12,18 +12,29 @@ from hypothesis.strategies import lists, sampled_from, builds
 
 from bitmath import GiB
 
+import boto3
+from botocore.exceptions import ClientError
+
+from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath
 
 from eliot.testing import capture_logging, assertHasMessage
 
 from ..ebs import (
-    AttachedUnexpectedDevice, _expected_device,
+    AttachedUnexpectedDevice, EBSBlockDeviceAPI, _EC2, _expected_device,
     _attach_volume_and_wait_for_device, _get_blockdevices,
-    _get_device_size, _wait_for_new_device,
+    _get_device_size, _wait_for_new_device, is_throttled,
+    _DeviceReservations, _kernel_device_names, _limit_requests,
+    _poll_for_volume_state_change, VolumeOperations, TimeoutException,
+    UnexpectedStateException, CLUSTER_ID_LABEL, DATASET_ID_LABEL,
 )
+from ..testtools import FakeEC2Connection, FakeEC2Volume, NonThreadedClock
 from .._logging import NO_NEW_DEVICE_IN_OS
-from ..blockdevice import BlockDeviceVolume
+from .._poller import BatchedStatePoller
+from .._ratelimit import RateLimiter
+from ..blockdevice import BlockDeviceVolume, UnknownVolume
 
+from ....common.test.test_thread import NonThreadPool
 from ....testtools import CustomException, TestCase
 
 
@@ -242,3 +253,342 @@ class WaitForNewDeviceTests(TestCase):
                 time_limit=0,
             )
         )
+
+
+class _FakeArrivals(object):
+    """
+    A fake ``DeviceArrivals`` which calls a function instead of waiting.
+    """
+    def __init__(self, waited):
+        """
+        :param waited: No-argument callable called for each wait.
+        """
+        self.waited = waited
+
+    def cursor(self):
+        return 0
+
+    def wait(self, cursor, timeout):
+        self.waited()
+        return []
+
+
+class WaitForReservedDeviceTests(TestCase):
+    """
+    Tests for ``_wait_for_new_device`` when the kernel names of the device
+    are given.
+    """
+    def setUp(self):
+        super(WaitForReservedDeviceTests, self).setUp()
+        self.sys_block = FilePath(self.mktemp())
+        self.sys_block.makedirs()
+        self.size = int(GiB(1).to_Byte())
+
+    def add_device(self, name):
+        """
+        Make a block device appear.
+
+        :param bytes name: The kernel's name for the device.
+        """
+        device = self.sys_block.child(name)
+        device.makedirs()
+        device.child(b"size").setContent(b"%d\n" % (self.size // 512,))
+
+    def test_interleaved_attaches(self):
+        """
+        If another attach's device of the same size appears first, and that
+        attach has finished and released its device name, the device is
+        still not mistaken for the one being waited for.
+        """
+        devices = _DeviceReservations(blockdevices=self.sys_block.children)
+        first = devices.reserve(u"vol-1")
+        second = devices.reserve(u"vol-2")
+        # The second attach finishes first:
+        self.add_device(b"xvdg")
+        devices.release(second)
+        waits = []
+
+        def waited():
+            waits.append(None)
+            self.add_device(b"xvdf")
+
+        found = _wait_for_new_device(
+            base=[], expected_size=self.size,
+            names=_kernel_device_names(first),
+            arrivals=_FakeArrivals(waited),
+            sys_block=self.sys_block,
+        )
+        self.assertEqual(
+            ([u"/dev/sdf", u"/dev/sdg"], FilePath(b"/dev/xvdf"), 1),
+            ([first, second], found, len(waits)))
+
+
+class IsThrottledTests(TestCase):
+    """
+    Tests for ``is_throttled``.
+    """
+    def test_throttled(self):
+        """
+        EC2's throttling error codes mean a call was throttled, but other
+        errors don't.
+        """
+        def error(code):
+            return ClientError(
+                {u"Error": {u"Code": code, u"Message": u"Error"}},
+                u"DescribeVolumes")
+        self.assertEqual(
+            [True, True, False, False],
+            [is_throttled(error(u"RequestLimitExceeded")),
+             is_throttled(error(u"Throttling")),
+             is_throttled(error(u"InvalidVolume.NotFound")),
+             is_throttled(CustomException())])
+
+
+def ebs_volume(cluster_id, number):
+    """
+    :param cluster_id: The ``UUID`` of the volume's cluster, or ``None`` for
+        a volume that doesn't belong to a Flocker cluster.
+    :param int number: Makes the volume's identifier unique.
+
+    :return: A ``FakeEC2Volume``.
+    """
+    tags = None
+    if cluster_id is not None:
+        tags = [{'Key': CLUSTER_ID_LABEL, 'Value': unicode(cluster_id)},
+                {'Key': DATASET_ID_LABEL, 'Value': unicode(uuid4())}]
+    return FakeEC2Volume(id=u"vol-%08x" % (number,), size=1, tags=tags)
+
+
+class _FakeHTTPResponse(object):
+    """
+    The part of a ``botocore`` HTTP response that ``_limit_requests`` uses.
+    """
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class LimitRequestsTests(TestCase):
+    """
+    Tests for ``_limit_requests``.
+    """
+    def test_requests(self):
+        """
+        Every request the client sends, including each page of a listing, is
+        charged to the ``RateLimiter``, which is told about throttled
+        requests.
+        """
+        ec2 = boto3_volume(u"vol-1").meta.client
+        limiter = RateLimiter(1000, 1000, is_throttled, Clock())
+        _limit_requests(ec2, limiter)
+        responses = [
+            (_FakeHTTPResponse(200),
+             {u"Volumes": [{u"VolumeId": u"vol-1"}], u"NextToken": u"a"}),
+            (_FakeHTTPResponse(200),
+             {u"Volumes": [{u"VolumeId": u"vol-2"}]}),
+            (_FakeHTTPResponse(400),
+             {u"Error": {u"Code": u"RequestLimitExceeded",
+                         u"Message": u"Request limit exceeded."}}),
+        ]
+        # Answer requests instead of sending them to EC2:
+        ec2.meta.events.register(
+            'before-call.ec2', lambda **kwargs: responses.pop(0))
+        pages = list(ec2.get_paginator('describe_volumes').paginate())
+        self.assertRaises(ClientError, ec2.describe_volumes)
+        self.assertEqual(
+            (2, 3, 1), (len(pages), limiter.calls, limiter.throttles))
+
+
+class ListVolumesTests(TestCase):
+    """
+    Tests for ``EBSBlockDeviceAPI.list_volumes``.
+    """
+    def test_filtered_by_ec2(self):
+        """
+        Only the volumes of this cluster are retrieved from EC2, in as few
+        pages as possible.
+        """
+        cluster_id = uuid4()
+        ours = [ebs_volume(cluster_id, number) for number in range(700)]
+        others = (
+            [ebs_volume(uuid4(), number) for number in range(700, 1500)] +
+            [ebs_volume(None, number) for number in range(1500, 2000)])
+        connection = FakeEC2Connection(others + ours)
+        api = EBSBlockDeviceAPI(
+            _EC2(zone=u"us-east-1a", connection=connection), cluster_id)
+        volumes = api.list_volumes()
+        self.assertEqual(
+            (sorted(volume.id for volume in ours), 700, 2),
+            (sorted(volume.blockdevice_id for volume in volumes),
+             connection.returned, connection.requests))
+
+
+class DescribeVolumesTests(TestCase):
+    """
+    Tests for ``EBSBlockDeviceAPI._describe_volumes`` and the poller of the
+    native asynchronous methods that uses it.
+    """
+    def setUp(self):
+        super(DescribeVolumesTests, self).setUp()
+        self.volumes = [ebs_volume(uuid4(), number) for number in range(250)]
+        self.connection = FakeEC2Connection(self.volumes)
+        self.api = EBSBlockDeviceAPI(
+            _EC2(zone=u"us-east-1a", connection=self.connection), uuid4())
+
+    def test_batched(self):
+        """
+        The volumes are described with as few calls as EC2 allows, and
+        volumes that don't exist are left out.
+        """
+        ids = [volume.id for volume in self.volumes] + [u"vol-missing"]
+        descriptions = self.api._describe_volumes(ids)
+        self.assertEqual(
+            (sorted(ids[:-1]), 2),
+            (sorted(descriptions), self.connection.requests))
+
+    def test_native_poller(self):
+        """
+        The native asynchronous methods share one poller, which describes
+        volumes in the thread pool they are given.
+        """
+        reactor = NonThreadedClock()
+        threadpool = NonThreadPool()
+        self.api.native_async_methods(reactor, threadpool)
+        poller = self.api._volume_poller
+        self.api.native_async_methods(reactor, threadpool)
+        refreshing = poller.refresh(self.volumes[0].id)
+        reactor.advance(0)
+        self.assertEqual(
+            (poller, self.volumes[0].id, 1),
+            (self.api._volume_poller,
+             self.successResultOf(refreshing)['VolumeId'], threadpool.calls))
+
+
+def boto3_volume(volume_id):
+    """
+    :param unicode volume_id: The ID of the volume.
+
+    :return: A boto3 EC2 ``Volume`` whose state hasn't been loaded.
+    """
+    ec2 = boto3.resource(
+        'ec2', region_name='us-east-1', aws_access_key_id='key',
+        aws_secret_access_key='secret')
+    return ec2.Volume(volume_id)
+
+
+class PollForVolumeStateChangeTests(TestCase):
+    """
+    Tests for ``_poll_for_volume_state_change``.
+    """
+    def setUp(self):
+        super(PollForVolumeStateChangeTests, self).setUp()
+        self.clock = Clock()
+        self.states = []
+        self.poller = BatchedStatePoller(
+            self.clock, self.describe, maximum_interval=1.0)
+        self.volume = boto3_volume(u"vol-1")
+
+    def describe(self, volume_ids):
+        """
+        Describe the volume with the next of ``states``, or as missing if
+        that is ``None``.
+        """
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        if state is None:
+            return {}
+        return {self.volume.id: {
+            'VolumeId': self.volume.id, 'State': state, 'Attachments': [],
+        }}
+
+    def test_reached(self):
+        """
+        The volume is polled until it reaches the end state of the
+        operation, and the ``Deferred`` fires with the updated volume.
+        """
+        self.states = [u"creating", u"creating", u"available"]
+        waiting = _poll_for_volume_state_change(
+            self.clock, self.poller, VolumeOperations.CREATE, self.volume)
+        self.clock.pump([0, 1, 1])
+        self.assertEqual(
+            (self.volume, u"available", 3),
+            (self.successResultOf(waiting), self.volume.state,
+             self.poller.polls))
+
+    def test_unexpected_state(self):
+        """
+        If the volume reaches a state that the operation doesn't lead
+        through, the ``Deferred`` fails with ``UnexpectedStateException``.
+        """
+        self.states = [u"error"]
+        waiting = _poll_for_volume_state_change(
+            self.clock, self.poller, VolumeOperations.CREATE, self.volume)
+        self.clock.advance(0)
+        self.failureResultOf(waiting, UnexpectedStateException)
+
+    def test_missing(self):
+        """
+        If the volume no longer exists, the ``Deferred`` fails with
+        ``UnknownVolume``.
+        """
+        self.states = [None]
+        waiting = _poll_for_volume_state_change(
+            self.clock, self.poller, VolumeOperations.DESTROY, self.volume)
+        self.clock.advance(0)
+        self.failureResultOf(waiting, UnknownVolume)
+
+    def test_timeout(self):
+        """
+        If the volume doesn't reach the end state within the timeout, the
+        ``Deferred`` fails with ``TimeoutException``.
+        """
+        self.states = [u"creating"]
+        waiting = _poll_for_volume_state_change(
+            self.clock, self.poller, VolumeOperations.CREATE, self.volume,
+            timeout=10)
+        self.clock.pump([0] + [1] * 10)
+        self.assertNoResult(waiting)
+        self.clock.advance(1)
+        self.failureResultOf(waiting, TimeoutException)
+
+
+class DeviceReservationsTests(TestCase):
+    """
+    Tests for ``_DeviceReservations``.
+    """
+    def reservations(self, *names):
+        """
+        :param names: The kernel names of the block devices that exist.
+
+        :return: A ``_DeviceReservations`` seeing those block devices.
+        """
+        sys_block = FilePath(b"/sys/block")
+        return _DeviceReservations(
+            blockdevices=lambda: [sys_block.child(name) for name in names])
+
+    def test_distinct(self):
+        """
+        Concurrent attaches reserve different device names, skipping those
+        the kernel already has.
+        """
+        devices = self.reservations(b"xvda", b"xvdf")
+        self.assertEqual(
+            [u"/dev/sdg", u"/dev/sdh"],
+            [devices.reserve(u"vol-1"), devices.reserve(u"vol-2")])
+
+    def test_release(self):
+        """
+        A released device name can be reserved again.
+        """
+        devices = self.reservations()
+        device = devices.reserve(u"vol-1")
+        devices.release(device)
+        self.assertEqual(device, devices.reserve(u"vol-2"))
+
+    def test_exhausted(self):
+        """
+        ``None`` is reserved if every device name is in use.
+        """
+        devices = self.reservations(*[b"sd" + suffix
+                                      for suffix in b"fghijklmno"])
+        self.assertEqual(
+            (u"/dev/sdp", None),
+            (devices.reserve(u"vol-1"), devices.reserve(u"vol-2")))
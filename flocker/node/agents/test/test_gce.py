@@ -0,0 +1,146 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.agents.gce``.
+"""
+
+from uuid import uuid4
+
+from twisted.internet.task import Clock
+
+from ..gce import (
+    GCEBlockDeviceAPI, _dataset_id_to_blockdevice_id, _poll_for_operation,
+    _OPERATION_POLLS,
+)
+from ..testtools import FakeGCECompute, NonThreadedClock
+from .._poller import BatchedStatePoller
+
+from ....common._retry import LoopExceeded
+from ....common.test.test_thread import NonThreadPool
+from ....testtools import TestCase
+
+
+def gce_disk(cluster_id):
+    """
+    :param UUID cluster_id: The cluster the disk belongs to.
+
+    :return: A GCE disk resource ``dict`` for a new dataset.
+    """
+    return {
+        'name': _dataset_id_to_blockdevice_id(uuid4()),
+        'sizeGb': u"10",
+        'description': u"flocker-v1-cluster-id: " + unicode(cluster_id),
+    }
+
+
+class ListVolumesTests(TestCase):
+    """
+    Tests for ``GCEBlockDeviceAPI.list_volumes``.
+    """
+    def test_filtered_by_gce(self):
+        """
+        Only the disks of this cluster are retrieved from GCE, and every page
+        of them is retrieved.
+        """
+        cluster_id = uuid4()
+        ours = [gce_disk(cluster_id) for _ in range(700)]
+        others = [gce_disk(uuid4()) for _ in range(800)] + [
+            {'name': u"unrelated", 'sizeGb': u"10", 'description': u""}]
+        compute = FakeGCECompute(others + ours)
+        api = GCEBlockDeviceAPI(
+            cluster_id=cluster_id, project=u"project", zone=u"zone",
+            compute=compute)
+        volumes = api.list_volumes()
+        self.assertEqual(
+            (sorted(disk['name'] for disk in ours), 700, 2),
+            (sorted(volume.blockdevice_id for volume in volumes),
+             compute.returned, compute.requests))
+
+    def test_no_disks(self):
+        """
+        If no disks match, there are no volumes.
+        """
+        api = GCEBlockDeviceAPI(
+            cluster_id=uuid4(), project=u"project", zone=u"zone",
+            compute=FakeGCECompute([]))
+        self.assertEqual([], api.list_volumes())
+
+
+class DescribeOperationsTests(TestCase):
+    """
+    Tests for ``GCEBlockDeviceAPI._describe_operations`` and the poller of
+    the native asynchronous methods that uses it.
+    """
+    def setUp(self):
+        super(DescribeOperationsTests, self).setUp()
+        operations = [
+            {'name': u"operation-%d" % (number,), 'status': u"RUNNING"}
+            for number in range(10)]
+        self.compute = FakeGCECompute([], operations)
+        self.api = GCEBlockDeviceAPI(
+            cluster_id=uuid4(), project=u"project", zone=u"zone",
+            compute=self.compute)
+
+    def test_filtered_by_gce(self):
+        """
+        Only the requested operations are retrieved from GCE.
+        """
+        names = [u"operation-1", u"operation-7", u"operation-missing"]
+        self.assertEqual(
+            ([u"operation-1", u"operation-7"], 2),
+            (sorted(self.api._describe_operations(names)),
+             self.compute.returned))
+
+    def test_native_poller(self):
+        """
+        The native asynchronous methods share one poller, which describes
+        operations in the thread pool they are given.
+        """
+        reactor = NonThreadedClock()
+        threadpool = NonThreadPool()
+        self.api.native_async_methods(reactor, threadpool)
+        poller = self.api._operation_poller
+        self.api.native_async_methods(reactor, threadpool)
+        refreshing = poller.refresh(u"operation-3")
+        reactor.advance(0)
+        self.assertEqual(
+            (poller, u"RUNNING", 1),
+            (self.api._operation_poller,
+             self.successResultOf(refreshing)['status'], threadpool.calls))
+
+
+class PollForOperationTests(TestCase):
+    """
+    Tests for ``_poll_for_operation``.
+    """
+    def setUp(self):
+        super(PollForOperationTests, self).setUp()
+        self.clock = Clock()
+        self.operation = {'name': u"operation-1", 'status': u"RUNNING"}
+        self.poller = BatchedStatePoller(
+            self.clock,
+            lambda names: {self.operation['name']: dict(self.operation)},
+            minimum_interval=1.0, maximum_interval=1.0)
+
+    def test_done(self):
+        """
+        The operation is polled until it is done, and the ``Deferred`` fires
+        with the concluded operation.
+        """
+        waiting = _poll_for_operation(self.poller, self.operation)
+        self.clock.advance(0)
+        self.assertNoResult(waiting)
+        self.operation['status'] = u"DONE"
+        self.clock.advance(1)
+        self.assertEqual(
+            {'name': u"operation-1", 'status': u"DONE"},
+            self.successResultOf(waiting))
+
+    def test_timeout(self):
+        """
+        If the operation isn't done after ``_OPERATION_POLLS`` polls, the
+        ``Deferred`` fails with ``LoopExceeded``.
+        """
+        waiting = _poll_for_operation(self.poller, self.operation)
+        self.clock.pump([0] + [1] * (_OPERATION_POLLS - 1))
+        self.failureResultOf(waiting, LoopExceeded)
@@ -0,0 +1,118 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.agents._mounttable``.
+"""
+
+from subprocess import check_call
+
+from twisted.python.filepath import FilePath
+
+from ....testtools import TestCase, if_root
+from .._mounttable import MountEntry, MountTable, parse_mountinfo
+
+
+MOUNTINFO = (
+    b"20 1 253:1 / / rw,relatime shared:1 - ext4 /dev/vda1 rw,data=ordered\n"
+    b"21 20 0:5 / /proc rw,nosuid - proc proc rw\n"
+    b"22 20 202:80 /data /flocker/with\\040space rw master:2 shared:3 - "
+    b"ext4 /dev/xvdf rw\n"
+    b"23 20 0:40 / /tmp rw - tmpfs none rw\n"
+)
+
+FILESYSTEMS = (
+    b"nodev\tproc\n"
+    b"nodev\ttmpfs\n"
+    b"\text4\n"
+)
+
+
+class ParseMountInfoTests(TestCase):
+    """
+    Tests for ``parse_mountinfo``.
+    """
+    def test_parse(self):
+        """
+        Each line is parsed into a ``MountEntry``, skipping any optional
+        fields and unescaping paths.
+        """
+        self.assertEqual(
+            MountEntry(
+                mount_id=22, parent_id=20, device=b"202:80",
+                root=FilePath(b"/data"),
+                mountpoint=FilePath(b"/flocker/with space"),
+                options=b"rw", filesystem_type=b"ext4",
+                source=b"/dev/xvdf", super_options=b"rw",
+            ),
+            parse_mountinfo(MOUNTINFO)[2])
+
+
+class MountTableTests(TestCase):
+    """
+    Tests for ``MountTable``.
+    """
+    def setUp(self):
+        super(MountTableTests, self).setUp()
+        self.mountinfo = self.make_temporary_file(content=MOUNTINFO)
+        self.table = MountTable(
+            self.mountinfo,
+            self.make_temporary_file(content=FILESYSTEMS))
+        self.addCleanup(self.table.close)
+
+    def test_by_source(self):
+        """
+        ``MountTable.by_source`` finds the mounts of a source.
+        """
+        self.assertEqual(
+            [FilePath(b"/flocker/with space")],
+            [entry.mountpoint
+             for entry in self.table.by_source(FilePath(b"/dev/xvdf"))])
+
+    def test_by_mountpoint(self):
+        """
+        ``MountTable.by_mountpoint`` finds the mount at a mountpoint, or
+        ``None`` if there isn't one.
+        """
+        self.assertEqual(
+            (b"proc", None),
+            (self.table.by_mountpoint(FilePath(b"/proc")).source,
+             self.table.by_mountpoint(FilePath(b"/flocker"))))
+
+    def test_device_entries(self):
+        """
+        ``MountTable.device_entries`` only includes mounts of filesystems
+        that are stored on a device.
+        """
+        self.assertEqual(
+            [b"/dev/vda1", b"/dev/xvdf"],
+            [entry.source for entry in self.table.device_entries()])
+
+    def test_not_read_again(self):
+        """
+        The mount table is only read once if the kernel doesn't report a
+        change.
+        """
+        self.table.entries()
+        self.mountinfo.setContent(b"")
+        self.assertEqual(
+            (4, 1), (len(self.table.entries()), self.table.reads))
+
+
+class KernelMountTableTests(TestCase):
+    """
+    Tests for ``MountTable`` using this process' mount table.
+    """
+    @if_root
+    def test_changed(self):
+        """
+        The mount table is read again after a filesystem is mounted.
+        """
+        table = MountTable()
+        self.addCleanup(table.close)
+        mountpoint = self.make_temporary_directory()
+        table.entries()
+        check_call([b"mount", b"-t", b"tmpfs", b"tmpfs", mountpoint.path])
+        self.addCleanup(check_call, [b"umount", mountpoint.path])
+        self.assertEqual(
+            (b"tmpfs", 2),
+            (table.by_mountpoint(mountpoint).filesystem_type, table.reads))
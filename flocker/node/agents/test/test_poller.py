@@ -0,0 +1,182 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.agents._poller``.
+"""
+
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.task import Clock
+
+from ....testtools import CustomException, TestCase
+from .._poller import BatchedStatePoller, wait_for_state
+
+
+class BatchedStatePollerTests(TestCase):
+    """
+    Tests for ``BatchedStatePoller``.
+    """
+    def setUp(self):
+        super(BatchedStatePollerTests, self).setUp()
+        self.clock = Clock()
+
+    def test_refresh(self):
+        """
+        ``BatchedStatePoller.refresh`` returns a ``Deferred`` that fires
+        with the description of the resource, or ``None`` if it doesn't
+        exist, once it has been polled.
+        """
+        poller = BatchedStatePoller(
+            self.clock, lambda identifiers: {u"a": u"available"})
+        refreshing = [poller.refresh(u"a"), poller.refresh(u"b")]
+        self.assertNoResult(refreshing[0])
+        self.clock.advance(0)
+        self.assertEqual(
+            [u"available", None],
+            [self.successResultOf(d) for d in refreshing])
+
+    def test_batched(self):
+        """
+        Resources that are waited for at the same time are described
+        together in one call, including those that started being waited for
+        while an earlier poll was in progress.
+        """
+        calls = []
+        describing = Deferred()
+
+        def describe(identifiers):
+            calls.append(identifiers)
+            if len(calls) == 1:
+                return describing
+            return dict((identifier, u"in-use") for identifier in identifiers)
+
+        poller = BatchedStatePoller(self.clock, describe)
+        refreshing = [poller.refresh(u"a")]
+        self.clock.advance(0)
+        refreshing.extend([poller.refresh(u"b"), poller.refresh(u"c")])
+        describing.callback({u"a": u"in-use"})
+        self.clock.advance(poller.minimum_interval)
+        self.assertEqual(
+            ([[u"a"], [u"b", u"c"]], [u"in-use"] * 3),
+            (calls, [self.successResultOf(d) for d in refreshing]))
+
+    def test_no_threads(self):
+        """
+        Nothing is described until something is waited for, and waiting
+        schedules a poll with the reactor rather than blocking.
+        """
+        calls = []
+        poller = BatchedStatePoller(
+            self.clock, lambda identifiers: calls.append(identifiers) or {})
+        self.clock.advance(10)
+        self.assertEqual(
+            ([], [], 0),
+            (calls, self.clock.getDelayedCalls(), poller.polls))
+
+    def test_error(self):
+        """
+        If describing the resources fails, the ``Deferred``\ s of the
+        resources waited for fail with the exception.
+        """
+        poller = BatchedStatePoller(
+            self.clock, lambda identifiers: fail(CustomException()))
+        refreshing = poller.refresh(u"a")
+        self.clock.advance(0)
+        self.failureResultOf(refreshing, CustomException)
+
+    def test_backoff(self):
+        """
+        While polls find nothing changed the interval doubles, up to the
+        maximum; a change resets it.
+        """
+        states = [u"creating", u"creating", u"creating", u"available"]
+        poller = BatchedStatePoller(
+            self.clock, lambda identifiers: {u"a": states.pop(0)},
+            minimum_interval=1.0, maximum_interval=3.0)
+        intervals = []
+        for _ in range(4):
+            refreshing = poller.refresh(u"a")
+            self.clock.advance(poller.interval)
+            self.successResultOf(refreshing)
+            intervals.append(poller.interval)
+        self.assertEqual([1.0, 2.0, 3.0, 1.0], intervals)
+
+    def test_interval(self):
+        """
+        The interval passes between the end of one poll and the start of
+        the next.
+        """
+        times = []
+        describing = Deferred()
+
+        def describe(identifiers):
+            times.append(self.clock.seconds())
+            if len(times) == 1:
+                return describing
+            return {}
+
+        poller = BatchedStatePoller(
+            self.clock, describe, minimum_interval=5.0, maximum_interval=5.0)
+        poller.refresh(u"a")
+        self.clock.advance(0)
+        self.clock.advance(1)
+        describing.callback({})
+        poller.refresh(u"a")
+        self.clock.advance(4.5)
+        self.clock.advance(0.5)
+        self.assertEqual([0, 6], times)
+
+    def test_new_resource(self):
+        """
+        A resource that wasn't in the last poll is polled without waiting
+        for the rest of the backed off interval.
+        """
+        calls = []
+        poller = BatchedStatePoller(
+            self.clock, lambda identifiers: calls.append(identifiers) or {},
+            minimum_interval=1.0, maximum_interval=8.0)
+        poller.refresh(u"a")
+        self.clock.advance(0)
+        poller.refresh(u"a")
+        self.clock.advance(0.5)
+        poller.refresh(u"b")
+        self.clock.advance(0.5)
+        self.assertEqual([[u"a"], [u"a", u"b"]], calls)
+
+
+class WaitForStateTests(TestCase):
+    """
+    Tests for ``wait_for_state``.
+    """
+    def setUp(self):
+        super(WaitForStateTests, self).setUp()
+        self.clock = Clock()
+        self.states = [u"creating", u"creating", u"available"]
+        self.poller = BatchedStatePoller(
+            self.clock, lambda identifiers: {u"a": self.states.pop(0)},
+            minimum_interval=1.0, maximum_interval=1.0)
+
+    def test_reached(self):
+        """
+        The resource is refreshed with every poll until ``reached`` returns
+        ``True``, and the ``Deferred`` fires with that description.
+        """
+        waiting = wait_for_state(
+            self.poller, u"a", lambda state: state == u"available")
+        self.clock.pump([0, 1])
+        self.assertNoResult(waiting)
+        self.clock.advance(1)
+        self.assertEqual(
+            (u"available", 3),
+            (self.successResultOf(waiting), self.poller.polls))
+
+    def test_give_up(self):
+        """
+        If ``reached`` raises an exception, the ``Deferred`` fails with it
+        and the resource is no longer polled.
+        """
+        def reached(state):
+            raise CustomException()
+        waiting = wait_for_state(self.poller, u"a", reached)
+        self.clock.pump([0, 1, 1])
+        self.failureResultOf(waiting, CustomException)
+        self.assertEqual(1, self.poller.polls)
@@ -0,0 +1,394 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.agents._ratelimit``.
+"""
+
+from uuid import uuid4
+
+from eliot.testing import LoggedMessage, capture_logging
+
+from twisted.internet.task import Clock
+
+from zope.interface import Interface, implementer
+
+from ....common.test.test_thread import NonThreadPool
+from ....testtools import CustomException, TestCase
+from ..blockdevice import IBlockDeviceAsyncAPI, INativeAsyncBlockDeviceAPI
+from ..testtools import NonThreadedClock
+from .._ratelimit import (
+    LOG_THROTTLED, RateLimitedBlockDeviceAPI, RateLimiter,
+    _MINIMUM_RATE, _THROTTLED_ATTEMPTS, auto_rate_limiting,
+)
+from .test_blockdevice import (
+    LOOPBACK_ALLOCATION_UNIT, LOOPBACK_MINIMUM_ALLOCATABLE_SIZE, NativeProxy,
+    loopbackblockdeviceapi_for_test, make_iblockdeviceapi_tests,
+)
+
+
+class Throttled(Exception):
+    """
+    A backend's exception for a throttled call.
+    """
+
+
+def is_throttled(exception):
+    return isinstance(exception, Throttled)
+
+
+class Backend(object):
+    """
+    A backend request that raises each of a sequence of exceptions and then
+    succeeds.
+
+    :ivar list calls: The times at which the backend was called.
+    """
+    def __init__(self, clock, errors=()):
+        self.clock = clock
+        self.errors = list(errors)
+        self.calls = []
+
+    def __call__(self):
+        self.calls.append(self.clock.seconds())
+        if self.errors:
+            raise self.errors.pop(0)
+        return u"result"
+
+
+class RateLimiterTests(TestCase):
+    """
+    Tests for ``RateLimiter``.
+    """
+    def setUp(self):
+        super(RateLimiterTests, self).setUp()
+        self.clock = Clock()
+        self.limiter = RateLimiter(
+            maximum_rate=2, burst=3, throttled=is_throttled,
+            reactor=self.clock)
+
+    def test_request(self):
+        """
+        ``RateLimiter.request`` makes the request straight away, even when
+        the bucket is empty, and counts it.
+        """
+        backend = Backend(self.clock)
+        results = [self.limiter.request(backend) for _ in range(5)]
+        self.assertEqual(
+            ([u"result"] * 5, [0] * 5, 5),
+            (results, backend.calls, self.limiter.calls))
+
+    def test_burst(self):
+        """
+        After a quiet period ``burst`` requests can be made without waiting.
+        """
+        backend = Backend(self.clock)
+        for _ in range(2):
+            self.limiter.request(backend)
+        self.successResultOf(self.limiter.wait())
+        self.limiter.request(backend)
+        self.assertNoResult(self.limiter.wait())
+
+    def test_wait(self):
+        """
+        ``RateLimiter.wait`` waits with the reactor until the bucket has
+        earned back a token, including paying off any debt left by requests
+        made while it was empty.
+        """
+        backend = Backend(self.clock)
+        for _ in range(5):
+            self.limiter.request(backend)
+        waiting = self.limiter.wait()
+        self.clock.advance(1)
+        self.assertNoResult(waiting)
+        self.clock.advance(0.5)
+        self.successResultOf(waiting)
+        self.assertEqual(1.5, self.limiter.waited)
+
+    def test_wait_again(self):
+        """
+        Requests made while a call waits make it wait longer.
+        """
+        backend = Backend(self.clock)
+        for _ in range(3):
+            self.limiter.request(backend)
+        waiting = self.limiter.wait()
+        self.clock.advance(0.25)
+        self.limiter.request(backend)
+        self.clock.advance(0.25)
+        self.assertNoResult(waiting)
+        self.clock.advance(0.5)
+        self.successResultOf(waiting)
+
+    def test_refill(self):
+        """
+        Tokens are earned back at the rate while no requests are made.
+        """
+        backend = Backend(self.clock)
+        for _ in range(3):
+            self.limiter.request(backend)
+        self.clock.advance(1)
+        self.successResultOf(self.limiter.wait())
+        self.assertEqual(0, self.limiter.waited)
+
+    @capture_logging(None)
+    def test_throttled(self, logger):
+        """
+        A throttled request raises the backend's exception, halves the rate
+        and empties the bucket; requests that succeed then grow the rate
+        again.
+        """
+        backend = Backend(self.clock, [Throttled()])
+        self.assertRaises(Throttled, self.limiter.request, backend)
+        throttled = (self.limiter.rate, self.limiter.throttles)
+        waiting = self.limiter.wait()
+        self.limiter.request(backend)
+        self.assertEqual(
+            ((1.0, 1), 1.1, 1),
+            (throttled, self.limiter.rate, len(backend.calls) - 1))
+        self.assertNoResult(waiting)
+        [message] = LoggedMessage.of_type(logger.messages, LOG_THROTTLED)
+        self.assertEqual(1.0, message.message[u"rate"])
+
+    @capture_logging(None)
+    def test_minimum_rate(self, logger):
+        """
+        However many requests are throttled, the rate doesn't drop below
+        ``_MINIMUM_RATE``.
+        """
+        backend = Backend(self.clock, [Throttled()] * 10)
+        for _ in range(10):
+            self.assertRaises(Throttled, self.limiter.request, backend)
+        self.assertEqual((_MINIMUM_RATE, 10),
+                         (self.limiter.rate, self.limiter.throttles))
+
+    def test_other_errors(self):
+        """
+        Other exceptions are raised right away and don't change the rate.
+        """
+        backend = Backend(self.clock, [CustomException()])
+        self.assertRaises(CustomException, self.limiter.request, backend)
+        self.assertEqual(
+            (1, 2.0, 0),
+            (len(backend.calls), self.limiter.rate, self.limiter.throttles))
+
+
+class AutoRateLimitingTests(TestCase):
+    """
+    Tests for ``auto_rate_limiting``.
+    """
+    def test_requests(self):
+        """
+        Each method of the interface is called on the wrapped object as a
+        request through the ``RateLimiter``.
+        """
+        class IClient(Interface):
+            def get(identifier):
+                pass
+
+        @implementer(IClient)
+        class Client(object):
+            def get(self, identifier):
+                return identifier * 2
+
+        @auto_rate_limiting(IClient, "_client")
+        class RateLimitedClient(object):
+            def __init__(self, client, rate_limiter):
+                self._client = client
+                self._rate_limiter = rate_limiter
+
+        limiter = RateLimiter(1000, 1000, is_throttled, Clock())
+        client = RateLimitedClient(Client(), limiter)
+        self.assertEqual((4, 1), (client.get(2), limiter.calls))
+
+
+def ratelimitedblockdeviceapi_for_test(test_case):
+    """
+    :return: A ``RateLimitedBlockDeviceAPI`` around a loopback API, with a
+        limit high enough not to slow down tests.
+    """
+    return RateLimitedBlockDeviceAPI(
+        loopbackblockdeviceapi_for_test(
+            test_case, allocation_unit=LOOPBACK_ALLOCATION_UNIT),
+        RateLimiter(1000, 1000, is_throttled, Clock()))
+
+
+class RateLimitedBlockDeviceAPIInterfaceTests(
+        make_iblockdeviceapi_tests(
+            blockdevice_api_factory=ratelimitedblockdeviceapi_for_test,
+            minimum_allocatable_size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE,
+            device_allocation_unit=None,
+            unknown_blockdevice_id_factory=lambda test: unicode(uuid4()),
+        )
+):
+    """
+    Interface adherence tests for ``RateLimitedBlockDeviceAPI``.
+    """
+
+
+class ThrottledAPI(object):
+    """
+    The parts of an ``IBlockDeviceAPI`` that make a backend call.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create_volume(self, dataset_id, size):
+        return self.backend()
+
+    def destroy_volume(self, blockdevice_id):
+        return self.backend()
+
+    def attach_volume(self, blockdevice_id, attach_to):
+        return self.backend()
+
+    def detach_volume(self, blockdevice_id):
+        return self.backend()
+
+    def list_volumes(self):
+        return self.backend()
+
+
+class RateLimitedBlockDeviceAPITests(TestCase):
+    """
+    Tests for ``RateLimitedBlockDeviceAPI``.
+    """
+    def setUp(self):
+        super(RateLimitedBlockDeviceAPITests, self).setUp()
+        self.clock = NonThreadedClock()
+
+    def native_methods(self, api):
+        """
+        :return: The asynchronous methods of ``api``, which call it without
+            threads.
+        """
+        return api.native_async_methods(self.clock, NonThreadPool())
+
+    def test_calls_limited(self):
+        """
+        Each call to a backend that doesn't make its requests through the
+        ``RateLimiter`` itself is charged as one request.
+        """
+        limiter = RateLimiter(1000, 1000, is_throttled, self.clock)
+        api = RateLimitedBlockDeviceAPI(
+            loopbackblockdeviceapi_for_test(self), limiter)
+        volume = api.create_volume(
+            dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE)
+        api.attach_volume(volume.blockdevice_id, api.compute_instance_id())
+        api.list_volumes()
+        api.allocation_unit()
+        self.assertEqual(4, limiter.calls)
+
+    def test_charged(self):
+        """
+        Calls to a backend that makes its requests through the
+        ``RateLimiter`` itself aren't charged again.
+        """
+        limiter = RateLimiter(1000, 1000, is_throttled, self.clock)
+        api = RateLimitedBlockDeviceAPI(
+            loopbackblockdeviceapi_for_test(self), limiter, charged=True)
+        api.list_volumes()
+        self.assertEqual(0, limiter.calls)
+
+    def test_native_async_methods(self):
+        """
+        ``RateLimitedBlockDeviceAPI`` provides ``INativeAsyncBlockDeviceAPI``
+        with every method that calls the backend.
+        """
+        api = ratelimitedblockdeviceapi_for_test(self)
+        self.assertEqual(
+            (True, sorted(set(IBlockDeviceAsyncAPI.names()) -
+                          {"allocation_unit"})),
+            (INativeAsyncBlockDeviceAPI.providedBy(api),
+             sorted(self.native_methods(api))))
+
+    def test_wrapped_native(self):
+        """
+        The wrapped API's native asynchronous methods are called after
+        waiting for the ``RateLimiter``; each call is charged as a request
+        unless the wrapped API makes its requests through the limiter itself.
+        """
+        native_calls = []
+        charged_calls = []
+        for charged in [True, False]:
+            limiter = RateLimiter(1000, 1000, is_throttled, self.clock)
+            native_api = NativeProxy(loopbackblockdeviceapi_for_test(self))
+            methods = self.native_methods(
+                RateLimitedBlockDeviceAPI(native_api, limiter, charged))
+            self.successResultOf(methods["list_volumes"]())
+            native_calls.append(native_api.native_calls)
+            charged_calls.append(limiter.calls)
+        self.assertEqual(
+            ([[u"list_volumes"]] * 2, [0, 1]),
+            (native_calls, charged_calls))
+
+    def test_async_waits(self):
+        """
+        The asynchronous methods wait in the reactor until the
+        ``RateLimiter`` has a token before calling the backend.
+        """
+        backend = Backend(self.clock)
+        limiter = RateLimiter(1, 1, is_throttled, self.clock)
+        limiter.request(backend)
+        list_volumes = self.native_methods(
+            RateLimitedBlockDeviceAPI(ThrottledAPI(backend), limiter))[
+                "list_volumes"]
+        listing = list_volumes()
+        self.clock.advance(0.5)
+        self.assertNoResult(listing)
+        self.clock.advance(0.5)
+        self.assertEqual(
+            (u"result", [0, 1]),
+            (self.successResultOf(listing), backend.calls))
+
+    @capture_logging(None)
+    def test_lookups_retried(self, logger):
+        """
+        A throttled lookup is made again, at the reduced rate, once the
+        ``RateLimiter`` has a token.
+        """
+        backend = Backend(self.clock, [Throttled()])
+        limiter = RateLimiter(2, 3, is_throttled, self.clock)
+        listing = self.native_methods(
+            RateLimitedBlockDeviceAPI(ThrottledAPI(backend), limiter))[
+                "list_volumes"]()
+        self.clock.advance(1)
+        self.assertEqual(
+            (u"result", [0, 1.0]),
+            (self.successResultOf(listing), backend.calls))
+
+    @capture_logging(None)
+    def test_give_up(self, logger):
+        """
+        A lookup that is throttled every time it is made is given up on, and
+        the backend's exception is raised.
+        """
+        backend = Backend(self.clock, [Throttled()] * _THROTTLED_ATTEMPTS)
+        limiter = RateLimiter(1000, 1000, is_throttled, self.clock)
+        listing = self.native_methods(
+            RateLimitedBlockDeviceAPI(ThrottledAPI(backend), limiter))[
+                "list_volumes"]()
+        self.clock.pump([1] * _THROTTLED_ATTEMPTS)
+        self.failureResultOf(listing, Throttled)
+        self.assertEqual(_THROTTLED_ATTEMPTS, len(backend.calls))
+
+    @capture_logging(None)
+    def test_changes_not_retried(self, logger):
+        """
+        Throttled calls that change volumes aren't made again, since they
+        may have happened anyway.
+        """
+        backend = Backend(self.clock, [Throttled()] * 4)
+        methods = self.native_methods(RateLimitedBlockDeviceAPI(
+            ThrottledAPI(backend),
+            RateLimiter(1000, 1000, is_throttled, self.clock)))
+        changes = [
+            methods["create_volume"](
+                dataset_id=uuid4(), size=LOOPBACK_MINIMUM_ALLOCATABLE_SIZE),
+            methods["destroy_volume"](u"vol"),
+            methods["attach_volume"](u"vol", u"node"),
+            methods["detach_volume"](u"vol"),
+        ]
+        self.clock.pump([1] * 4)
+        for change in changes:
+            self.failureResultOf(change, Throttled)
+        self.assertEqual(4, len(backend.calls))
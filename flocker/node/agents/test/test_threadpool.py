@@ -0,0 +1,67 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.agents._threadpool``.
+"""
+
+from threading import Event
+
+from eliot.testing import capture_logging, assertHasMessage
+
+from ....testtools import MemoryCoreReactor, TestCase
+from .._threadpool import BackendThreadPool, LOG_QUEUED
+
+
+class BackendThreadPoolTests(TestCase):
+    """
+    Tests for ``BackendThreadPool``.
+    """
+    def call(self, threadpool, function):
+        """
+        Call a function in a thread pool and wait for the result.
+
+        :return: The ``(success, result)`` the call finished with.
+        """
+        finished = Event()
+        results = []
+
+        def on_result(success, result):
+            results.append((success, result))
+            finished.set()
+        threadpool.callInThreadWithCallback(on_result, function)
+        finished.wait(10)
+        return results[0]
+
+    def threadpool(self, times):
+        """
+        :param list times: The times the pool's clock returns, in order.
+
+        :return: A ``BackendThreadPool`` stopped when the test ends.
+        """
+        reactor = MemoryCoreReactor()
+        threadpool = BackendThreadPool(
+            reactor, 2, b"test", clock=iter(times).next)
+        self.addCleanup(threadpool.stop)
+        return threadpool
+
+    def test_measured(self):
+        """
+        The pool is started when it is first used, and counts finished calls
+        and how long they waited and ran.
+        """
+        threadpool = self.threadpool([10.0, 10.5, 12.5])
+        self.assertFalse(threadpool.started)
+        self.assertEqual(
+            ((True, 3), True, 1, 0, 0, 0.5, 2.0),
+            (self.call(threadpool, lambda: 3), threadpool.started,
+             threadpool.calls, threadpool.queued, threadpool.running,
+             threadpool.waited, threadpool.busy))
+
+    @capture_logging(assertHasMessage, LOG_QUEUED, dict(
+        name=b"test", waited=5.0, queued=0))
+    def test_slow_queue(self, logger):
+        """
+        A call that waited a long time for a thread is logged.
+        """
+        threadpool = self.threadpool([0.0, 5.0, 6.0])
+        self.call(threadpool, lambda: None)
@@ -4,9 +4,18 @@
 Test helpers for ``flocker.node.agents``.
 """
 
+import re
+
 from zope.interface.verify import verifyObject
 
+from keystoneclient.openstack.common.apiclient.exceptions import (
+    NotFound as CinderNotFound,
+)
+
+from twisted.internet.task import Clock
+
 from flocker.testtools import TestCase
+from ...common.test.test_thread import NonReactor
 from .cinder import (
     ICinderVolumeManager, INovaVolumeManager,
 )
@@ -58,3 +67,236 @@ def make_inovavolumemanager_tests(client_factory):
             self.client = client_factory(test_case=self)
 
     return Tests
+
+
+class FakeEC2Volume(object):
+    """
+    A fake of the parts of a boto3 EC2 ``Volume`` that listing uses.
+    """
+    def __init__(self, id, size, tags, attachments=()):
+        self.id = id
+        self.size = size
+        self.tags = tags
+        self.attachments = list(attachments)
+
+
+class _FakeEC2VolumeCollection(object):
+    """
+    A fake of the boto3 collection of EC2 volumes, which filters volumes by
+    tag and returns them in pages like EC2 does.
+    """
+    def __init__(self, connection, filters=(), page_size=None):
+        self._connection = connection
+        self._filters = filters
+        self._page_size = page_size
+
+    def filter(self, Filters):
+        return _FakeEC2VolumeCollection(
+            self._connection, Filters, self._page_size)
+
+    def page_size(self, count):
+        return _FakeEC2VolumeCollection(
+            self._connection, self._filters, count)
+
+    def _matches(self, volume):
+        tags = dict(
+            (tag['Key'], tag['Value']) for tag in volume.tags or ())
+        for volume_filter in self._filters:
+            name = volume_filter['Name']
+            if not name.startswith('tag:'):
+                raise ValueError("Unsupported filter", name)
+            if tags.get(name[len('tag:'):]) not in volume_filter['Values']:
+                return False
+        return True
+
+    def pages(self):
+        matching = [
+            volume for volume in self._connection.all_volumes
+            if self._matches(volume)
+        ]
+        page_size = self._page_size or len(matching) or 1
+        for start in range(0, max(len(matching), 1), page_size):
+            page = matching[start:start + page_size]
+            self._connection.requests += 1
+            self._connection.returned += len(page)
+            yield page
+
+
+class _FakeEC2Client(object):
+    """
+    A fake of the ``DescribeVolumes`` call of a boto3 EC2 client, which
+    supports filtering by volume ID.
+    """
+    def __init__(self, connection):
+        self._connection = connection
+
+    def describe_volumes(self, Filters):
+        [volume_filter] = Filters
+        if volume_filter['Name'] != 'volume-id':
+            raise ValueError("Unsupported filter", volume_filter['Name'])
+        if len(volume_filter['Values']) > 200:
+            raise ValueError("Too many filter values")
+        self._connection.requests += 1
+        descriptions = [
+            {'VolumeId': volume.id, 'Size': volume.size, 'Tags': volume.tags,
+             'Attachments': volume.attachments}
+            for volume in self._connection.all_volumes
+            if volume.id in volume_filter['Values']
+        ]
+        self._connection.returned += len(descriptions)
+        return {'Volumes': descriptions}
+
+
+class _FakeEC2Meta(object):
+    """
+    A fake of the ``meta`` attribute of a boto3 resource.
+    """
+    def __init__(self, client):
+        self.client = client
+
+
+class FakeEC2Connection(object):
+    """
+    A fake of the parts of a boto3 EC2 resource that listing and describing
+    volumes uses.
+
+    :ivar list all_volumes: The ``FakeEC2Volume``\ s in the account.
+    :ivar int requests: How many pages of volumes were requested.
+    :ivar int returned: How many volumes were returned.
+    """
+    def __init__(self, volumes):
+        self.all_volumes = list(volumes)
+        self.volumes = _FakeEC2VolumeCollection(self)
+        self.meta = _FakeEC2Meta(_FakeEC2Client(self))
+        self.requests = 0
+        self.returned = 0
+
+
+class NonThreadedClock(Clock, NonReactor):
+    """
+    A ``Clock`` for the poller of native asynchronous methods, which runs
+    the calls that ``NonThreadPool`` makes from its "threads" directly.
+    """
+
+
+class FakeCinderVolume(object):
+    """
+    A fake of the parts of a ``cinderclient`` ``Volume`` that listing and
+    waiting for state changes use.
+    """
+    def __init__(self, id, size, metadata, attachments=(),
+                 status=u"available"):
+        self.id = id
+        self.size = size
+        self.metadata = metadata
+        self.attachments = list(attachments)
+        self.status = status
+
+
+class FakeCinderVolumeManager(object):
+    """
+    A fake of ``ICinderVolumeManager.list`` and
+    ``ICinderVolumeManager.delete``, which filters volumes by metadata like
+    Cinder does.
+
+    :ivar list volumes: The ``FakeCinderVolume``\ s in the tenant.
+    :ivar int returned: How many volumes were returned.
+    """
+    def __init__(self, volumes):
+        self.volumes = list(volumes)
+        self.returned = 0
+
+    def list(self, detailed=True, search_opts=None):
+        metadata = (search_opts or {}).get('metadata', {})
+        result = [
+            volume for volume in self.volumes
+            if all(volume.metadata.get(key) == value
+                   for key, value in metadata.items())
+        ]
+        self.returned += len(result)
+        return result
+
+    def delete(self, volume_id):
+        for volume in self.volumes:
+            if volume.id == volume_id:
+                self.volumes.remove(volume)
+                return
+        raise CinderNotFound(404)
+
+
+class _FakeGCERequest(object):
+    """
+    A request for one page of a fake GCE list call.
+    """
+    def __init__(self, collection, page_token):
+        self._collection = collection
+        self.page_token = page_token
+
+    def execute(self):
+        return self._collection._page(self.page_token)
+
+
+class _FakeGCECollection(object):
+    """
+    A fake of a collection of the GCE compute API, e.g. disks, which filters
+    resources and returns them in pages like GCE does.
+    """
+    def __init__(self, compute, resources):
+        self._compute = compute
+        self._resources = resources
+
+    def list(self, project, zone, filter=None, maxResults=500):
+        self._compute.filter = filter
+        self._compute.page_size = maxResults
+        return _FakeGCERequest(self, 0)
+
+    def list_next(self, request, response):
+        if 'nextPageToken' not in response:
+            return None
+        return _FakeGCERequest(self, response['nextPageToken'])
+
+    def _page(self, start):
+        compute = self._compute
+        resources = self._resources
+        if compute.filter is not None:
+            field, operator, value = compute.filter.split(u" ", 2)
+            if operator != u"eq":
+                raise ValueError("Unsupported filter", compute.filter)
+            # GCE's filter values match the whole field:
+            resources = [
+                resource for resource in resources
+                if re.match(u"(?:%s)$" % (value,), resource[field])]
+        page = resources[start:start + compute.page_size]
+        compute.requests += 1
+        compute.returned += len(page)
+        result = {}
+        if page:
+            result['items'] = page
+        if start + compute.page_size < len(resources):
+            result['nextPageToken'] = start + compute.page_size
+        return result
+
+
+class FakeGCECompute(object):
+    """
+    A fake of the parts of the GCE compute API client that listing disks and
+    zone operations uses.
+
+    :ivar list all_disks: The disk resources in the project, as ``dict``\ s.
+    :ivar list all_operations: The zone operation resources, as ``dict``\ s.
+    :ivar int requests: How many pages of resources were requested.
+    :ivar int returned: How many resources were returned.
+    """
+    def __init__(self, disks, operations=()):
+        self.all_disks = list(disks)
+        self.all_operations = list(operations)
+        self.filter = None
+        self.page_size = None
+        self.requests = 0
+        self.returned = 0
+
+    def disks(self):
+        return _FakeGCECollection(self, self.all_disks)
+
+    def zoneOperations(self):
+        return _FakeGCECollection(self, self.all_operations)
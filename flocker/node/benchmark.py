@@ -10,6 +10,9 @@ from pyrsistent import PClass
 from zope.interface import implementer
 
 from .diagnostics import list_hardware
+from ..control._benchmark import (
+    synthetic_cluster, measure_endpoints, format_timings,
+)
 
 from ..common.script import (
     ICommandLineScript,
@@ -25,6 +28,33 @@ class HardwareReportOptions(Options):
     """
 
 
+class APIValidationOptions(Options):
+    """
+    Command line options for ``flocker-benchmark api-validation``.
+    """
+    longdesc = """\
+    Measure how long the control service's REST API takes to build, encode
+    and validate the response of each listing endpoint for a simulated
+    cluster.
+    """
+
+    optParameters = [
+        ["nodes", None, 10, "The number of nodes in the cluster.", int],
+        ["datasets", None, 1000, "The number of datasets in the cluster.",
+         int],
+        ["containers", None, 100,
+         "The number of containers in the cluster.", int],
+        ["repeat", None, 10, "How many times to repeat each measurement.",
+         int],
+    ]
+
+    def postOptions(self):
+        if self["containers"] > self["datasets"]:
+            raise UsageError(
+                "Each container uses a dataset, so there cannot be more "
+                "containers than datasets.")
+
+
 @flocker_standard_options
 class BenchmarkOptions(Options):
     """
@@ -39,6 +69,8 @@ class BenchmarkOptions(Options):
     subCommands = [
         ['hardware-report', None, HardwareReportOptions,
          "Print a hardware report."],
+        ['api-validation', None, APIValidationOptions,
+         "Measure the cost of REST API response validation."],
     ]
 
     def postOptions(self):
@@ -56,6 +88,18 @@ def hardware_report(options):
     return succeed(None)
 
 
+def api_validation(options):
+    """
+    Print the cost of building, encoding and validating REST API responses
+    to stdout.
+    """
+    deployment, changes = synthetic_cluster(
+        options["nodes"], options["datasets"], options["containers"])
+    sys.stdout.write(format_timings(
+        measure_endpoints(deployment, changes, options["repeat"])))
+    return succeed(None)
+
+
 @implementer(ICommandLineScript)
 class BenchmarkScript(PClass):
     """
@@ -63,6 +107,7 @@ class BenchmarkScript(PClass):
     """
     _subcommands = {
         'hardware-report': hardware_report,
+        'api-validation': api_validation,
     }
 
     def main(self, reactor, options):
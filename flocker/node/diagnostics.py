@@ -17,6 +17,8 @@ from pyrsistent import PClass, field
 
 from flocker import __version__
 
+from .agents._mounttable import MOUNTINFO, parse_mountinfo
+
 
 def gzip_file(source_path, archive_path):
     """
@@ -59,7 +61,8 @@ class FlockerDebugArchive(object):
     * Flocker version,
     * logs from all installed Flocker services,
     * some or all of the syslog depending on the logging system,
-    * Docker version and configuration information, and
+    * Docker version and configuration information,
+    * the mounted filesystems, and
     * a list of all the services installed on the system and their status.
     """
     def __init__(self, service_manager, log_exporter):
@@ -168,6 +171,14 @@ class FlockerDebugArchive(object):
                 stdout=self._open_logfile('lsblk')
             )
 
+            # Mounted filesystems
+            with self._open_logfile('mounts') as output:
+                for entry in parse_mountinfo(MOUNTINFO.getContent()):
+                    output.write(b" ".join([
+                        entry.source, entry.mountpoint.path,
+                        entry.filesystem_type, entry.options,
+                    ]) + b"\n")
+
             # Hardware inventory
             self._open_logfile('lshw').write(list_hardware())
 
@@ -35,21 +35,40 @@ from ..volume.service import (
 from ..common.script import (
     ICommandLineScript,
     flocker_standard_options, FlockerScriptRunner, main_for_service)
-from . import P2PManifestationDeployer, ApplicationNodeDeployer
+from . import (
+    P2PManifestationDeployer, ApplicationNodeDeployer, StateChangeExecutor,
+)
 from ._loop import AgentLoopService
+from ._multiplexer import (
+    ControlServiceMultiplexer, CONTROL_MULTIPLEXER_SOCKET,
+)
+from ._wakeup import DeviceWatcher, DockerEventsWatcher, MountInfoPoller
+from ._events import (
+    DatasetEventPublisher, DatasetEventSubscriber,
+    dataset_event_publisher_service,
+)
 from .exceptions import StorageInitializationError
 from .diagnostics import (
     current_distribution, FlockerDebugArchive, DISTRIBUTION_BY_LABEL,
     lookup_distribution,
 )
 from .agents.blockdevice import (
-    BlockDeviceDeployer, ProcessLifetimeCache,
+    BLOCK_DEVICE_CHANGE_CONCURRENCY, BLOCK_DEVICE_CHANGE_POLICIES,
+    BlockDeviceDeployer, IProfiledBlockDeviceAPI, ProcessLifetimeCache,
+    VolumeListCache,
+)
+from .agents.blockdevice_manager import (
+    BlockDeviceManager, SyscallBlockDeviceManager,
 )
 from .agents.loopback import (
     LoopbackBlockDeviceAPI,
 )
-from .agents.cinder import cinder_from_configuration
-from .agents.ebs import aws_from_configuration
+from .agents.cinder import (
+    cinder_from_configuration, is_throttled as cinder_throttled,
+)
+from .agents.ebs import aws_from_configuration, is_throttled as aws_throttled
+from .agents._ratelimit import RateLimitedBlockDeviceAPI, RateLimiter
+from .agents._threadpool import BackendThreadPool
 from ..ca import ControlServicePolicy, NodeCredential
 from ..common._era import get_era
 
@@ -88,7 +107,9 @@ def flocker_container_agent_main():
     def deployer_factory(cluster_uuid, **kwargs):
         return ApplicationNodeDeployer(**kwargs)
     service_factory = AgentServiceFactory(
-        deployer_factory=deployer_factory
+        deployer_factory=deployer_factory,
+        subscribe_to_dataset_events=True,
+        follow_docker_events=True,
     ).get_service
     agent_script = AgentScript(service_factory=service_factory)
     return FlockerScriptRunner(
@@ -200,6 +221,7 @@ def validate_configuration(configuration):
                         "format": "hostname",
                     },
                     "port": {"type": "integer"},
+                    "multiplex": {"type": "boolean"},
                 }
             },
             "dataset": {
@@ -208,11 +230,33 @@ def validate_configuration(configuration):
                     "backend": {
                         "type": "string",
                     },
+                    "list_volumes_cache_ttl": {
+                        "type": "number",
+                        "minimum": 0,
+                    },
+                    "mount_syscalls": {
+                        "type": "boolean",
+                    },
+                    "api_rate_limit": {
+                        "type": "number",
+                        "minimum": 0,
+                    },
+                    "api_burst": {
+                        "type": "integer",
+                        "minimum": 1,
+                    },
+                    "api_threads": {
+                        "type": "integer",
+                        "minimum": 1,
+                    },
                 },
                 "required": [
                     "backend",
                 ],
             },
+            "wakeups": {
+                "type": "boolean",
+            },
             "logging": {
                 # Format described at https://www.python.org/dev/peps/pep-0391/
                 "type": "object",
@@ -297,11 +341,21 @@ class AgentServiceFactory(PClass):
         ``node_uuid`` keyword argument. They must be passed by keyword.
     :ivar get_external_ip: Typically ``_get_external_ip``, but
         overrideable for tests.
+    :ivar bool subscribe_to_dataset_events: Whether the agent should apply
+        state published by the dataset agent on the same node as soon as it
+        is published, rather than waiting for it to arrive via the control
+        service.
+    :ivar bool follow_docker_events: Whether the agent should rediscover
+        local state as soon as the Docker daemon reports an event, e.g. a
+        container stopping, unless ``wakeups`` is false in the configuration
+        file.
     """
     # This should have an explicit interface:
     # https://clusterhq.atlassian.net/browse/FLOC-1929
     deployer_factory = field(mandatory=True)
     get_external_ip = field(initial=_get_external_ip, mandatory=True)
+    subscribe_to_dataset_events = field(type=bool, initial=False)
+    follow_docker_events = field(type=bool, initial=False)
 
     def get_service(self, reactor, options):
         """
@@ -323,11 +377,15 @@ class AgentServiceFactory(PClass):
         host = configuration['control-service']['hostname']
         port = configuration['control-service']['port']
         ip = self.get_external_ip(host, port)
+        control_socket = None
+        if configuration['control-service'].get('multiplex', False):
+            # The dataset agent runs the multiplexer:
+            control_socket = CONTROL_MULTIPLEXER_SOCKET
 
         tls_info = _context_factory_and_credential(
             options["agent-config"].parent(), host, port)
 
-        return AgentLoopService(
+        service = AgentLoopService(
             reactor=reactor,
             deployer=self.deployer_factory(
                 node_uuid=tls_info.node_credential.uuid, hostname=ip,
@@ -335,7 +393,17 @@ class AgentServiceFactory(PClass):
             host=host, port=port,
             context_factory=tls_info.context_factory,
             era=get_era(),
+            control_socket=control_socket,
         )
+        if self.subscribe_to_dataset_events:
+            subscriber = DatasetEventSubscriber(reactor)
+            subscriber.observe(service.dataset_state_changed)
+            subscriber.setServiceParent(service)
+        if self.follow_docker_events and configuration.get('wakeups', True):
+            DockerEventsWatcher(
+                reactor, service.local_change_detected,
+            ).setServiceParent(service)
+        return service
 
 
 def get_configuration(options):
@@ -429,6 +497,13 @@ class BackendDescription(PClass):
     :ivar deployer_type: A constant from ``DeployerType`` indicating which kind
         of ``IDeployer`` the API object returned by ``api_factory`` is usable
         with.
+    :ivar is_throttled: One-argument callable that returns whether an
+        exception raised by the API object means the backend throttled the
+        call, or ``None`` if the backend doesn't throttle calls.  Calls to
+        backends that throttle calls are rate limited.
+    :ivar needs_rate_limiter: A flag which indicates whether this backend's
+        API factory takes the ``RateLimiter`` to make each of its requests
+        through, rather than having each call rate limited as a whole.
     """
     name = field(type=unicode, mandatory=True)
     needs_reactor = field(type=bool, mandatory=True)
@@ -442,6 +517,8 @@ class BackendDescription(PClass):
             value in DeployerType.iterconstants(), "Unknown deployer_type"
         ),
     )
+    is_throttled = field(initial=None)
+    needs_rate_limiter = field(type=bool, initial=False)
 
 # These structures should be created dynamically to handle plug-ins
 _DEFAULT_BACKENDS = [
@@ -464,22 +541,73 @@ _DEFAULT_BACKENDS = [
     BackendDescription(
         name=u"openstack", needs_reactor=False, needs_cluster_id=True,
         api_factory=cinder_from_configuration,
-        deployer_type=DeployerType.block,
+        deployer_type=DeployerType.block, is_throttled=cinder_throttled,
+        needs_rate_limiter=True,
     ),
     BackendDescription(
         name=u"aws", needs_reactor=False, needs_cluster_id=True,
         api_factory=aws_from_configuration,
-        deployer_type=DeployerType.block,
+        deployer_type=DeployerType.block, is_throttled=aws_throttled,
+        needs_rate_limiter=True,
     ),
 ]
 
+# How many seconds the dataset agent reuses a listing of the backend's
+# volumes for, unless ``list_volumes_cache_ttl`` is configured in the
+# ``dataset`` section of ``agent.yml``:
+_DEFAULT_LIST_VOLUMES_CACHE_TTL = 5
+
+# How many calls per second the dataset agent makes to a backend that
+# throttles calls, and how many it can make at once after a quiet period,
+# unless ``api_rate_limit`` and ``api_burst`` are configured in the
+# ``dataset`` section of ``agent.yml``:
+_DEFAULT_API_RATE_LIMIT = 10
+_DEFAULT_API_BURST = 10
+
+# How many threads the dataset agent calls the backend in, unless
+# ``api_threads`` is configured in the ``dataset`` section of ``agent.yml``:
+_DEFAULT_API_THREADS = 10
+
+
+def _block_device_deployer(api, reactor, list_volumes_cache_ttl,
+                           mount_syscalls, api_threads, **kw):
+    """
+    Create a ``BlockDeviceDeployer`` with caching around the block device
+    API, which calls the API in a thread pool of its own.
+
+    :param api: The ``IBlockDeviceAPI`` provider.
+    :param reactor: The reactor the agent runs in.
+    :param list_volumes_cache_ttl: Seconds to reuse a listing of volumes for.
+    :param bool mount_syscalls: Whether to mount filesystems by calling
+        ``mount(2)`` directly rather than running ``mount(8)``.
+    :param int api_threads: How many threads to call the API in.
+    :param kw: Other arguments for ``BlockDeviceDeployer``.
+
+    :return: The ``BlockDeviceDeployer``.
+    """
+    profiled_api = None
+    if IProfiledBlockDeviceAPI.providedBy(api):
+        profiled_api = api
+    cache = VolumeListCache(
+        ProcessLifetimeCache(api), ttl=list_volumes_cache_ttl, clock=reactor,
+        profiled_api=profiled_api,
+    )
+    if mount_syscalls:
+        block_device_manager = SyscallBlockDeviceManager()
+    else:
+        block_device_manager = BlockDeviceManager()
+    return BlockDeviceDeployer(
+        block_device_api=cache, _profiled_blockdevice_api=cache,
+        block_device_manager=block_device_manager,
+        threadpool=BackendThreadPool(
+            reactor, api_threads, b"flocker-dataset-backend"),
+        **kw)
+
+
 _DEFAULT_DEPLOYERS = {
     DeployerType.p2p: lambda api, **kw:
         P2PManifestationDeployer(volume_service=api, **kw),
-    DeployerType.block: lambda api, **kw:
-        BlockDeviceDeployer(block_device_api=ProcessLifetimeCache(api),
-                            _profiled_blockdevice_api=api,
-                            **kw),
+    DeployerType.block: _block_device_deployer,
 }
 
 
@@ -496,8 +624,25 @@ class AgentService(PClass):
     :ivar backend_name: The name of the storage driver to instantiate.  This
         must name one of the items in ``backends``.
     :ivar api_args: Extra arguments to pass to the factory from ``backends``.
+    :ivar list_volumes_cache_ttl: Seconds for which block device deployers
+        reuse a listing of the backend's volumes.
+    :ivar bool mount_syscalls: Whether block device deployers call
+        ``mount(2)`` and ``umount2(2)`` directly, rather than running
+        ``mount(8)`` and ``umount(8)``.  Off by default until calling them
+        directly has been proven on every supported distribution.
+    :ivar api_rate_limit: The most requests per second made to a backend
+        that throttles requests, or ``0`` for no limit.
+    :ivar int api_burst: How many requests can be made to such a backend at
+        once after a quiet period.
+    :ivar int api_threads: How many threads block device deployers call the
+        backend in.
     :ivar get_external_ip: Typically ``_get_external_ip``, but
         overrideable for tests.
+    :ivar bool multiplex_control_service: Whether to run a
+        ``ControlServiceMultiplexer`` that other agents on this node share
+        the connection to the control service through.
+    :ivar bool wakeups: Whether the convergence loop is woken as soon as
+        devices or mounts change, rather than only at the end of its sleep.
     """
     backends = field(
         factory=pvector, initial=_DEFAULT_BACKENDS, mandatory=True,
@@ -509,6 +654,8 @@ class AgentService(PClass):
 
     control_service_host = field(type=bytes, mandatory=True)
     control_service_port = field(type=int, mandatory=True)
+    multiplex_control_service = field(type=bool, initial=False)
+    wakeups = field(type=bool, initial=True)
 
     # Cannot use type=NodeCredential because one of the tests really wants to
     # set this to None.
@@ -518,6 +665,13 @@ class AgentService(PClass):
 
     backend_name = field(type=unicode, mandatory=True)
     api_args = field(type=PMap, factory=pmap, mandatory=True)
+    list_volumes_cache_ttl = field(
+        type=(int, float), initial=_DEFAULT_LIST_VOLUMES_CACHE_TTL)
+    mount_syscalls = field(type=bool, initial=False)
+    api_rate_limit = field(
+        type=(int, float), initial=_DEFAULT_API_RATE_LIMIT)
+    api_burst = field(type=int, initial=_DEFAULT_API_BURST)
+    api_threads = field(type=int, initial=_DEFAULT_API_THREADS)
 
     @classmethod
     def from_configuration(cls, configuration):
@@ -543,16 +697,31 @@ class AgentService(PClass):
 
         api_args = configuration['dataset']
         backend_name = api_args.pop('backend')
+        list_volumes_cache_ttl = api_args.pop(
+            'list_volumes_cache_ttl', _DEFAULT_LIST_VOLUMES_CACHE_TTL)
+        mount_syscalls = api_args.pop('mount_syscalls', False)
+        api_rate_limit = api_args.pop(
+            'api_rate_limit', _DEFAULT_API_RATE_LIMIT)
+        api_burst = api_args.pop('api_burst', _DEFAULT_API_BURST)
+        api_threads = api_args.pop('api_threads', _DEFAULT_API_THREADS)
 
         return cls(
             control_service_host=host,
             control_service_port=port,
+            multiplex_control_service=configuration['control-service'].get(
+                'multiplex', False),
+            wakeups=configuration.get('wakeups', True),
 
             node_credential=node_credential,
             ca_certificate=ca_certificate,
 
             backend_name=backend_name.decode("ascii"),
             api_args=api_args,
+            list_volumes_cache_ttl=list_volumes_cache_ttl,
+            mount_syscalls=mount_syscalls,
+            api_rate_limit=api_rate_limit,
+            api_burst=api_burst,
+            api_threads=api_threads,
         )
 
     def get_backend(self):
@@ -597,7 +766,8 @@ class AgentService(PClass):
 
         :return: An object created by one of the factories in ``self.backends``
             using the configuration from ``self.api_args`` and other useful
-            state on ``self``.
+            state on ``self``.  If the backend throttles requests, it is
+            wrapped in a ``RateLimitedBlockDeviceAPI``.
         """
         backend = self.get_backend()
 
@@ -607,14 +777,26 @@ class AgentService(PClass):
             api_args = api_args.set("cluster_id", cluster_id)
         if backend.needs_reactor:
             api_args = api_args.set("reactor", self.reactor)
+        limiter = None
+        if backend.is_throttled is not None and self.api_rate_limit:
+            # Every request made to the backend shares one budget:
+            limiter = RateLimiter(
+                self.api_rate_limit, self.api_burst, backend.is_throttled,
+                self.reactor)
+            if backend.needs_rate_limiter:
+                api_args = api_args.set("rate_limiter", limiter)
 
         try:
-            return backend.api_factory(**api_args)
+            api = backend.api_factory(**api_args)
         except StorageInitializationError as e:
             if e.code == StorageInitializationError.CONFIGURATION_ERROR:
                 raise UsageError(u"Configuration error", *e.args)
             else:
                 raise
+        if limiter is not None:
+            api = RateLimitedBlockDeviceAPI(
+                api, limiter, charged=backend.needs_rate_limiter)
+        return api
 
     def get_deployer(self, api):
         """
@@ -633,10 +815,29 @@ class AgentService(PClass):
             self.control_service_host, self.control_service_port,
         )
         node_uuid = self.node_credential.uuid
+        extra = {}
+        if backend.deployer_type == DeployerType.block:
+            extra["reactor"] = self.reactor
+            extra["list_volumes_cache_ttl"] = self.list_volumes_cache_ttl
+            extra["mount_syscalls"] = self.mount_syscalls
+            extra["api_threads"] = self.api_threads
         return deployer_factory(
-            api=api, hostname=address, node_uuid=node_uuid,
+            api=api, hostname=address, node_uuid=node_uuid, **extra
         )
 
+    def get_executor(self, deployer):
+        """
+        :param IDeployer deployer: The deployer whose changes will be run.
+
+        :return: A ``StateChangeExecutor`` to run the changes calculated by
+            ``deployer``.  Block device changes are limited and prioritized;
+            other deployers' changes are run as soon as they are calculated.
+        """
+        if isinstance(deployer, BlockDeviceDeployer):
+            return StateChangeExecutor(
+                BLOCK_DEVICE_CHANGE_POLICIES, BLOCK_DEVICE_CHANGE_CONCURRENCY)
+        return StateChangeExecutor()
+
     def get_loop_service(self, deployer):
         """
         :param IDeployer deployer: The deployer which the loop service can use
@@ -646,13 +847,32 @@ class AgentService(PClass):
             discover changes to send to the control service and to deploy
             configuration changes received from the control service.
         """
-        return AgentLoopService(
+        context_factory = self.get_tls_context().context_factory
+        executor = self.get_executor(deployer)
+        if not self.multiplex_control_service:
+            return AgentLoopService(
+                reactor=self.reactor,
+                deployer=deployer,
+                host=self.control_service_host,
+                port=self.control_service_port,
+                context_factory=context_factory,
+                era=get_era(),
+                executor=executor,
+            )
+        loop_service = AgentLoopService(
             reactor=self.reactor,
             deployer=deployer,
             host=self.control_service_host, port=self.control_service_port,
-            context_factory=self.get_tls_context().context_factory,
+            context_factory=context_factory,
             era=get_era(),
+            control_socket=CONTROL_MULTIPLEXER_SOCKET,
+            executor=executor,
         )
+        ControlServiceMultiplexer(
+            self.reactor, self.control_service_host,
+            self.control_service_port, context_factory,
+        ).setServiceParent(loop_service)
+        return loop_service
 
 
 class DatasetServiceFactory(PClass):
@@ -679,6 +899,24 @@ class DatasetServiceFactory(PClass):
 
         loop_service = agent_service.get_loop_service(deployer)
 
+        # Let other processes on this node hear about local dataset changes
+        # without going through the control service:
+        publisher = DatasetEventPublisher()
+        loop_service.local_state_observers.append(
+            publisher.local_state_changed)
+        dataset_event_publisher_service(
+            reactor, publisher).setServiceParent(loop_service)
+
+        if agent_service.wakeups:
+            # Rediscover local state as soon as devices or mounts change,
+            # rather than at the end of the convergence loop's sleep:
+            DeviceWatcher(
+                reactor, loop_service.local_change_detected,
+            ).setServiceParent(loop_service)
+            MountInfoPoller(
+                reactor, loop_service.local_change_detected,
+            ).setServiceParent(loop_service)
+
         return loop_service
 
 
@@ -10,12 +10,16 @@ from zope.interface import implementer
 
 from pyrsistent import PClass, field
 
-from twisted.internet.defer import FirstError, Deferred, succeed, fail
+from twisted.internet.defer import (
+    CancelledError, FirstError, Deferred, succeed, fail,
+)
 from twisted.python.components import proxyForInterface
 
 from eliot import ActionType
 from eliot.testing import (
-    validate_logging, assertHasAction, capture_logging, LoggedAction)
+    validate_logging, assertHasAction, capture_logging, LoggedAction,
+    LoggedMessage,
+)
 
 from ..testtools import (
     CONTROLLABLE_ACTION_TYPE, ControllableAction, ControllableDeployer,
@@ -23,8 +27,11 @@ from ..testtools import (
 )
 from ...testtools import CustomException, TestCase
 
-from .. import IStateChange, sequentially, in_parallel, run_state_change, NoOp
-from .._change import LOG_IN_PARALLEL, LOG_SEQUENTIALLY
+from .. import (
+    IStateChange, sequentially, in_parallel, run_state_change, NoOp,
+    ChangePolicy, StateChangeExecutor,
+)
+from .._change import LOG_EXECUTOR_STATE, LOG_IN_PARALLEL, LOG_SEQUENTIALLY
 
 from .istatechange import (
     DummyStateChange, RunSpyStateChange, make_istatechange_tests,
@@ -580,3 +587,234 @@ class RunStateChangeTests(TestCase):
         which the parallel ``IStateChange`` is run.
         """
         self.assert_nested_logging(in_parallel, LOG_IN_PARALLEL, logger)
+
+
+class UrgentAction(ControllableAction):
+    """
+    A ``ControllableAction`` of a different type, so it can have a different
+    ``ChangePolicy``.
+    """
+
+
+class StateChangeExecutorTests(TestCase):
+    """
+    Tests for ``StateChangeExecutor``.
+    """
+    def test_run(self):
+        """
+        ``StateChangeExecutor.run`` runs nested changes like
+        ``run_state_change`` does.
+        """
+        actions = [ControllableAction(result=succeed(None)) for _ in range(3)]
+        executor = StateChangeExecutor()
+        d = executor.run(
+            sequentially(changes=[
+                actions[0], in_parallel(changes=actions[1:])]),
+            DEPLOYER)
+        self.successResultOf(d)
+        self.assertEqual(
+            ([True] * 3, [DEPLOYER] * 3, {}),
+            ([action.called for action in actions],
+             [action.deployer for action in actions],
+             executor.in_flight()))
+
+    def test_type_concurrency(self):
+        """
+        No more changes of a type run at once than its policy allows; the
+        next one starts when a running one finishes.
+        """
+        actions = [ControllableAction(result=Deferred()) for _ in range(3)]
+        executor = StateChangeExecutor(
+            {ControllableAction: ChangePolicy(concurrency=2)})
+        executor.run(in_parallel(changes=actions), DEPLOYER)
+        started = [action for action in actions if action.called]
+        started[0].result.callback(None)
+        self.assertEqual(
+            (2, [True] * 3),
+            (len(started), [action.called for action in actions]))
+
+    def test_queued_and_in_flight(self):
+        """
+        ``StateChangeExecutor.queued`` and ``StateChangeExecutor.in_flight``
+        count the changes of each type that are waiting and running.
+        """
+        actions = [ControllableAction(result=Deferred()) for _ in range(3)]
+        urgent = UrgentAction(result=Deferred())
+        executor = StateChangeExecutor(
+            {ControllableAction: ChangePolicy(concurrency=1)})
+        executor.run(in_parallel(changes=actions + [urgent]), DEPLOYER)
+        self.assertEqual(
+            ({ControllableAction: 2},
+             {ControllableAction: 1, UrgentAction: 1}),
+            (executor.queued(), executor.in_flight()))
+
+    def test_priority(self):
+        """
+        When a change finishes, the queued change with the lowest priority
+        is started next, whatever order they were submitted in.
+        """
+        running = ControllableAction(result=Deferred())
+        later = ControllableAction(result=succeed(None))
+        urgent = UrgentAction(result=succeed(None))
+        executor = StateChangeExecutor(
+            {ControllableAction: ChangePolicy(priority=1),
+             UrgentAction: ChangePolicy(priority=0)},
+            concurrency=1)
+        for action in (running, later, urgent):
+            executor.run(action, DEPLOYER)
+        # Finishing the running change starts the urgent one, which finishes
+        # right away and then lets the other one start:
+        started = []
+        self.patch(executor, "_log_state", lambda change_type: None)
+        original_start = executor._start
+
+        def start(submission):
+            started.append(submission.change)
+            original_start(submission)
+        self.patch(executor, "_start", start)
+        running.result.callback(None)
+        self.assertEqual([urgent, later], started)
+
+    def test_equal_change_joined(self):
+        """
+        A change equal to one that is already running isn't run again; both
+        callers get its result.
+        """
+        result = Deferred()
+        executor = StateChangeExecutor()
+        first = executor.run(ControllableAction(result=result), DEPLOYER)
+        second_action = ControllableAction(result=result)
+        second = executor.run(second_action, DEPLOYER)
+        result.callback(None)
+        self.successResultOf(first)
+        self.successResultOf(second)
+        self.assertFalse(second_action.called)
+
+    @capture_logging(None)
+    def test_equal_change_failure(self, logger):
+        """
+        Each caller waiting for a change that fails gets its own ``Failure``,
+        so handling one doesn't handle the others.
+        """
+        result = Deferred()
+        executor = StateChangeExecutor()
+        first = executor.run(ControllableAction(result=result), DEPLOYER)
+        second = executor.run(ControllableAction(result=result), DEPLOYER)
+        result.errback(CustomException())
+        failures = [self.failureResultOf(d, CustomException)
+                    for d in (first, second)]
+        self.assertIsNot(failures[0], failures[1])
+
+    def test_waiter_cancelled_by_another(self):
+        """
+        If a caller's callbacks for a finished change cancel another
+        caller's ``Deferred`` for it, that one fails with
+        ``CancelledError``.
+        """
+        result = Deferred()
+        executor = StateChangeExecutor()
+        first = executor.run(ControllableAction(result=result), DEPLOYER)
+        second = executor.run(ControllableAction(result=result), DEPLOYER)
+        first.addCallback(lambda _: second.cancel())
+        result.callback(None)
+        self.successResultOf(first)
+        self.failureResultOf(second, CancelledError)
+
+    def test_wait_for_foreground(self):
+        """
+        ``StateChangeExecutor.wait_for_foreground`` fires once the only
+        changes queued or running are background ones.
+        """
+        foreground = ControllableAction(result=Deferred())
+        background = UrgentAction(result=Deferred())
+        queued = UrgentAction(result=Deferred())
+        executor = StateChangeExecutor(
+            {UrgentAction: ChangePolicy(concurrency=1, background=True)})
+        executor.run(
+            in_parallel(changes=[foreground, background, queued]), DEPLOYER)
+        waiting = executor.wait_for_foreground()
+        self.assertNoResult(waiting)
+        foreground.result.callback(None)
+        self.successResultOf(waiting)
+
+    def test_wait_for_foreground_sequential(self):
+        """
+        ``StateChangeExecutor.wait_for_foreground`` doesn't fire between one
+        change and the next of a sequence.
+        """
+        actions = [ControllableAction(result=Deferred()) for _ in range(2)]
+        executor = StateChangeExecutor()
+        executor.run(sequentially(changes=actions), DEPLOYER)
+        waiting = executor.wait_for_foreground()
+        actions[0].result.callback(None)
+        self.assertNoResult(waiting)
+        actions[1].result.callback(None)
+        self.successResultOf(waiting)
+
+    def test_wait_for_foreground_idle(self):
+        """
+        ``StateChangeExecutor.wait_for_foreground`` fires immediately if no
+        changes are queued or running.
+        """
+        self.successResultOf(StateChangeExecutor().wait_for_foreground())
+
+    def test_cancel_queued(self):
+        """
+        Cancelling the result of ``StateChangeExecutor.run`` for a change
+        that hasn't started means it never runs.
+        """
+        running = ControllableAction(result=Deferred())
+        queued = ControllableAction(result=succeed(None))
+        executor = StateChangeExecutor(concurrency=1)
+        executor.run(running, DEPLOYER)
+        d = executor.run(queued, DEPLOYER)
+        d.cancel()
+        running.result.callback(None)
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(
+            (False, {}), (queued.called, executor.queued()))
+
+    def test_cancel_all_queued(self):
+        """
+        ``StateChangeExecutor.cancel_queued`` cancels every change that
+        hasn't started, but lets running ones finish.
+        """
+        actions = [ControllableAction(result=Deferred()) for _ in range(3)]
+        executor = StateChangeExecutor(concurrency=1)
+        results = [executor.run(action, DEPLOYER) for action in actions]
+        executor.cancel_queued()
+        self.failureResultOf(results[1], CancelledError)
+        self.failureResultOf(results[2], CancelledError)
+        actions[0].result.callback(None)
+        self.successResultOf(results[0])
+        self.assertEqual(
+            [True, False, False], [action.called for action in actions])
+
+    @capture_logging(None)
+    def test_failure(self, logger):
+        """
+        If a change fails, the ``Deferred`` returned by
+        ``StateChangeExecutor.run`` fails the same way and queued changes
+        still start.
+        """
+        broken = ControllableAction(result=fail(CustomException()))
+        queued = ControllableAction(result=succeed(None))
+        executor = StateChangeExecutor(concurrency=1)
+        self.failureResultOf(executor.run(broken, DEPLOYER), CustomException)
+        self.successResultOf(executor.run(queued, DEPLOYER))
+
+    @capture_logging(None)
+    def test_state_logged(self, logger):
+        """
+        The number of queued and running changes is logged when a change
+        starts and finishes.
+        """
+        action = ControllableAction(result=Deferred())
+        executor = StateChangeExecutor()
+        executor.run(action, DEPLOYER)
+        action.result.callback(None)
+        self.assertEqual(
+            [(1, 0), (0, 0)],
+            [(message.message[u"in_flight"], message.message[u"queued"])
+             for message in LoggedMessage.of_type(
+                 logger.messages, LOG_EXECUTOR_STATE)])
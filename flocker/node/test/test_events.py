@@ -0,0 +1,294 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node._events``.
+"""
+
+from uuid import UUID, uuid4
+
+from twisted.internet.defer import CancelledError
+from twisted.internet.error import ConnectionLost
+from twisted.python.filepath import FilePath
+from twisted.test.iosim import connectedServerAndClient
+from twisted.test.proto_helpers import MemoryReactor
+
+from ...testtools import TestCase
+from ...control import NodeState, Manifestation, Dataset
+from .._events import (
+    DatasetEvent, DatasetEventType, DatasetEventPublisher,
+    DatasetEventSubscriber, dataset_events, dataset_event_publisher_service,
+    _PublisherAMP, _SubscriberAMP,
+)
+
+
+NODE_UUID = uuid4()
+
+
+def node_state(mounted=(), attached=()):
+    """
+    Create a ``NodeState`` for a node with some datasets.
+
+    :param mounted: Dataset IDs of datasets that are attached and mounted.
+    :param attached: Dataset IDs of datasets that are only attached.
+
+    :return: The ``NodeState``.
+    """
+    manifestations = {
+        dataset_id: Manifestation(dataset=Dataset(dataset_id=dataset_id),
+                                  primary=True)
+        for dataset_id in mounted
+    }
+    return NodeState(
+        uuid=NODE_UUID, hostname=u"192.0.2.1",
+        manifestations=manifestations,
+        paths={dataset_id: FilePath(b"/flocker").child(bytes(dataset_id))
+               for dataset_id in mounted},
+        devices={UUID(dataset_id): FilePath(b"/dev/sdb")
+                 for dataset_id in list(mounted) + list(attached)},
+    )
+
+
+class DatasetEventsTests(TestCase):
+    """
+    Tests for ``dataset_events``.
+    """
+    def setUp(self):
+        super(DatasetEventsTests, self).setUp()
+        self.dataset_id = unicode(uuid4())
+
+    def test_initial(self):
+        """
+        With no previous state every dataset that is attached or mounted gets
+        events.
+        """
+        new = node_state(mounted=[self.dataset_id])
+        self.assertEqual(
+            [DatasetEvent(dataset_id=self.dataset_id,
+                          event_type=DatasetEventType.ATTACHED),
+             DatasetEvent(dataset_id=self.dataset_id,
+                          event_type=DatasetEventType.MOUNTED,
+                          path=new.paths[self.dataset_id])],
+            dataset_events(None, new))
+
+    def test_mounted(self):
+        """
+        A dataset that gains a path is ``MOUNTED``.
+        """
+        new = node_state(mounted=[self.dataset_id])
+        self.assertEqual(
+            [DatasetEvent(dataset_id=self.dataset_id,
+                          event_type=DatasetEventType.MOUNTED,
+                          path=new.paths[self.dataset_id])],
+            dataset_events(node_state(attached=[self.dataset_id]), new))
+
+    def test_unmounted_and_detached(self):
+        """
+        A dataset that loses its path and device is ``UNMOUNTED`` and then
+        ``DETACHED``.
+        """
+        self.assertEqual(
+            [DatasetEvent(dataset_id=self.dataset_id,
+                          event_type=DatasetEventType.UNMOUNTED),
+             DatasetEvent(dataset_id=self.dataset_id,
+                          event_type=DatasetEventType.DETACHED)],
+            dataset_events(node_state(mounted=[self.dataset_id]),
+                           node_state()))
+
+    def test_ignorant(self):
+        """
+        A ``NodeState`` that knows nothing about datasets has no events.
+        """
+        self.assertEqual(
+            [], dataset_events(None, NodeState(uuid=NODE_UUID,
+                                               hostname=u"192.0.2.1")))
+
+
+class PublisherSubscriberTests(TestCase):
+    """
+    Tests for ``DatasetEventPublisher`` and ``DatasetEventSubscriber``
+    talking to each other.
+    """
+    def setUp(self):
+        super(PublisherSubscriberTests, self).setUp()
+        self.dataset_id = unicode(uuid4())
+        self.publisher = DatasetEventPublisher()
+        self.subscriber = DatasetEventSubscriber(MemoryReactor())
+        self.observed = []
+        self.subscriber.observe(
+            lambda state, events: self.observed.append((state, events)))
+
+    def connect(self):
+        """
+        Connect the subscriber to the publisher.
+
+        :return: ``IOPump`` for the connection.
+        """
+        client, server, pump = connectedServerAndClient(
+            lambda: _PublisherAMP(self.publisher),
+            lambda: _SubscriberAMP(self.subscriber))
+        self.client = client
+        return pump
+
+    def test_not_connected(self):
+        """
+        A subscriber that hasn't connected knows no state.
+        """
+        self.assertEqual((False, None),
+                         (self.subscriber.connected,
+                          self.subscriber.path(self.dataset_id)))
+
+    def test_replay_on_connect(self):
+        """
+        A newly connected subscriber is sent the current state.
+        """
+        state = node_state(mounted=[self.dataset_id])
+        self.publisher.local_state_changed(state)
+        self.connect().flush()
+        self.assertEqual(
+            (True, state, state.paths[self.dataset_id],
+             [(state, dataset_events(None, state))]),
+            (self.subscriber.connected, self.subscriber.node_state,
+             self.subscriber.path(self.dataset_id), self.observed))
+
+    def test_changes_pushed(self):
+        """
+        Changed local state is pushed to subscribers with the resulting
+        events.
+        """
+        pump = self.connect()
+        old = node_state(attached=[self.dataset_id])
+        new = node_state(mounted=[self.dataset_id])
+        self.publisher.local_state_changed(old)
+        pump.flush()
+        self.publisher.local_state_changed(new)
+        pump.flush()
+        self.assertEqual(
+            [(old, dataset_events(None, old)),
+             (new, dataset_events(old, new))],
+            self.observed)
+
+    def test_unchanged_not_pushed(self):
+        """
+        Rediscovering the same local state doesn't notify subscribers.
+        """
+        pump = self.connect()
+        state = node_state(mounted=[self.dataset_id])
+        self.publisher.local_state_changed(state)
+        self.publisher.local_state_changed(state)
+        pump.flush()
+        self.assertEqual(1, len(self.observed))
+
+    def test_wait_for_path(self):
+        """
+        ``DatasetEventSubscriber.wait_for_path`` fires with the mountpoint
+        once the dataset is mounted.
+        """
+        pump = self.connect()
+        self.publisher.local_state_changed(node_state())
+        pump.flush()
+        d = self.subscriber.wait_for_path(self.dataset_id)
+        self.assertNoResult(d)
+        state = node_state(mounted=[self.dataset_id])
+        self.publisher.local_state_changed(state)
+        pump.flush()
+        self.assertEqual(state.paths[self.dataset_id],
+                         self.successResultOf(d))
+
+    def test_wait_for_path_already_mounted(self):
+        """
+        ``DatasetEventSubscriber.wait_for_path`` fires immediately for a
+        dataset that is already mounted.
+        """
+        state = node_state(mounted=[self.dataset_id])
+        self.publisher.local_state_changed(state)
+        self.connect().flush()
+        self.assertEqual(
+            state.paths[self.dataset_id],
+            self.successResultOf(
+                self.subscriber.wait_for_path(self.dataset_id)))
+
+    def test_wait_for_path_not_connected(self):
+        """
+        ``DatasetEventSubscriber.wait_for_path`` fails with
+        ``ConnectionLost`` if the publisher isn't connected.
+        """
+        self.failureResultOf(
+            self.subscriber.wait_for_path(self.dataset_id), ConnectionLost)
+
+    def test_disconnect(self):
+        """
+        When the connection is lost outstanding waits fail, the state is
+        forgotten and observers are told.
+        """
+        pump = self.connect()
+        self.publisher.local_state_changed(node_state())
+        pump.flush()
+        d = self.subscriber.wait_for_path(self.dataset_id)
+        self.client.transport.loseConnection()
+        pump.flush()
+        self.failureResultOf(d, ConnectionLost)
+        self.assertEqual((False, (None, [])),
+                         (self.subscriber.connected, self.observed[-1]))
+
+    def test_cancel_wait(self):
+        """
+        A cancelled wait is forgotten.
+        """
+        pump = self.connect()
+        self.publisher.local_state_changed(node_state())
+        pump.flush()
+        d = self.subscriber.wait_for_path(self.dataset_id)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual({}, self.subscriber._path_waiters)
+
+    def test_query_path(self):
+        """
+        ``DatasetEventSubscriber.query_path`` asks the publisher where a
+        dataset is mounted.
+        """
+        pump = self.connect()
+        state = node_state(mounted=[self.dataset_id])
+        self.publisher.local_state_changed(state)
+        d = self.subscriber.query_path(self.dataset_id)
+        unknown = self.subscriber.query_path(unicode(uuid4()))
+        pump.flush()
+        self.assertEqual(
+            (state.paths[self.dataset_id], None),
+            (self.successResultOf(d), self.successResultOf(unknown)))
+
+
+class ServiceTests(TestCase):
+    """
+    Tests for the publisher and subscriber services.
+    """
+    def test_publisher_listens(self):
+        """
+        ``dataset_event_publisher_service`` creates the socket's parent
+        directory and listens on the socket.
+        """
+        reactor = MemoryReactor()
+        socket_path = self.make_temporary_directory().child(
+            b"run").child(b"events.sock")
+        service = dataset_event_publisher_service(
+            reactor, DatasetEventPublisher(), socket_path)
+        service.privilegedStartService()
+        self.addCleanup(service.stopService)
+        self.assertEqual(
+            (True, socket_path.path),
+            (socket_path.parent().isdir(), reactor.unixServers[0][0]))
+
+    def test_subscriber_connects(self):
+        """
+        Starting a ``DatasetEventSubscriber`` connects to the socket, and
+        stopping it stops reconnection attempts.
+        """
+        reactor = MemoryReactor()
+        socket_path = FilePath(b"/tmp/events.sock")
+        subscriber = DatasetEventSubscriber(reactor, socket_path)
+        subscriber.startService()
+        subscriber.stopService()
+        self.assertEqual(
+            (socket_path.path, subscriber.factory,
+             subscriber.factory.continueTrying),
+            reactor.unixClients[0][:2] + (False,))
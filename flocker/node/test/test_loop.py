@@ -17,12 +17,13 @@ from pyrsistent import pset
 
 from twisted.test.proto_helpers import MemoryReactorClock
 from twisted.internet.protocol import ReconnectingClientFactory
-from twisted.internet.defer import succeed, Deferred, fail
+from twisted.internet.defer import CancelledError, succeed, Deferred, fail
 from twisted.internet.ssl import ClientContextFactory
 from twisted.internet.task import Clock
 from twisted.protocols.tls import TLSMemoryBIOFactory, TLSMemoryBIOProtocol
 from twisted.protocols.amp import AMP, CommandLocator
 from twisted.test.iosim import connectedServerAndClient
+from twisted.python.filepath import FilePath
 
 from ...testtools.amp import (
     FakeAMPClient, DelayedAMPClient, connected_amp_protocol,
@@ -34,7 +35,7 @@ from .._loop import (
     ConvergenceLoopStates, build_convergence_loop_fsm, AgentLoopService,
     LOG_SEND_TO_CONTROL_SERVICE,
     LOG_CONVERGE, LOG_CALCULATED_ACTIONS, LOG_DISCOVERY,
-    _UNCONVERGED_DELAY, _Sleep,
+    _UNCONVERGED_DELAY, _Sleep, _LOCAL_CHANGE_INTERVAL, _BACKGROUND_DELAY,
     )
 from ..testtools import ControllableDeployer, ControllableAction, to_node
 from ...control import (
@@ -43,7 +44,7 @@ from ...control import (
 )
 from ...control._protocol import NodeStateCommand, AgentAMP, SetNodeEraCommand
 from ...control.test.test_protocol import iconvergence_agent_tests_factory
-from .. import NoOp
+from .. import ChangePolicy, NoOp, StateChangeExecutor
 
 
 NO_OP = NoOp(sleep=timedelta(seconds=300))
@@ -820,6 +821,91 @@ class ConvergenceLoopFSMTests(TestCase):
         delay = delayed_call.getTime() - self.reactor.seconds()
         self.assertEqual(delay, 17)
 
+    def test_local_change_while_sleeping(self):
+        """
+        A local change reported to a sleeping convergence loop more than
+        ``_LOCAL_CHANGE_INTERVAL`` after the last iteration started wakes it
+        up immediately.
+        """
+        loop = self.convergence_iteration(initial_action=NO_OP,
+                                          later_actions=[NO_OP, NO_OP])
+        self.reactor.advance(_LOCAL_CHANGE_INTERVAL + 1)
+        loop.receive(ConvergenceLoopInputs.LOCAL_CHANGE)
+        self.reactor.advance(0)
+        self.assertEqual(
+            (ConvergenceLoopStates.SLEEPING, []),
+            (loop.state, self.deployer.local_states))
+
+    def test_local_change_minimum_interval(self):
+        """
+        Local changes reported soon after an iteration started only wake up
+        the sleeping convergence loop ``_LOCAL_CHANGE_INTERVAL`` after that
+        iteration started, however many there are.
+        """
+        loop = self.convergence_iteration(initial_action=NO_OP,
+                                          later_actions=[NO_OP, NO_OP])
+        for i in range(10):
+            loop.receive(ConvergenceLoopInputs.LOCAL_CHANGE)
+        [delayed_call] = self.reactor.getDelayedCalls()
+        self.assertEqual(_LOCAL_CHANGE_INTERVAL, delayed_call.getTime())
+
+    def test_local_change_while_converging(self):
+        """
+        A local change reported during an iteration shortens the following
+        sleep to ``_LOCAL_CHANGE_INTERVAL`` after that iteration started.
+        """
+        local_state = NodeState(hostname=u"192.0.2.123")
+        discovered = Deferred()
+        deployer = ControllableDeployer(
+            local_state.hostname, [discovered], [NO_OP])
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(reactor, deployer)
+        loop.receive(_ClientStatusUpdate(
+            client=self.make_amp_client([local_state]),
+            configuration=Deployment(), state=DeploymentState()))
+        reactor.advance(0.25)
+        loop.receive(ConvergenceLoopInputs.LOCAL_CHANGE)
+        discovered.callback(local_state)
+        [delayed_call] = reactor.getDelayedCalls()
+        self.assertEqual(_LOCAL_CHANGE_INTERVAL, delayed_call.getTime())
+
+    def test_background_change(self):
+        """
+        An iteration doesn't wait for background changes to finish.  The
+        loop sleeps for ``_BACKGROUND_DELAY`` instead and is woken up by
+        them finishing as for a local change.
+        """
+        local_state = NodeState(hostname=u"192.0.2.123")
+        background = ControllableAction(result=Deferred())
+        deployer = ControllableDeployer(
+            local_state.hostname, [succeed(local_state), succeed(local_state)],
+            [background, NO_OP])
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(
+            reactor, deployer, executor=StateChangeExecutor(
+                {ControllableAction: ChangePolicy(background=True)}))
+        loop.receive(_ClientStatusUpdate(
+            client=self.make_amp_client([local_state]),
+            configuration=Deployment(), state=DeploymentState()))
+        [delayed_call] = reactor.getDelayedCalls()
+        sleep = (loop.state, delayed_call.getTime())
+        reactor.advance(_LOCAL_CHANGE_INTERVAL)
+        background.result.callback(None)
+        reactor.advance(0)
+        self.assertEqual(
+            ((ConvergenceLoopStates.SLEEPING, _BACKGROUND_DELAY.delay_seconds),
+             []),
+            (sleep, deployer.local_states))
+
+    def test_local_change_stopped(self):
+        """
+        A local change reported to a stopped convergence loop is ignored.
+        """
+        loop = build_convergence_loop_fsm(
+            Clock(), ControllableDeployer(u"192.0.2.123", [], []))
+        loop.receive(ConvergenceLoopInputs.LOCAL_CHANGE)
+        self.assertEqual(ConvergenceLoopStates.STOPPED, loop.state)
+
     def assert_woken_up(self, loop):
         """
         When a new configuraton and cluster state are fed to a sleeping
@@ -1142,6 +1228,57 @@ class ConvergenceLoopFSMTests(TestCase):
              [(NodeStateCommand, dict(state_changes=(local_state,)))],
              [(NodeStateCommand, dict(state_changes=(local_state2,)))]))
 
+    def test_local_state_observers(self):
+        """
+        Local state observers are called with the discovered ``NodeState`` of
+        the local node.
+        """
+        local_node_hostname = u'192.0.2.123'
+        local_node_state = NodeState(
+            hostname=local_node_hostname,
+            manifestations={}, devices={}, paths={},
+        )
+        client = self.make_amp_client([local_node_state])
+        deployer = ControllableDeployer(
+            local_node_hostname, [succeed(local_node_state)],
+            [ControllableAction(result=Deferred())]
+        )
+        observed = []
+        fsm = build_convergence_loop_fsm(Clock(), deployer, [observed.append])
+        fsm.receive(_ClientStatusUpdate(client=client,
+                                        configuration=Deployment(),
+                                        state=DeploymentState()))
+        self.assertEqual([local_node_state], observed)
+
+    @capture_logging(None)
+    def test_local_state_observer_error(self, logger):
+        """
+        An exception raised by a local state observer is logged and doesn't
+        stop convergence.
+        """
+        local_node_hostname = u'192.0.2.123'
+        local_node_state = NodeState(
+            hostname=local_node_hostname,
+            manifestations={}, devices={}, paths={},
+        )
+        client = self.make_amp_client([local_node_state])
+        deployer = ControllableDeployer(
+            local_node_hostname, [succeed(local_node_state)],
+            [ControllableAction(result=Deferred())]
+        )
+
+        def broken(state):
+            raise CustomException()
+        fsm = build_convergence_loop_fsm(Clock(), deployer, [broken])
+        self.patch(fsm, "logger", logger)
+        fsm.receive(_ClientStatusUpdate(client=client,
+                                        configuration=Deployment(),
+                                        state=DeploymentState()))
+        self.assertEqual(
+            (len(logger.flush_tracebacks(CustomException)),
+             len(deployer.calculate_inputs)),
+            (1, 1))
+
     def test_discover_states_gets_cluster_state(self):
         """
         ``IDeployer.discover_state`` gets passed the entire cluster state.
@@ -1208,6 +1345,31 @@ class AgentLoopServiceTests(TestCase):
                           ReconnectingClientFactory,
                           True, TLSMemoryBIOProtocol, AgentAMP, True))
 
+    def test_start_service_control_socket(self):
+        """
+        If a control socket is given, starting the service connects to it
+        rather than to the control service's host and port.
+        """
+        socket_path = FilePath(b"/tmp/control.sock")
+        service = AgentLoopService(
+            reactor=self.reactor, deployer=self.deployer, host=u"example.com",
+            port=1234, context_factory=ClientContextFactory(), era=uuid4(),
+            control_socket=socket_path)
+        service.startService()
+        self.addCleanup(service.stopService)
+        self.assertEqual(
+            ([], (socket_path.path, service.reconnecting_factory)),
+            (self.reactor.tcpClients, self.reactor.unixClients[0][:2]))
+
+    def test_local_change_detected(self):
+        """
+        ``AgentLoopService.local_change_detected`` tells the convergence loop
+        about the local change.
+        """
+        self.service.convergence_loop = fsm = StubFSM()
+        self.service.local_change_detected()
+        self.assertEqual([ConvergenceLoopInputs.LOCAL_CHANGE], fsm.inputted)
+
     def test_stop_service(self):
         """
         Stopping the service stops the reconnecting TCP client and inputs
@@ -1221,6 +1383,19 @@ class AgentLoopServiceTests(TestCase):
                           fsm.inputted, service.running),
                          (False, [ClusterStatusInputs.SHUTDOWN], False))
 
+    def test_stop_service_cancels_queued(self):
+        """
+        Stopping the service cancels state changes that haven't started yet.
+        """
+        service = self.service
+        service.executor.concurrency = 1
+        service.startService()
+        service.executor.run(ControllableAction(result=Deferred()), None)
+        queued = service.executor.run(
+            ControllableAction(result=Deferred()), None)
+        service.stopService()
+        self.failureResultOf(queued, CancelledError)
+
     def test_connected(self):
         """
         When ``connnected()`` is called a ``_ConnectedToControlService`` input
@@ -1309,6 +1484,80 @@ class AgentLoopServiceTests(TestCase):
                          [_StatusUpdate(configuration=config,
                                         state=state.set(nodes=[]))])
 
+    def test_dataset_state_changed(self):
+        """
+        When ``dataset_state_changed()`` is called the last received cluster
+        state is passed to the cluster status FSM again, updated with the
+        given local ``NodeState``.
+        """
+        service = self.service
+        service.cluster_status = fsm = StubFSM()
+        config = Deployment()
+        state = DeploymentState(
+            nodes=[self.node_state],
+            node_uuid_to_era={self.deployer.node_uuid: self.service.era})
+        service.cluster_updated(config, state)
+        dataset_state = self.node_state.set(
+            manifestations={}, devices={}, paths={})
+        service.dataset_state_changed(dataset_state, [])
+        self.assertEqual(
+            fsm.inputted[1:],
+            [_StatusUpdate(configuration=config,
+                           state=state.update_node(dataset_state))])
+
+    def test_dataset_state_before_cluster_updated(self):
+        """
+        Local ``NodeState`` passed to ``dataset_state_changed()`` before any
+        cluster state was received is applied to the next cluster state.
+        """
+        service = self.service
+        service.cluster_status = fsm = StubFSM()
+        dataset_state = self.node_state.set(
+            manifestations={}, devices={}, paths={})
+        service.dataset_state_changed(dataset_state, [])
+        config = Deployment()
+        state = DeploymentState(
+            node_uuid_to_era={self.deployer.node_uuid: self.service.era})
+        service.cluster_updated(config, state)
+        self.assertEqual(
+            fsm.inputted,
+            [_StatusUpdate(configuration=config,
+                           state=state.update_node(dataset_state))])
+
+    def test_dataset_state_lost(self):
+        """
+        When ``dataset_state_changed()`` is called with ``None`` the cluster
+        state from the control service is used unmodified again.
+        """
+        service = self.service
+        service.cluster_status = fsm = StubFSM()
+        service.dataset_state_changed(
+            self.node_state.set(manifestations={}, devices={}, paths={}), [])
+        config = Deployment()
+        state = DeploymentState(
+            nodes=[self.node_state],
+            node_uuid_to_era={self.deployer.node_uuid: self.service.era})
+        service.cluster_updated(config, state)
+        service.dataset_state_changed(None, [])
+        self.assertEqual(
+            fsm.inputted[-1],
+            _StatusUpdate(configuration=config, state=state))
+
+    def test_dataset_state_after_disconnect(self):
+        """
+        ``dataset_state_changed()`` doesn't resend cluster state received
+        over a connection to the control service that has since been lost.
+        """
+        service = self.service
+        service.cluster_status = fsm = StubFSM()
+        service.cluster_updated(Deployment(), DeploymentState())
+        service.disconnected()
+        service.dataset_state_changed(
+            self.node_state.set(manifestations={}, devices={}, paths={}), [])
+        self.assertEqual(
+            fsm.inputted[-1],
+            ClusterStatusInputs.DISCONNECTED_FROM_CONTROL_SERVICE)
+
 
 def _build_service(test):
     """
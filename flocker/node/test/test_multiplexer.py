@@ -0,0 +1,366 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node._multiplexer``.
+"""
+
+from uuid import uuid4
+
+from eliot import Logger, start_action
+from eliot.testing import capture_logging
+
+from zope.interface import implementer
+
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionLost
+from twisted.internet.ssl import ClientContextFactory
+from twisted.internet.task import Clock
+from twisted.protocols.amp import AMP
+from twisted.python.failure import Failure
+from twisted.test.iosim import connectedServerAndClient
+from twisted.test.proto_helpers import MemoryReactorClock, StringTransport
+
+from ...testtools import CustomException, TestCase
+from ...control import (
+    Deployment, DeploymentState, IConvergenceAgent, Node, NodeState,
+    NodeStateCommand, SetNodeEraCommand, AgentAMP,
+)
+from ...control._persistence import wire_encode
+from ...control._protocol import (
+    ClusterStatusCommand, ExpireNodeStateCommand,
+)
+from .._multiplexer import ControlServiceMultiplexer, _RawClusterStatusCommand
+from .._multiplexer import _DownstreamAMP, _UpstreamAMP
+
+
+class FakeConnection(object):
+    """
+    An AMP connection whose commands are recorded and answered by the test.
+
+    :ivar list calls: Tuples of command, arguments and the ``Deferred``
+        returned for the call.
+    """
+    def __init__(self):
+        self.calls = []
+        self.transport = StringTransport()
+
+    def callRemote(self, command, **kwargs):
+        d = Deferred()
+        self.calls.append((command, kwargs, d))
+        return d
+
+    def commands(self):
+        """
+        :return: ``list`` of the commands called so far.
+        """
+        return [command for (command, _, _) in self.calls]
+
+
+@implementer(IConvergenceAgent)
+class RecordingAgent(object):
+    """
+    An ``IConvergenceAgent`` that records cluster status updates.
+    """
+    logger = Logger()
+
+    def __init__(self):
+        self.updates = []
+
+    def connected(self, client):
+        pass
+
+    def disconnected(self):
+        pass
+
+    def cluster_updated(self, configuration, cluster_state):
+        self.updates.append((configuration, cluster_state))
+
+
+def node_state():
+    """
+    :return: A new ``NodeState``.
+    """
+    return NodeState(uuid=uuid4(), hostname=u"192.0.2.1")
+
+
+class ControlServiceMultiplexerTests(TestCase):
+    """
+    Tests for ``ControlServiceMultiplexer``.
+    """
+    def setUp(self):
+        super(ControlServiceMultiplexerTests, self).setUp()
+        self.reactor = MemoryReactorClock()
+        self.multiplexer = ControlServiceMultiplexer(
+            self.reactor, b"192.0.2.100", 4524, ClientContextFactory(),
+            self.make_temporary_directory().child(b"mux.sock"))
+        self.upstream = FakeConnection()
+        self.agent = FakeConnection()
+        self.other_agent = FakeConnection()
+
+    def test_start_service(self):
+        """
+        Starting the multiplexer connects to the control service and listens
+        on its Unix socket.
+        """
+        self.multiplexer.startService()
+        self.addCleanup(self.multiplexer.stopService)
+        self.assertEqual(
+            ((b"192.0.2.100", 4524), 1),
+            (self.reactor.tcpClients[0][:2], len(self.reactor.unixServers)))
+
+    def test_relay(self):
+        """
+        A cluster status update is relayed to connected agents as is.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.multiplexer.cluster_updated(b"configuration", b"state")
+        [(command, kwargs, _)] = self.agent.calls
+        self.assertEqual(
+            (_RawClusterStatusCommand, b"configuration", b"state"),
+            (command, kwargs["configuration"], kwargs["state"]))
+
+    def test_relay_on_agent_connect(self):
+        """
+        An agent that connects is sent the latest cluster status update.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.cluster_updated(b"configuration", b"state")
+        self.multiplexer.agent_connected(self.agent)
+        self.assertEqual([_RawClusterStatusCommand], self.agent.commands())
+
+    def test_no_update_yet(self):
+        """
+        An agent that connects before any cluster status has been received
+        is sent nothing.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.assertEqual([], self.agent.calls)
+
+    def test_relay_latest_only(self):
+        """
+        Updates received while an agent is still processing an earlier one
+        are replaced by the latest update, which is sent once the agent
+        acknowledges the earlier one.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.multiplexer.cluster_updated(b"c1", b"s1")
+        self.multiplexer.cluster_updated(b"c2", b"s2")
+        self.multiplexer.cluster_updated(b"c3", b"s3")
+        self.agent.calls[0][2].callback({})
+        self.assertEqual(
+            [b"c1", b"c3"],
+            [kwargs["configuration"] for (_, kwargs, _) in self.agent.calls])
+
+    def test_identical_update_not_relayed(self):
+        """
+        An update identical to the one an agent last received is not sent
+        to it again.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.multiplexer.cluster_updated(b"c1", b"s1")
+        self.agent.calls[0][2].callback({})
+        self.multiplexer.cluster_updated(b"c1", b"s1")
+        self.multiplexer.cluster_updated(b"c1", b"s2")
+        self.assertEqual(
+            [b"s1", b"s2"],
+            [kwargs["state"] for (_, kwargs, _) in self.agent.calls])
+
+    def test_era_sent_once(self):
+        """
+        The era is sent to the control service only once per connection no
+        matter how many agents send it.
+        """
+        self.multiplexer.connected(self.upstream)
+        era, node_uuid = unicode(uuid4()), unicode(uuid4())
+        first = self.multiplexer.set_node_era(era, node_uuid)
+        second = self.multiplexer.set_node_era(era, node_uuid)
+        self.upstream.calls[0][2].callback({})
+        self.successResultOf(first)
+        self.successResultOf(second)
+        self.assertEqual([SetNodeEraCommand], self.upstream.commands())
+
+    def test_era_resent_on_reconnect(self):
+        """
+        The era last sent by an agent is sent again when the connection to
+        the control service is replaced.
+        """
+        self.multiplexer.connected(self.upstream)
+        era, node_uuid = unicode(uuid4()), unicode(uuid4())
+        self.multiplexer.set_node_era(era, node_uuid)
+        self.multiplexer.disconnected()
+        upstream = FakeConnection()
+        self.multiplexer.connected(upstream)
+        [(command, kwargs, _)] = upstream.calls
+        self.assertEqual(
+            (SetNodeEraCommand, era, node_uuid),
+            (command, kwargs["era"], kwargs["node_uuid"]))
+
+    def test_upload_immediately(self):
+        """
+        Local state is sent to the control service right away if no other
+        upload is in progress, and the agent is answered once the control
+        service acknowledges it.
+        """
+        self.multiplexer.connected(self.upstream)
+        changes = [node_state()]
+        d = self.multiplexer.node_changed(self.agent, changes)
+        [(command, kwargs, response)] = self.upstream.calls
+        self.assertNoResult(d)
+        response.callback({})
+        self.successResultOf(d)
+        self.assertEqual((NodeStateCommand, changes),
+                         (command, kwargs["state_changes"]))
+
+    def test_uploads_merged(self):
+        """
+        Uploads received while another upload is in progress are sent
+        together, with only the latest upload from each agent.
+        """
+        self.multiplexer.connected(self.upstream)
+        first = self.multiplexer.node_changed(self.agent, [node_state()])
+        old = self.multiplexer.node_changed(self.agent, [node_state()])
+        latest = [node_state()]
+        new = self.multiplexer.node_changed(self.agent, latest)
+        other_changes = [node_state()]
+        other = self.multiplexer.node_changed(self.other_agent, other_changes)
+        self.upstream.calls[0][2].callback({})
+        self.successResultOf(first)
+        [(_, kwargs, response)] = self.upstream.calls[1:]
+        self.assertItemsEqual(latest + other_changes, kwargs["state_changes"])
+        response.callback({})
+        for d in (old, new, other):
+            self.successResultOf(d)
+
+    @capture_logging(None)
+    def test_upload_failed(self, logger):
+        """
+        If the control service fails to process an upload, every agent
+        whose state was part of it gets the failure.
+        """
+        self.patch(self.multiplexer, "logger", logger)
+        self.multiplexer.connected(self.upstream)
+        d = self.multiplexer.node_changed(self.agent, [node_state()])
+        self.upstream.calls[0][2].errback(Failure(CustomException()))
+        self.failureResultOf(d, CustomException)
+        self.assertEqual(1, len(logger.flush_tracebacks(CustomException)))
+
+    def test_upload_not_connected(self):
+        """
+        Local state can't be uploaded while the control service is not
+        connected.
+        """
+        self.failureResultOf(
+            self.multiplexer.node_changed(self.agent, [node_state()]),
+            ConnectionLost)
+
+    def test_disconnected(self):
+        """
+        When the connection to the control service is lost the agents are
+        disconnected and pending uploads fail.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.multiplexer.node_changed(self.agent, [node_state()])
+        pending = self.multiplexer.node_changed(self.agent, [node_state()])
+        self.multiplexer.disconnected()
+        self.failureResultOf(pending, ConnectionLost)
+        self.assertTrue(self.agent.transport.disconnecting)
+
+    def test_agent_with_state_disconnected(self):
+        """
+        When an agent that sent state disconnects, the control service is
+        told to expire that state, and the connection to it is kept.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        changes = [node_state()]
+        self.multiplexer.node_changed(self.agent, changes)
+        self.upstream.calls[0][2].callback({})
+        self.multiplexer.agent_disconnected(self.agent)
+        [(command, kwargs, _)] = self.upstream.calls[1:]
+        self.assertEqual(
+            (ExpireNodeStateCommand, changes, False),
+            (command, kwargs["state_changes"],
+             self.upstream.transport.disconnecting))
+
+    def test_agent_disconnected_shared_state(self):
+        """
+        State that another, still connected, agent sent too is not expired
+        when an agent disconnects.
+        """
+        self.multiplexer.connected(self.upstream)
+        state = node_state()
+        shared = state.set(manifestations={}, paths={}, devices={})
+        own = state.set(applications=[])
+        self.multiplexer.node_changed(self.agent, [shared, own])
+        self.multiplexer.node_changed(self.other_agent, [shared])
+        self.multiplexer.agent_disconnected(self.agent)
+        [(command, kwargs, _)] = self.upstream.calls[1:]
+        self.assertEqual((ExpireNodeStateCommand, [own]),
+                         (command, kwargs["state_changes"]))
+
+    def test_agent_without_state_disconnected(self):
+        """
+        When an agent that sent no state over the current connection to the
+        control service disconnects, nothing is sent to the control service.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.multiplexer.node_changed(self.agent, [node_state()])
+        self.multiplexer.disconnected()
+        upstream = FakeConnection()
+        self.multiplexer.connected(upstream)
+        self.multiplexer.agent_disconnected(self.agent)
+        self.assertEqual([], upstream.calls)
+
+    def test_agents_disconnected_with_upstream(self):
+        """
+        Agents disconnected because the connection to the control service was
+        lost send nothing to the control service.
+        """
+        self.multiplexer.connected(self.upstream)
+        self.multiplexer.agent_connected(self.agent)
+        self.multiplexer.node_changed(self.agent, [node_state()])
+        self.multiplexer.disconnected()
+        self.multiplexer.agent_disconnected(self.agent)
+        self.assertEqual([NodeStateCommand], self.upstream.commands())
+
+
+class EndToEndTests(TestCase):
+    """
+    Tests for agents talking to the control service through a
+    ``ControlServiceMultiplexer``.
+    """
+    def test_cluster_status(self):
+        """
+        Agents connected to the multiplexer receive the configuration and
+        state sent by the control service.
+        """
+        clock = Clock()
+        multiplexer = ControlServiceMultiplexer(
+            MemoryReactorClock(), b"192.0.2.100", 4524,
+            ClientContextFactory(),
+            self.make_temporary_directory().child(b"mux.sock"))
+        control_service, _, control_pump = connectedServerAndClient(
+            lambda: _UpstreamAMP(clock, multiplexer), AMP)
+        agent = RecordingAgent()
+        _, _, agent_pump = connectedServerAndClient(
+            lambda: _DownstreamAMP(clock, multiplexer),
+            lambda: AgentAMP(clock, agent))
+
+        configuration = Deployment(nodes={Node(uuid=uuid4())})
+        state = DeploymentState(nodes={node_state()})
+        with start_action(action_type=u"flocker:test") as action:
+            control_service.callRemote(
+                ClusterStatusCommand, configuration=configuration,
+                state=state, eliot_context=action)
+        control_pump.flush()
+        agent_pump.flush()
+        self.assertEqual(
+            ([(configuration, state)],
+             wire_encode(configuration)),
+            (agent.updates, wire_encode(agent.updates[0][0])))
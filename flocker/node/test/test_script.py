@@ -5,6 +5,7 @@ Tests for :module:`flocker.node.script`.
 """
 
 from functools import wraps
+from uuid import uuid4
 import logging
 import socket
 from unittest import skipUnless
@@ -21,6 +22,7 @@ from eliot.testing import assertHasAction, capture_logging
 from zope.interface.verify import verifyObject
 
 from twisted.internet.defer import Deferred
+from twisted.internet.ssl import ClientContextFactory
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service
 from twisted.python.runtime import platform
@@ -38,8 +40,23 @@ from ..script import (
 )
 from ..agents.cinder import CinderBlockDeviceAPI
 from ..agents.ebs import EBSBlockDeviceAPI
+from ..agents.blockdevice import (
+    BLOCK_DEVICE_CHANGE_CONCURRENCY, BLOCK_DEVICE_CHANGE_POLICIES,
+    VolumeListCache,
+)
+from ..agents._ratelimit import RateLimitedBlockDeviceAPI
+from ..agents._threadpool import BackendThreadPool
+from ..agents.blockdevice_manager import (
+    BlockDeviceManager, SyscallBlockDeviceManager,
+)
 
 from .._loop import AgentLoopService
+from .._events import DatasetEventSubscriber
+from .._wakeup import DeviceWatcher, DockerEventsWatcher, MountInfoPoller
+from .._multiplexer import (
+    ControlServiceMultiplexer, CONTROL_MULTIPLEXER_SOCKET,
+)
+from ..testtools import ControllableDeployer
 from ...testtools import MemoryCoreReactor, TestCase, random_name
 from ...ca.testtools import get_credential_sets
 
@@ -104,12 +121,14 @@ class DummyAgentService(PClass):
     reactor = field()
     loop_service = field()
     configuration = field()
+    wakeups = field(initial=True)
 
     @classmethod
     def for_loop_service(cls, loop_service):
         return lambda configuration: cls(
             loop_service=loop_service,
             configuration=configuration,
+            wakeups=configuration.get(u"wakeups", True),
         )
 
     def get_api(self):
@@ -157,6 +176,54 @@ class DatasetServiceFactoryTests(TestCase):
             DatasetServiceFactory().get_service, MemoryCoreReactor(), options,
         )
 
+    def test_local_change_sources(self):
+        """
+        The service created by ``DatasetServiceFactory.get_service`` wakes
+        the convergence loop when devices or mounts change.
+        """
+        setup_config(self)
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        loop_service = AgentLoopService(
+            reactor=MemoryCoreReactor(),
+            deployer=ControllableDeployer(u"127.0.0.1", [], []),
+            host=u"example.com", port=1234,
+            context_factory=ClientContextFactory(), era=uuid4())
+        service = DatasetServiceFactory(
+            agent_service_factory=DummyAgentService.for_loop_service(
+                loop_service),
+        ).get_service(MemoryCoreReactor(), options)
+        watchers = [child for child in service
+                    if isinstance(child, (DeviceWatcher, MountInfoPoller))]
+        self.assertEqual(
+            [loop_service.local_change_detected] * 2,
+            [watcher.changed for watcher in watchers])
+
+    def test_no_local_change_sources(self):
+        """
+        The service created by ``DatasetServiceFactory.get_service`` doesn't
+        watch devices or mounts if ``wakeups`` is false in the configuration
+        file.
+        """
+        setup_config(self)
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"wakeups"] = False
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        loop_service = AgentLoopService(
+            reactor=MemoryCoreReactor(),
+            deployer=ControllableDeployer(u"127.0.0.1", [], []),
+            host=u"example.com", port=1234,
+            context_factory=ClientContextFactory(), era=uuid4())
+        service = DatasetServiceFactory(
+            agent_service_factory=DummyAgentService.for_loop_service(
+                loop_service),
+        ).get_service(MemoryCoreReactor(), options)
+        self.assertEqual(
+            [], [child for child in service
+                 if isinstance(child, (DeviceWatcher, MountInfoPoller))])
+
 
 def agent_service_setup(test):
     """
@@ -257,6 +324,128 @@ class AgentServiceFromConfigurationTests(TestCase):
             ),
         )
 
+    def test_multiplex(self):
+        """
+        ``AgentService.from_configuration`` sets
+        ``multiplex_control_service`` from the ``multiplex`` key of the
+        ``control-service`` section.
+        """
+        setup_config(self)
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"control-service"][u"multiplex"] = True
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertTrue(agent_service.multiplex_control_service)
+
+    def test_wakeups(self):
+        """
+        ``AgentService.from_configuration`` sets ``wakeups`` from the
+        top-level ``wakeups`` key, defaulting to ``True``.
+        """
+        setup_config(self)
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        default = AgentService.from_configuration(get_configuration(options))
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"wakeups"] = False
+        self.config.setContent(yaml.safe_dump(contents))
+        configured = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual((True, False), (default.wakeups, configured.wakeups))
+
+    def test_list_volumes_cache_ttl(self):
+        """
+        ``AgentService.from_configuration`` sets ``list_volumes_cache_ttl``
+        from the ``list_volumes_cache_ttl`` key of the ``dataset`` section,
+        and doesn't pass it on to the backend.
+        """
+        setup_config(self)
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"dataset"][u"list_volumes_cache_ttl"] = 30
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(
+            (30, False),
+            (agent_service.list_volumes_cache_ttl,
+             "list_volumes_cache_ttl" in agent_service.api_args))
+
+    def test_mount_syscalls(self):
+        """
+        ``AgentService.from_configuration`` sets ``mount_syscalls`` from the
+        ``mount_syscalls`` key of the ``dataset`` section, and doesn't pass
+        it on to the backend.
+        """
+        setup_config(self)
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"dataset"][u"mount_syscalls"] = True
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(
+            (True, False),
+            (agent_service.mount_syscalls,
+             "mount_syscalls" in agent_service.api_args))
+
+    def test_mount_syscalls_default(self):
+        """
+        ``AgentService.from_configuration`` sets ``mount_syscalls`` to
+        ``False`` if the ``dataset`` section doesn't have the key.
+        """
+        setup_config(self)
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(False, agent_service.mount_syscalls)
+
+    def test_api_rate_limit(self):
+        """
+        ``AgentService.from_configuration`` sets ``api_rate_limit`` and
+        ``api_burst`` from the keys of the same names in the ``dataset``
+        section, and doesn't pass them on to the backend.
+        """
+        setup_config(self)
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"dataset"][u"api_rate_limit"] = 2.5
+        contents[u"dataset"][u"api_burst"] = 4
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(
+            (2.5, 4, False, False),
+            (agent_service.api_rate_limit, agent_service.api_burst,
+             "api_rate_limit" in agent_service.api_args,
+             "api_burst" in agent_service.api_args))
+
+    def test_api_threads(self):
+        """
+        ``AgentService.from_configuration`` sets ``api_threads`` from the
+        ``api_threads`` key of the ``dataset`` section, and doesn't pass it
+        on to the backend.
+        """
+        setup_config(self)
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"dataset"][u"api_threads"] = 25
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        agent_service = AgentService.from_configuration(
+            get_configuration(options))
+        self.assertEqual(
+            (25, False),
+            (agent_service.api_threads,
+             "api_threads" in agent_service.api_args))
+
     @_restore_logging(log_name='flocker.test')
     def test_logging(self, log_name):
         """
@@ -399,7 +588,8 @@ class AgentServiceGetAPITests(TestCase):
 
     def test_default_openstack(self):
         """
-        An OpenStack backend is available by default.
+        An OpenStack backend is available by default, making its requests
+        through a ``RateLimiter``.
         """
         agent_service = self.agent_service.set(
             "backend_name", u"openstack"
@@ -413,11 +603,14 @@ class AgentServiceGetAPITests(TestCase):
             }
         )
         cinder = agent_service.get_api()
-        self.assertIsInstance(cinder, CinderBlockDeviceAPI)
+        self.assertEqual(
+            (RateLimitedBlockDeviceAPI, CinderBlockDeviceAPI, True),
+            (type(cinder), type(cinder._api), cinder.charged))
 
     def test_default_aws(self):
         """
-        An AWS backend is available by default.
+        An AWS backend is available by default, making its requests
+        through a ``RateLimiter``.
         """
         agent_service = self.agent_service.set(
             "backend_name", u"aws"
@@ -432,7 +625,9 @@ class AgentServiceGetAPITests(TestCase):
             }
         )
         ebs = agent_service.get_api()
-        self.assertIsInstance(ebs, EBSBlockDeviceAPI)
+        self.assertEqual(
+            (RateLimitedBlockDeviceAPI, EBSBlockDeviceAPI, True),
+            (type(ebs), type(ebs._api), ebs.charged))
 
     def test_3rd_party_backend(self):
         """
@@ -477,6 +672,66 @@ class AgentServiceGetAPITests(TestCase):
                          "'notarealmoduleireallyhope' is neither a "
                          "built-in backend nor a 3rd party module.")
 
+    def rate_limited_api(self, is_throttled, needs_rate_limiter=False):
+        """
+        :return: A ``tuple`` of the API object ``AgentService.get_api``
+            returns for a block device backend with the given
+            ``is_throttled`` and ``needs_rate_limiter``, and the keyword
+            arguments the backend's factory was called with.
+        """
+        class API(object):
+            pass
+
+        factory_args = {}
+
+        def api_factory(**kwargs):
+            factory_args.update(kwargs)
+            return API()
+
+        agent_service = self.agent_service.set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=api_factory, deployer_type=DeployerType.block,
+                    is_throttled=is_throttled,
+                    needs_rate_limiter=needs_rate_limiter,
+                ),
+            ],
+        ).set("api_rate_limit", 3).set("api_burst", 6)
+        return agent_service.get_api(), factory_args
+
+    def test_rate_limited(self):
+        """
+        The API object of a backend that throttles requests is wrapped in a
+        ``RateLimitedBlockDeviceAPI`` with the configured limits, which
+        charges each call as a request; other backends are used directly.
+        """
+        def is_throttled(exception):
+            return False
+
+        limited, factory_args = self.rate_limited_api(is_throttled)
+        self.assertEqual(
+            (RateLimitedBlockDeviceAPI, 3, 6, is_throttled, False, {},
+             False),
+            (type(limited), limited.limiter.maximum_rate,
+             limited.limiter.burst, limited.limiter.throttled,
+             limited.charged, factory_args,
+             isinstance(self.rate_limited_api(None)[0],
+                        RateLimitedBlockDeviceAPI)))
+
+    def test_needs_rate_limiter(self):
+        """
+        If the flag for needing a rate limiter is set in the selected
+        backend, its factory is given the ``RateLimiter`` to make its
+        requests through, and calls aren't charged again.
+        """
+        limited, factory_args = self.rate_limited_api(
+            lambda exception: False, needs_rate_limiter=True)
+        self.assertEqual(
+            ({"rate_limiter": limited.limiter}, True),
+            (factory_args, limited.charged))
+
 
 class AgentServiceDeployerTests(TestCase):
     """
@@ -538,6 +793,84 @@ class AgentServiceDeployerTests(TestCase):
             deployer,
         )
 
+    def test_block_device_cache(self):
+        """
+        The default block device deployer uses the block device API through
+        a ``VolumeListCache`` with the configured TTL, which expires
+        listings using the agent's reactor.
+        """
+        agent_service = self.agent_service.set(
+            "get_external_ip", lambda host, port: u"192.0.2.7",
+        ).set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=None, deployer_type=DeployerType.block,
+                ),
+            ],
+        ).set(
+            "list_volumes_cache_ttl", 30,
+        )
+        deployer = agent_service.get_deployer(object())
+        self.assertEqual(
+            (VolumeListCache, 30, self.reactor),
+            (type(deployer.block_device_api),
+             deployer.block_device_api.ttl,
+             deployer.block_device_api._clock))
+
+    def test_block_device_threadpool(self):
+        """
+        The default block device deployer calls the block device API in a
+        ``BackendThreadPool`` of the configured size, which isn't started
+        until it is used and is stopped by the agent's reactor.
+        """
+        agent_service = self.agent_service.set(
+            "get_external_ip", lambda host, port: u"192.0.2.7",
+        ).set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=None, deployer_type=DeployerType.block,
+                ),
+            ],
+        ).set(
+            "api_threads", 25,
+        )
+        threadpool = agent_service.get_deployer(object()).threadpool
+        self.assertEqual(
+            (BackendThreadPool, 25, False, self.reactor),
+            (type(threadpool), threadpool.max, threadpool.started,
+             threadpool._reactor))
+
+    def test_block_device_manager(self):
+        """
+        The default block device deployer runs ``mount(8)`` to mount
+        filesystems, unless ``mount_syscalls`` is true.
+        """
+        agent_service = self.agent_service.set(
+            "get_external_ip", lambda host, port: u"192.0.2.7",
+        ).set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=None, deployer_type=DeployerType.block,
+                ),
+            ],
+        )
+        managers = [
+            service.get_deployer(object()).block_device_manager
+            for service in (
+                agent_service,
+                agent_service.set("mount_syscalls", True),
+            )
+        ]
+        self.assertEqual(
+            [BlockDeviceManager, SyscallBlockDeviceManager],
+            [type(manager) for manager in managers])
+
 
 class AgentServiceLoopTests(TestCase):
     """
@@ -569,6 +902,56 @@ class AgentServiceLoopTests(TestCase):
             loop_service,
         )
 
+    @skipUnless(platform.isLinux(), "get_era() only supports Linux.")
+    def test_multiplexed(self):
+        """
+        If ``multiplex_control_service`` is set, the ``AgentLoopService``
+        talks to the control service through a ``ControlServiceMultiplexer``
+        running as its child.
+        """
+        agent_service = self.agent_service.set(
+            multiplex_control_service=True)
+        loop_service = agent_service.get_loop_service(object())
+        [multiplexer] = list(loop_service)
+        self.assertEqual(
+            (CONTROL_MULTIPLEXER_SOCKET, ControlServiceMultiplexer),
+            (loop_service.control_socket, multiplexer.__class__))
+
+    @skipUnless(platform.isLinux(), "get_era() only supports Linux.")
+    def test_block_device_executor(self):
+        """
+        The changes of a block device deployer are run with the block device
+        change policies.
+        """
+        agent_service = self.agent_service.set(
+            "get_external_ip", lambda host, port: u"192.0.2.7",
+        ).set(
+            "backends", [
+                BackendDescription(
+                    name=self.agent_service.backend_name,
+                    needs_reactor=False, needs_cluster_id=False,
+                    api_factory=None, deployer_type=DeployerType.block,
+                ),
+            ],
+        )
+        loop_service = agent_service.get_loop_service(
+            agent_service.get_deployer(object()))
+        self.assertEqual(
+            (BLOCK_DEVICE_CHANGE_POLICIES, BLOCK_DEVICE_CHANGE_CONCURRENCY),
+            (loop_service.executor.policies,
+             loop_service.executor.concurrency))
+
+    @skipUnless(platform.isLinux(), "get_era() only supports Linux.")
+    def test_default_executor(self):
+        """
+        The changes of other deployers are run without limits.
+        """
+        loop_service = self.agent_service.get_loop_service(object())
+        self.assertEqual(
+            ({}, None),
+            (loop_service.executor.policies,
+             loop_service.executor.concurrency))
+
 
 class AgentServiceFactoryTests(TestCase):
     """
@@ -707,6 +1090,61 @@ class AgentServiceFactoryTests(TestCase):
         agent.get_service(reactor, options)
         self.assertIn(spied[0], get_all_ips())
 
+    @skipUnless(platform.isLinux(), "get_era() only supports Linux.")
+    def test_subscribe_to_dataset_events(self):
+        """
+        If ``subscribe_to_dataset_events`` is set, the ``AgentLoopService``
+        has a ``DatasetEventSubscriber`` child service which passes the
+        state published by the dataset agent to the loop service.
+        """
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        service_factory = self.service_factory(
+            deployer_factory=lambda **kw: ControllableDeployer(
+                u"127.0.0.1", [], []),
+        ).set(subscribe_to_dataset_events=True)
+        service = service_factory.get_service(MemoryCoreReactor(), options)
+        [subscriber] = list(service)
+        self.assertEqual(
+            (DatasetEventSubscriber, [service.dataset_state_changed]),
+            (subscriber.__class__, subscriber._observers))
+
+    def test_follow_docker_events(self):
+        """
+        If ``follow_docker_events`` is set, the ``AgentLoopService`` has a
+        ``DockerEventsWatcher`` child service which wakes the convergence
+        loop.
+        """
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        service_factory = self.service_factory(
+            deployer_factory=lambda **kw: ControllableDeployer(
+                u"127.0.0.1", [], []),
+        ).set(follow_docker_events=True)
+        service = service_factory.get_service(MemoryCoreReactor(), options)
+        [watcher] = list(service)
+        self.assertEqual(
+            (DockerEventsWatcher, service.local_change_detected),
+            (watcher.__class__, watcher.changed))
+
+    def test_no_docker_events_without_wakeups(self):
+        """
+        Even if ``follow_docker_events`` is set, the ``AgentLoopService`` has
+        no ``DockerEventsWatcher`` if ``wakeups`` is false in the
+        configuration file.
+        """
+        contents = yaml.safe_load(self.config.getContent())
+        contents[u"wakeups"] = False
+        self.config.setContent(yaml.safe_dump(contents))
+        options = DatasetAgentOptions()
+        options.parseOptions([b"--agent-config", self.config.path])
+        service_factory = self.service_factory(
+            deployer_factory=lambda **kw: ControllableDeployer(
+                u"127.0.0.1", [], []),
+        ).set(follow_docker_events=True)
+        service = service_factory.get_service(MemoryCoreReactor(), options)
+        self.assertEqual([], list(service))
+
     def test_missing_configuration_file(self):
         """
         ``AgentServiceFactory.get_service`` raises an ``IOError`` if the given
@@ -913,6 +1351,22 @@ class ValidateConfigurationTests(TestCase):
         # Nothing is raised
         validate_configuration(self.configuration)
 
+    def test_wakeups_optional(self):
+        """
+        ``wakeups`` may be set to a boolean.
+        """
+        self.configuration['wakeups'] = False
+        # Nothing is raised
+        validate_configuration(self.configuration)
+
+    def test_error_on_invalid_wakeups(self):
+        """
+        ``wakeups`` must be a boolean.
+        """
+        self.configuration['wakeups'] = "no"
+        self.assertRaises(
+            ValidationError, validate_configuration, self.configuration)
+
     def test_error_on_invalid_configuration_type(self):
         """
         A ``ValidationError`` is raised if the config file is not formatted
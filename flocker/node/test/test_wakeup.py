@@ -0,0 +1,164 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node._wakeup``.
+"""
+
+from tempfile import mkdtemp
+from unittest import skipIf
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.endpoints import UNIXServerEndpoint
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from ...testtools import AsyncTestCase, TestCase
+from .._wakeup import (
+    DeviceWatcher, DockerEventsWatcher, MountInfoPoller, INotify,
+)
+
+
+class MountInfoPollerTests(TestCase):
+    """
+    Tests for ``MountInfoPoller``.
+    """
+    def setUp(self):
+        super(MountInfoPollerTests, self).setUp()
+        self.clock = Clock()
+        self.mountinfo = self.make_temporary_file(content=b"/ /\n")
+        self.changes = []
+        self.poller = MountInfoPoller(
+            self.clock, lambda: self.changes.append(None), self.mountinfo,
+            interval=1.0)
+        self.poller.startService()
+        self.addCleanup(self.poller.stopService)
+
+    def test_unchanged(self):
+        """
+        Nothing is reported if the mount table doesn't change.
+        """
+        self.clock.pump([1.0] * 5)
+        self.assertEqual([], self.changes)
+
+    def test_changed(self):
+        """
+        A change to the mount table is reported once, at the next poll.
+        """
+        self.mountinfo.setContent(b"/ /\n/dev/sdb /flocker/x\n")
+        self.clock.pump([0.5, 0.5, 1.0])
+        self.assertEqual([None], self.changes)
+
+    def test_unreadable(self):
+        """
+        A mount table that can no longer be read is reported as a change.
+        """
+        self.mountinfo.remove()
+        self.clock.pump([1.0, 1.0])
+        self.assertEqual([None], self.changes)
+
+
+class DeviceWatcherTests(AsyncTestCase):
+    """
+    Tests for ``DeviceWatcher``.
+    """
+    @skipIf(INotify is None, "inotify is not available on this platform.")
+    def test_created(self):
+        """
+        A file created in the watched directory is reported.
+        """
+        directory = self.make_temporary_directory()
+        changed = Deferred()
+        watcher = DeviceWatcher(
+            reactor, lambda: changed.callback(None), directory)
+        watcher.startService()
+        self.addCleanup(watcher.stopService)
+        directory.child(b"sdb").touch()
+        return changed
+
+    def test_unwatchable(self):
+        """
+        If the directory can't be watched the service starts anyway.
+        """
+        watcher = DeviceWatcher(
+            reactor, lambda: None, self.make_temporary_path())
+        watcher.startService()
+        self.addCleanup(watcher.stopService)
+        self.assertTrue(watcher.running)
+
+
+class _Events(Resource):
+    """
+    A fake Docker ``/events`` resource which keeps requests open until told
+    to send an event.
+
+    :ivar list requests: The open requests.
+    """
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.requests = []
+        self.connected = Deferred()
+
+    def render_GET(self, request):
+        self.requests.append(request)
+        request.write(b"")
+        connected, self.connected = self.connected, Deferred()
+        connected.callback(request)
+        return NOT_DONE_YET
+
+
+class DockerEventsWatcherTests(AsyncTestCase):
+    """
+    Tests for ``DockerEventsWatcher``.
+    """
+    def setUp(self):
+        super(DockerEventsWatcherTests, self).setUp()
+        # The temporary directories of tests are too deeply nested for
+        # Unix socket paths:
+        directory = FilePath(mkdtemp())
+        self.addCleanup(directory.remove)
+        self.socket_path = directory.child(b"docker.sock")
+        self.events = _Events()
+        listening = UNIXServerEndpoint(
+            reactor, self.socket_path.path).listen(Site(self.events))
+
+        def listened(port):
+            self.addCleanup(port.stopListening)
+        return listening.addCallback(listened)
+
+    def start_watcher(self, changed):
+        """
+        Start a ``DockerEventsWatcher`` for the fake Docker daemon.
+
+        :param changed: The callback for changes.
+        """
+        watcher = DockerEventsWatcher(
+            reactor, changed, self.socket_path, reconnect_delay=0)
+        watcher.startService()
+        self.addCleanup(watcher.stopService)
+
+    def test_event(self):
+        """
+        An event received from Docker is reported.
+        """
+        changed = Deferred()
+        self.start_watcher(lambda: changed.callback(None))
+        self.events.connected.addCallback(
+            lambda request: request.write(b'{"status": "die"}'))
+        return changed
+
+    def test_reconnect(self):
+        """
+        If the event stream ends it is requested again.
+        """
+        self.start_watcher(lambda: None)
+
+        def finish(request):
+            reconnected = self.events.connected
+            request.finish()
+            return reconnected
+        return self.events.connected.addCallback(finish)
@@ -6,7 +6,9 @@ Infrastructure for publishing a REST HTTP API.
 
 from ._infrastructure import (
     structured, EndpointResponse, user_documentation, private_api,
+    set_response_validation_rate, set_request_logging_policy,
     )
+from ._logging import RequestLoggingPolicy
 
 from ._error import makeBadRequest as make_bad_request, BadRequest
 
@@ -14,4 +16,6 @@ from ._error import makeBadRequest as make_bad_request, BadRequest
 __all__ = [
     "structured", "EndpointResponse", "user_documentation",
     "make_bad_request", "private_api", "BadRequest",
+    "set_response_validation_rate", "set_request_logging_policy",
+    "RequestLoggingPolicy",
 ]
@@ -7,8 +7,16 @@ from __future__ import absolute_import
 
 from functools import wraps
 
+from hashlib import sha1
+
 from json import loads, dumps
 
+from random import random
+
+from zlib import compressobj, DEFLATED, MAX_WBITS
+
+from repoze.lru import LRUCache
+
 from pyrsistent import PClass, field, pvector
 
 from twisted.internet.defer import maybeDeferred
@@ -20,8 +28,11 @@ from eliot.twisted import DeferredContext
 from pyrsistent import pmap
 
 from ._error import DECODING_ERROR, BadRequest, InvalidRequestJSON
-from ._logging import LOG_SYSTEM, REQUEST, JSON_REQUEST
-from ._schema import getValidator
+from ._logging import (
+    LOG_SYSTEM, REQUEST, JSON_REQUEST, JSON_REQUEST_SUMMARY,
+    JSON_REQUEST_FAILED, RequestLoggingPolicy,
+)
+from ._schema import compileValidator
 
 _ASCENDING = b"ascending"
 _DESCENDING = b"descending"
@@ -29,6 +40,173 @@ _DESCENDING = b"descending"
 _logger = Logger()
 
 
+class _ResponseValidation(object):
+    """
+    Decide which responses are checked against their endpoint's output schema.
+
+    Output validation catches bugs in the endpoints themselves rather than in
+    what clients send, and for large listings it can cost more than building
+    the response.  In production it can be enough to validate a sample.
+
+    :ivar float rate: The fraction of responses to validate, from ``0``
+        (none) to ``1`` (all).
+    :ivar _random: Zero-argument callable returning a ``float`` in ``[0,
+        1)``.
+    """
+    def __init__(self, rate=1.0, random=random):
+        self.rate = rate
+        self._random = random
+
+    def should_validate(self):
+        """
+        :return: ``True`` if the next response should be validated.
+        """
+        return self.rate >= 1.0 or self._random() < self.rate
+
+
+_response_validation = _ResponseValidation()
+
+
+def set_response_validation_rate(rate):
+    """
+    Set the fraction of API responses which are validated against the
+    endpoint's output schema.  All responses are validated by default.
+
+    :param float rate: A number from ``0`` (validate no responses) to ``1``
+        (validate every response).
+
+    :raise ValueError: If ``rate`` is out of range.
+    """
+    if not 0 <= rate <= 1:
+        raise ValueError(
+            "Response validation rate must be between 0 and 1: "
+            "{!r}".format(rate))
+    _response_validation.rate = rate
+
+
+class _RequestLogging(object):
+    """
+    Decide how the JSON bodies of API requests and responses are logged.
+
+    Logging a large listing in full means encoding all of it a second time,
+    and writing all of it to disk.
+
+    :ivar policy: A ``RequestLoggingPolicy`` constant.
+    :ivar float rate: For ``RequestLoggingPolicy.SAMPLED``, the fraction of
+        requests to log, from ``0`` (none) to ``1`` (all).
+    :ivar _random: Zero-argument callable returning a ``float`` in ``[0,
+        1)``.
+    """
+    def __init__(self, policy=RequestLoggingPolicy.FULL, rate=1.0,
+                 random=random):
+        self.policy = policy
+        self.rate = rate
+        self._random = random
+
+    def start_action(self, logger, json):
+        """
+        Start the action which logs the JSON bodies of a request and its
+        response.
+
+        :param Logger logger: The logger to write to.
+        :param dict json: The decoded request body.  It must not be mutated
+            afterwards.
+
+        :return: The started Eliot action, or ``None`` if the bodies of this
+            request are not to be logged.
+        """
+        policy = self.policy
+        if policy is RequestLoggingPolicy.SAMPLED:
+            if self._random() >= self.rate:
+                return None
+            policy = RequestLoggingPolicy.FULL
+        if policy is RequestLoggingPolicy.FULL:
+            return JSON_REQUEST(logger, json=json)
+        elif policy is RequestLoggingPolicy.SUMMARY:
+            return JSON_REQUEST_SUMMARY(logger, json=json)
+        return None
+
+    def log_failures(self):
+        """
+        :return: ``True`` if the bodies of requests which fail should be
+            logged even though no action was started for them.
+        """
+        return self.policy is RequestLoggingPolicy.ERRORS
+
+
+_request_logging = _RequestLogging()
+
+
+def set_request_logging_policy(policy, rate=1.0):
+    """
+    Set how the JSON bodies of API requests and responses are logged.  By
+    default they are all logged in full.
+
+    :param policy: A ``RequestLoggingPolicy`` constant.
+    :param float rate: For ``RequestLoggingPolicy.SAMPLED``, a number from
+        ``0`` (log no requests) to ``1`` (log every request).
+
+    :raise ValueError: If ``rate`` is out of range.
+    """
+    if not 0 <= rate <= 1:
+        raise ValueError(
+            "Request logging rate must be between 0 and 1: "
+            "{!r}".format(rate))
+    _request_logging.policy = policy
+    _request_logging.rate = rate
+
+
+# Responses smaller than this many bytes are not worth compressing:
+_MINIMUM_COMPRESSED_SIZE = 1024
+
+# Listings are identical until the cluster changes, and each can be megabytes
+# in size, so only a few are kept:
+_compressed_bodies = LRUCache(8)
+
+
+def _accepts_gzip(request):
+    """
+    :param IRequest request: A request.
+
+    :return: ``True`` if the request's ``Accept-Encoding`` header allows a
+        gzip encoded response.
+    """
+    for header in request.requestHeaders.getRawHeaders(
+            b"accept-encoding", []):
+        for coding in header.split(b","):
+            parameters = coding.split(b";")
+            if parameters[0].strip().lower() not in (b"gzip", b"*"):
+                continue
+            quality = 1.0
+            for parameter in parameters[1:]:
+                name, _, value = parameter.partition(b"=")
+                if name.strip().lower() == b"q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                return True
+    return False
+
+
+def _compress(body):
+    """
+    gzip encode a response body, reusing the result of an earlier call for
+    the same body.
+
+    :param bytes body: The body to compress.
+    :return: The compressed ``bytes``.
+    """
+    key = sha1(body).digest()
+    compressed = _compressed_bodies.get(key)
+    if compressed is None:
+        compressor = compressobj(6, DEFLATED, 16 + MAX_WBITS)
+        compressed = compressor.compress(body) + compressor.flush()
+        _compressed_bodies.put(key, compressed)
+    return compressed
+
+
 class EndpointResponse(object):
     """
     An endpoint can return an L{EndpointResponse} instance to return a custom
@@ -145,9 +323,12 @@ def _remote_logging(original):
 def _serialize(outputValidator):
     """
     Decorate a function so that its return value is automatically JSON encoded
-    into a structure indicating a successful result.
+    into a structure indicating a successful result.  Large responses are
+    gzip encoded for clients which accept that.
 
     @param outputValidator: A L{jsonschema} validator for the returned JSON.
+        It is only consulted for the fraction of responses configured with
+        L{set_response_validation_rate}.
 
     @return: A decorator that decorates a function with the signature
         of a Klein route endpoint that may return a Deferred.
@@ -160,13 +341,22 @@ def _serialize(outputValidator):
                 code = result.code
                 headers = result.headers
                 result = result.result
-            outputValidator.validate(result)
+            if _response_validation.should_validate():
+                outputValidator.validate(result)
             request.responseHeaders.setRawHeaders(
                 b"content-type", [b"application/json"])
             for key, value in headers.items():
                 request.responseHeaders.setRawHeaders(key, [value])
             request.setResponseCode(code)
-            return dumps(result)
+            body = dumps(result)
+            if len(body) >= _MINIMUM_COMPRESSED_SIZE:
+                request.responseHeaders.addRawHeader(
+                    b"vary", b"accept-encoding")
+                if _accepts_gzip(request):
+                    request.responseHeaders.setRawHeaders(
+                        b"content-encoding", [b"gzip"])
+                    body = _compress(body)
+            return body
 
         def doit(self, request, **routeArguments):
             result = maybeDeferred(original, self, request, **routeArguments)
@@ -207,8 +397,8 @@ def structured(inputSchema, outputSchema, schema_store=None,
     """
     if schema_store is None:
         schema_store = {}
-    inputValidator = getValidator(inputSchema, schema_store)
-    outputValidator = getValidator(outputSchema, schema_store)
+    inputValidator = compileValidator(inputSchema, schema_store)
+    outputValidator = compileValidator(outputSchema, schema_store)
 
     def deco(original):
         @wraps(original)
@@ -231,16 +421,27 @@ def structured(inputSchema, outputSchema, schema_store=None,
                 if errors:
                     raise InvalidRequestJSON(errors=errors, schema=inputSchema)
 
-            eliot_action = JSON_REQUEST(_get_logger(self), json=objects.copy())
-            with eliot_action.context():
-                # Just assume there are no conflicts between these collections
-                # of arguments right now.  When there is a schema for the JSON
-                # hopefully we can do some static verification that no routing
-                # arguments conflict with any top-level keys in the request
-                # body and then we can be sure there are no conflicts here.
-                objects.update(routeArguments)
+            # Just assume there are no conflicts between these collections
+            # of arguments right now.  When there is a schema for the JSON
+            # hopefully we can do some static verification that no routing
+            # arguments conflict with any top-level keys in the request
+            # body and then we can be sure there are no conflicts here.
+            arguments = objects.copy()
+            arguments.update(routeArguments)
+
+            logger = _get_logger(self)
+            eliot_action = _request_logging.start_action(logger, objects)
+            if eliot_action is None:
+                d = maybeDeferred(original, self, **arguments)
+                if _request_logging.log_failures():
+                    def failed(reason):
+                        JSON_REQUEST_FAILED(json=objects).write(logger)
+                        return reason
+                    d.addErrback(failed)
+                return d
 
-                d = DeferredContext(maybeDeferred(original, self, **objects))
+            with eliot_action.context():
+                d = DeferredContext(maybeDeferred(original, self, **arguments))
 
                 def got_result(result):
                     code = OK
@@ -256,6 +457,8 @@ def structured(inputSchema, outputSchema, schema_store=None,
 
         loadAndDispatch.inputSchema = inputSchema
         loadAndDispatch.outputSchema = outputSchema
+        loadAndDispatch.outputValidator = outputValidator
+        loadAndDispatch.original = original
         return loadAndDispatch
     return deco
 
@@ -4,11 +4,19 @@
 This module defines the Eliot log events emitted by the API implementation.
 """
 
-from eliot import Field, ActionType
+from hashlib import sha256
+from json import dumps
+
+from twisted.python.constants import Names, NamedConstant
+
+from eliot import Field, ActionType, MessageType
 
 __all__ = [
     "JSON_REQUEST",
+    "JSON_REQUEST_SUMMARY",
+    "JSON_REQUEST_FAILED",
     "REQUEST",
+    "RequestLoggingPolicy",
     ]
 
 LOG_SYSTEM = u"api"
@@ -21,6 +29,27 @@ REQUEST_PATH = Field(
 JSON = Field.forTypes(
     u"json", [unicode, bytes, dict, list, None, bool, float],
     u"JSON, either request or response depending on context.")
+
+
+def _summarize(json):
+    """
+    Describe a JSON structure without including it.
+
+    This is used as a field serializer, so it only runs for messages which are
+    actually written.
+
+    :param json: A JSON-encodeable structure.
+    :return: ``dict`` with the ``size`` in bytes and the ``sha256`` hex digest
+        of the JSON encoding of ``json``.
+    """
+    encoded = dumps(json)
+    return {u"size": len(encoded), u"sha256": sha256(encoded).hexdigest()}
+
+
+JSON_SUMMARY = Field(
+    u"json", _summarize,
+    u"The size and digest of the JSON encoding of either the request or "
+    u"response, depending on context.")
 RESPONSE_CODE = Field.forTypes(
     u"code", [int],
     u"The response code for the request.")
@@ -38,3 +67,31 @@ JSON_REQUEST = ActionType(
     [JSON],
     [RESPONSE_CODE, JSON],
     u"A request containing JSON request and response bodies.")
+JSON_REQUEST_SUMMARY = ActionType(
+    LOG_SYSTEM + u":json_request_summary",
+    [JSON_SUMMARY],
+    [RESPONSE_CODE, JSON_SUMMARY],
+    u"A request containing JSON request and response bodies, logged as "
+    u"summaries of those bodies.")
+JSON_REQUEST_FAILED = MessageType(
+    LOG_SYSTEM + u":json_request_failed",
+    [JSON],
+    u"The JSON body of a request whose handling failed.")
+
+
+class RequestLoggingPolicy(Names):
+    """
+    How much of the JSON bodies of API requests and responses is logged.
+
+    :cvar FULL: Log every request and response body in full.
+    :cvar SUMMARY: Log the size and digest of every request and response
+        body.
+    :cvar SAMPLED: Log the bodies of a random sample of requests in full, and
+        nothing for the rest.
+    :cvar ERRORS: Log only the request bodies of requests whose handling
+        failed.
+    """
+    FULL = NamedConstant()
+    SUMMARY = NamedConstant()
+    SAMPLED = NamedConstant()
+    ERRORS = NamedConstant()
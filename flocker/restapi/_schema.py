@@ -15,6 +15,7 @@ __all__ = [
     "SchemaNotProvided",
     "LocalRefResolver",
     "getValidator",
+    "compileValidator",
     "resolveSchema",
 ]
 
@@ -53,6 +54,102 @@ def getValidator(schema, schema_store):
         schema, resolver=resolver, format_checker=draft4_format_checker)
 
 
+class _AcceptEverything(object):
+    """
+    A validator for the empty schema, which every document matches.
+
+    Validating against C{{}} still costs a full walk of the document with
+    L{jsonschema}, which this avoids.
+    """
+    def iter_errors(self, instance):
+        return iter(())
+
+    def is_valid(self, instance):
+        return True
+
+    def validate(self, instance):
+        pass
+
+
+class _RecursiveReference(Exception):
+    """
+    A schema refers to itself, so its references cannot all be inlined.
+    """
+
+
+def _inlineReferences(schema, schema_store):
+    """
+    Replace every I{$ref} in C{schema} with a copy of the schema it refers to.
+
+    Unlike L{resolveSchema}, neither C{schema} nor C{schema_store} is
+    modified and recursive references are detected rather than followed
+    forever.
+
+    @param schema: The JSON Schema to inline, a L{dict}.
+    @param dict schema_store: See L{getValidator}.
+
+    @raise _RecursiveReference: If a reference refers to a schema that is
+        already being inlined.
+
+    @return: A new JSON Schema without any I{$ref}.
+    """
+    resolver = LocalRefResolver(
+        base_uri=b'', referrer=schema, store=schema_store)
+    resolver.resolution_scope = b''
+    resolving = []
+
+    def inline(obj):
+        if isinstance(obj, list):
+            return [inline(item) for item in obj]
+        if isinstance(obj, dict):
+            if u"$ref" in obj:
+                key = (resolver.base_uri, resolver.resolution_scope,
+                       obj[u"$ref"])
+                if key in resolving:
+                    raise _RecursiveReference(obj[u"$ref"])
+                resolving.append(key)
+                try:
+                    with resolver.resolving(obj[u"$ref"]) as resolved:
+                        return inline(resolved)
+                finally:
+                    resolving.pop()
+            return {key: inline(value) for (key, value) in obj.items()}
+        return obj
+
+    return inline(schema)
+
+
+def compileValidator(schema, schema_store):
+    """
+    Get a L{jsonschema} validator for C{schema} which does the expensive
+    parts of validation once, up front.
+
+    Validators returned by L{getValidator} look up every I{$ref} each time
+    they reach it, so validating a list of a thousand items resolves the
+    item schema a thousand times.  Here references are inlined when the
+    validator is created, and the empty schema gets a validator that does
+    no work at all.  Schemas with recursive references fall back to
+    L{getValidator}.
+
+    @param schema: The JSON Schema to validate against.
+    @type schema: L{dict}
+
+    @param dict schema_store: A mapping between schema paths
+        (e.g. ``b/v1/types.json``) and the JSON schema structure.
+
+    @return: An object with C{validate}, C{is_valid} and C{iter_errors}
+        methods, like a L{jsonschema} validator.
+    """
+    if not schema:
+        return _AcceptEverything()
+    try:
+        inlined = _inlineReferences(schema, schema_store)
+    except _RecursiveReference:
+        return getValidator(schema, schema_store)
+    return validator_for(schema)(
+        inlined, format_checker=draft4_format_checker)
+
+
 def resolveSchema(schema, schemaStore):
     """
     Recursively resolve all I{$ref} JSON references in a JSON Schema.
@@ -3,16 +3,22 @@
 Tests for ``flocker.restapi._infrastructure``.
 """
 
+from hashlib import sha256
+from zlib import decompress, MAX_WBITS
+
 from jsonschema.exceptions import ValidationError
 from klein import Klein
 
 from eliot import ActionType
 from eliot.testing import (
-    assertHasAction, capture_logging, LoggedAction, validateLogging,
+    assertHasAction, capture_logging, LoggedAction, LoggedMessage,
+    validateLogging,
 )
 
 from pyrsistent import pvector
 
+from repoze.lru import LRUCache
+
 from twisted.python.constants import Names, NamedConstant
 from twisted.python.failure import Failure
 from twisted.internet.defer import succeed, fail
@@ -21,9 +27,15 @@ from twisted.web.http import (
     BAD_REQUEST, INTERNAL_SERVER_ERROR, PAYMENT_REQUIRED, GONE,
     NOT_ALLOWED, NOT_FOUND, OK)
 
+from .. import _infrastructure
 from .._infrastructure import (
-    EndpointResponse, user_documentation, structured, UserDocumentation)
-from .._logging import REQUEST, JSON_REQUEST
+    EndpointResponse, user_documentation, structured, UserDocumentation,
+    set_response_validation_rate, _ResponseValidation,
+    set_request_logging_policy, _RequestLogging)
+from .._logging import (
+    REQUEST, JSON_REQUEST, JSON_REQUEST_SUMMARY, JSON_REQUEST_FAILED,
+    RequestLoggingPolicy,
+)
 from .._error import DECODING_ERROR_DESCRIPTION, BadRequest
 
 from ..testtools import (EventChannel, dumps, loads,
@@ -608,6 +620,260 @@ class StructuredJSONTests(TestCase):
             {"jsonValue": True, "routingValue": "quux"}, app.kwargs)
 
 
+class ResponseValidationTests(TestCase):
+    """
+    Tests for sampled validation of responses by L{structured}.
+    """
+    def setUp(self):
+        super(ResponseValidationTests, self).setUp()
+        self.samples = []
+        self.validation = _ResponseValidation(random=self.samples.pop)
+        self.patch(_infrastructure, "_response_validation", self.validation)
+
+    def render_bad_response(self, logger):
+        """
+        Request an endpoint whose response doesn't match its schema.
+
+        :param MemoryLogger logger: The logger to use.
+
+        :return: The response code.
+        """
+        request = dummyRequest(b"GET", b"/foo/badresponse", Headers(), b"")
+        app = ResultHandlingApplication(Execution.SYNCHRONOUS, logger, None)
+        render(app.app.resource(), request)
+        return request._code
+
+    @validateLogging(_assertTracebackLogged(ValidationError))
+    def test_sampled(self, logger):
+        """
+        Responses are validated when the random sample falls below the
+        configured rate.
+        """
+        set_response_validation_rate(0.5)
+        self.samples.append(0.1)
+        self.assertEqual(INTERNAL_SERVER_ERROR,
+                         self.render_bad_response(logger))
+
+    @validateLogging(None)
+    def test_not_sampled(self, logger):
+        """
+        Responses are not validated when the random sample falls at or above
+        the configured rate.
+        """
+        set_response_validation_rate(0.5)
+        self.samples.append(0.5)
+        self.assertEqual(OK, self.render_bad_response(logger))
+
+    @validateLogging(_assertTracebackLogged(ValidationError))
+    def test_all(self, logger):
+        """
+        With a rate of 1 every response is validated, without sampling.
+        """
+        set_response_validation_rate(1)
+        self.assertEqual(
+            (INTERNAL_SERVER_ERROR, []),
+            (self.render_bad_response(logger), self.samples))
+
+    def test_out_of_range(self):
+        """
+        L{set_response_validation_rate} rejects rates outside of ``[0, 1]``.
+        """
+        self.assertRaises(ValueError, set_response_validation_rate, 1.5)
+        self.assertRaises(ValueError, set_response_validation_rate, -0.5)
+
+
+class RequestLoggingTests(TestCase):
+    """
+    Tests for the request logging policies used by L{structured}.
+    """
+    def setUp(self):
+        super(RequestLoggingTests, self).setUp()
+        self.samples = []
+        self.patch(_infrastructure, "_request_logging",
+                   _RequestLogging(random=self.samples.pop))
+
+    def render(self, logger, path=b"/foo/bar", body=None):
+        """
+        Send a POST request to the test application.
+
+        :param MemoryLogger logger: The logger to use.
+        :param bytes path: The path to request.
+        :param body: The object to send JSON encoded as the request body.
+        """
+        if body is None:
+            body = {u"foo": u"bar"}
+        request = dummyRequest(
+            b"POST", path, Headers({b"content-type": [b"application/json"]}),
+            dumps(body))
+        app = ResultHandlingApplication(
+            Execution.SYNCHRONOUS, logger, [u"result"])
+        render(app.app.resource(), request)
+
+    @validateLogging(None)
+    def test_summary(self, logger):
+        """
+        With L{RequestLoggingPolicy.SUMMARY} the size and digest of the
+        request and response bodies are logged instead of the bodies.
+        """
+        set_request_logging_policy(RequestLoggingPolicy.SUMMARY)
+        self.render(logger)
+        start, end = [
+            message for message in logger.serialize()
+            if message[u"action_type"] == JSON_REQUEST_SUMMARY.action_type]
+        request_json = dumps({u"foo": u"bar"})
+        response_json = dumps([u"result"])
+        self.assertEqual(
+            ({u"size": len(request_json),
+              u"sha256": sha256(request_json).hexdigest()},
+             {u"size": len(response_json),
+              u"sha256": sha256(response_json).hexdigest()},
+             OK),
+            (start[u"json"], end[u"json"], end[u"code"]))
+
+    @validateLogging(None)
+    def test_sampled(self, logger):
+        """
+        With L{RequestLoggingPolicy.SAMPLED} requests are logged in full when
+        the random sample falls below the configured rate.
+        """
+        set_request_logging_policy(RequestLoggingPolicy.SAMPLED, 0.5)
+        self.samples.append(0.1)
+        self.render(logger)
+        assertHasAction(
+            self, logger, JSON_REQUEST, True, {u"json": {u"foo": u"bar"}},
+            {u"json": [u"result"], u"code": OK})
+
+    @validateLogging(None)
+    def test_not_sampled(self, logger):
+        """
+        With L{RequestLoggingPolicy.SAMPLED} the bodies of requests are not
+        logged when the random sample falls at or above the configured rate.
+        The request itself is still logged.
+        """
+        set_request_logging_policy(RequestLoggingPolicy.SAMPLED, 0.5)
+        self.samples.append(0.5)
+        self.render(logger)
+        self.assertEqual(
+            (1, []),
+            (len(LoggedAction.ofType(logger.messages, REQUEST)),
+             LoggedAction.ofType(logger.messages, JSON_REQUEST)))
+
+    @validateLogging(None)
+    def test_errors_success(self, logger):
+        """
+        With L{RequestLoggingPolicy.ERRORS} nothing is logged about the
+        bodies of successful requests.
+        """
+        set_request_logging_policy(RequestLoggingPolicy.ERRORS)
+        self.render(logger)
+        self.assertEqual(
+            ([], []),
+            (LoggedAction.ofType(logger.messages, JSON_REQUEST),
+             LoggedMessage.ofType(logger.messages, JSON_REQUEST_FAILED)))
+
+    @validateLogging(None)
+    def test_errors_failure(self, logger):
+        """
+        With L{RequestLoggingPolicy.ERRORS} the body of a failed request is
+        logged within the request's action.
+        """
+        set_request_logging_policy(RequestLoggingPolicy.ERRORS)
+        self.render(logger, b"/foo/badrequest", {})
+        [request] = LoggedAction.ofType(logger.messages, REQUEST)
+        [failed] = LoggedMessage.ofType(logger.messages, JSON_REQUEST_FAILED)
+        self.assertEqual(({}, [failed]),
+                         (failed.message[u"json"], request.children))
+
+    def test_out_of_range(self):
+        """
+        L{set_request_logging_policy} rejects rates outside of ``[0, 1]``.
+        """
+        self.assertRaises(
+            ValueError, set_request_logging_policy,
+            RequestLoggingPolicy.SAMPLED, 1.5)
+
+
+class CompressionTests(TestCase):
+    """
+    Tests for gzip encoding of responses by L{structured}.
+    """
+    def setUp(self):
+        super(CompressionTests, self).setUp()
+        self.patch(_infrastructure, "_compressed_bodies", LRUCache(8))
+        self.large = [u"x" * 100] * 100
+
+    def render(self, result, accept_encoding=None):
+        """
+        Request an endpoint returning the given result.
+
+        :param result: The result of the endpoint.
+        :param bytes accept_encoding: The value of the ``Accept-Encoding``
+            header to send, or ``None`` to send none.
+
+        :return: The rendered request.
+        """
+        headers = Headers()
+        if accept_encoding is not None:
+            headers.setRawHeaders(b"accept-encoding", [accept_encoding])
+        request = dummyRequest(b"GET", b"/foo/bar", headers)
+        app = ResultHandlingApplication(Execution.SYNCHRONOUS, None, result)
+        render(app.app.resource(), request)
+        return request
+
+    def test_compressed(self):
+        """
+        A large response to a request accepting gzip encoding is gzip
+        encoded.
+        """
+        request = self.render(self.large, b"deflate, gzip")
+        self.assertEqual(
+            ([b"gzip"], [b"accept-encoding"], self.large),
+            (request.responseHeaders.getRawHeaders(b"content-encoding"),
+             request.responseHeaders.getRawHeaders(b"vary"),
+             loads(decompress(request._responseBody, 16 + MAX_WBITS))))
+
+    def test_not_accepted(self):
+        """
+        A large response is not compressed if the request does not accept
+        gzip encoding.
+        """
+        request = self.render(self.large)
+        self.assertEqual(
+            (None, [b"accept-encoding"], self.large),
+            (request.responseHeaders.getRawHeaders(b"content-encoding"),
+             request.responseHeaders.getRawHeaders(b"vary"),
+             loads(request._responseBody)))
+
+    def test_refused(self):
+        """
+        A large response is not compressed if the request gives gzip
+        encoding a quality of zero.
+        """
+        request = self.render(self.large, b"gzip;q=0, identity")
+        self.assertEqual(
+            None, request.responseHeaders.getRawHeaders(b"content-encoding"))
+
+    def test_small(self):
+        """
+        A small response is not compressed.
+        """
+        request = self.render([u"x"], b"gzip")
+        self.assertEqual(
+            (None, None, [u"x"]),
+            (request.responseHeaders.getRawHeaders(b"content-encoding"),
+             request.responseHeaders.getRawHeaders(b"vary"),
+             loads(request._responseBody)))
+
+    def test_cached(self):
+        """
+        The compressed form of a body is reused for later identical
+        responses.
+        """
+        first = self.render(self.large, b"gzip")
+        second = self.render(self.large, b"gzip")
+        self.assertIs(first._responseBody, second._responseBody)
+
+
 class UserDocumentationTests(TestCase):
     """
     Tests for L{user_documentation}.
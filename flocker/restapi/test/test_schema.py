@@ -8,7 +8,8 @@ import copy
 from jsonschema.exceptions import RefResolutionError, ValidationError
 
 from .._schema import (
-    LocalRefResolver, SchemaNotProvided, getValidator, resolveSchema)
+    LocalRefResolver, SchemaNotProvided, getValidator, compileValidator,
+    resolveSchema)
 from ...testtools import TestCase
 
 
@@ -64,6 +65,67 @@ class GetValidatorTests(TestCase):
         self.assertRaises(ValidationError, validator.validate, {})
 
 
+class CompileValidatorTests(TestCase):
+    """
+    Tests for L{compileValidator}.
+    """
+    STORE = {b"/path/types.json":
+             {"item": {"type": "integer"},
+              "list": {"type": "array", "items": {"$ref": "#/item"}},
+              "loop": {"type": "object",
+                       "properties": {"next": {"$ref": "#/loop"}}}},
+             b"/path/endpoints.json":
+             {"list": {"$ref": "types.json#/list"}}}
+
+    def test_basic(self):
+        """
+        L{compileValidator} returns a validator with C{validate} and
+        C{iter_errors} methods.
+        """
+        validator = compileValidator({u'type': u'string'}, {})
+        validator.validate('abc')
+        self.assertEqual(len(list(validator.iter_errors({}))), 1)
+        self.assertRaises(ValidationError, validator.validate, {})
+
+    def test_empty(self):
+        """
+        The validator for the empty schema accepts anything.
+        """
+        validator = compileValidator({}, {})
+        validator.validate(object())
+        self.assertEqual(
+            ([], True), (list(validator.iter_errors(None)),
+                         validator.is_valid(None)))
+
+    def test_references(self):
+        """
+        References are resolved using the schema store, including references
+        within the referenced documents.
+        """
+        validator = compileValidator(
+            {"$ref": "/path/endpoints.json#/list"}, self.STORE)
+        validator.validate([1, 2])
+        self.assertRaises(ValidationError, validator.validate, [1, "2"])
+
+    def test_storeUnmodified(self):
+        """
+        The store is not modified by compilation.
+        """
+        original = copy.deepcopy(self.STORE)
+        compileValidator({"$ref": "/path/endpoints.json#/list"}, self.STORE)
+        self.assertEqual(self.STORE, original)
+
+    def test_recursive(self):
+        """
+        Recursive schemas can still be validated against.
+        """
+        validator = compileValidator(
+            {"$ref": "/path/types.json#/loop"}, self.STORE)
+        validator.validate({"next": {"next": {}}})
+        self.assertRaises(
+            ValidationError, validator.validate, {"next": {"next": 1}})
+
+
 class ResolveSchemaTests(TestCase):
     """
     Tests for L{ResolveSchema}.